@@ -0,0 +1,54 @@
+"""Add audit log hash chain, chain cutover and daily Merkle checkpoints
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Logs existentes mantêm previous_checksum nulo (checksum no formato original)
+    op.add_column('audit_logs', sa.Column('previous_checksum', sa.String(length=64), nullable=True))
+
+    op.create_table('audit_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('checkpoint_date', sa.Date(), nullable=False),
+    sa.Column('first_log_id', sa.Integer(), nullable=False),
+    sa.Column('last_log_id', sa.Integer(), nullable=False),
+    sa.Column('log_count', sa.Integer(), nullable=False),
+    sa.Column('merkle_root', sa.String(length=64), nullable=False),
+    sa.Column('last_checksum', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_checkpoints_id'), 'audit_checkpoints', ['id'], unique=False)
+    op.create_index(op.f('ix_audit_checkpoints_checkpoint_date'), 'audit_checkpoints', ['checkpoint_date'], unique=True)
+
+    # Corte do encadeamento: apenas logs até este id podem estar fora da cadeia
+    op.create_table('audit_chain_cutover',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('legacy_max_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO audit_chain_cutover (id, legacy_max_id, created_at) "
+        "SELECT 1, COALESCE(MAX(id), 0), CURRENT_TIMESTAMP FROM audit_logs"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('audit_chain_cutover')
+    op.drop_index(op.f('ix_audit_checkpoints_checkpoint_date'), table_name='audit_checkpoints')
+    op.drop_index(op.f('ix_audit_checkpoints_id'), table_name='audit_checkpoints')
+    op.drop_table('audit_checkpoints')
+    op.drop_column('audit_logs', 'previous_checksum')
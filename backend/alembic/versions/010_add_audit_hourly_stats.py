@@ -0,0 +1,46 @@
+"""Add hourly audit log rollup table
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # O agregado é preenchido pelo job de audit_stats ao iniciar; até lá as
+    # estatísticas são calculadas diretamente sobre audit_logs
+    op.create_table('audit_log_hourly_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('bucket_hour', sa.DateTime(), nullable=False),
+    sa.Column('event_type', sa.String(length=100), nullable=False),
+    sa.Column('severity', sa.String(length=20), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('username', sa.String(length=100), nullable=True),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_log_hourly_stats_id'), 'audit_log_hourly_stats', ['id'], unique=False)
+    op.create_index('idx_audit_hourly_bucket', 'audit_log_hourly_stats', ['bucket_hour'], unique=False)
+    op.create_index('idx_audit_hourly_user_bucket', 'audit_log_hourly_stats', ['user_id', 'bucket_hour'], unique=False)
+    op.create_index(
+        'uq_audit_hourly_bucket_key', 'audit_log_hourly_stats',
+        ['bucket_hour', 'event_type', 'severity', sa.text('coalesce(user_id, 0)'), sa.text("coalesce(username, '')")],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_audit_hourly_bucket_key', table_name='audit_log_hourly_stats')
+    op.drop_index('idx_audit_hourly_user_bucket', table_name='audit_log_hourly_stats')
+    op.drop_index('idx_audit_hourly_bucket', table_name='audit_log_hourly_stats')
+    op.drop_index(op.f('ix_audit_log_hourly_stats_id'), table_name='audit_log_hourly_stats')
+    op.drop_table('audit_log_hourly_stats')
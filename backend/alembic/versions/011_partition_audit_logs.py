@@ -0,0 +1,109 @@
+"""Partition audit_logs by month on created_at
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+# Meses futuros criados junto com a conversão
+MONTHS_AHEAD = 3
+
+INDEXES = [
+    ('ix_audit_logs_id', ['id']),
+    ('ix_audit_logs_event_type', ['event_type']),
+    ('ix_audit_logs_severity', ['severity']),
+    ('ix_audit_logs_event_id', ['event_id']),
+    ('ix_audit_logs_user_id', ['user_id']),
+    ('ix_audit_logs_username', ['username']),
+    ('ix_audit_logs_session_id', ['session_id']),
+    ('ix_audit_logs_ip_address', ['ip_address']),
+    ('ix_audit_logs_resource_type', ['resource_type']),
+    ('ix_audit_logs_resource_id', ['resource_id']),
+    ('ix_audit_logs_is_sensitive_data', ['is_sensitive_data']),
+    ('ix_audit_logs_created_at', ['created_at']),
+    ('idx_audit_user_date', ['user_id', 'created_at']),
+    ('idx_audit_event_date', ['event_type', 'created_at']),
+    ('idx_audit_resource', ['resource_type', 'resource_id']),
+    ('idx_audit_severity_date', ['severity', 'created_at']),
+    ('idx_audit_sensitive', ['is_sensitive_data', 'created_at']),
+]
+
+
+def _add_months(year, month, months):
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+def _create_indexes(table):
+    for name, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # Particionamento declarativo disponível apenas no PostgreSQL
+        return
+
+    first_log = bind.execute(sa.text("SELECT min(created_at) FROM audit_logs")).scalar()
+    now = datetime.utcnow()
+    start = first_log or now
+
+    # Nova tabela particionada com a mesma estrutura (inclui o default do id)
+    op.execute(
+        "CREATE TABLE audit_logs_partitioned "
+        "(LIKE audit_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    op.execute("ALTER TABLE audit_logs_partitioned ADD PRIMARY KEY (id, created_at)")
+
+    year, month = start.year, start.month
+    end_year, end_month = _add_months(now.year, now.month, MONTHS_AHEAD)
+    while (year, month) <= (end_year, end_month):
+        next_year, next_month = _add_months(year, month, 1)
+        op.execute(
+            f"CREATE TABLE audit_logs_y{year:04d}m{month:02d} PARTITION OF audit_logs_partitioned "
+            f"FOR VALUES FROM ('{year:04d}-{month:02d}-01') TO ('{next_year:04d}-{next_month:02d}-01')"
+        )
+        year, month = next_year, next_month
+
+    op.execute("CREATE TABLE audit_logs_default PARTITION OF audit_logs_partitioned DEFAULT")
+
+    # Copiar os dados e transferir a sequência antes de remover a tabela antiga
+    op.execute("INSERT INTO audit_logs_partitioned SELECT * FROM audit_logs")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs_partitioned.id")
+    op.execute("DROP TABLE audit_logs")
+    op.execute("ALTER TABLE audit_logs_partitioned RENAME TO audit_logs")
+
+    _create_indexes('audit_logs')
+    op.create_unique_constraint('uq_audit_logs_event_id_created_at', 'audit_logs', ['event_id', 'created_at'])
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute(
+        "CREATE TABLE audit_logs_plain "
+        "(LIKE audit_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    op.execute("INSERT INTO audit_logs_plain SELECT * FROM audit_logs")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs_plain.id")
+    op.execute("DROP TABLE audit_logs CASCADE")
+    op.execute("ALTER TABLE audit_logs_plain RENAME TO audit_logs")
+    op.execute("ALTER TABLE audit_logs ADD PRIMARY KEY (id)")
+
+    _create_indexes('audit_logs')
+    op.create_unique_constraint('audit_logs_event_id_key', 'audit_logs', ['event_id'])
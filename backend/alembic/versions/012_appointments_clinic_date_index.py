@@ -0,0 +1,23 @@
+"""Add composite index for appointment statistics
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Atende o GROUP BY de appointment_stats e a carga de agendas por clínica
+    op.create_index('ix_appointments_clinic_date', 'appointments', ['clinic_id', 'appointment_date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_appointments_clinic_date', table_name='appointments')
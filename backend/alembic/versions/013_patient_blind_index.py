@@ -0,0 +1,50 @@
+"""Add blind index columns and prefix tokens for patient search
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('patients', sa.Column('cpf_hash', sa.String(length=64), nullable=True))
+    op.add_column('patients', sa.Column('rg_number_hash', sa.String(length=64), nullable=True))
+    op.add_column('patients', sa.Column('phone_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_patients_cpf_hash'), 'patients', ['cpf_hash'], unique=False)
+    op.create_index(op.f('ix_patients_rg_number_hash'), 'patients', ['rg_number_hash'], unique=False)
+    op.create_index(op.f('ix_patients_phone_hash'), 'patients', ['phone_hash'], unique=False)
+
+    op.create_table('patient_search_tokens',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=True),
+    sa.Column('field', sa.String(length=30), nullable=False),
+    sa.Column('token_hash', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinics.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_patient_search_tokens_hash', 'patient_search_tokens', ['token_hash', 'patient_id'], unique=False)
+
+    # Hashes e tokens dos pacientes existentes são preenchidos fora da
+    # migração, com ENCRYPTION_KEY: python patient_search.py
+
+
+def downgrade() -> None:
+    op.drop_index('ix_patient_search_tokens_hash', table_name='patient_search_tokens')
+    op.drop_table('patient_search_tokens')
+    op.drop_index(op.f('ix_patients_phone_hash'), table_name='patients')
+    op.drop_index(op.f('ix_patients_rg_number_hash'), table_name='patients')
+    op.drop_index(op.f('ix_patients_cpf_hash'), table_name='patients')
+    op.drop_column('patients', 'phone_hash')
+    op.drop_column('patients', 'rg_number_hash')
+    op.drop_column('patients', 'cpf_hash')
@@ -0,0 +1,66 @@
+"""Add accent-insensitive trigram index for patient name search
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        # unaccent() não é IMMUTABLE; o wrapper permite usá-lo em índices
+        op.execute("""
+            CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+        """)
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_patients_name_trgm ON patients "
+            "USING gin (immutable_unaccent(lower(name)) gin_trgm_ops)"
+        )
+    elif bind.dialect.name == 'sqlite':
+        # Mesma DDL de patient_search.sqlite_fts_statements, fixada nesta revisão
+        op.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_name_fts USING fts5(
+                name, content='patients', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_name_fts_ai AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_name_fts(rowid, name) VALUES (new.id, new.name);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_name_fts_ad AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_name_fts(patients_name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER IF NOT EXISTS patients_name_fts_au AFTER UPDATE OF name ON patients BEGIN
+                INSERT INTO patients_name_fts(patients_name_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO patients_name_fts(rowid, name) VALUES (new.id, new.name);
+            END
+        """)
+        op.execute("INSERT INTO patients_name_fts(patients_name_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_patients_name_trgm")
+        op.execute("DROP FUNCTION IF EXISTS immutable_unaccent(text)")
+    elif bind.dialect.name == 'sqlite':
+        for trigger in ('patients_name_fts_ai', 'patients_name_fts_ad', 'patients_name_fts_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS patients_name_fts")
@@ -0,0 +1,50 @@
+"""Add pharmacy stock snapshots and report indexes
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('pharmacy_stock_snapshots',
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('total_products', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('low_stock_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinics.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('clinic_id')
+    )
+
+    # Atendem as contagens e filtros de pharmacy_reports
+    op.create_index('ix_products_clinic_active', 'products', ['clinic_id', 'is_active'], unique=False)
+    op.create_index('ix_product_batches_product_expiry', 'product_batches', ['product_id', 'expiry_date'], unique=False)
+    op.create_index('ix_product_stock_movements_product_created', 'product_stock_movements', ['product_id', 'created_at'], unique=False)
+
+    # Snapshot inicial; a partir daqui mantido pelas gravações de produtos
+    op.execute("""
+        INSERT INTO pharmacy_stock_snapshots (clinic_id, total_products, low_stock_count, updated_at)
+        SELECT clinic_id,
+               COUNT(*),
+               SUM(CASE WHEN current_stock <= minimum_stock THEN 1 ELSE 0 END),
+               CURRENT_TIMESTAMP
+        FROM products
+        WHERE is_active = true AND clinic_id IS NOT NULL
+        GROUP BY clinic_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_stock_movements_product_created', table_name='product_stock_movements')
+    op.drop_index('ix_product_batches_product_expiry', table_name='product_batches')
+    op.drop_index('ix_products_clinic_active', table_name='products')
+    op.drop_table('pharmacy_stock_snapshots')
@@ -0,0 +1,46 @@
+"""Add delivery queue columns to notifications
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '016'
+down_revision = '015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # notifications é criada pelo sistema de notificações (create_all)
+    if 'notifications' not in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.add_column('notifications', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    op.add_column('notifications', sa.Column('locked_until', sa.DateTime(), nullable=True))
+    op.add_column('notifications', sa.Column('claim_token', sa.String(length=32), nullable=True))
+    op.add_column('notifications', sa.Column('last_error', sa.Text(), nullable=True))
+    op.create_index('ix_notifications_claim_token', 'notifications', ['claim_token'], unique=False)
+    op.create_index('ix_notifications_status_next_attempt', 'notifications', ['status', 'next_attempt_at'], unique=False)
+
+    # Pendentes existentes (inclusive as agendadas, antes descartadas) entram na fila
+    op.execute(
+        "UPDATE notifications SET next_attempt_at = COALESCE(scheduled_at, created_at) "
+        "WHERE status = 'PENDING'"
+    )
+
+
+def downgrade() -> None:
+    if 'notifications' not in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.drop_index('ix_notifications_status_next_attempt', table_name='notifications')
+    op.drop_index('ix_notifications_claim_token', table_name='notifications')
+    op.drop_column('notifications', 'last_error')
+    op.drop_column('notifications', 'claim_token')
+    op.drop_column('notifications', 'locked_until')
+    op.drop_column('notifications', 'next_attempt_at')
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Estatísticas de Consultas
+
+Este módulo calcula as estatísticas de consultas de uma clínica em uma única
+consulta agregada (GROUP BY médico e dia, com contagens condicionais por
+status) ou, no Supabase, em uma única chamada RPC:
+- Totais por status, taxas de realização e de cancelamento
+- Quebras por médico e por dia
+- Cache por clínica e período com TTL curto, compartilhado entre os painéis
+  de consultas e financeiro
+"""
+
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from session_cache import LocalSessionCache
+
+logger = logging.getLogger(__name__)
+
+# Grupos de status (o sistema grava status em português e em inglês)
+STATUS_GROUPS: Dict[str, Tuple[str, ...]] = {
+    'completed': ('completed', 'realizado'),
+    'cancelled': ('cancelled', 'cancelado'),
+    'scheduled': ('scheduled', 'agendado'),
+    'confirmed': ('confirmed', 'confirmado'),
+    'no_show': ('no_show', 'faltou')
+}
+
+COUNT_FIELDS = ('total',) + tuple(STATUS_GROUPS)
+
+# (médico, dia, total, completed, cancelled, scheduled, confirmed, no_show)
+StatsRow = Tuple[Any, ...]
+
+def _empty_counts() -> Dict[str, int]:
+    return {name: 0 for name in COUNT_FIELDS}
+
+def _rate(part: int, total: int) -> float:
+    return (part / total * 100) if total > 0 else 0
+
+@dataclass
+class AppointmentStatistics:
+    """Estatísticas de consultas de uma clínica em um período"""
+    clinic_id: Any
+    start_date: date
+    end_date: date
+    totals: Dict[str, int] = field(default_factory=_empty_counts)
+    by_doctor: Dict[Any, Dict[str, int]] = field(default_factory=dict)
+    by_day: Dict[date, Dict[str, int]] = field(default_factory=dict)
+
+    @classmethod
+    def from_rows(cls, clinic_id, start_date: date, end_date: date, rows: Iterable[StatsRow]) -> "AppointmentStatistics":
+        stats = cls(clinic_id, start_date, end_date)
+        for doctor_id, day, *counts in rows:
+            if isinstance(day, str):
+                day = date.fromisoformat(day[:10])
+            elif isinstance(day, datetime):
+                day = day.date()
+
+            doctor_counts = stats.by_doctor.setdefault(doctor_id, _empty_counts())
+            day_counts = stats.by_day.setdefault(day, _empty_counts())
+            for name, value in zip(COUNT_FIELDS, counts):
+                value = int(value or 0)
+                stats.totals[name] += value
+                doctor_counts[name] += value
+                day_counts[name] += value
+        return stats
+
+    @property
+    def total(self) -> int:
+        return self.totals['total']
+
+    @property
+    def completion_rate(self) -> float:
+        return _rate(self.totals['completed'], self.total)
+
+    @property
+    def cancellation_rate(self) -> float:
+        return _rate(self.totals['cancelled'], self.total)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_appointments': self.total,
+            'completed_appointments': self.totals['completed'],
+            'cancelled_appointments': self.totals['cancelled'],
+            'scheduled_appointments': self.totals['scheduled'],
+            'confirmed_appointments': self.totals['confirmed'],
+            'no_show_appointments': self.totals['no_show'],
+            'completion_rate': self.completion_rate,
+            'cancellation_rate': self.cancellation_rate,
+            'by_doctor': [
+                {
+                    'doctor_id': doctor_id,
+                    **counts,
+                    'completion_rate': _rate(counts['completed'], counts['total']),
+                    'cancellation_rate': _rate(counts['cancelled'], counts['total'])
+                }
+                for doctor_id, counts in self.by_doctor.items()
+            ],
+            'by_day': [
+                {'date': day.isoformat(), **counts}
+                for day, counts in sorted(self.by_day.items())
+            ]
+        }
+
+class AppointmentStatsSource:
+    """Consulta agregada via SQLAlchemy"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, clinic_id: int, start: datetime, end: datetime) -> List[StatsRow]:
+        from sqlalchemy import case, func
+        from models import Appointment
+
+        day = func.date(Appointment.appointment_date)
+        counts = [
+            func.sum(case((Appointment.status.in_(statuses), 1), else_=0))
+            for statuses in STATUS_GROUPS.values()
+        ]
+        return self.db.query(
+            Appointment.doctor_id, day, func.count(Appointment.id), *counts
+        ).filter(
+            Appointment.clinic_id == clinic_id,
+            Appointment.appointment_date >= start,
+            Appointment.appointment_date < end
+        ).group_by(Appointment.doctor_id, day).all()
+
+class SupabaseAppointmentStatsSource:
+    """Mesma agregação via função RPC appointment_statistics do Supabase"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def load(self, clinic_id, start: datetime, end: datetime) -> List[StatsRow]:
+        result = self.client.rpc('appointment_statistics', {
+            'p_clinic_id': clinic_id,
+            'p_start': start.isoformat(),
+            'p_end': end.isoformat()
+        }).execute()
+        return [
+            (row['doctor_id'], row['day'], *(row[name] for name in COUNT_FIELDS))
+            for row in result.data or []
+        ]
+
+class AppointmentStatsService:
+    """
+    Estatísticas de consultas com cache por clínica e período.
+
+    Cada clínica tem uma versão incluída na chave do cache; invalidar a
+    clínica incrementa a versão e as entradas antigas deixam de ser usadas.
+    """
+
+    def __init__(self, ttl_seconds: float = None, max_entries: int = None):
+        self.cache = LocalSessionCache(
+            max_entries=max_entries or int(os.getenv("APPOINTMENT_STATS_CACHE_SIZE", "1000")),
+            ttl_seconds=ttl_seconds or float(os.getenv("APPOINTMENT_STATS_TTL_SECONDS", "30"))
+        )
+        self._versions: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.hits = 0
+        self.queries = 0
+
+    def get(self, source, clinic_id, start_date: date, end_date: date) -> AppointmentStatistics:
+        """
+        Estatísticas de `start_date` a `end_date` (inclusive), calculadas em
+        uma única consulta à origem ou obtidas do cache.
+        """
+        key = f"{clinic_id}:{self._versions.get(clinic_id, 0)}:{start_date.isoformat()}:{end_date.isoformat()}"
+        stats = self.cache.get(key)
+        if stats is not None:
+            self.hits += 1
+            return stats
+
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+        rows = source.load(clinic_id, start, end)
+        self.queries += 1
+
+        stats = AppointmentStatistics.from_rows(clinic_id, start_date, end_date, rows)
+        self.cache.set(key, stats)
+        return stats
+
+    def invalidate(self, clinic_id):
+        """Descarta as estatísticas em cache da clínica"""
+        if clinic_id is None:
+            return
+        with self._lock:
+            self._versions[clinic_id] = self._versions.get(clinic_id, 0) + 1
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {'entries': len(self.cache), 'hits': self.hits, 'queries': self.queries}
+
+# Instância global
+appointment_stats = AppointmentStatsService()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Detecção de Padrões de Ataque
+
+Este módulo implementa o mecanismo único de triagem de requisições usado
+pelo SecurityMiddleware e pelo SecurityMonitor:
+- Conjuntos de assinaturas por categoria (SQL Injection, XSS, etc.),
+  opcionalmente restritos a alguns cabeçalhos
+- Assinaturas literais compiladas uma única vez em um autômato
+  Aho-Corasick (pyahocorasick) ou, sem a biblioteca, em uma expressão
+  regular combinada; assinaturas em regex vão para uma regex combinada
+- URL, cabeçalhos e corpo verificados em uma única varredura do texto
+  (em minúsculas)
+
+Os conjuntos podem ser estendidos ou substituídos por um arquivo JSON
+indicado em ATTACK_SIGNATURES_FILE, no mesmo formato de DEFAULT_SIGNATURES,
+e categorias podem ser desativadas em ATTACK_DISABLED_CATEGORIES.
+"""
+
+import os
+import re
+import json
+import bisect
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# Assinaturas por categoria. "literals" são substrings (em minúsculas),
+# "patterns" são regex aplicadas ao texto em minúsculas e "targets" restringe
+# a categoria a algumas partes: "url", "body" ou nomes de cabeçalho (sem
+# "targets", vale para toda a requisição). Assinaturas de URL ficam restritas
+# à URL: em texto livre (evoluções, templates) gerariam falsos positivos.
+DEFAULT_SIGNATURES: Dict[str, Dict[str, List[str]]] = {
+    'sql_injection': {'literals': [
+        "union select", "drop table", "insert into", "delete from",
+        "' or '1'='1", "' or 1=1", "'; drop", "' union"
+    ]},
+    'xss': {'literals': [
+        "<script", "javascript:", "onerror=", "onload=", "onmouseover=",
+        "onfocus=", "alert(", "document.cookie", "eval("
+    ]},
+    'path_traversal': {
+        'targets': ["url"],
+        'literals': ["../", "..\\", "..%2f", "..%5c", "%2e%2e%2f", "%2e%2e%5c"]
+    },
+    'command_injection': {
+        'targets': ["url"],
+        'literals': [
+            "; cat", "; ls", "; rm", "; wget", "; curl",
+            "| cat", "| ls", "| rm", "| wget", "| curl"
+        ]
+    },
+    'ldap_injection': {'literals': ["*)(uid=*", "*)(cn=*", ")(|(uid=*"]},
+    'xml_injection': {'targets': ["url"], 'literals': ["<!entity", "<!doctype", "<![cdata["]},
+    'scanner': {
+        'targets': ["user-agent"],
+        'literals': [
+            "sqlmap", "nikto", "nmap", "masscan", "zap",
+            "burp", "w3af", "acunetix", "nessus", "openvas",
+            "python-requests", "curl", "wget", "bot", "crawler"
+        ]
+    },
+    'header_spoofing': {
+        'targets': ["x-forwarded-for", "x-real-ip", "x-originating-ip"],
+        'literals': ["127.0.0.1", "localhost", "0.0.0.0"]
+    }
+}
+
+# Cabeçalhos verificados (cookies e tokens ficam de fora)
+DEFAULT_SCREENED_HEADERS = (
+    "user-agent", "referer", "x-forwarded-for", "x-real-ip", "x-originating-ip"
+)
+
+@dataclass
+class AttackMatch:
+    """Assinatura encontrada em uma requisição"""
+    category: str
+    target: str  # "url", "body" ou o nome do cabeçalho
+    matched: str
+
+class AttackPatternMatcher:
+    """
+    Verifica requisições contra todas as assinaturas em uma única varredura.
+
+    URL, cabeçalhos e corpo são unidos em um único texto; as ocorrências
+    encontradas são atribuídas à parte de origem pela posição, e as de
+    categorias restritas a outros cabeçalhos são descartadas.
+    """
+
+    def __init__(
+        self,
+        signatures: Optional[Mapping[str, Mapping[str, List[str]]]] = None,
+        screened_headers: Iterable[str] = DEFAULT_SCREENED_HEADERS,
+        disabled_categories: Iterable[str] = (),
+        max_body_chars: int = 65536
+    ):
+        disabled = set(disabled_categories)
+        self.signatures = {
+            category: signature
+            for category, signature in (signatures or DEFAULT_SIGNATURES).items()
+            if category not in disabled
+        }
+        self.screened_headers = tuple(name.lower() for name in screened_headers)
+        self.max_body_chars = max_body_chars
+
+        # Categoria -> cabeçalhos permitidos (None = qualquer parte)
+        self._targets = {
+            category: set(signature['targets']) if signature.get('targets') else None
+            for category, signature in self.signatures.items()
+        }
+        self._groups: Dict[str, str] = {}
+        self._automaton = None
+        self.literal_pattern = None
+        self.pattern = None
+        self._compile()
+
+    @classmethod
+    def from_env(cls) -> "AttackPatternMatcher":
+        """Cria o detector com os conjuntos de assinaturas configurados"""
+        signatures = {
+            category: {key: list(values) for key, values in signature.items()}
+            for category, signature in DEFAULT_SIGNATURES.items()
+        }
+
+        signatures_file = os.getenv("ATTACK_SIGNATURES_FILE")
+        if signatures_file:
+            try:
+                with open(signatures_file, encoding="utf-8") as f:
+                    custom = json.load(f)
+                if os.getenv("ATTACK_SIGNATURES_MODE", "extend").lower() == "replace":
+                    signatures = {}
+                for category, signature in custom.items():
+                    current = signatures.setdefault(category, {})
+                    for key, values in signature.items():
+                        current.setdefault(key, []).extend(values)
+            except Exception as e:
+                logger.error(f"Erro ao carregar assinaturas de ataque de {signatures_file}: {e}")
+
+        disabled = [c.strip() for c in os.getenv("ATTACK_DISABLED_CATEGORIES", "").split(",") if c.strip()]
+        headers = os.getenv("ATTACK_SCREENED_HEADERS")
+
+        return cls(
+            signatures=signatures,
+            screened_headers=headers.split(",") if headers else DEFAULT_SCREENED_HEADERS,
+            disabled_categories=disabled,
+            max_body_chars=int(os.getenv("ATTACK_SCREEN_MAX_BODY_CHARS", "65536"))
+        )
+
+    @property
+    def engine(self) -> str:
+        return "aho-corasick" if self._automaton is not None else "regex"
+
+    def scan(
+        self,
+        url: str = "",
+        headers: Optional[Mapping[str, str]] = None,
+        body: Union[str, bytes, None] = None
+    ) -> Optional[AttackMatch]:
+        """
+        Verifica URL, cabeçalhos e corpo de uma requisição.
+
+        Returns:
+            A primeira assinatura encontrada ou None
+        """
+        parts = [url]
+        targets = ["url"]
+
+        if headers:
+            for name in self.screened_headers:
+                value = headers.get(name)
+                if value:
+                    parts.append(value)
+                    targets.append(name)
+
+        if body:
+            if isinstance(body, bytes):
+                body = body[:self.max_body_chars].decode("utf-8", errors="replace")
+            parts.append(body[:self.max_body_chars])
+            targets.append("body")
+
+        text = "\n".join(parts).lower()
+
+        offsets = []
+        position = 0
+        for part in parts:
+            offsets.append(position)
+            position += len(part) + 1
+
+        for start, category, matched in self._find(text):
+            target = targets[bisect.bisect_right(offsets, start) - 1]
+            allowed = self._targets[category]
+            if allowed is None or target in allowed:
+                return AttackMatch(category=category, target=target, matched=matched)
+
+        return None
+
+    def scan_text(self, payload: str) -> Optional[AttackMatch]:
+        """Verifica um texto avulso (ex.: payload já extraído) contra as categorias de URL e corpo"""
+        match = self.scan(payload)
+        if match:
+            match.target = "payload"
+        return match
+
+    def _find(self, text: str) -> Iterator[Tuple[int, str, str]]:
+        """Ocorrências (posição, categoria, trecho) em uma varredura por mecanismo"""
+        if self._automaton is not None:
+            for end, (category, literal) in self._automaton.iter(text):
+                yield end - len(literal) + 1, category, literal
+        elif self.literal_pattern is not None:
+            for match in self.literal_pattern.finditer(text):
+                yield match.start(), self._groups[match.lastgroup], match.group(0)
+
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                yield match.start(), self._groups[match.lastgroup], match.group(0)
+
+    def _compile(self):
+        literals: List[Tuple[str, str]] = []
+        patterns: List[Tuple[str, str]] = []
+        for category, signature in self.signatures.items():
+            literals.extend((category, literal.lower()) for literal in signature.get('literals', []))
+            patterns.extend((category, pattern) for pattern in signature.get('patterns', []))
+
+        if literals and ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for category, literal in literals:
+                self._automaton.add_word(literal, (category, literal))
+            self._automaton.make_automaton()
+        elif literals:
+            self.literal_pattern = self._combine(
+                ((category, re.escape(literal)) for category, literal in literals), literal=True
+            )
+
+        if patterns:
+            self.pattern = self._combine(patterns)
+
+    def _combine(self, patterns: Iterable[Tuple[str, str]], literal: bool = False) -> "re.Pattern":
+        """
+        Une as regex em uma só. Cada alternativa termina em um grupo vazio
+        que identifica a categoria, preservando o início literal das
+        alternativas (o que permite ao `re` pular posições sem candidatos).
+        """
+        alternatives = []
+        for category, pattern in patterns:
+            group = f"g{len(self._groups)}"
+            self._groups[group] = category
+            alternatives.append(f"{pattern if literal else f'(?:{pattern})'}(?P<{group}>)")
+        return re.compile("|".join(alternatives))
+
+# Instância global
+attack_detector = AttackPatternMatcher.from_env()
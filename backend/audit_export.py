@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Exportação em Streaming dos Logs de Auditoria
+
+Este módulo gera exportações de logs de auditoria (CSV, JSON ou NDJSON,
+opcionalmente comprimidas com gzip) de forma incremental. Os logs são
+lidos com cursor no servidor (stream_results/yield_per) em ordem de id,
+de modo que o uso de memória não depende da quantidade de linhas.
+
+Exportações podem ser retomadas com um token de cursor (keyset sobre o id).
+"""
+
+import os
+import csv
+import io
+import json
+import zlib
+import base64
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from audit_logger import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Linhas lidas por ida ao banco e tamanho aproximado de cada bloco enviado
+EXPORT_FETCH_SIZE = int(os.getenv("AUDIT_EXPORT_FETCH_SIZE", "2000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FIELDS = [
+    "id", "event_type", "severity", "event_id", "user_id", "username",
+    "user_role", "session_id", "ip_address", "resource_type", "resource_id",
+    "action", "description", "endpoint", "http_method", "status_code",
+    "response_time_ms", "country", "city", "is_sensitive_data", "created_at",
+    "old_values", "new_values", "metadata"
+]
+
+# Colunas do CSV (sem os campos JSON)
+CSV_HEADER = [
+    "ID", "Tipo de Evento", "Severidade", "ID do Evento", "ID do Usuário",
+    "Nome do Usuário", "Papel do Usuário", "ID da Sessão", "Endereço IP",
+    "Tipo do Recurso", "ID do Recurso", "Ação", "Descrição", "Endpoint",
+    "Método HTTP", "Código de Status", "Tempo de Resposta (ms)",
+    "País", "Cidade", "Dados Sensíveis", "Data de Criação"
+]
+CSV_FIELD_COUNT = len(CSV_HEADER)
+
+class InvalidExportCursor(ValueError):
+    """Token de cursor inválido"""
+
+def encode_cursor(last_id: int) -> str:
+    """Gera o token opaco para retomar a exportação após last_id"""
+    payload = json.dumps({"after_id": last_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(token: str) -> int:
+    """Decodifica o token de cursor, retornando o último id exportado"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after_id"])
+    except Exception:
+        raise InvalidExportCursor(f"Cursor de exportação inválido: {token}")
+
+class AuditLogExporter:
+    """Gera exportações de logs de auditoria em blocos"""
+
+    def __init__(
+        self,
+        export_format: str,
+        compress: bool = False,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        event_type: Optional[str] = None,
+        user_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        session_factory=None
+    ):
+        self.export_format = export_format
+        self.compress = compress
+        self.start_date = start_date
+        self.end_date = end_date
+        self.event_type = event_type
+        self.user_id = user_id
+        self.after_id = after_id
+        self.max_rows = max_rows
+        self.session_factory = session_factory or SessionLocal
+
+        self.rows_exported = 0
+        self.last_id = after_id
+        self.last_id_limit: Optional[int] = None
+
+    @property
+    def media_type(self) -> str:
+        if self.compress:
+            return "application/gzip"
+        return {
+            "csv": "text/csv",
+            "ndjson": "application/x-ndjson",
+            "json": "application/json"
+        }[self.export_format]
+
+    @property
+    def filename(self) -> str:
+        name = f"audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{self.export_format}"
+        return name + ".gz" if self.compress else name
+
+    def resolve_page(self, db: Session) -> Optional[str]:
+        """
+        Quando max_rows é informado, determina o último id desta página
+        (consulta apenas ao índice de id) e retorna o cursor da próxima.
+        """
+        if not self.max_rows:
+            return None
+
+        self.last_id_limit = self._base_query(db, AuditLog.id).order_by(
+            AuditLog.id
+        ).offset(self.max_rows - 1).limit(1).scalar()
+
+        return encode_cursor(self.last_id_limit) if self.last_id_limit is not None else None
+
+    def stream(self) -> Iterator[bytes]:
+        """Gera o conteúdo da exportação em blocos de bytes"""
+        compressor = zlib.compressobj(wbits=31) if self.compress else None
+        buffer = io.StringIO()
+
+        def drain(final: bool = False) -> Optional[bytes]:
+            data = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            if compressor:
+                data = compressor.compress(data)
+                if final:
+                    data += compressor.flush()
+            return data or None
+
+        db = self.session_factory()
+        try:
+            writer = csv.writer(buffer) if self.export_format == "csv" else None
+            if writer:
+                writer.writerow(CSV_HEADER)
+            elif self.export_format == "json":
+                buffer.write('{"export_info": ')
+                buffer.write(json.dumps({
+                    "format": "json",
+                    "exported_at": datetime.utcnow().isoformat(),
+                    "after_id": self.after_id
+                }))
+                buffer.write(', "logs": [')
+
+            for record in self._iter_records(db):
+                if writer:
+                    writer.writerow([
+                        record[field] for field in EXPORT_FIELDS[:CSV_FIELD_COUNT]
+                    ])
+                else:
+                    if self.export_format == "json" and self.rows_exported > 1:
+                        buffer.write(", ")
+                    buffer.write(json.dumps(record, ensure_ascii=False, default=str))
+                    if self.export_format == "ndjson":
+                        buffer.write("\n")
+
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    chunk = drain()
+                    if chunk:
+                        yield chunk
+
+            if self.export_format == "ndjson" and self._next_cursor():
+                buffer.write(json.dumps({"next_cursor": self._next_cursor()}) + "\n")
+            elif self.export_format == "json":
+                buffer.write("], ")
+                buffer.write(json.dumps({
+                    "total_logs": self.rows_exported,
+                    "next_cursor": self._next_cursor()
+                })[1:])
+
+            chunk = drain(final=True)
+            if chunk:
+                yield chunk
+
+        finally:
+            db.close()
+
+    def _next_cursor(self) -> Optional[str]:
+        """Cursor para continuar após o último log exportado (se houver mais)"""
+        if self.max_rows and self.rows_exported >= self.max_rows and self.last_id is not None:
+            return encode_cursor(self.last_id)
+        return None
+
+    def _base_query(self, db: Session, *columns):
+        query = db.query(*columns)
+
+        if self.after_id is not None:
+            query = query.filter(AuditLog.id > self.after_id)
+        if self.user_id:
+            query = query.filter(AuditLog.user_id == self.user_id)
+        if self.event_type:
+            query = query.filter(AuditLog.event_type == self.event_type)
+        if self.start_date:
+            query = query.filter(AuditLog.created_at >= self.start_date)
+        if self.end_date:
+            query = query.filter(AuditLog.created_at <= self.end_date)
+
+        return query
+
+    def _iter_records(self, db: Session) -> Iterator[Dict[str, Any]]:
+        """Lê os logs em ordem de id com cursor no servidor"""
+        query = self._base_query(db, *[getattr(AuditLog, field) for field in EXPORT_FIELDS])
+
+        if self.last_id_limit is not None:
+            query = query.filter(AuditLog.id <= self.last_id_limit)
+        elif self.max_rows:
+            query = query.limit(self.max_rows)
+
+        query = query.order_by(AuditLog.id).yield_per(EXPORT_FETCH_SIZE)
+
+        for row in query:
+            record = dict(zip(EXPORT_FIELDS, row))
+            if record["created_at"]:
+                record["created_at"] = record["created_at"].isoformat()
+
+            self.rows_exported += 1
+            self.last_id = record["id"]
+            yield record
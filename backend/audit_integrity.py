@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Integridade Encadeada dos Logs de Auditoria
+
+Este módulo implementa a verificação de integridade dos logs de auditoria:
+- Checksum encadeado (cada log referencia o hash do log anterior)
+- Checkpoints diários com raiz de Merkle
+- Verificador que percorre a tabela em blocos ordenados por id (em paralelo
+  no pool de processos apenas fora das requisições: python audit_integrity.py)
+
+As funções de hash não dependem do banco de dados para que possam ser
+executadas em processos de um pool sem reimportar a aplicação.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Checksum anterior do primeiro log da cadeia
+GENESIS_CHECKSUM = "0" * 64
+
+# Chave do advisory lock do PostgreSQL que serializa o encadeamento
+AUDIT_CHAIN_LOCK_KEY = 7_314_552_001
+
+# Máximo de detalhes de falhas retornados por verificação
+MAX_REPORTED_FAILURES = 100
+
+def compute_audit_checksum(
+    event_type: Optional[str],
+    user_id: Optional[int],
+    resource_type: Optional[str],
+    resource_id: Optional[str],
+    action: Optional[str],
+    description: Optional[str],
+    created_at: Optional[datetime],
+    previous_checksum: Optional[str] = None
+) -> str:
+    """
+    Calcula o checksum SHA-256 de um log de auditoria.
+
+    Logs gravados antes do encadeamento (id até o corte registrado em
+    audit_chain_cutover) foram calculados sem previous_checksum e com
+    created_at nulo; são verificados chamando esta função dessa forma.
+    """
+    data = {
+        'event_type': event_type,
+        'user_id': user_id,
+        'resource_type': resource_type,
+        'resource_id': resource_id,
+        'action': action,
+        'description': description,
+        'created_at': created_at.isoformat() if created_at else None
+    }
+
+    if previous_checksum is not None:
+        data['previous_checksum'] = previous_checksum
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+class MerkleAccumulator:
+    """
+    Calcula a raiz de Merkle de forma incremental, com memória O(log n).
+
+    Subárvores completas de mesmo nível são combinadas assim que possível;
+    as subárvores restantes são combinadas da direita para a esquerda.
+    """
+
+    def __init__(self):
+        self._stack: List[tuple] = []  # (nível, hash)
+        self.count = 0
+
+    def add(self, checksum: str):
+        """Adiciona uma folha (checksum hexadecimal)"""
+        node = bytes.fromhex(checksum)
+        level = 0
+
+        while self._stack and self._stack[-1][0] == level:
+            _, left = self._stack.pop()
+            node = hashlib.sha256(left + node).digest()
+            level += 1
+
+        self._stack.append((level, node))
+        self.count += 1
+
+    def root(self) -> Optional[str]:
+        """Retorna a raiz hexadecimal ou None se não houver folhas"""
+        if not self._stack:
+            return None
+
+        node = self._stack[-1][1]
+        for _, left in reversed(self._stack[:-1]):
+            node = hashlib.sha256(left + node).digest()
+
+        return node.hex()
+
+def merkle_root(checksums: Iterable[str]) -> Optional[str]:
+    """Calcula a raiz de Merkle de uma sequência de checksums"""
+    accumulator = MerkleAccumulator()
+    for checksum in checksums:
+        accumulator.add(checksum)
+    return accumulator.root()
+
+# Colunas lidas pelo verificador, na ordem esperada por _verify_chunk
+VERIFY_COLUMNS = (
+    'id', 'event_type', 'user_id', 'resource_type', 'resource_id',
+    'action', 'description', 'created_at', 'checksum', 'previous_checksum'
+)
+
+def _verify_chunk(rows: Sequence[tuple], legacy_max_id: int = 0) -> Dict[str, Any]:
+    """
+    Verifica um bloco de logs ordenado por id (executado no pool de processos).
+
+    Recalcula o checksum de cada linha e confere o encadeamento interno do
+    bloco. Apenas logs com id até `legacy_max_id` podem estar fora da cadeia;
+    depois do corte, previous_checksum nulo é uma quebra de cadeia. O
+    encadeamento com o bloco anterior é conferido pelo chamador.
+    """
+    corrupted = []
+    broken_links = []
+    previous_row_checksum = None
+
+    for index, row in enumerate(rows):
+        (log_id, event_type, user_id, resource_type, resource_id,
+         action, description, created_at, checksum, previous_checksum) = row
+
+        legacy = log_id <= legacy_max_id
+        expected = compute_audit_checksum(
+            event_type, user_id, resource_type, resource_id,
+            action, description, None if legacy else created_at, previous_checksum
+        )
+
+        if expected != checksum:
+            corrupted.append({
+                'id': log_id,
+                'created_at': created_at.isoformat() if created_at else None,
+                'expected_checksum': expected,
+                'stored_checksum': checksum
+            })
+
+        if not legacy and (previous_checksum is None or (index > 0 and previous_checksum != previous_row_checksum)):
+            broken_links.append({'id': log_id, 'previous_id': rows[index - 1][0] if index > 0 else None})
+
+        previous_row_checksum = checksum
+
+    return {
+        'count': len(rows),
+        'first_id': rows[0][0],
+        'last_id': rows[-1][0],
+        'first_previous_checksum': rows[0][9],
+        'first_chained': rows[0][0] > legacy_max_id,
+        'last_checksum': rows[-1][8],
+        'corrupted': corrupted,
+        'broken_links': broken_links
+    }
+
+class AuditIntegrityVerifier:
+    """
+    Verificador da integridade encadeada dos logs de auditoria.
+
+    Por padrão verifica no próprio processo (AUDIT_VERIFY_WORKERS=1), como
+    nas requisições da API; a verificação completa em paralelo roda como
+    job (python audit_integrity.py).
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, max_workers: Optional[int] = None):
+        self.chunk_size = chunk_size or int(os.getenv("AUDIT_VERIFY_CHUNK_SIZE", "20000"))
+        self.max_workers = max_workers or int(os.getenv("AUDIT_VERIFY_WORKERS", "1"))
+
+    def verify(
+        self,
+        db,
+        start_id: Optional[int] = None,
+        end_id: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        max_workers: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Verifica checksums e encadeamento de um intervalo de logs.
+
+        Os logs são lidos em blocos ordenados por id com yield_per e, com
+        mais de um worker, verificados em um pool de processos; apenas um
+        número limitado de blocos fica em memória ao mesmo tempo.
+
+        Args:
+            db: Sessão do banco de dados
+            start_id: Primeiro id a verificar
+            end_id: Último id a verificar
+            start_date: Data inicial (convertida no intervalo de ids do período)
+            end_date: Data final
+            max_workers: Processos do pool (padrão: self.max_workers)
+
+        Returns:
+            Resultado da verificação
+        """
+        from audit_logger import AuditLog
+
+        started = time.perf_counter()
+        result = {
+            'total_logs_checked': 0,
+            'corrupted_logs_count': 0,
+            'broken_links_count': 0,
+            'corrupted_logs': [],
+            'broken_links': []
+        }
+
+        if start_date or end_date:
+            # O encadeamento segue o id: o período vira o intervalo contíguo
+            # [min(id), max(id)], e logs gravados fora de ordem no meio dele
+            # também são verificados
+            start_id, end_id = self.id_range(db, start_date, end_date, start_id, end_id)
+            if start_id is None:
+                result['integrity_ok'] = True
+                result['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+                return result
+
+        query = db.query(*[getattr(AuditLog, column) for column in VERIFY_COLUMNS])
+        if start_id is not None:
+            query = query.filter(AuditLog.id >= start_id)
+        if end_id is not None:
+            query = query.filter(AuditLog.id <= end_id)
+
+        rows = query.order_by(AuditLog.id).yield_per(self.chunk_size)
+
+        state = {'last_checksum': None, 'last_id': None}
+        legacy_max_id = self.legacy_max_id(db)
+        max_workers = max_workers or self.max_workers
+
+        if max_workers <= 1:
+            for chunk in self._chunks(rows):
+                self._merge(result, state, _verify_chunk(chunk, legacy_max_id))
+        else:
+            max_in_flight = max_workers * 2
+            pending = deque()
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for chunk in self._chunks(rows):
+                    pending.append(executor.submit(_verify_chunk, chunk, legacy_max_id))
+                    if len(pending) >= max_in_flight:
+                        self._merge(result, state, pending.popleft().result())
+
+                while pending:
+                    self._merge(result, state, pending.popleft().result())
+
+        result['integrity_ok'] = (
+            result['corrupted_logs_count'] == 0 and result['broken_links_count'] == 0
+        )
+        result['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+        return result
+
+    def verify_recent(self, db, limit: int, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """Verifica os últimos `limit` logs"""
+        from audit_logger import AuditLog
+
+        start_id = db.query(AuditLog.id).order_by(AuditLog.id.desc()).offset(limit - 1).limit(1).scalar()
+        return self.verify(db, start_id=start_id, max_workers=max_workers)
+
+    @staticmethod
+    def id_range(
+        db,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        start_id: Optional[int] = None,
+        end_id: Optional[int] = None
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """Menor e maior id dos logs do período ((None, None) se não houver)"""
+        from sqlalchemy import func
+        from audit_logger import AuditLog
+
+        query = db.query(func.min(AuditLog.id), func.max(AuditLog.id))
+        if start_id is not None:
+            query = query.filter(AuditLog.id >= start_id)
+        if end_id is not None:
+            query = query.filter(AuditLog.id <= end_id)
+        if start_date:
+            query = query.filter(AuditLog.created_at >= start_date)
+        if end_date:
+            query = query.filter(AuditLog.created_at <= end_date)
+        return tuple(query.one())
+
+    @staticmethod
+    def legacy_max_id(db) -> int:
+        """Último id gravado antes do encadeamento (0 se não houver corte registrado)"""
+        from audit_logger import AuditChainCutover
+
+        return db.query(AuditChainCutover.legacy_max_id).order_by(AuditChainCutover.id).limit(1).scalar() or 0
+
+    def _chunks(self, rows: Iterable[tuple]):
+        """Agrupa as linhas em blocos de tamanho chunk_size"""
+        chunk = []
+        for row in rows:
+            chunk.append(tuple(row))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _merge(result: Dict[str, Any], state: Dict[str, Any], chunk_result: Dict[str, Any]):
+        """Acumula o resultado de um bloco e confere a fronteira com o bloco anterior"""
+        if (
+            state['last_checksum'] is not None
+            and chunk_result['first_chained']
+            and chunk_result['first_previous_checksum'] is not None
+            and chunk_result['first_previous_checksum'] != state['last_checksum']
+        ):
+            chunk_result['broken_links'].insert(0, {
+                'id': chunk_result['first_id'],
+                'previous_id': state['last_id']
+            })
+
+        result['total_logs_checked'] += chunk_result['count']
+        result['corrupted_logs_count'] += len(chunk_result['corrupted'])
+        result['broken_links_count'] += len(chunk_result['broken_links'])
+
+        room = MAX_REPORTED_FAILURES - len(result['corrupted_logs'])
+        if room > 0:
+            result['corrupted_logs'].extend(chunk_result['corrupted'][:room])
+        room = MAX_REPORTED_FAILURES - len(result['broken_links'])
+        if room > 0:
+            result['broken_links'].extend(chunk_result['broken_links'][:room])
+
+        state['last_checksum'] = chunk_result['last_checksum']
+        state['last_id'] = chunk_result['last_id']
+
+class AuditCheckpointManager:
+    """Gerencia os checkpoints diários de Merkle dos logs de auditoria"""
+
+    def __init__(self, chunk_size: Optional[int] = None):
+        self.chunk_size = chunk_size or int(os.getenv("AUDIT_VERIFY_CHUNK_SIZE", "20000"))
+
+    def build_checkpoint(self, db, checkpoint_date: date):
+        """
+        Cria (ou recria) o checkpoint de um dia.
+
+        Args:
+            db: Sessão do banco de dados
+            checkpoint_date: Dia do checkpoint
+
+        Returns:
+            AuditCheckpoint criado ou None se não houver logs no dia
+        """
+        from audit_logger import AuditCheckpoint
+
+        summary = self._summarize_day(db, checkpoint_date)
+        if not summary:
+            return None
+
+        checkpoint = db.query(AuditCheckpoint).filter(
+            AuditCheckpoint.checkpoint_date == checkpoint_date
+        ).first()
+
+        if not checkpoint:
+            checkpoint = AuditCheckpoint(checkpoint_date=checkpoint_date)
+            db.add(checkpoint)
+
+        checkpoint.first_log_id = summary['first_log_id']
+        checkpoint.last_log_id = summary['last_log_id']
+        checkpoint.log_count = summary['log_count']
+        checkpoint.merkle_root = summary['merkle_root']
+        checkpoint.last_checksum = summary['last_checksum']
+        checkpoint.created_at = datetime.utcnow()
+
+        db.commit()
+        db.refresh(checkpoint)
+        return checkpoint
+
+    def build_missing_checkpoints(self, db, until: Optional[date] = None) -> int:
+        """
+        Cria checkpoints para todos os dias completos ainda sem checkpoint.
+
+        Args:
+            db: Sessão do banco de dados
+            until: Último dia a considerar (padrão: ontem)
+
+        Returns:
+            Número de checkpoints criados
+        """
+        from sqlalchemy import func
+        from audit_logger import AuditLog, AuditCheckpoint
+
+        until = until or (datetime.utcnow().date() - timedelta(days=1))
+
+        last_checkpoint = db.query(func.max(AuditCheckpoint.checkpoint_date)).scalar()
+        if last_checkpoint:
+            day = last_checkpoint + timedelta(days=1)
+        else:
+            first_log = db.query(func.min(AuditLog.created_at)).scalar()
+            if not first_log:
+                return 0
+            day = first_log.date()
+
+        created = 0
+        while day <= until:
+            if self.build_checkpoint(db, day):
+                created += 1
+            day += timedelta(days=1)
+
+        logger.info(f"Checkpoints de auditoria criados: {created}")
+        return created
+
+    def verify_checkpoints(
+        self,
+        db,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """
+        Recalcula a raiz de Merkle de cada dia e compara com o checkpoint.
+
+        Detecta alterações, inserções e remoções de logs em dias já fechados.
+        """
+        from audit_logger import AuditCheckpoint
+
+        query = db.query(AuditCheckpoint)
+        if start_date:
+            query = query.filter(AuditCheckpoint.checkpoint_date >= start_date)
+        if end_date:
+            query = query.filter(AuditCheckpoint.checkpoint_date <= end_date)
+
+        mismatches = []
+        checked = 0
+
+        for checkpoint in query.order_by(AuditCheckpoint.checkpoint_date).all():
+            checked += 1
+            summary = self._summarize_day(db, checkpoint.checkpoint_date) or {}
+
+            if (
+                summary.get('merkle_root') != checkpoint.merkle_root
+                or summary.get('log_count') != checkpoint.log_count
+            ):
+                mismatches.append({
+                    'checkpoint_date': checkpoint.checkpoint_date.isoformat(),
+                    'expected_merkle_root': checkpoint.merkle_root,
+                    'current_merkle_root': summary.get('merkle_root'),
+                    'expected_log_count': checkpoint.log_count,
+                    'current_log_count': summary.get('log_count', 0)
+                })
+
+        return {
+            'checkpoints_ok': not mismatches,
+            'checkpoints_checked': checked,
+            'mismatches': mismatches[:MAX_REPORTED_FAILURES]
+        }
+
+    def _summarize_day(self, db, checkpoint_date: date) -> Optional[Dict[str, Any]]:
+        """Percorre os checksums de um dia em ordem de id"""
+        from audit_logger import AuditLog
+
+        day_start = datetime.combine(checkpoint_date, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+
+        rows = db.query(AuditLog.id, AuditLog.checksum).filter(
+            AuditLog.created_at >= day_start,
+            AuditLog.created_at < day_end
+        ).order_by(AuditLog.id).yield_per(self.chunk_size)
+
+        accumulator = MerkleAccumulator()
+        first_log_id = None
+        last_log_id = None
+        last_checksum = None
+
+        for log_id, checksum in rows:
+            if first_log_id is None:
+                first_log_id = log_id
+            accumulator.add(checksum or GENESIS_CHECKSUM)
+            last_log_id = log_id
+            last_checksum = checksum
+
+        if not accumulator.count:
+            return None
+
+        return {
+            'first_log_id': first_log_id,
+            'last_log_id': last_log_id,
+            'log_count': accumulator.count,
+            'merkle_root': accumulator.root(),
+            'last_checksum': last_checksum
+        }
+
+# Instâncias globais
+integrity_verifier = AuditIntegrityVerifier()
+checkpoint_manager = AuditCheckpointManager()
+
+if __name__ == "__main__":
+    # Verificação completa em paralelo, fora das requisições: python audit_integrity.py
+    logging.basicConfig(level=logging.INFO)
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        verification = integrity_verifier.verify(session, max_workers=os.cpu_count() or 1)
+        print(json.dumps(verification, indent=2, default=str))
+    finally:
+        session.close()
@@ -13,17 +13,23 @@ para rastrear todas as ações críticas do sistema, incluindo:
 
 import os
 import json
-import hashlib
+import time
+import atexit
+import threading
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any, Union
 from enum import Enum
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, Index
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, Text, JSON, Index, insert, text
+from sqlalchemy import inspect as sa_inspect
 import logging
 from functools import wraps
 from contextlib import contextmanager
 
-from database import Base, get_db
+from database import Base, get_db, SessionLocal
+from audit_integrity import compute_audit_checksum, GENESIS_CHECKSUM, AUDIT_CHAIN_LOCK_KEY
+from audit_partitions import partition_manager
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -100,7 +106,8 @@ class AuditLog(Base):
     # Identificação do evento
     event_type = Column(String(100), nullable=False, index=True)
     severity = Column(String(20), nullable=False, index=True)
-    event_id = Column(String(36), unique=True, index=True)  # UUID
+    # UUID; na tabela particionada a unicidade é garantida por (event_id, created_at)
+    event_id = Column(String(36), index=True)
     
     # Contexto do usuário
     user_id = Column(Integer, index=True)
@@ -139,6 +146,7 @@ class AuditLog(Base):
     
     # Integridade
     checksum = Column(String(64))  # Hash SHA-256 para verificar integridade
+    previous_checksum = Column(String(64))  # Hash do log anterior (encadeamento)
     
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -156,22 +164,376 @@ class AuditLog(Base):
         return f"<AuditLog(event_type={self.event_type}, user_id={self.user_id}, created_at={self.created_at})>"
     
     def calculate_checksum(self) -> str:
-        """Calcula checksum para verificação de integridade"""
-        data = {
-            'event_type': self.event_type,
-            'user_id': self.user_id,
-            'resource_type': self.resource_type,
-            'resource_id': self.resource_id,
-            'action': self.action,
-            'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
-        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        """Calcula checksum para verificação de integridade (encadeado ao log anterior)"""
+        return compute_audit_checksum(
+            self.event_type,
+            self.user_id,
+            self.resource_type,
+            self.resource_id,
+            self.action,
+            self.description,
+            self.created_at,
+            self.previous_checksum
+        )
     
     def verify_integrity(self) -> bool:
         """Verifica integridade do log"""
         return self.checksum == self.calculate_checksum()
 
+class AuditCheckpoint(Base):
+    """Checkpoint diário com a raiz de Merkle dos logs de auditoria"""
+    
+    __tablename__ = "audit_checkpoints"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    checkpoint_date = Column(Date, nullable=False, unique=True, index=True)
+    first_log_id = Column(Integer, nullable=False)
+    last_log_id = Column(Integer, nullable=False)
+    log_count = Column(Integer, nullable=False)
+    merkle_root = Column(String(64), nullable=False)
+    last_checksum = Column(String(64))  # Cabeça da cadeia ao final do dia
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f"<AuditCheckpoint(date={self.checkpoint_date}, log_count={self.log_count})>"
+
+class AuditChainCutover(Base):
+    """Último log gravado antes do encadeamento de checksums (registrado na migração 009)"""
+    
+    __tablename__ = "audit_chain_cutover"
+    
+    id = Column(Integer, primary_key=True)
+    legacy_max_id = Column(Integer, nullable=False)  # Logs com id maior devem estar encadeados
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class AuditLogHourlyStat(Base):
+    """Agregado horário dos logs de auditoria (mantido por audit_stats)"""
+    
+    __tablename__ = "audit_log_hourly_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bucket_hour = Column(DateTime, nullable=False)  # Início da hora (UTC)
+    event_type = Column(String(100), nullable=False)
+    severity = Column(String(20), nullable=False)
+    user_id = Column(Integer)
+    username = Column(String(100))
+    event_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index('idx_audit_hourly_bucket', 'bucket_hour'),
+        Index('idx_audit_hourly_user_bucket', 'user_id', 'bucket_hour'),
+        # Uma linha por chave do bucket (usuário nulo = eventos do sistema)
+        Index(
+            'uq_audit_hourly_bucket_key',
+            'bucket_hour', 'event_type', 'severity',
+            text('coalesce(user_id, 0)'), text("coalesce(username, '')"),
+            unique=True
+        ),
+    )
+    
+    def __repr__(self):
+        return f"<AuditLogHourlyStat(bucket_hour={self.bucket_hour}, event_type={self.event_type}, event_count={self.event_count})>"
+
+def link_audit_chain(db: Session, audit_logs: List[AuditLog]):
+    """
+    Encadeia os checksums dos logs ao último log persistido.
+    
+    No PostgreSQL um advisory lock de transação serializa o encadeamento
+    entre processos; o lock é liberado no commit do lote.
+    """
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': AUDIT_CHAIN_LOCK_KEY})
+    
+    # Limitar a busca às partições recentes; recorrer à tabela inteira se vazia
+    last_checksum = db.query(AuditLog.checksum).order_by(AuditLog.id.desc())
+    previous = last_checksum.filter(
+        AuditLog.created_at >= datetime.utcnow() - timedelta(days=1)
+    ).limit(1).scalar()
+    if previous is None:
+        previous = last_checksum.limit(1).scalar()
+    previous = previous or GENESIS_CHECKSUM
+    
+    for audit_log in audit_logs:
+        audit_log.previous_checksum = previous
+        audit_log.checksum = audit_log.calculate_checksum()
+        previous = audit_log.checksum
+
+class AuditLogBuffer:
+    """
+    Gravador assíncrono em lote para logs de auditoria.
+    
+    Os eventos são enfileirados em memória e persistidos com um único
+    INSERT multi-linha quando a fila atinge o tamanho do lote ou quando o
+    intervalo de flush expira. A ordem de enfileiramento é preservada na
+    gravação e os checksums são encadeados no momento do flush.
+    
+    Um lote que falha é dividido ao meio até isolar o log que impede a
+    gravação; esse log vai para o arquivo de auditoria (dead-letter) após
+    max_attempts tentativas. Com a fila cheia, novos eventos também vão
+    direto para o arquivo em vez de gravar no banco na requisição.
+    """
+    
+    def __init__(
+        self,
+        session_factory=None,
+        batch_size: Optional[int] = None,
+        flush_interval_seconds: Optional[float] = None,
+        max_queue_size: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        on_flush=None
+    ):
+        self.session_factory = session_factory or SessionLocal
+        self.batch_size = batch_size or int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+        self.flush_interval_seconds = flush_interval_seconds or float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "2"))
+        self.max_queue_size = max_queue_size or int(os.getenv("AUDIT_MAX_QUEUE_SIZE", "10000"))
+        self.max_attempts = max_attempts or int(os.getenv("AUDIT_MAX_WRITE_ATTEMPTS", "5"))
+        self.on_flush = on_flush
+        self.dead_letter_logger = logging.getLogger('audit')
+        
+        self._queue: deque = deque()
+        self._queue_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        # Métricas
+        self._flush_count = 0
+        self._flushed_rows = 0
+        self._failed_flushes = 0
+        self._dead_lettered = 0
+        self._shed = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._last_flush_at: Optional[datetime] = None
+    
+    @property
+    def max_backlog_seconds(self) -> float:
+        """
+        Maior atraso entre o enqueue e a gravação de um log: com o banco
+        indisponível, cada log da fila esgota max_attempts flushes antes do
+        seguinte (e então vai para o dead-letter).
+        """
+        return self.max_queue_size * self.max_attempts * self.flush_interval_seconds
+    
+    def start(self):
+        """Inicia a thread de flush periódico"""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="audit-log-writer",
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.shutdown)
+    
+    def enqueue(self, audit_log: AuditLog):
+        """Adiciona um log à fila de gravação"""
+        with self._queue_lock:
+            queue_depth = len(self._queue)
+            accepted = queue_depth < self.max_queue_size
+            if accepted:
+                self._queue.append(audit_log)
+                queue_depth += 1
+        
+        if not accepted:
+            # Fila cheia (banco lento ou indisponível): o evento vai para o
+            # arquivo em vez de gravar no banco de forma síncrona na requisição
+            self._shed += 1
+            self._dead_letter(audit_log, "fila cheia")
+        
+        if queue_depth >= self.batch_size:
+            self._wakeup.set()
+    
+    def flush(self) -> int:
+        """
+        Grava todos os logs pendentes no banco.
+        
+        Returns:
+            Número de logs gravados
+        """
+        total = 0
+        
+        with self._flush_lock:
+            while True:
+                with self._queue_lock:
+                    batch = [
+                        self._queue.popleft()
+                        for _ in range(min(self.batch_size, len(self._queue)))
+                    ]
+                
+                if not batch:
+                    break
+                
+                written, remaining = self._write_isolating(batch)
+                total += written
+                
+                if remaining:
+                    # Devolver o restante à frente da fila, preservando a ordem
+                    with self._queue_lock:
+                        self._queue.extendleft(reversed(remaining))
+                    break
+        
+        return total
+    
+    def shutdown(self, timeout: float = 10.0):
+        """Interrompe a thread e grava os logs pendentes (hook de desligamento)"""
+        self._stopped.set()
+        self._wakeup.set()
+        
+        if self._thread and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+        
+        self.flush()
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Retorna métricas de fila e latência de flush"""
+        with self._queue_lock:
+            queue_depth = len(self._queue)
+        
+        return {
+            'queue_depth': queue_depth,
+            'max_queue_size': self.max_queue_size,
+            'batch_size': self.batch_size,
+            'flush_interval_seconds': self.flush_interval_seconds,
+            'flush_count': self._flush_count,
+            'flushed_rows': self._flushed_rows,
+            'failed_flushes': self._failed_flushes,
+            'dead_lettered': self._dead_lettered,
+            'shed': self._shed,
+            'last_flush_ms': round(self._last_flush_ms, 2),
+            'max_flush_ms': round(self._max_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self._flush_count, 2) if self._flush_count else 0.0,
+            'last_flush_at': self._last_flush_at.isoformat() if self._last_flush_at else None,
+            'writer_running': bool(self._thread and self._thread.is_alive())
+        }
+    
+    def _run(self):
+        """Loop da thread de gravação"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval_seconds)
+            self._wakeup.clear()
+            
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Erro no gravador de auditoria: {e}")
+    
+    def _write_isolating(self, batch: List[AuditLog]):
+        """
+        Grava o lote; se falhar, divide-o ao meio até isolar os logs que
+        impedem a gravação. Um log que falha sozinho conta uma tentativa e,
+        após max_attempts, vai para o dead-letter.
+        
+        Returns:
+            (logs gravados, logs a devolver à fila na ordem original)
+        """
+        written = 0
+        parts = [batch]
+        
+        while parts:
+            part = parts.pop(0)
+            if self._write_batch(part):
+                written += len(part)
+                continue
+            
+            if len(part) > 1:
+                middle = len(part) // 2
+                parts[:0] = [part[:middle], part[middle:]]
+                continue
+            
+            audit_log = part[0]
+            audit_log._write_attempts = getattr(audit_log, '_write_attempts', 0) + 1
+            if audit_log._write_attempts >= self.max_attempts:
+                self._dead_letter(audit_log, f"{audit_log._write_attempts} tentativas de gravação")
+                continue
+            
+            # Provável indisponibilidade do banco: tentar de novo no próximo flush
+            return written, [audit_log] + [pending for rest in parts for pending in rest]
+        
+        return written, []
+    
+    def _dead_letter(self, audit_log: AuditLog, reason: str):
+        """Registra no arquivo de auditoria um log que não será gravado no banco"""
+        self._dead_lettered += 1
+        try:
+            row = self._to_row(audit_log)
+            row['dead_letter_reason'] = reason
+            self.dead_letter_logger.error(json.dumps(row, ensure_ascii=False, default=str))
+        except Exception as e:
+            logger.error(f"Erro ao registrar log de auditoria descartado: {e}")
+    
+    def _write_batch(self, batch: List[AuditLog]) -> bool:
+        """Grava um lote com um único INSERT multi-linha"""
+        start = time.perf_counter()
+        db = self.session_factory()
+        
+        try:
+            link_audit_chain(db, batch)
+            db.execute(insert(AuditLog), [self._to_row(audit_log) for audit_log in batch])
+            db.commit()
+        except Exception as e:
+            logger.error(f"Erro ao gravar lote de auditoria ({len(batch)} logs): {e}")
+            db.rollback()
+            self._failed_flushes += 1
+            return False
+        finally:
+            db.close()
+        
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._flush_count += 1
+        self._flushed_rows += len(batch)
+        self._last_flush_ms = elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+        self._last_flush_at = datetime.utcnow()
+        
+        if self.on_flush:
+            for audit_log in batch:
+                self.on_flush(audit_log)
+        
+        return True
+    
+    @staticmethod
+    def _to_row(audit_log: AuditLog) -> Dict[str, Any]:
+        """Converte um AuditLog em parâmetros de INSERT, aplicando defaults escalares"""
+        row = {}
+        for attribute in sa_inspect(AuditLog).column_attrs:
+            column = attribute.columns[0]
+            if column.primary_key:
+                continue
+            
+            value = getattr(audit_log, attribute.key)
+            if value is None and column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+            row[attribute.key] = value
+        
+        return row
+
+_audit_buffer: Optional[AuditLogBuffer] = None
+_audit_buffer_lock = threading.Lock()
+
+def get_audit_buffer(on_flush=None) -> AuditLogBuffer:
+    """
+    Gravador em lote do processo, compartilhado por todas as instâncias de
+    AuditLogger: uma única thread de flush e um único hook de desligamento.
+    """
+    global _audit_buffer
+    with _audit_buffer_lock:
+        if _audit_buffer is None:
+            _audit_buffer = AuditLogBuffer(on_flush=on_flush)
+            _audit_buffer.start()
+        return _audit_buffer
+
+def audit_buffer_max_backlog_seconds() -> float:
+    """Atraso máximo de gravação do buffer do processo (ou da configuração, se ainda não criado)"""
+    buffer = _audit_buffer or AuditLogBuffer()
+    return buffer.max_backlog_seconds
+
 class AuditLogger:
     """Sistema de auditoria e logs de segurança"""
     
@@ -179,15 +541,25 @@ class AuditLogger:
         self.enabled = os.getenv("AUDIT_LOGGING_ENABLED", "true").lower() == "true"
         self.log_sensitive_data = os.getenv("LOG_SENSITIVE_DATA", "false").lower() == "true"
         self.max_description_length = int(os.getenv("AUDIT_MAX_DESCRIPTION_LENGTH", "1000"))
+        self.buffered_writes = os.getenv("AUDIT_BUFFERED_WRITES", "true").lower() == "true"
         
         # Configurar logger de arquivo para auditoria
         self.file_logger = self._setup_file_logger()
+        
+        # Gravador em lote do processo (o arquivo de log é escrito após cada flush)
+        self.buffer: Optional[AuditLogBuffer] = None
+        if self.enabled and self.buffered_writes:
+            self.buffer = get_audit_buffer(on_flush=self._log_to_file)
     
     def _setup_file_logger(self) -> logging.Logger:
         """Configura logger de arquivo para auditoria"""
         audit_logger = logging.getLogger('audit')
         audit_logger.setLevel(logging.INFO)
         
+        # Handler já configurado por outra instância
+        if audit_logger.handlers:
+            return audit_logger
+        
         # Handler para arquivo de auditoria
         log_dir = os.getenv("AUDIT_LOG_DIR", "logs")
         os.makedirs(log_dir, exist_ok=True)
@@ -257,7 +629,8 @@ class AuditLogger:
             is_sensitive_data: Se envolve dados sensíveis
             
         Returns:
-            Objeto AuditLog criado ou None se auditoria estiver desabilitada
+            Objeto AuditLog criado ou None se auditoria estiver desabilitada.
+            Com gravação em lote, o objeto retornado ainda não possui id.
         """
         if not self.enabled:
             return None
@@ -298,11 +671,17 @@ class AuditLogger:
                 http_method=http_method,
                 status_code=status_code,
                 response_time_ms=response_time_ms,
-                is_sensitive_data=is_sensitive_data
+                is_sensitive_data=is_sensitive_data,
+                created_at=datetime.utcnow()
             )
             
-            # Calcular checksum para integridade
-            audit_log.checksum = audit_log.calculate_checksum()
+            # Enfileirar para gravação em lote (checksum calculado no flush)
+            if self.buffer:
+                self.buffer.enqueue(audit_log)
+                return audit_log
+            
+            # Calcular checksum encadeado para integridade
+            link_audit_chain(db, [audit_log])
             
             # Salvar no banco
             db.add(audit_log)
@@ -319,6 +698,22 @@ class AuditLogger:
             db.rollback()
             return None
     
+    def flush(self) -> int:
+        """Grava imediatamente os logs pendentes no buffer"""
+        return self.buffer.flush() if self.buffer else 0
+    
+    def shutdown(self):
+        """Hook de desligamento: grava os logs pendentes e encerra o gravador"""
+        if self.buffer:
+            self.buffer.shutdown()
+    
+    def get_writer_metrics(self) -> Dict[str, Any]:
+        """Retorna métricas do gravador em lote"""
+        if not self.buffer:
+            return {'buffered_writes': False}
+        
+        return {'buffered_writes': True, **self.buffer.get_metrics()}
+    
     def _sanitize_sensitive_data(self, data: Optional[Dict]) -> Optional[Dict]:
         """Remove ou mascara dados sensíveis"""
         if not data:
@@ -379,6 +774,10 @@ class AuditLogger:
         """
         Busca logs de auditoria com filtros.
         
+        Os filtros de data são aplicados sobre created_at, a chave de
+        particionamento, de modo que consultas com intervalo de datas leem
+        apenas as partições mensais do intervalo.
+        
         Args:
             db: Sessão do banco de dados
             user_id: ID do usuário
@@ -442,6 +841,9 @@ class AuditLogger:
         """
         Retorna resumo da atividade de um usuário.
         
+        As contagens são obtidas do agregado horário (audit_stats), sem
+        carregar os logs individualmente.
+        
         Args:
             db: Sessão do banco de dados
             user_id: ID do usuário
@@ -451,73 +853,70 @@ class AuditLogger:
             Resumo da atividade do usuário
         """
         try:
-            start_date = datetime.utcnow() - timedelta(days=days)
-            
-            logs = db.query(AuditLog).filter(
-                AuditLog.user_id == user_id,
-                AuditLog.created_at >= start_date
-            ).all()
-            
-            # Estatísticas
-            total_events = len(logs)
-            event_types = {}
-            severity_counts = {}
-            daily_activity = {}
-            
-            for log in logs:
-                # Contar tipos de evento
-                event_types[log.event_type] = event_types.get(log.event_type, 0) + 1
-                
-                # Contar severidades
-                severity_counts[log.severity] = severity_counts.get(log.severity, 0) + 1
-                
-                # Atividade diária
-                date_key = log.created_at.date().isoformat()
-                daily_activity[date_key] = daily_activity.get(date_key, 0) + 1
-            
-            return {
-                'user_id': user_id,
-                'period_days': days,
-                'total_events': total_events,
-                'event_types': event_types,
-                'severity_counts': severity_counts,
-                'daily_activity': daily_activity,
-                'most_active_day': max(daily_activity.items(), key=lambda x: x[1]) if daily_activity else None,
-                'security_events': len([l for l in logs if 'security' in l.event_type or 'suspicious' in l.event_type])
-            }
+            from audit_stats import audit_stats
+            
+            return audit_stats.get_user_activity_summary(db, user_id, days)
             
         except Exception as e:
             logger.error(f"Erro ao gerar resumo de atividade: {e}")
             return {}
     
-    def cleanup_old_logs(self, db: Session, retention_days: int = 2555) -> int:
+    def cleanup_old_logs(self, db: Session, retention_days: int = 2555, batch_size: int = 10000) -> int:
         """
         Remove logs antigos baseado no período de retenção.
         
+        Meses inteiramente expirados são removidos descartando a partição
+        mensal; as linhas restantes (mês parcial ou tabela não particionada)
+        são removidas com DELETE em lotes, cada lote em sua transação.
+        
         Args:
             db: Sessão do banco de dados
             retention_days: Dias de retenção (padrão: 7 anos)
+            batch_size: Linhas removidas por transação
             
         Returns:
-            Número de logs removidos
+            Número de logs removidos (estimativa para as partições inteiras)
         """
         try:
             cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
             
-            # Buscar logs antigos
-            old_logs = db.query(AuditLog).filter(
-                AuditLog.created_at < cutoff_date
-            ).all()
-            
-            count = len(old_logs)
-            
-            # Remover logs
-            for log in old_logs:
-                db.delete(log)
+            # Remover partições mensais inteiras
+            count, partitions = partition_manager.drop_expired_partitions(db, cutoff_date)
             
+            # Remover logs restantes em lotes
+            while True:
+                expired_ids = db.query(AuditLog.id).filter(
+                    AuditLog.created_at < cutoff_date
+                ).limit(batch_size).subquery()
+                
+                deleted = db.query(AuditLog).filter(
+                    AuditLog.id.in_(db.query(expired_ids.c.id))
+                ).delete(synchronize_session=False)
+                db.commit()
+                
+                count += deleted
+                if deleted < batch_size:
+                    break
+            
+            # Remover agregados horários e checkpoints do mesmo período
+            db.query(AuditLogHourlyStat).filter(
+                AuditLogHourlyStat.bucket_hour < cutoff_date.replace(minute=0, second=0, microsecond=0)
+            ).delete(synchronize_session=False)
+            db.query(AuditCheckpoint).filter(
+                AuditCheckpoint.checkpoint_date < cutoff_date.date()
+            ).delete(synchronize_session=False)
             db.commit()
             
-            logger.info(f"Limpeza de auditoria: {count} logs antigos removidos")
+            # Garantir partições futuras (falhas são repetidas pelo job de partições)
+            try:
+                partition_manager.ensure_partitions(db)
+            except Exception as e:
+                logger.error(f"Erro ao criar partições de auditoria: {e}")
+            
+            logger.info(
+                f"Limpeza de auditoria: {count} logs antigos removidos "
+                f"({len(partitions)} partições descartadas)"
+            )
             return count
             
         except Exception as e:
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Particionamento Mensal dos Logs de Auditoria
+
+No PostgreSQL a tabela audit_logs é particionada por faixa mensal de
+created_at (ver migração 011). Este módulo cria as partições futuras (job
+periódico, fora do caminho de gravação dos logs) e aplica a retenção
+removendo partições inteiras, sem apagar linha a linha.
+
+Linhas gravadas antes da criação da partição do mês ficam na partição
+DEFAULT; ao criar a partição elas são movidas para ela.
+
+Em bancos sem particionamento (SQLite, ambientes locais) todas as
+operações são ignoradas e a retenção usa DELETE em lotes.
+"""
+
+import os
+import re
+import logging
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "audit_logs"
+PARTITION_NAME_PATTERN = re.compile(r"^audit_logs_y(\d{4})m(\d{2})$")
+
+# Chave do advisory lock que serializa a criação de partições entre processos
+AUDIT_PARTITION_LOCK_KEY = 7_314_552_004
+
+def partition_name(year: int, month: int) -> str:
+    """Nome da partição de um mês (ex.: audit_logs_y2025m01)"""
+    return f"{PARENT_TABLE}_y{year:04d}m{month:02d}"
+
+def add_months(year: int, month: int, months: int) -> Tuple[int, int]:
+    """Soma meses a um par (ano, mês)"""
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+class AuditPartitionManager:
+    """Gerencia as partições mensais de audit_logs"""
+
+    def __init__(self, session_factory=None, months_ahead: Optional[int] = None,
+                 interval_seconds: Optional[float] = None):
+        self.session_factory = session_factory or SessionLocal
+        self.months_ahead = months_ahead or int(os.getenv("AUDIT_PARTITION_MONTHS_AHEAD", "3"))
+        self.detach_only = os.getenv("AUDIT_PARTITION_DETACH_ONLY", "false").lower() == "true"
+        self.interval_seconds = interval_seconds or float(
+            os.getenv("AUDIT_PARTITION_INTERVAL_SECONDS", "3600")
+        )
+        self.retry_seconds = float(os.getenv("AUDIT_PARTITION_RETRY_SECONDS", "60"))
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_ensured_at: Optional[datetime] = None
+
+    def start(self):
+        """Inicia a criação periódica das partições futuras"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="audit-partitions",
+            daemon=True
+        )
+        self._thread.start()
+
+    def shutdown(self):
+        """Interrompe a criação periódica"""
+        self._stopped.set()
+
+    def is_partitioned(self, db: Session) -> bool:
+        """Indica se audit_logs é uma tabela particionada"""
+        if db.get_bind().dialect.name != 'postgresql':
+            return False
+
+        return bool(db.execute(text(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = :table"
+        ), {'table': PARENT_TABLE}).scalar())
+
+    def ensure_partitions(self, db: Session, reference: Optional[date] = None) -> List[str]:
+        """
+        Cria as partições do mês de referência até `months_ahead` meses à frente.
+
+        Cada partição é criada em sua transação, sob advisory lock. Se a
+        partição DEFAULT já tiver linhas do mês, elas são movidas para a
+        nova partição antes de anexá-la.
+
+        Returns:
+            Nomes das partições criadas
+        """
+        if not self.is_partitioned(db):
+            return []
+
+        reference = reference or datetime.utcnow().date()
+        created = []
+
+        for offset in range(self.months_ahead + 1):
+            year, month = add_months(reference.year, reference.month, offset)
+            if self._create_partition(db, year, month):
+                created.append(partition_name(year, month))
+
+        if created:
+            logger.info(f"Partições de auditoria criadas: {', '.join(created)}")
+        return created
+
+    def _create_partition(self, db: Session, year: int, month: int) -> bool:
+        """Cria a partição de um mês (False se já existir)"""
+        name = partition_name(year, month)
+        next_year, next_month = add_months(year, month, 1)
+        start = f"{year:04d}-{month:02d}-01"
+        end = f"{next_year:04d}-{next_month:02d}-01"
+
+        try:
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': AUDIT_PARTITION_LOCK_KEY})
+            if name in {partition['name'] for partition in self.list_partitions(db)}:
+                db.commit()
+                return False
+
+            default = self.default_partition(db)
+            has_default_rows = default is not None and db.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= :start AND created_at < :end)"
+            ), {'start': start, 'end': end}).scalar()
+
+            if not has_default_rows:
+                db.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                    f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                ))
+            else:
+                # CREATE ... PARTITION OF falharia (linhas do mês na DEFAULT):
+                # move as linhas para uma tabela avulsa e a anexa como partição
+                db.execute(text(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE"))
+                db.execute(text(
+                    f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                ))
+                moved = db.execute(text(
+                    f"WITH moved AS (DELETE FROM {default} "
+                    f"WHERE created_at >= :start AND created_at < :end RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ), {'start': start, 'end': end}).rowcount
+                db.execute(text(
+                    f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                ))
+                logger.info(f"{moved} logs de auditoria movidos de {default} para {name}")
+
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            raise
+
+    def default_partition(self, db: Session) -> Optional[str]:
+        """Nome da partição DEFAULT de audit_logs, se existir"""
+        return db.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'"
+        ), {'table': PARENT_TABLE}).scalar()
+
+    def list_partitions(self, db: Session) -> List[Dict]:
+        """Lista as partições mensais com seus limites [início, fim)"""
+        rows = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table ORDER BY c.relname"
+        ), {'table': PARENT_TABLE}).scalars().all()
+
+        partitions = []
+        for name in rows:
+            match = PARTITION_NAME_PATTERN.match(name)
+            if not match:
+                continue  # Partição DEFAULT ou fora da convenção
+
+            year, month = int(match.group(1)), int(match.group(2))
+            next_year, next_month = add_months(year, month, 1)
+            partitions.append({
+                'name': name,
+                'start': datetime(year, month, 1),
+                'end': datetime(next_year, next_month, 1)
+            })
+
+        return partitions
+
+    def drop_expired_partitions(self, db: Session, cutoff: datetime) -> Tuple[int, List[str]]:
+        """
+        Remove as partições cujo mês inteiro é anterior ao corte.
+
+        As partições são desanexadas (DETACH) e, a menos que
+        AUDIT_PARTITION_DETACH_ONLY esteja ativo, removidas (DROP).
+
+        O número de logs vem da estimativa do planner (pg_class.reltuples),
+        sem varrer as partições antes de removê-las.
+
+        Returns:
+            (número estimado de logs removidos, nomes das partições)
+        """
+        if not self.is_partitioned(db):
+            return 0, []
+
+        removed_rows = 0
+        removed = []
+
+        for partition in self.list_partitions(db):
+            if partition['end'] > cutoff:
+                continue
+
+            name = partition['name']
+            removed_rows += db.execute(text(
+                "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = :name"
+            ), {'name': name}).scalar() or 0
+            db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            if not self.detach_only:
+                db.execute(text(f"DROP TABLE {name}"))
+            db.commit()
+
+            removed.append(name)
+
+        if removed:
+            action = "desanexadas" if self.detach_only else "removidas"
+            logger.info(f"Partições de auditoria {action}: {', '.join(removed)}")
+
+        return removed_rows, removed
+
+    def _run(self):
+        """Loop da thread (a primeira execução é imediata; falhas são repetidas após retry_seconds)"""
+        delay = 0
+        while not self._stopped.wait(delay):
+            db = self.session_factory()
+            try:
+                self.ensure_partitions(db)
+                self.last_ensured_at = datetime.utcnow()
+                delay = self.interval_seconds
+            except Exception as e:
+                # Até a criação, linhas do mês vão para a partição DEFAULT
+                logger.error(f"Erro ao criar partições de auditoria: {e}")
+                db.rollback()
+                delay = self.retry_seconds
+            finally:
+                db.close()
+
+# Instância global (o job periódico é iniciado no lifespan da aplicação)
+partition_manager = AuditPartitionManager()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Agregação de Estatísticas de Auditoria
+
+Este módulo mantém um agregado horário dos logs de auditoria
+(audit_log_hourly_stats) e responde às consultas de estatísticas com
+GROUP BY sobre o agregado, sem carregar os logs individualmente.
+
+O agregado é atualizado de forma incremental por uma thread em segundo
+plano (iniciada no lifespan da aplicação), que também faz a carga inicial. As horas ainda não
+agregadas (cauda recente ou, até a carga inicial terminar, todo o período)
+são somadas com uma consulta agrupada sobre audit_logs, de modo que os
+resultados são exatos.
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import case, func, insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, advisory_lock_session
+from audit_logger import AuditLog, AuditLogHourlyStat, AuditSeverity, audit_buffer_max_backlog_seconds
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock que evita atualizações concorrentes do agregado
+AUDIT_ROLLUP_LOCK_KEY = 7_314_552_002
+
+def is_security_event(event_type: Optional[str]) -> bool:
+    """Indica se o tipo de evento é relacionado a segurança"""
+    return bool(event_type) and ('security' in event_type or 'suspicious' in event_type)
+
+class AuditStatsAggregator:
+    """Agregador incremental de estatísticas de auditoria"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        refresh_interval_seconds: Optional[float] = None,
+        late_arrival_hours: Optional[float] = None,
+        backfill_window_days: int = 7,
+        max_backlog_seconds: Optional[float] = None
+    ):
+        self.session_factory = session_factory or SessionLocal
+        self.refresh_interval_seconds = refresh_interval_seconds or float(
+            os.getenv("AUDIT_ROLLUP_INTERVAL_SECONDS", "300")
+        )
+        self.late_arrival_hours = late_arrival_hours if late_arrival_hours is not None else float(
+            os.getenv("AUDIT_ROLLUP_LATE_ARRIVAL_HOURS", "1")
+        )
+        self.backfill_window_days = backfill_window_days
+        # Atraso máximo do buffer de auditoria: janela da primeira atualização do processo
+        self.max_backlog_seconds = max_backlog_seconds if max_backlog_seconds is not None else (
+            audit_buffer_max_backlog_seconds()
+        )
+
+        # Maior id de log visto nas duas últimas atualizações (penúltima, última)
+        self._watermarks: Tuple[Optional[int], Optional[int]] = (None, None)
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_refresh_at: Optional[datetime] = None
+
+    def start(self):
+        """Inicia a atualização periódica do agregado"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="audit-stats-rollup",
+            daemon=True
+        )
+        self._thread.start()
+
+    def shutdown(self):
+        """Interrompe a atualização periódica"""
+        self._stopped.set()
+
+    def refresh(self, db: Session) -> int:
+        """
+        Atualiza o agregado horário a partir da última hora agregada.
+
+        A última hora agregada e as `late_arrival_hours` anteriores são
+        recalculadas, cobrindo horas parciais; a janela recua até o log mais
+        antigo gravado desde a penúltima atualização, cobrindo logs que o
+        buffer de auditoria gravou com atraso.
+
+        Args:
+            db: Sessão do banco de dados
+
+        Returns:
+            Número de linhas de agregado gravadas
+        """
+        with advisory_lock_session(db, AUDIT_ROLLUP_LOCK_KEY) as locked:
+            if locked is None:
+                return 0
+            return self._refresh(locked)
+
+    def _refresh(self, db: Session) -> int:
+        max_id = db.query(func.max(AuditLog.id)).scalar()
+        last_bucket = db.query(func.max(AuditLogHourlyStat.bucket_hour)).scalar()
+
+        if last_bucket is None:
+            first_log = db.query(func.min(AuditLog.created_at)).scalar()
+            if first_log is None:
+                return 0
+            window_start = first_log.replace(minute=0, second=0, microsecond=0)
+        else:
+            window_start = self._reconcile_start(db, self._as_datetime(last_bucket))
+
+        now = datetime.utcnow()
+        written = 0
+
+        # Janelas limitadas para que a carga inicial não use uma única transação
+        while window_start <= now:
+            window_end = window_start + timedelta(days=self.backfill_window_days)
+            written += self._refresh_window(db, window_start, window_end)
+            window_start = window_end
+
+        # A penúltima marca cobre logs com id menor que o máximo lido, mas
+        # confirmados depois da leitura
+        self._watermarks = (self._watermarks[1] if self._watermarks[1] is not None else max_id, max_id)
+        self.last_refresh_at = now
+        return written
+
+    def _reconcile_start(self, db: Session, last_bucket: datetime) -> datetime:
+        """Início da janela a recalcular a partir da última hora agregada"""
+        window_start = last_bucket - timedelta(hours=self.late_arrival_hours)
+
+        watermark = self._watermarks[0]
+        if watermark is None:
+            # Sem atualização anterior neste processo: recuar o atraso máximo do buffer
+            return min(window_start, last_bucket - timedelta(seconds=self.max_backlog_seconds))
+
+        oldest = db.query(func.min(AuditLog.created_at)).filter(AuditLog.id > watermark).scalar()
+        if oldest is not None:
+            window_start = min(window_start, self._as_datetime(oldest).replace(minute=0, second=0, microsecond=0))
+        return window_start
+
+    def get_stats(self, db: Session, top_n: int = 10) -> Dict[str, Any]:
+        """
+        Retorna as estatísticas gerais de auditoria.
+
+        Janelas de 24h/7d/30d têm granularidade de hora.
+        """
+        now = datetime.utcnow()
+        boundary = self._get_boundary(db)
+        since_24h = now - timedelta(hours=24)
+        since_7d = now - timedelta(days=7)
+        since_30d = now - timedelta(days=30)
+
+        totals = {'total': 0, 'last_24h': 0, 'last_7d': 0, 'last_30d': 0}
+        for source in self._sources(boundary):
+            bucket, count = source['time'], source['count']
+            row = source['query'](db, [
+                count,
+                func.sum(case((bucket >= self._floor_hour(since_24h), source['one']), else_=0)),
+                func.sum(case((bucket >= self._floor_hour(since_7d), source['one']), else_=0)),
+                func.sum(case((bucket >= self._floor_hour(since_30d), source['one']), else_=0)),
+            ]).one()
+            for key, value in zip(totals, row):
+                totals[key] += int(value or 0)
+
+        by_type_severity = self._counts(db, boundary, ('event_type', 'severity'), since=since_30d)
+        by_user = self._counts(db, boundary, ('username',), since=since_30d)
+
+        event_types: Dict[str, int] = {}
+        security_events = 0
+        critical_events = 0
+        for (event_type, severity), count in by_type_severity.items():
+            event_types[event_type] = event_types.get(event_type, 0) + count
+            if is_security_event(event_type):
+                security_events += count
+            if severity == AuditSeverity.CRITICAL.value:
+                critical_events += count
+
+        users = {username: count for (username,), count in by_user.items() if username}
+
+        return {
+            'total_logs': totals['total'],
+            'logs_last_24h': totals['last_24h'],
+            'logs_last_7d': totals['last_7d'],
+            'logs_last_30d': totals['last_30d'],
+            'top_event_types': dict(sorted(event_types.items(), key=lambda x: x[1], reverse=True)[:top_n]),
+            'top_users': dict(sorted(users.items(), key=lambda x: x[1], reverse=True)[:top_n]),
+            'security_events_count': security_events,
+            'critical_events_count': critical_events
+        }
+
+    def get_user_activity_summary(self, db: Session, user_id: int, days: int = 30) -> Dict[str, Any]:
+        """Retorna o resumo da atividade de um usuário a partir do agregado"""
+        boundary = self._get_boundary(db)
+        since = datetime.utcnow() - timedelta(days=days)
+
+        counts = self._counts(
+            db, boundary, ('event_type', 'severity', 'hour'), since=since, user_id=user_id
+        )
+
+        event_types: Dict[str, int] = {}
+        severity_counts: Dict[str, int] = {}
+        daily_activity: Dict[str, int] = {}
+        security_events = 0
+
+        for (event_type, severity, hour), count in counts.items():
+            event_types[event_type] = event_types.get(event_type, 0) + count
+            severity_counts[severity] = severity_counts.get(severity, 0) + count
+            date_key = self._as_datetime(hour).date().isoformat()
+            daily_activity[date_key] = daily_activity.get(date_key, 0) + count
+            if is_security_event(event_type):
+                security_events += count
+
+        return {
+            'user_id': user_id,
+            'period_days': days,
+            'total_events': sum(event_types.values()),
+            'event_types': event_types,
+            'severity_counts': severity_counts,
+            'daily_activity': daily_activity,
+            'most_active_day': max(daily_activity.items(), key=lambda x: x[1]) if daily_activity else None,
+            'security_events': security_events
+        }
+
+    def _run(self):
+        """Loop da thread de atualização (a primeira execução faz a carga inicial)"""
+        delay = 0
+        while not self._stopped.wait(delay):
+            delay = self.refresh_interval_seconds
+            db = self.session_factory()
+            try:
+                self.refresh(db)
+            except Exception as e:
+                logger.error(f"Erro ao atualizar agregado de auditoria: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def _refresh_window(self, db: Session, window_start: datetime, window_end: datetime) -> int:
+        """Recalcula o agregado de uma janela de tempo"""
+        bucket = self._hour_bucket(db)
+
+        rows = db.query(
+            bucket,
+            AuditLog.event_type,
+            AuditLog.severity,
+            AuditLog.user_id,
+            AuditLog.username,
+            func.count(AuditLog.id)
+        ).filter(
+            AuditLog.created_at >= window_start,
+            AuditLog.created_at < window_end
+        ).group_by(
+            bucket,
+            AuditLog.event_type,
+            AuditLog.severity,
+            AuditLog.user_id,
+            AuditLog.username
+        ).all()
+
+        db.query(AuditLogHourlyStat).filter(
+            AuditLogHourlyStat.bucket_hour >= window_start,
+            AuditLogHourlyStat.bucket_hour < window_end
+        ).delete(synchronize_session=False)
+
+        if rows:
+            db.execute(insert(AuditLogHourlyStat), [
+                {
+                    'bucket_hour': self._as_datetime(hour),
+                    'event_type': event_type,
+                    'severity': severity,
+                    'user_id': user_id,
+                    'username': username,
+                    'event_count': count
+                }
+                for hour, event_type, severity, user_id, username, count in rows
+            ])
+
+        db.commit()
+        return len(rows)
+
+    def _get_boundary(self, db: Session) -> Optional[datetime]:
+        """
+        Retorna a última hora agregada (parcial). Horas anteriores são lidas
+        do agregado; a partir dela, os logs são agrupados diretamente.
+
+        Sem agregado (carga inicial ainda em andamento no job), retorna None
+        e as consultas usam apenas audit_logs; a carga nunca é feita na
+        requisição.
+        """
+        boundary = db.query(func.max(AuditLogHourlyStat.bucket_hour)).scalar()
+        return self._as_datetime(boundary) if boundary is not None else None
+
+    def _sources(self, boundary: Optional[datetime]):
+        """Fontes de contagem: agregado (antes da fronteira) e cauda de logs"""
+        rollup_filter = []
+        live_filter = []
+        sources = []
+
+        if boundary is not None:
+            rollup_filter.append(AuditLogHourlyStat.bucket_hour < boundary)
+            live_filter.append(AuditLog.created_at >= boundary)
+
+            sources.append({
+                'columns': {
+                    'event_type': AuditLogHourlyStat.event_type,
+                    'severity': AuditLogHourlyStat.severity,
+                    'user_id': AuditLogHourlyStat.user_id,
+                    'username': AuditLogHourlyStat.username,
+                    'hour': AuditLogHourlyStat.bucket_hour
+                },
+                'time': AuditLogHourlyStat.bucket_hour,
+                'count': func.sum(AuditLogHourlyStat.event_count),
+                'one': AuditLogHourlyStat.event_count,
+                'query': lambda db, columns: db.query(*columns).filter(*rollup_filter)
+            })
+
+        sources.append({
+            'columns': {
+                'event_type': AuditLog.event_type,
+                'severity': AuditLog.severity,
+                'user_id': AuditLog.user_id,
+                'username': AuditLog.username,
+                'hour': None  # resolvido por dialeto em _counts
+            },
+            'time': AuditLog.created_at,
+            'count': func.count(AuditLog.id),
+            'one': 1,
+            'query': lambda db, columns: db.query(*columns).filter(*live_filter)
+        })
+
+        return sources
+
+    def _counts(
+        self,
+        db: Session,
+        boundary: Optional[datetime],
+        dimensions: Tuple[str, ...],
+        since: Optional[datetime] = None,
+        user_id: Optional[int] = None
+    ) -> Dict[tuple, int]:
+        """Soma contagens agrupadas pelas dimensões, combinando agregado e cauda"""
+        result: Dict[tuple, int] = {}
+
+        for source in self._sources(boundary):
+            columns = []
+            for dimension in dimensions:
+                column = source['columns'][dimension]
+                if column is None:
+                    column = self._hour_bucket(db)
+                columns.append(column)
+
+            query = source['query'](db, columns + [source['count']])
+
+            if since is not None:
+                query = query.filter(source['time'] >= self._floor_hour(since))
+            if user_id is not None:
+                query = query.filter(source['columns']['user_id'] == user_id)
+
+            for row in query.group_by(*columns).all():
+                key = tuple(row[:-1])
+                result[key] = result.get(key, 0) + int(row[-1] or 0)
+
+        return result
+
+    @staticmethod
+    def _hour_bucket(db: Session):
+        """Expressão SQL que trunca created_at para a hora"""
+        if db.get_bind().dialect.name == 'postgresql':
+            return func.date_trunc('hour', AuditLog.created_at)
+        return func.strftime('%Y-%m-%d %H:00:00', AuditLog.created_at)
+
+    @staticmethod
+    def _floor_hour(value: datetime) -> datetime:
+        return value.replace(minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def _as_datetime(value) -> datetime:
+        """Normaliza o bucket retornado pelo banco (SQLite retorna texto)"""
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+# Instância global
+audit_stats = AuditStatsAggregator()
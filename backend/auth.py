@@ -1,14 +1,18 @@
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect as sa_inspect, or_
+from sqlalchemy.orm import Session, make_transient_to_detached
 
 import crud, models, schemas
 from database import get_db
 from database_supabase import get_supabase_client
+from principal_cache import principal_cache, Principal
 import logging
 
 logger = logging.getLogger(__name__)
@@ -46,27 +50,126 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+def _resolve_principal(db: Session, user: models.User) -> tuple:
+    """
+    Monta o principal do usuário com clínica e papéis atribuídos.
+    
+    Returns:
+        (principal, timestamp até o qual os papéis continuam válidos ou None)
+    """
+    user_data = {attr.key: getattr(user, attr.key) for attr in sa_inspect(models.User).column_attrs}
+    
+    clinic = None
+    if user.clinic_id:
+        clinic_row = db.query(
+            models.Clinic.id, models.Clinic.name, models.Clinic.is_active, models.Clinic.subscription_plan
+        ).filter(models.Clinic.id == user.clinic_id).first()
+        if clinic_row:
+            clinic = dict(clinic_row._mapping)
+    
+    roles = []
+    valid_until = None
+    try:
+        now = datetime.utcnow()
+        assignments = db.query(
+            models.UserRole.id, models.UserRole.code, models.UserRole.name,
+            models.UserRoleAssignment.expires_at
+        ).join(
+            models.UserRoleAssignment, models.UserRoleAssignment.role_id == models.UserRole.id
+        ).filter(
+            models.UserRoleAssignment.user_id == user.id,
+            models.UserRoleAssignment.is_active == True,
+            models.UserRole.is_active == True,
+            or_(models.UserRoleAssignment.expires_at.is_(None), models.UserRoleAssignment.expires_at > now)
+        ).all()
+        
+        for role_id, code, name, expires_at in assignments:
+            roles.append({'id': role_id, 'code': code, 'name': name})
+            if expires_at is not None:
+                expires_ts = time.time() + (expires_at - now).total_seconds()
+                valid_until = expires_ts if valid_until is None else min(valid_until, expires_ts)
+    except Exception as e:
+        logger.warning(f"Não foi possível resolver os papéis do usuário {user.id}: {e}")
+        db.rollback()
+    
+    principal = Principal(
+        user_id=user.id,
+        username=user.username,
+        role=user.role,
+        clinic_id=user.clinic_id,
+        is_active=bool(user.is_active),
+        user_data=user_data,
+        clinic=clinic,
+        roles=roles
     )
+    return principal, valid_until
+
+def _principal_user(principal: Principal) -> models.User:
+    """Usuário desanexado (sem consulta ao banco) a partir do principal"""
+    user = models.User(**principal.user_data)
+    make_transient_to_detached(user)
+    return user
+
+def _decode_token(token: str, credentials_exception: HTTPException) -> Dict[str, Any]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
+
+def cached_principal(token: Optional[str]) -> Optional[Principal]:
+    """
+    Principal já resolvido para um token com assinatura válida, sem consultar
+    o banco; None se o token for inválido ou o principal não estiver no cache.
+    Usado antes da autenticação da rota (ex.: rate limiting por tenant).
+    """
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    cache_key = principal_cache.cache_key(payload)
+    return principal_cache.get(cache_key) if cache_key else None
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    """
+    Obtém o principal do token (usuário, clínica e papéis), consultando o
+    banco apenas quando não está no cache de principais.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    payload = _decode_token(token, credentials_exception)
+    cache_key = principal_cache.cache_key(payload)
+    
+    principal = principal_cache.get(cache_key)
+    if principal is not None:
+        return principal
+    
+    generation = principal_cache.generation
+    token_data = schemas.TokenData(username=payload["sub"])
     user = crud.get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    
+    principal, valid_until = _resolve_principal(db, user)
+    token_exp = payload.get("exp")
+    if valid_until is not None:
+        token_exp = valid_until if token_exp is None else min(token_exp, valid_until)
+    principal_cache.set(cache_key, principal, token_exp, generation)
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return _principal_user(principal)
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     if not current_user.is_active:
@@ -136,14 +239,15 @@ async def get_current_user_supabase(token: str = Depends(oauth2_scheme)) -> Dict
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    payload = _decode_token(token, credentials_exception)
+    username: str = payload["sub"]
+    cache_key = f"supabase:{principal_cache.cache_key(payload)}"
+    
+    principal = principal_cache.get(cache_key)
+    if principal is not None:
+        return dict(principal.user_data)
     
+    generation = principal_cache.generation
     try:
         supabase_client = get_supabase_client()
         
@@ -159,8 +263,20 @@ async def get_current_user_supabase(token: str = Depends(oauth2_scheme)) -> Dict
         
         user = users[0]
         logger.info(f"Usuário atual obtido: {username}")
+        
+        principal = Principal(
+            user_id=user.get('id'),
+            username=username,
+            role=user.get('role'),
+            clinic_id=user.get('clinic_id'),
+            is_active=bool(user.get('is_active', True)),
+            user_data=dict(user)
+        )
+        principal_cache.set(cache_key, principal, payload.get("exp"), generation)
         return user
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao obter usuário atual: {e}")
         raise credentials_exception
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Disponibilidade de Médicos
+
+Este módulo mantém a agenda ocupada de cada médico em memória para responder
+consultas de disponibilidade sem uma ida ao banco por horário candidato:
+- Agenda do dia como intervalos ordenados pelo início, com o maior fim
+  acumulado (verificação de conflito em O(log n), incluindo consultas que
+  começaram antes do horário pedido)
+- Carga da semana do médico (ou do dia de todos os médicos da clínica) em
+  uma única consulta
+- Invalidação por médico/dia ao criar ou alterar consultas, com TTL para
+  alterações feitas por outros processos
+- Verificação de conflito na gravação sempre lida da origem (nunca do
+  cache), com o médico travado nos dias afetados quando a origem permite
+
+A origem dos dados é plugável: AppointmentSource lê do SQLAlchemy e
+SupabaseAppointmentSource do Supabase.
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Consultas nesses status não ocupam a agenda
+FREE_STATUSES = ("cancelado", "cancelled")
+
+# (médico, consulta, início, duração em minutos)
+AppointmentRow = Tuple[int, Optional[int], datetime, Optional[int]]
+
+def _parse_time(value: str) -> dt_time:
+    hours, minutes = value.split(":")
+    return dt_time(int(hours), int(minutes))
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    # Agenda trabalha com horários locais sem fuso, como no modelo
+    return parsed.replace(tzinfo=None)
+
+class SchedulingConflictError(ValueError):
+    """O horário pedido conflita com outra consulta do médico"""
+
+    def __init__(self, doctor_id: int, start: datetime, end: datetime):
+        self.doctor_id = doctor_id
+        self.start = start
+        self.end = end
+        super().__init__(
+            f"Médico {doctor_id} já possui consulta entre "
+            f"{start.strftime('%d/%m/%Y %H:%M')} e {end.strftime('%H:%M')}"
+        )
+
+@dataclass
+class FreeSlot:
+    """Horário livre de um médico"""
+    doctor_id: int
+    start: datetime
+    end: datetime
+
+class DaySchedule:
+    """
+    Intervalos ocupados de um médico em um dia.
+
+    Os intervalos ficam ordenados pelo início; `_max_ends[i]` guarda o maior
+    fim entre os intervalos 0..i. Um horário [s, e) conflita se algum
+    intervalo com início < e termina depois de s, ou seja, se o maior fim
+    acumulado até o último início < e for maior que s.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[datetime, datetime, Optional[int]]] = ()):
+        self._starts: List[datetime] = []
+        self._ends: List[datetime] = []
+        self._ids: List[Optional[int]] = []
+        self._max_ends: List[datetime] = []
+        for start, end, appointment_id in sorted(intervals, key=lambda interval: interval[:2]):
+            self._starts.append(start)
+            self._ends.append(end)
+            self._ids.append(appointment_id)
+            self._max_ends.append(max(end, self._max_ends[-1]) if self._max_ends else end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def busy_until(self, start: datetime, end: datetime, exclude_id: Optional[int] = None) -> Optional[datetime]:
+        """
+        Retorna None se [start, end) estiver livre; caso contrário, o
+        horário a partir do qual os intervalos conflitantes terminam.
+        `exclude_id` ignora a própria consulta (remarcação).
+        """
+        index = bisect.bisect_left(self._starts, end)
+        if not index or self._max_ends[index - 1] <= start:
+            return None
+        if exclude_id is None:
+            return self._max_ends[index - 1]
+
+        # Caminho raro: conflito possível só com a própria consulta
+        conflicting = [
+            self._ends[i] for i in range(index)
+            if self._ends[i] > start and self._ids[i] != exclude_id
+        ]
+        return max(conflicting) if conflicting else None
+
+    def is_free(self, start: datetime, end: datetime, exclude_id: Optional[int] = None) -> bool:
+        return self.busy_until(start, end, exclude_id) is None
+
+class AppointmentSource:
+    """Leitura das consultas via SQLAlchemy"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load_doctors(self, doctor_ids: Sequence[int], start: datetime, end: datetime) -> List[AppointmentRow]:
+        from sqlalchemy import or_
+        from models import Appointment
+
+        return self.db.query(
+            Appointment.doctor_id, Appointment.id, Appointment.appointment_date, Appointment.duration
+        ).filter(
+            Appointment.doctor_id.in_(doctor_ids),
+            Appointment.appointment_date >= start,
+            Appointment.appointment_date < end,
+            or_(Appointment.status.is_(None), Appointment.status.notin_(FREE_STATUSES))
+        ).all()
+
+    def lock_doctor_days(self, doctor_id: int, days: Sequence[date]):
+        """
+        Trava (médico, dia) até o fim da transação (advisory lock do
+        PostgreSQL): verificações de conflito concorrentes para o mesmo
+        médico e dia são serializadas até o commit da consulta gravada.
+        """
+        from sqlalchemy import text
+
+        if self.db.get_bind().dialect.name != 'postgresql':
+            return
+        for day in sorted(days):
+            self.db.execute(
+                text("SELECT pg_advisory_xact_lock(:doctor_id, :day)"),
+                {'doctor_id': doctor_id, 'day': day.toordinal()}
+            )
+
+    def load_clinic(self, clinic_id: int, start: datetime, end: datetime) -> Tuple[List[int], List[AppointmentRow]]:
+        """Médicos ativos da clínica e suas consultas no período, em uma consulta"""
+        from sqlalchemy import and_, or_
+        from models import Appointment, Doctor
+
+        rows = self.db.query(
+            Doctor.id, Appointment.id, Appointment.appointment_date, Appointment.duration
+        ).outerjoin(
+            Appointment,
+            and_(
+                Appointment.doctor_id == Doctor.id,
+                Appointment.appointment_date >= start,
+                Appointment.appointment_date < end,
+                or_(Appointment.status.is_(None), Appointment.status.notin_(FREE_STATUSES))
+            )
+        ).filter(
+            Doctor.clinic_id == clinic_id,
+            Doctor.is_active == True
+        ).all()
+
+        doctor_ids = sorted({row[0] for row in rows})
+        return doctor_ids, [row for row in rows if row[2] is not None]
+
+class SupabaseAppointmentSource:
+    """Leitura das consultas via Supabase"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def load_doctors(self, doctor_ids: Sequence[int], start: datetime, end: datetime) -> List[AppointmentRow]:
+        result = self.client.table('appointments').select(
+            'id, doctor_id, appointment_date, duration, status'
+        ).in_('doctor_id', list(doctor_ids)).gte(
+            'appointment_date', start.isoformat()
+        ).lt('appointment_date', end.isoformat()).execute()
+
+        return [
+            (row['doctor_id'], row['id'], _parse_datetime(row['appointment_date']), row.get('duration'))
+            for row in result.data or []
+            if row.get('status') not in FREE_STATUSES
+        ]
+
+    def load_clinic(self, clinic_id: int, start: datetime, end: datetime) -> Tuple[List[int], List[AppointmentRow]]:
+        # Consultas embutidas nos médicos, filtradas pelo período
+        result = self.client.table('doctors').select(
+            'id, appointments(id, appointment_date, duration, status)'
+        ).eq('clinic_id', clinic_id).eq('is_active', True).gte(
+            'appointments.appointment_date', start.isoformat()
+        ).lt('appointments.appointment_date', end.isoformat()).execute()
+
+        doctor_ids = []
+        rows = []
+        for doctor in result.data or []:
+            doctor_ids.append(doctor['id'])
+            for appointment in doctor.get('appointments') or []:
+                if appointment.get('status') not in FREE_STATUSES:
+                    rows.append((
+                        doctor['id'], appointment['id'],
+                        _parse_datetime(appointment['appointment_date']), appointment.get('duration')
+                    ))
+        return doctor_ids, rows
+
+class AvailabilityEngine:
+    """
+    Cache de agendas (médico, dia) com consultas de horário livre.
+
+    A agenda de um médico é carregada por semana (SCHEDULE_PRELOAD_DAYS) e a
+    de uma clínica por dia, sempre com uma única consulta à origem.
+    """
+
+    def __init__(self):
+        self.day_start = _parse_time(os.getenv("SCHEDULE_DAY_START", "08:00"))
+        self.day_end = _parse_time(os.getenv("SCHEDULE_DAY_END", "18:00"))
+        self.slot_minutes = int(os.getenv("SCHEDULE_SLOT_MINUTES", "30"))
+        self.default_duration = int(os.getenv("SCHEDULE_DEFAULT_DURATION_MINUTES", "30"))
+        self.preload_days = int(os.getenv("SCHEDULE_PRELOAD_DAYS", "7"))
+        self.ttl_seconds = float(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "60"))
+        self.max_entries = int(os.getenv("AVAILABILITY_CACHE_SIZE", "20000"))
+
+        # (médico, dia) -> (carregado em, agenda)
+        self._schedules: Dict[Tuple[int, date], Tuple[float, DaySchedule]] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.loads = 0
+        self.hits = 0
+
+    def is_slot_free(
+        self,
+        source,
+        doctor_id: int,
+        start: datetime,
+        duration_minutes: Optional[int] = None,
+        exclude_appointment_id: Optional[int] = None
+    ) -> bool:
+        """Verifica se o médico está livre em [start, start + duração)"""
+        start = _parse_datetime(start)
+        end = start + timedelta(minutes=duration_minutes or self.default_duration)
+        schedules = self._get_doctor_days(source, doctor_id, self._days(start, end))
+        return all(schedule.is_free(start, end, exclude_appointment_id) for schedule in schedules)
+
+    def ensure_slot_free(
+        self,
+        source,
+        doctor_id: int,
+        start: datetime,
+        duration_minutes: Optional[int] = None,
+        exclude_appointment_id: Optional[int] = None
+    ):
+        """
+        Levanta SchedulingConflictError se o horário estiver ocupado.
+
+        Caminho de gravação: a agenda é lida da origem, nunca do cache. Se a
+        origem permitir (lock_doctor_days), o médico fica travado nos dias
+        afetados até o commit da transação que grava a consulta.
+        """
+        start = _parse_datetime(start)
+        end = start + timedelta(minutes=duration_minutes or self.default_duration)
+        days = self._days(start, end)
+
+        lock = getattr(source, 'lock_doctor_days', None)
+        if lock is not None:
+            lock(doctor_id, days)
+
+        schedules = self._load_doctor_days(source, doctor_id, days)
+        if not all(schedule.is_free(start, end, exclude_appointment_id) for schedule in schedules):
+            raise SchedulingConflictError(doctor_id, start, end)
+
+    def next_free_slots(
+        self,
+        source,
+        doctor_id: int,
+        after: datetime,
+        count: int = 5,
+        duration_minutes: Optional[int] = None,
+        max_days: Optional[int] = None
+    ) -> List[FreeSlot]:
+        """Próximos `count` horários livres do médico a partir de `after`"""
+        duration = timedelta(minutes=duration_minutes or self.default_duration)
+        days = [after.date() + timedelta(days=i) for i in range(max_days or self.preload_days)]
+        schedules = self._get_doctor_days(source, doctor_id, days)
+
+        slots: List[FreeSlot] = []
+        for day, schedule in zip(days, schedules):
+            for start in self._free_starts(schedule, day, duration, after):
+                slots.append(FreeSlot(doctor_id, start, start + duration))
+                if len(slots) >= count:
+                    return slots
+        return slots
+
+    def clinic_free_slots(
+        self,
+        source,
+        clinic_id: int,
+        day: date,
+        duration_minutes: Optional[int] = None,
+        per_doctor: int = 3,
+        after: Optional[datetime] = None
+    ) -> Dict[int, List[FreeSlot]]:
+        """Horários livres do dia de todos os médicos da clínica (uma consulta)"""
+        duration = timedelta(minutes=duration_minutes or self.default_duration)
+        start = datetime.combine(day, dt_time.min)
+        # Desde o dia anterior: consultas que começam nele podem passar da meia-noite
+        doctor_ids, rows = source.load_clinic(clinic_id, start - timedelta(days=1), start + timedelta(days=1))
+        self.loads += 1
+        schedules = self._store(doctor_ids, [day], rows)
+
+        result = {}
+        for doctor_id in doctor_ids:
+            starts = self._free_starts(schedules[(doctor_id, day)], day, duration, after)
+            result[doctor_id] = [
+                FreeSlot(doctor_id, slot_start, slot_start + duration)
+                for _, slot_start in zip(range(per_doctor), starts)
+            ]
+        return result
+
+    def invalidate(self, doctor_id: int, *moments: Optional[datetime]):
+        """Descarta as agendas do médico nos dias informados (ou todas)"""
+        with self._lock:
+            if not any(moments):
+                for key in [key for key in self._schedules if key[0] == doctor_id]:
+                    del self._schedules[key]
+                return
+
+            for moment in moments:
+                if moment is not None:
+                    moment = _parse_datetime(moment)
+                    # Consultas longas podem ocupar também o dia seguinte
+                    for day in (moment.date(), moment.date() + timedelta(days=1)):
+                        self._schedules.pop((doctor_id, day), None)
+
+    def clear(self):
+        with self._lock:
+            self._schedules.clear()
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {'schedules': len(self._schedules), 'loads': self.loads, 'hits': self.hits}
+
+    def _free_starts(self, schedule: DaySchedule, day: date, duration: timedelta, after: Optional[datetime]):
+        """Inícios livres no expediente, alinhados à grade de horários"""
+        step = timedelta(minutes=self.slot_minutes)
+        opening = datetime.combine(day, self.day_start)
+        closing = datetime.combine(day, self.day_end)
+
+        candidate = opening
+        if after is not None and after > opening:
+            candidate = self._align(opening, after, step)
+
+        while candidate + duration <= closing:
+            busy_until = schedule.busy_until(candidate, candidate + duration)
+            if busy_until is None:
+                yield candidate
+                candidate += step
+            else:
+                # Pula direto para o fim dos intervalos conflitantes
+                candidate = self._align(opening, busy_until, step)
+
+    @staticmethod
+    def _align(origin: datetime, moment: datetime, step: timedelta) -> datetime:
+        steps = -(-(moment - origin) // step)
+        return origin + steps * step
+
+    def _days(self, start: datetime, end: datetime) -> List[date]:
+        last = (end - timedelta(microseconds=1)).date()
+        return [start.date() + timedelta(days=i) for i in range((last - start.date()).days + 1)]
+
+    def _get_doctor_days(self, source, doctor_id: int, days: List[date]) -> List[DaySchedule]:
+        now = time.monotonic()
+        with self._lock:
+            cached = [self._schedules.get((doctor_id, day)) for day in days]
+        if all(entry and now - entry[0] < self.ttl_seconds for entry in cached):
+            self.hits += 1
+            return [entry[1] for entry in cached]
+
+        # Carrega a semana (ou o período pedido, se maior) de uma vez
+        first = days[0]
+        load_days = [first + timedelta(days=i) for i in range(max(len(days), self.preload_days))]
+        return self._load_doctor_days(source, doctor_id, load_days)[:len(days)]
+
+    def _load_doctor_days(self, source, doctor_id: int, days: List[date]) -> List[DaySchedule]:
+        """Agendas de dias consecutivos lidas da origem (e guardadas no cache)"""
+        # Desde o dia anterior: consultas que começam nele podem passar da meia-noite
+        start = datetime.combine(days[0] - timedelta(days=1), dt_time.min)
+        end = datetime.combine(days[-1] + timedelta(days=1), dt_time.min)
+        rows = source.load_doctors([doctor_id], start, end)
+        self.loads += 1
+        schedules = self._store([doctor_id], days, rows)
+        return [schedules[(doctor_id, day)] for day in days]
+
+    def _store(self, doctor_ids: Iterable[int], days: List[date], rows: Iterable[AppointmentRow]) -> Dict[Tuple[int, date], DaySchedule]:
+        day_set: Set[date] = set(days)
+        intervals: Dict[Tuple[int, date], List[Tuple[datetime, datetime, Optional[int]]]] = {
+            (doctor_id, day): [] for doctor_id in doctor_ids for day in days
+        }
+        for doctor_id, appointment_id, start, duration in rows:
+            start = _parse_datetime(start)
+            end = start + timedelta(minutes=duration or self.default_duration)
+            # Intervalo registrado em todos os dias que ocupa
+            for day in self._days(start, end):
+                if day in day_set and (doctor_id, day) in intervals:
+                    intervals[(doctor_id, day)].append((start, end, appointment_id))
+
+        schedules = {key: DaySchedule(values) for key, values in intervals.items()}
+        loaded_at = time.monotonic()
+        with self._lock:
+            for key, schedule in schedules.items():
+                self._schedules[key] = (loaded_at, schedule)
+            if len(self._schedules) > self.max_entries:
+                self._prune(loaded_at)
+        return schedules
+
+    def _prune(self, now: float):
+        """Remove agendas expiradas e, se necessário, as mais antigas"""
+        for key in [key for key, (loaded_at, _) in self._schedules.items() if now - loaded_at >= self.ttl_seconds]:
+            del self._schedules[key]
+        excess = len(self._schedules) - self.max_entries
+        if excess > 0:
+            oldest = sorted(self._schedules.items(), key=lambda item: item[1][0])[:excess]
+            for key, _ in oldest:
+                del self._schedules[key]
+
+# Instância global
+availability_engine = AvailabilityEngine()
@@ -6,6 +6,13 @@ from passlib.context import CryptContext
 
 import models, schemas
 from encryption import field_encryption
+from principal_cache import principal_cache
+from availability import availability_engine, AppointmentSource, FREE_STATUSES
+from appointment_stats import appointment_stats
+from patient_search import blind_index_filter, is_document_term, sync_search_tokens, patient_name_search
+from reference_index import reference_data, ReferenceTableSource
+from pagination import paginate, Page
+from pharmacy_reports import pharmacy_reports, PharmacyReportSource
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -91,6 +98,7 @@ def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
             setattr(db_user, field, value)
         db.commit()
         db.refresh(db_user)
+        principal_cache.invalidate_user(user_id)
     return db_user
 
 def delete_user(db: Session, user_id: int):
@@ -98,6 +106,7 @@ def delete_user(db: Session, user_id: int):
     if db_user:
         db.delete(db_user)
         db.commit()
+        principal_cache.invalidate_user(user_id)
     return db_user
 
 # Patient CRUD
@@ -105,25 +114,46 @@ def get_patient(db: Session, patient_id: int):
     return db.query(models.Patient).filter(models.Patient.id == patient_id).first()
 
 def get_patient_by_cpf(db: Session, cpf: str):
-    return db.query(models.Patient).filter(models.Patient.cpf == cpf).first()
+    # CPF criptografado: busca pelo blind index
+    return db.query(models.Patient).filter(
+        models.Patient.cpf_hash == field_encryption.encryption.hash_for_search(cpf)
+    ).first()
 
-def get_patients(db: Session, skip: int = 0, limit: int = 100, search: Optional[str] = None):
+def _patients_query(db: Session, search: Optional[str] = None):
     query = db.query(models.Patient)
     if search:
-        query = query.filter(
-            or_(
-                models.Patient.name.ilike(f"%{search}%"),
-                models.Patient.cpf.ilike(f"%{search}%"),
-                models.Patient.email.ilike(f"%{search}%")
-            )
-        )
-    return query.offset(skip).limit(limit).all()
+        # CPF, RG e telefone: blind index; nome: índice de trigramas/FTS; e-mail: texto
+        blind_index = blind_index_filter(search)
+        if is_document_term(search):
+            conditions = [blind_index]
+        elif '@' in search:
+            conditions = [models.Patient.email.ilike(f"%{search}%")]
+        else:
+            conditions = [patient_name_search.name_condition(db, search)]
+            if blind_index is not None:
+                conditions.append(blind_index)
+        query = query.filter(or_(*conditions))
+    return query
+
+def get_patients(db: Session, skip: int = 0, limit: int = 100, search: Optional[str] = None):
+    return _patients_query(db, search).offset(skip).limit(limit).all()
+
+def get_patients_page(db: Session, limit: int = 100, cursor: Optional[str] = None,
+                      search: Optional[str] = None, with_total: bool = False) -> Page:
+    """Listagem de pacientes paginada por cursor (ordem de id)"""
+    return paginate(_patients_query(db, search), models.Patient.id, models.Patient.id,
+                    limit=limit, cursor=cursor, with_total=with_total)
+
+def search_patients(db: Session, clinic_id: Optional[int], search: str, limit: int = 20, cursor: Optional[str] = None):
+    """Busca por nome ordenada por relevância, paginada por cursor (patient_search.PatientSearchPage)"""
+    return patient_name_search.search(db, clinic_id, search, limit=limit, cursor=cursor)
 
 def create_patient(db: Session, patient: schemas.PatientCreate):
     patient_data = patient.dict()
     # Aplicar criptografia automática nos campos sensíveis
-    patient_data = field_encryption.encrypt_model_data(patient_data, 'Patient')
-    db_patient = models.Patient(**patient_data)
+    encrypted_data = field_encryption.encrypt_model_data(patient_data, 'Patient')
+    db_patient = models.Patient(**encrypted_data)
+    sync_search_tokens(db_patient, patient_data)
     db.add(db_patient)
     db.commit()
     db.refresh(db_patient)
@@ -133,6 +163,7 @@ def update_patient(db: Session, patient_id: int, patient: schemas.PatientUpdate)
     db_patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
     if db_patient:
         update_data = patient.dict(exclude_unset=True)
+        sync_search_tokens(db_patient, update_data)
         # Aplicar criptografia automática nos campos sensíveis
         update_data = field_encryption.encrypt_model_data(update_data, 'Patient')
         for field, value in update_data.items():
@@ -192,7 +223,7 @@ def delete_doctor(db: Session, doctor_id: int):
 def get_appointment(db: Session, appointment_id: int):
     return db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
 
-def get_appointments(db: Session, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None):
+def _appointments_query(db: Session, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None):
     query = db.query(models.Appointment)
     
     if patient_id:
@@ -204,9 +235,25 @@ def get_appointments(db: Session, skip: int = 0, limit: int = 100, patient_id: O
     if date_to:
         query = query.filter(models.Appointment.appointment_date <= date_to)
     
-    return query.offset(skip).limit(limit).all()
+    return query
+
+def get_appointments(db: Session, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    return _appointments_query(db, patient_id, doctor_id, date_from, date_to).offset(skip).limit(limit).all()
+
+def get_appointments_page(db: Session, limit: int = 100, cursor: Optional[str] = None, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                          date_from: Optional[date] = None, date_to: Optional[date] = None, with_total: bool = False) -> Page:
+    """Consultas paginadas por cursor, em ordem de data"""
+    return paginate(_appointments_query(db, patient_id, doctor_id, date_from, date_to),
+                    models.Appointment.appointment_date, models.Appointment.id,
+                    limit=limit, cursor=cursor, with_total=with_total)
 
 def create_appointment(db: Session, appointment: schemas.AppointmentCreate):
+    # Levanta SchedulingConflictError se o médico já estiver ocupado
+    if appointment.status not in FREE_STATUSES:
+        availability_engine.ensure_slot_free(
+            AppointmentSource(db), appointment.doctor_id, appointment.appointment_date, appointment.duration
+        )
+    
     appointment_data = appointment.dict()
     # Aplicar criptografia automática nos campos sensíveis
     appointment_data = field_encryption.encrypt_model_data(appointment_data, 'Appointment')
@@ -214,18 +261,41 @@ def create_appointment(db: Session, appointment: schemas.AppointmentCreate):
     db.add(db_appointment)
     db.commit()
     db.refresh(db_appointment)
+    availability_engine.invalidate(db_appointment.doctor_id, db_appointment.appointment_date)
+    appointment_stats.invalidate(db_appointment.clinic_id)
     return db_appointment
 
 def update_appointment(db: Session, appointment_id: int, appointment: schemas.AppointmentUpdate):
     db_appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if db_appointment:
         update_data = appointment.dict(exclude_unset=True)
+        previous_doctor_id = db_appointment.doctor_id
+        previous_date = db_appointment.appointment_date
+        
+        doctor_id = update_data.get('doctor_id', db_appointment.doctor_id)
+        appointment_date = update_data.get('appointment_date', db_appointment.appointment_date)
+        duration = update_data.get('duration', db_appointment.duration)
+        status = update_data.get('status', db_appointment.status)
+        rescheduled = (
+            doctor_id != previous_doctor_id or appointment_date != previous_date
+            or duration != db_appointment.duration
+            or (db_appointment.status in FREE_STATUSES and status not in FREE_STATUSES)
+        )
+        if rescheduled and status not in FREE_STATUSES:
+            availability_engine.ensure_slot_free(
+                AppointmentSource(db), doctor_id, appointment_date, duration,
+                exclude_appointment_id=appointment_id
+            )
+        
         # Aplicar criptografia automática nos campos sensíveis
         update_data = field_encryption.encrypt_model_data(update_data, 'Appointment')
         for field, value in update_data.items():
             setattr(db_appointment, field, value)
         db.commit()
         db.refresh(db_appointment)
+        availability_engine.invalidate(previous_doctor_id, previous_date)
+        availability_engine.invalidate(db_appointment.doctor_id, db_appointment.appointment_date)
+        appointment_stats.invalidate(db_appointment.clinic_id)
     return db_appointment
 
 def delete_appointment(db: Session, appointment_id: int):
@@ -233,13 +303,15 @@ def delete_appointment(db: Session, appointment_id: int):
     if db_appointment:
         db.delete(db_appointment)
         db.commit()
+        availability_engine.invalidate(db_appointment.doctor_id, db_appointment.appointment_date)
+        appointment_stats.invalidate(db_appointment.clinic_id)
     return db_appointment
 
 # Medical Record CRUD
 def get_medical_record(db: Session, record_id: int):
     return db.query(models.MedicalRecord).filter(models.MedicalRecord.id == record_id).first()
 
-def get_medical_records(db: Session, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None):
+def _medical_records_query(db: Session, patient_id: Optional[int] = None, doctor_id: Optional[int] = None):
     query = db.query(models.MedicalRecord)
     
     if patient_id:
@@ -247,7 +319,16 @@ def get_medical_records(db: Session, skip: int = 0, limit: int = 100, patient_id
     if doctor_id:
         query = query.filter(models.MedicalRecord.doctor_id == doctor_id)
     
-    return query.offset(skip).limit(limit).all()
+    return query
+
+def get_medical_records(db: Session, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None):
+    return _medical_records_query(db, patient_id, doctor_id).offset(skip).limit(limit).all()
+
+def get_medical_records_page(db: Session, limit: int = 100, cursor: Optional[str] = None, patient_id: Optional[int] = None,
+                             doctor_id: Optional[int] = None, with_total: bool = False) -> Page:
+    """Prontuários paginados por cursor (ordem de id)"""
+    return paginate(_medical_records_query(db, patient_id, doctor_id), models.MedicalRecord.id, models.MedicalRecord.id,
+                    limit=limit, cursor=cursor, with_total=with_total)
 
 def create_medical_record(db: Session, record: schemas.MedicalRecordCreate):
     record_data = record.dict()
@@ -347,13 +428,22 @@ def create_stock_movement(db: Session, movement: schemas.StockMovementCreate):
     db.refresh(db_movement)
     return db_movement
 
-def get_stock_movements(db: Session, skip: int = 0, limit: int = 100, medication_id: Optional[int] = None):
+def _stock_movements_query(db: Session, medication_id: Optional[int] = None):
     query = db.query(models.StockMovement)
     
     if medication_id:
         query = query.filter(models.StockMovement.medication_id == medication_id)
     
-    return query.order_by(models.StockMovement.created_at.desc()).offset(skip).limit(limit).all()
+    return query
+
+def get_stock_movements(db: Session, skip: int = 0, limit: int = 100, medication_id: Optional[int] = None):
+    return _stock_movements_query(db, medication_id).order_by(models.StockMovement.created_at.desc()).offset(skip).limit(limit).all()
+
+def get_stock_movements_page(db: Session, limit: int = 100, cursor: Optional[str] = None, medication_id: Optional[int] = None,
+                             with_total: bool = False) -> Page:
+    """Movimentações de estoque paginadas por cursor (mais recentes primeiro)"""
+    return paginate(_stock_movements_query(db, medication_id), models.StockMovement.created_at, models.StockMovement.id,
+                    limit=limit, cursor=cursor, descending=True, with_total=with_total)
 
 # Financial Transaction CRUD
 def get_financial_transaction(db: Session, transaction_id: int):
@@ -569,10 +659,8 @@ def get_cid_diagnosis_by_code(db: Session, code: str):
     return db.query(models.CidDiagnosis).filter(models.CidDiagnosis.code == code).first()
 
 def search_cid_diagnosis(db: Session, search_term: str, skip: int = 0, limit: int = 20):
-    return db.query(models.CidDiagnosis).filter(
-        models.CidDiagnosis.code.ilike(f"%{search_term}%") |
-        models.CidDiagnosis.description.ilike(f"%{search_term}%")
-    ).offset(skip).limit(limit).all()
+    # Autocomplete atendido pelo índice em memória (prefixo do código ou palavras da descrição)
+    return reference_data.search(ReferenceTableSource(db), 'cid', search_term, limit=limit, offset=skip)
 
 # ETAPA 4 - Faturamento e Financeiro CRUD
 
@@ -610,13 +698,10 @@ def get_tuss_procedure(db: Session, procedure_id: int):
     return db.query(models.TussProcedure).filter(models.TussProcedure.id == procedure_id).first()
 
 def get_tuss_procedures(db: Session, skip: int = 0, limit: int = 100, search: Optional[str] = None):
-    query = db.query(models.TussProcedure)
     if search:
-        query = query.filter(
-            models.TussProcedure.code.ilike(f"%{search}%") |
-            models.TussProcedure.description.ilike(f"%{search}%")
-        )
-    return query.offset(skip).limit(limit).all()
+        # Autocomplete atendido pelo índice em memória (prefixo do código ou palavras da descrição)
+        return reference_data.search(ReferenceTableSource(db), 'tuss', search, limit=limit, offset=skip)
+    return db.query(models.TussProcedure).offset(skip).limit(limit).all()
 
 def create_tuss_procedure(db: Session, procedure: schemas.TussProcedureCreate):
     procedure_data = procedure.dict()
@@ -626,6 +711,7 @@ def create_tuss_procedure(db: Session, procedure: schemas.TussProcedureCreate):
     db.add(db_procedure)
     db.commit()
     db.refresh(db_procedure)
+    reference_data.invalidate('tuss')
     return db_procedure
 
 # Billing Batch CRUD
@@ -1163,8 +1249,7 @@ def create_audit_log(db: Session, audit_log: schemas.AuditLogCreate):
     db.refresh(db_audit_log)
     return db_audit_log
 
-def get_audit_logs(db: Session, clinic_id: int, skip: int = 0, limit: int = 100, 
-                   start_date=None, end_date=None, table_name: str = None, user_id: int = None):
+def _audit_logs_query(db: Session, clinic_id: int, start_date=None, end_date=None, table_name: str = None, user_id: int = None):
     query = db.query(models.AuditLog).filter(
         models.AuditLog.clinic_id == clinic_id
     )
@@ -1178,8 +1263,21 @@ def get_audit_logs(db: Session, clinic_id: int, skip: int = 0, limit: int = 100,
     if user_id:
         query = query.filter(models.AuditLog.user_id == user_id)
     
+    return query
+
+def get_audit_logs(db: Session, clinic_id: int, skip: int = 0, limit: int = 100, 
+                   start_date=None, end_date=None, table_name: str = None, user_id: int = None):
+    query = _audit_logs_query(db, clinic_id, start_date, end_date, table_name, user_id)
     return query.order_by(models.AuditLog.timestamp.desc()).offset(skip).limit(limit).all()
 
+def get_audit_logs_page(db: Session, clinic_id: int, limit: int = 100, cursor: Optional[str] = None,
+                        start_date=None, end_date=None, table_name: str = None, user_id: int = None,
+                        with_total: bool = False) -> Page:
+    """Trilha de auditoria paginada por cursor (mais recentes primeiro)"""
+    return paginate(_audit_logs_query(db, clinic_id, start_date, end_date, table_name, user_id),
+                    models.AuditLog.timestamp, models.AuditLog.id,
+                    limit=limit, cursor=cursor, descending=True, with_total=with_total)
+
 def get_audit_log(db: Session, audit_log_id: int, clinic_id: int):
     return db.query(models.AuditLog).filter(
         models.AuditLog.id == audit_log_id,
@@ -1227,9 +1325,8 @@ def delete_product_category(db: Session, category_id: int):
 def get_product(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
-def get_products(db: Session, clinic_id: int, category_id: Optional[int] = None, 
-                search: Optional[str] = None, low_stock: bool = False, 
-                skip: int = 0, limit: int = 100):
+def _products_query(db: Session, clinic_id: int, category_id: Optional[int] = None,
+                    search: Optional[str] = None, low_stock: bool = False):
     query = db.query(models.Product).filter(
         models.Product.clinic_id == clinic_id,
         models.Product.is_active == True
@@ -1248,11 +1345,25 @@ def get_products(db: Session, clinic_id: int, category_id: Optional[int] = None,
     if low_stock:
         query = query.filter(models.Product.current_stock <= models.Product.minimum_stock)
     
-    return query.offset(skip).limit(limit).all()
+    return query
+
+def get_products(db: Session, clinic_id: int, category_id: Optional[int] = None, 
+                search: Optional[str] = None, low_stock: bool = False, 
+                skip: int = 0, limit: int = 100):
+    return _products_query(db, clinic_id, category_id, search, low_stock).offset(skip).limit(limit).all()
+
+def get_products_page(db: Session, clinic_id: int, category_id: Optional[int] = None,
+                      search: Optional[str] = None, low_stock: bool = False,
+                      limit: int = 100, cursor: Optional[str] = None, with_total: bool = False) -> Page:
+    """Produtos paginados por cursor (ordem de id)"""
+    return paginate(_products_query(db, clinic_id, category_id, search, low_stock), models.Product.id, models.Product.id,
+                    limit=limit, cursor=cursor, with_total=with_total)
 
 def create_product(db: Session, product: schemas.ProductCreate, clinic_id: int):
     db_product = models.Product(**product.dict(), clinic_id=clinic_id)
     db.add(db_product)
+    db.flush()
+    pharmacy_reports.record_product_change(db, clinic_id, pharmacy_reports.stock_state(None), pharmacy_reports.stock_state(db_product))
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -1260,10 +1371,12 @@ def create_product(db: Session, product: schemas.ProductCreate, clinic_id: int):
 def update_product(db: Session, product_id: int, product: schemas.ProductUpdate):
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if db_product:
+        before = pharmacy_reports.stock_state(db_product)
         update_data = product.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_product, field, value)
         db_product.updated_at = datetime.utcnow()
+        pharmacy_reports.record_product_change(db, db_product.clinic_id, before, pharmacy_reports.stock_state(db_product))
         db.commit()
         db.refresh(db_product)
     return db_product
@@ -1271,7 +1384,9 @@ def update_product(db: Session, product_id: int, product: schemas.ProductUpdate)
 def delete_product(db: Session, product_id: int):
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if db_product:
+        before = pharmacy_reports.stock_state(db_product)
         db_product.is_active = False
+        pharmacy_reports.record_product_change(db, db_product.clinic_id, before, pharmacy_reports.stock_state(db_product))
         db.commit()
         db.refresh(db_product)
     return db_product
@@ -1321,9 +1436,8 @@ def update_product_batch(db: Session, batch_id: int, batch: schemas.ProductBatch
 def get_product_stock_movement(db: Session, movement_id: int):
     return db.query(models.ProductStockMovement).filter(models.ProductStockMovement.id == movement_id).first()
 
-def get_product_stock_movements(db: Session, clinic_id: int, product_id: Optional[int] = None,
-                               department: Optional[str] = None, movement_type: Optional[str] = None,
-                               skip: int = 0, limit: int = 100):
+def _product_stock_movements_query(db: Session, clinic_id: int, product_id: Optional[int] = None,
+                                   department: Optional[str] = None, movement_type: Optional[str] = None):
     query = db.query(models.ProductStockMovement).filter(models.ProductStockMovement.clinic_id == clinic_id)
     
     if product_id:
@@ -1333,8 +1447,22 @@ def get_product_stock_movements(db: Session, clinic_id: int, product_id: Optiona
     if movement_type:
         query = query.filter(models.ProductStockMovement.movement_type == movement_type)
     
+    return query
+
+def get_product_stock_movements(db: Session, clinic_id: int, product_id: Optional[int] = None,
+                               department: Optional[str] = None, movement_type: Optional[str] = None,
+                               skip: int = 0, limit: int = 100):
+    query = _product_stock_movements_query(db, clinic_id, product_id, department, movement_type)
     return query.order_by(models.ProductStockMovement.created_at.desc()).offset(skip).limit(limit).all()
 
+def get_product_stock_movements_page(db: Session, clinic_id: int, product_id: Optional[int] = None,
+                                     department: Optional[str] = None, movement_type: Optional[str] = None,
+                                     limit: int = 100, cursor: Optional[str] = None, with_total: bool = False) -> Page:
+    """Movimentações de produtos paginadas por cursor (mais recentes primeiro)"""
+    return paginate(_product_stock_movements_query(db, clinic_id, product_id, department, movement_type),
+                    models.ProductStockMovement.created_at, models.ProductStockMovement.id,
+                    limit=limit, cursor=cursor, descending=True, with_total=with_total)
+
 def create_product_stock_movement(db: Session, movement: schemas.ProductStockMovementCreate, 
                                  clinic_id: int, user_id: int):
     db_movement = models.ProductStockMovement(
@@ -1346,12 +1474,14 @@ def create_product_stock_movement(db: Session, movement: schemas.ProductStockMov
     # Atualizar estoque do produto
     db_product = db.query(models.Product).filter(models.Product.id == movement.product_id).first()
     if db_product:
+        before = pharmacy_reports.stock_state(db_product)
         if movement.movement_type in ['entrada', 'ajuste_positivo']:
             db_product.current_stock += int(movement.quantity)
         elif movement.movement_type in ['saida', 'ajuste_negativo']:
             db_product.current_stock -= int(movement.quantity)
         
         db.add(db_movement)
+        pharmacy_reports.record_product_change(db, db_product.clinic_id, before, pharmacy_reports.stock_state(db_product))
         db.commit()
         db.refresh(db_movement)
         db.refresh(db_product)
@@ -2045,10 +2175,12 @@ def create_stock_adjustment(db: Session, adjustment: schemas.StockAdjustmentCrea
     # Atualizar estoque do produto
     product = db.query(models.Product).filter(models.Product.id == adjustment.product_id).first()
     if product:
+        before = pharmacy_reports.stock_state(product)
         if adjustment.adjustment_type == "positivo":
             product.current_stock += adjustment.quantity
         elif adjustment.adjustment_type == "negativo":
             product.current_stock -= adjustment.quantity
+        pharmacy_reports.record_product_change(db, product.clinic_id, before, pharmacy_reports.stock_state(product))
         
         # Calcular valor do ajuste
         if product.unit_cost:
@@ -3341,6 +3473,7 @@ def update_user_role(db: Session, role_id: int, role: schemas.UserRoleUpdate):
         db_role.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_role)
+        _invalidate_role_principals(db, role_id)
     return db_role
 
 def delete_user_role(db: Session, role_id: int):
@@ -3349,8 +3482,16 @@ def delete_user_role(db: Session, role_id: int):
         db_role.is_active = False
         db.commit()
         db.refresh(db_role)
+        _invalidate_role_principals(db, role_id)
     return db_role
 
+def _invalidate_role_principals(db: Session, role_id: int):
+    """Remove do cache os principais dos usuários com o papel atribuído"""
+    assigned_users = db.query(models.UserRoleAssignment.user_id).filter(
+        models.UserRoleAssignment.role_id == role_id
+    ).all()
+    principal_cache.invalidate_users([user_id for (user_id,) in assigned_users])
+
 # Module CRUD
 def get_module(db: Session, module_id: int):
     return db.query(models.Module).filter(models.Module.id == module_id).first()
@@ -3441,6 +3582,7 @@ def create_user_role_assignment(db: Session, assignment: schemas.UserRoleAssignm
     db.add(db_assignment)
     db.commit()
     db.refresh(db_assignment)
+    principal_cache.invalidate_user(db_assignment.user_id)
     return db_assignment
 
 def update_user_role_assignment(db: Session, assignment_id: int, assignment: schemas.UserRoleAssignmentUpdate):
@@ -3451,6 +3593,7 @@ def update_user_role_assignment(db: Session, assignment_id: int, assignment: sch
             setattr(db_assignment, field, value)
         db.commit()
         db.refresh(db_assignment)
+        principal_cache.invalidate_user(db_assignment.user_id)
     return db_assignment
 
 def deactivate_user_role_assignment(db: Session, assignment_id: int):
@@ -3459,6 +3602,7 @@ def deactivate_user_role_assignment(db: Session, assignment_id: int):
         db_assignment.is_active = False
         db.commit()
         db.refresh(db_assignment)
+        principal_cache.invalidate_user(db_assignment.user_id)
     return db_assignment
 
 # ============================================================================
@@ -3828,4 +3972,11 @@ def delete_billing_item(db: Session, item_id: int):
     if db_item:
         db.delete(db_item)
         db.commit()
-    return db_item
\ No newline at end of file
+    return db_item
+
+# Pharmacy Reports
+def get_stock_summary(db: Session, clinic_id: int, limit: int = 100, expiring_days: Optional[int] = None):
+    return pharmacy_reports.stock_summary(PharmacyReportSource(db), clinic_id, limit=limit, expiring_days=expiring_days).to_dict()
+
+def get_movement_history(db: Session, clinic_id: int, days: int = 30, product_id: Optional[int] = None, limit: int = 1000):
+    return pharmacy_reports.movement_history(PharmacyReportSource(db), clinic_id, days=days, product_id=product_id, limit=limit)
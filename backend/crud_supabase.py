@@ -5,6 +5,15 @@ from supabase import Client
 
 import schemas
 from encryption import field_encryption
+from principal_cache import principal_cache
+from availability import availability_engine, SupabaseAppointmentSource, FREE_STATUSES
+from reference_index import reference_data, SupabaseReferenceTableSource
+from pagination import supabase_paginate, Page
+from appointment_stats import appointment_stats
+from patient_search import (
+    is_document_term, supabase_blind_index_filter, supabase_sync_search_tokens,
+    supabase_search_by_name, encode_cursor, to_supabase_patient, PatientSearchPage
+)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -48,7 +57,7 @@ class SupabaseCRUD:
         try:
             response = self.supabase.table('medical_documents').select('*').eq('patient_id', patient_id).eq('clinic_id', clinic_id).execute()
             # Descriptografar campos sensíveis
-            return [field_encryption.decrypt_model_data(item, 'MedicalDocument') for item in response.data]
+            return field_encryption.decrypt_rows_lazy(response.data, 'MedicalDocument')
         except Exception as e:
             print(f"Erro ao buscar documentos médicos do paciente: {e}")
             return []
@@ -102,7 +111,7 @@ class SupabaseCRUD:
         try:
             response = self.supabase.table('prescriptions').select('*').eq('patient_id', patient_id).eq('clinic_id', clinic_id).execute()
             # Descriptografar campos sensíveis
-            return [field_encryption.decrypt_model_data(item, 'Prescription') for item in response.data]
+            return field_encryption.decrypt_rows_lazy(response.data, 'Prescription')
         except Exception as e:
             print(f"Erro ao buscar prescrições do paciente: {e}")
             return []
@@ -139,27 +148,40 @@ class SupabaseCRUD:
             return None
     
     # CID Diagnosis CRUD
-    def search_cid_diagnosis(self, search_term: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Buscar diagnósticos CID por termo de busca"""
+    # Tabelas de referência (CID-10, TUSS) são compartilhadas entre as clínicas;
+    # clinic_id é aceito apenas por compatibilidade com os endpoints
+    def search_cid_diagnosis(self, search_term: str, limit: int = 50, skip: int = 0, clinic_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Buscar diagnósticos CID por termo de busca (índice em memória)"""
         try:
-            # Buscar por código ou descrição
-            response = self.supabase.table('cid_diagnosis').select('*').or_(
-                f'code.ilike.%{search_term}%,description.ilike.%{search_term}%'
-            ).limit(limit).execute()
-            return response.data
+            # Buscar por prefixo do código ou palavras da descrição
+            return reference_data.search(
+                SupabaseReferenceTableSource(self.supabase), 'cid', search_term, limit=limit, offset=skip
+            )
         except Exception as e:
             print(f"Erro ao buscar diagnósticos CID: {e}")
             return []
     
-    def get_cid_diagnosis_by_code(self, code: str) -> Optional[Dict[str, Any]]:
-        """Buscar diagnóstico CID por código"""
+    def get_cid_diagnosis_by_code(self, code: str, clinic_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Buscar diagnóstico CID por código (índice em memória)"""
         try:
-            response = self.supabase.table('cid_diagnosis').select('*').eq('code', code).execute()
-            return response.data[0] if response.data else None
+            return reference_data.get_by_code(SupabaseReferenceTableSource(self.supabase), 'cid', code)
         except Exception as e:
             print(f"Erro ao buscar diagnóstico CID por código: {e}")
             return None
     
+    def get_tuss_procedures(self, skip: int = 0, limit: int = 100, search: Optional[str] = None, clinic_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Listar procedimentos TUSS (busca pelo índice em memória)"""
+        try:
+            if search:
+                return reference_data.search(
+                    SupabaseReferenceTableSource(self.supabase), 'tuss', search, limit=limit, offset=skip
+                )
+            response = self.supabase.table('tuss_procedures').select('*').order('id').range(skip, skip + limit - 1).execute()
+            return response.data
+        except Exception as e:
+            print(f"Erro ao listar procedimentos TUSS: {e}")
+            return []
+    
     # Insurance Company CRUD
     def get_insurance_companies(self, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
         """Listar empresas de seguro"""
@@ -321,7 +343,7 @@ class SupabaseCRUD:
         try:
             response = self.supabase.table('anamnesis').select('*').eq('patient_id', patient_id).eq('clinic_id', clinic_id).execute()
             # Descriptografar campos sensíveis
-            return [field_encryption.decrypt_model_data(item, 'Anamnesis') for item in response.data]
+            return field_encryption.decrypt_rows_lazy(response.data, 'Anamnesis')
         except Exception as e:
             print(f"Erro ao buscar anamneses do paciente: {e}")
             return []
@@ -375,7 +397,7 @@ class SupabaseCRUD:
         try:
             response = self.supabase.table('physical_exams').select('*').eq('patient_id', patient_id).eq('clinic_id', clinic_id).execute()
             # Descriptografar campos sensíveis
-            return [field_encryption.decrypt_model_data(item, 'PhysicalExam') for item in response.data]
+            return field_encryption.decrypt_rows_lazy(response.data, 'PhysicalExam')
         except Exception as e:
             print(f"Erro ao buscar exames físicos do paciente: {e}")
             return []
@@ -455,23 +477,33 @@ class SupabaseCRUD:
             print(f"Erro ao buscar prontuário: {e}")
             return None
     
+    def _medical_records_query(self, clinic_id: int, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                               count: Optional[str] = None):
+        query = self.supabase.table('medical_records').select('*', count=count).eq('clinic_id', clinic_id)
+        
+        if patient_id:
+            query = query.eq('patient_id', patient_id)
+        if doctor_id:
+            query = query.eq('doctor_id', doctor_id)
+        return query
+    
     def get_medical_records(self, clinic_id: int, skip: int = 0, limit: int = 100, 
                            patient_id: Optional[int] = None, doctor_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """Listar prontuários com filtros (com isolamento por clínica)"""
         try:
-            query = self.supabase.table('medical_records').select('*').eq('clinic_id', clinic_id)
-            
-            if patient_id:
-                query = query.eq('patient_id', patient_id)
-            if doctor_id:
-                query = query.eq('doctor_id', doctor_id)
-            
-            response = query.range(skip, skip + limit - 1).execute()
+            response = self._medical_records_query(clinic_id, patient_id, doctor_id).range(skip, skip + limit - 1).execute()
             return response.data
         except Exception as e:
             print(f"Erro ao listar prontuários: {e}")
             return []
     
+    def get_medical_records_page(self, clinic_id: int, limit: int = 100, cursor: Optional[str] = None,
+                                 patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                                 with_total: bool = False) -> Page:
+        """Listar prontuários paginados por cursor (ordem de id, com isolamento por clínica)"""
+        query = self._medical_records_query(clinic_id, patient_id, doctor_id, count='estimated' if with_total else None)
+        return supabase_paginate(query, 'id', limit=limit, cursor=cursor)
+    
     def create_medical_record(self, record: schemas.MedicalRecordCreate) -> Optional[Dict[str, Any]]:
         """Criar novo prontuário"""
         try:
@@ -726,25 +758,44 @@ class SupabaseCRUD:
                         date_from: Optional[date] = None, date_to: Optional[date] = None) -> List[Dict[str, Any]]:
         """Listar consultas com filtros (com isolamento por clínica)"""
         try:
-            query = self.supabase.table('appointments').select('*').eq('clinic_id', clinic_id)
-            
-            if patient_id:
-                query = query.eq('patient_id', patient_id)
-            if doctor_id:
-                query = query.eq('doctor_id', doctor_id)
-            if date_from:
-                query = query.gte('appointment_date', date_from.isoformat())
-            if date_to:
-                query = query.lte('appointment_date', date_to.isoformat())
-            
+            query = self._appointments_query(clinic_id, patient_id, doctor_id, date_from, date_to)
             response = query.range(skip, skip + limit - 1).execute()
             return response.data
         except Exception as e:
             print(f"Erro ao listar consultas: {e}")
             return []
     
+    def get_appointments_page(self, clinic_id: int, limit: int = 100, cursor: Optional[str] = None,
+                              patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                              date_from: Optional[date] = None, date_to: Optional[date] = None,
+                              with_total: bool = False) -> Page:
+        """Listar consultas paginadas por cursor (ordem de data, com isolamento por clínica)"""
+        query = self._appointments_query(clinic_id, patient_id, doctor_id, date_from, date_to,
+                                         count='estimated' if with_total else None)
+        return supabase_paginate(query, 'appointment_date', limit=limit, cursor=cursor)
+    
+    def _appointments_query(self, clinic_id: int, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                            date_from: Optional[date] = None, date_to: Optional[date] = None, count: Optional[str] = None):
+        query = self.supabase.table('appointments').select('*', count=count).eq('clinic_id', clinic_id)
+        
+        if patient_id:
+            query = query.eq('patient_id', patient_id)
+        if doctor_id:
+            query = query.eq('doctor_id', doctor_id)
+        if date_from:
+            query = query.gte('appointment_date', date_from.isoformat())
+        if date_to:
+            query = query.lte('appointment_date', date_to.isoformat())
+        return query
+    
     def create_appointment(self, appointment: schemas.AppointmentCreate) -> Optional[Dict[str, Any]]:
-        """Criar nova consulta"""
+        """Criar nova consulta (levanta SchedulingConflictError se o médico estiver ocupado)"""
+        if appointment.status not in FREE_STATUSES:
+            availability_engine.ensure_slot_free(
+                SupabaseAppointmentSource(self.supabase),
+                appointment.doctor_id, appointment.appointment_date, appointment.duration
+            )
+        
         try:
             appointment_data = appointment.dict()
             appointment_data['created_at'] = datetime.utcnow().isoformat()
@@ -754,6 +805,8 @@ class SupabaseCRUD:
             appointment_data = field_encryption.encrypt_model_data(appointment_data, 'Appointment')
             
             response = self.supabase.table('appointments').insert(appointment_data).execute()
+            availability_engine.invalidate(appointment.doctor_id, appointment.appointment_date)
+            appointment_stats.invalidate(appointment.clinic_id)
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Erro ao criar consulta: {e}")
@@ -761,14 +814,36 @@ class SupabaseCRUD:
     
     def update_appointment(self, appointment_id: int, appointment: schemas.AppointmentUpdate, clinic_id: int) -> Optional[Dict[str, Any]]:
         """Atualizar consulta (com isolamento por clínica)"""
+        update_data = appointment.dict(exclude_unset=True)
+        current = None
+        if update_data.keys() & {'doctor_id', 'appointment_date', 'duration', 'status'}:
+            current = self.get_appointment(appointment_id, clinic_id)
+        
+        if current:
+            schedule = {**current, **update_data}
+            rescheduled = bool(update_data.keys() & {'doctor_id', 'appointment_date', 'duration'}) or (
+                current.get('status') in FREE_STATUSES and schedule.get('status') not in FREE_STATUSES
+            )
+            if rescheduled and schedule.get('status') not in FREE_STATUSES:
+                # Levanta SchedulingConflictError se o novo horário estiver ocupado
+                availability_engine.ensure_slot_free(
+                    SupabaseAppointmentSource(self.supabase),
+                    schedule['doctor_id'], schedule['appointment_date'], schedule.get('duration'),
+                    exclude_appointment_id=appointment_id
+                )
+        
         try:
-            update_data = appointment.dict(exclude_unset=True)
             update_data['updated_at'] = datetime.utcnow().isoformat()
             
             # Aplicar criptografia automática nos campos sensíveis
             update_data = field_encryption.encrypt_model_data(update_data, 'Appointment')
             
             response = self.supabase.table('appointments').update(update_data).eq('id', appointment_id).eq('clinic_id', clinic_id).execute()
+            if current:
+                availability_engine.invalidate(current['doctor_id'], current.get('appointment_date'))
+            if response.data:
+                availability_engine.invalidate(response.data[0]['doctor_id'], response.data[0].get('appointment_date'))
+            appointment_stats.invalidate(clinic_id)
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Erro ao atualizar consulta: {e}")
@@ -778,6 +853,9 @@ class SupabaseCRUD:
         """Deletar consulta (com isolamento por clínica)"""
         try:
             response = self.supabase.table('appointments').delete().eq('id', appointment_id).eq('clinic_id', clinic_id).execute()
+            for deleted in response.data or []:
+                availability_engine.invalidate(deleted.get('doctor_id'), deleted.get('appointment_date'))
+            appointment_stats.invalidate(clinic_id)
             return len(response.data) > 0
         except Exception as e:
             print(f"Erro ao deletar consulta: {e}")
@@ -854,6 +932,7 @@ class SupabaseCRUD:
             update_data = field_encryption.encrypt_model_data(update_data, 'User')
             
             response = self.supabase.table('users').update(update_data).eq('id', user_id).execute()
+            principal_cache.invalidate_user(user_id)
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Erro ao atualizar usuário: {e}")
@@ -863,6 +942,7 @@ class SupabaseCRUD:
         """Deletar usuário"""
         try:
             response = self.supabase.table('users').delete().eq('id', user_id).execute()
+            principal_cache.invalidate_user(user_id)
             return len(response.data) > 0
         except Exception as e:
             print(f"Erro ao deletar usuário: {e}")
@@ -881,21 +961,39 @@ class SupabaseCRUD:
     def get_patient_by_cpf(self, cpf: str, clinic_id: int) -> Optional[Dict[str, Any]]:
         """Buscar paciente por CPF (com isolamento por clínica)"""
         try:
-            response = self.supabase.table('patients').select('*').eq('cpf', cpf).eq('clinic_id', clinic_id).execute()
+            # CPF criptografado: busca pelo blind index
+            cpf_hash = field_encryption.encryption.hash_for_search(cpf)
+            response = self.supabase.table('patients').select('*').eq('cpf_hash', cpf_hash).eq('clinic_id', clinic_id).execute()
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Erro ao buscar paciente por CPF: {e}")
             return None
     
+    def _patients_query(self, clinic_id: int, search: Optional[str] = None, name_limit: int = 100, count: Optional[str] = None):
+        """Consulta de pacientes da clínica (None quando a busca não encontra nada)"""
+        query = self.supabase.table('patients').select('*', count=count).eq('clinic_id', clinic_id)
+        
+        if search:
+            # CPF, RG e telefone pelo blind index; nome pelo índice de trigramas
+            conditions = []
+            if not is_document_term(search):
+                patient_ids = [patient_id for patient_id, _ in supabase_search_by_name(self.supabase, clinic_id, search, limit=name_limit)]
+                if patient_ids:
+                    conditions.append(f"id.in.({','.join(str(patient_id) for patient_id in patient_ids)})")
+            blind_index = supabase_blind_index_filter(self.supabase, clinic_id, search)
+            if blind_index:
+                conditions.append(blind_index)
+            if not conditions:
+                return None
+            query = query.or_(','.join(conditions))
+        return query
+    
     def get_patients(self, clinic_id: int, skip: int = 0, limit: int = 100, search: Optional[str] = None) -> List[Dict[str, Any]]:
         """Listar pacientes com paginação e busca (com isolamento por clínica)"""
         try:
-            query = self.supabase.table('patients').select('*').eq('clinic_id', clinic_id)
-            
-            if search:
-                # Supabase não suporta OR diretamente, então fazemos múltiplas consultas
-                # Por simplicidade, vamos buscar apenas por nome
-                query = query.ilike('name', f'%{search}%')
+            query = self._patients_query(clinic_id, search, name_limit=skip + limit)
+            if query is None:
+                return []
             
             response = query.range(skip, skip + limit - 1).execute()
             return response.data
@@ -903,6 +1001,63 @@ class SupabaseCRUD:
             print(f"Erro ao listar pacientes: {e}")
             return []
     
+    def get_patients_page(self, clinic_id: int, limit: int = 100, cursor: Optional[str] = None,
+                          search: Optional[str] = None, with_total: bool = False) -> Page:
+        """
+        Listar pacientes paginados por cursor (com isolamento por clínica).
+        Sem busca ou com CPF/RG/telefone, em ordem de id; busca por nome em
+        ordem de relevância (cursor de relevância e id, sem limite de resultados).
+        """
+        if search and not is_document_term(search):
+            return self._patients_name_page(clinic_id, search, limit, cursor)
+        query = self._patients_query(clinic_id, search, count='estimated' if with_total else None)
+        if query is None:
+            return Page(total=0 if with_total else None)
+        return supabase_paginate(query, 'id', limit=limit, cursor=cursor)
+    
+    def _patients_name_page(self, clinic_id: int, search: str, limit: int, cursor: Optional[str]) -> Page:
+        """
+        Página da busca por nome via search_patients_by_name. Correspondências
+        pelo blind index (ex.: RG com letras) abrem a primeira página e não
+        se repetem nas seguintes.
+        """
+        exact_ids = []
+        blind_index = supabase_blind_index_filter(self.supabase, clinic_id, search)
+        if blind_index:
+            response = self.supabase.table('patients').select('id').eq('clinic_id', clinic_id).or_(blind_index).execute()
+            exact_ids = [row['id'] for row in response.data or []]
+        
+        ranked = supabase_search_by_name(self.supabase, clinic_id, search, limit=limit + 1, cursor=cursor)
+        page, has_more = ranked[:limit], len(ranked) > limit
+        patient_ids = (exact_ids if cursor is None else []) + [
+            patient_id for patient_id, _ in page if patient_id not in exact_ids
+        ]
+        return Page(
+            items=self._patients_by_ids(clinic_id, patient_ids),
+            next_cursor=encode_cursor(page[-1][1], page[-1][0]) if has_more else None
+        )
+    
+    def _patients_by_ids(self, clinic_id: int, patient_ids: List[int]) -> List[Dict[str, Any]]:
+        """Pacientes da clínica na ordem de `patient_ids`"""
+        if not patient_ids:
+            return []
+        response = self.supabase.table('patients').select('*').eq('clinic_id', clinic_id).in_('id', patient_ids).execute()
+        patients = {row['id']: row for row in response.data or []}
+        return [patients[patient_id] for patient_id in patient_ids if patient_id in patients]
+    
+    def search_patients(self, clinic_id: int, search: str, limit: int = 20, cursor: Optional[str] = None) -> PatientSearchPage:
+        """Busca por nome ordenada por relevância, paginada por cursor (com isolamento por clínica)"""
+        ranked = supabase_search_by_name(self.supabase, clinic_id, search, limit=limit + 1, cursor=cursor)
+        page, has_more = ranked[:limit], len(ranked) > limit
+        if not page:
+            return PatientSearchPage()
+        
+        patients = self._patients_by_ids(clinic_id, [patient_id for patient_id, _ in page])
+        return PatientSearchPage(
+            items=field_encryption.decrypt_rows_lazy(patients, 'Patient'),
+            next_cursor=encode_cursor(page[-1][1], page[-1][0]) if has_more else None
+        )
+    
     def create_patient(self, patient: schemas.PatientCreate) -> Optional[Dict[str, Any]]:
         """Criar novo paciente"""
         try:
@@ -911,10 +1066,14 @@ class SupabaseCRUD:
             patient_data['updated_at'] = datetime.utcnow().isoformat()
             
             # Aplicar criptografia automática nos campos sensíveis
-            patient_data = field_encryption.encrypt_model_data(patient_data, 'Patient')
+            encrypted_data = to_supabase_patient(field_encryption.encrypt_model_data(patient_data, 'Patient'))
             
-            response = self.supabase.table('patients').insert(patient_data).execute()
-            return response.data[0] if response.data else None
+            response = self.supabase.table('patients').insert(encrypted_data).execute()
+            if not response.data:
+                return None
+            created = response.data[0]
+            supabase_sync_search_tokens(self.supabase, created['id'], created.get('clinic_id'), patient_data)
+            return created
         except Exception as e:
             print(f"Erro ao criar paciente: {e}")
             return None
@@ -926,10 +1085,13 @@ class SupabaseCRUD:
             update_data['updated_at'] = datetime.utcnow().isoformat()
             
             # Aplicar criptografia automática nos campos sensíveis
-            update_data = field_encryption.encrypt_model_data(update_data, 'Patient')
+            encrypted_data = to_supabase_patient(field_encryption.encrypt_model_data(update_data, 'Patient'))
             
-            response = self.supabase.table('patients').update(update_data).eq('id', patient_id).eq('clinic_id', clinic_id).execute()
-            return response.data[0] if response.data else None
+            response = self.supabase.table('patients').update(encrypted_data).eq('id', patient_id).eq('clinic_id', clinic_id).execute()
+            if not response.data:
+                return None
+            supabase_sync_search_tokens(self.supabase, patient_id, clinic_id, update_data)
+            return response.data[0]
         except Exception as e:
             print(f"Erro ao atualizar paciente: {e}")
             return None
@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 import os
 from dotenv import load_dotenv
 
@@ -23,4 +24,37 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@contextmanager
+def advisory_lock_session(db, key: int):
+    """
+    Sessão para jobs que usam um advisory lock de sessão do PostgreSQL.
+
+    O lock pertence à conexão: com commits por lote, a sessão comum devolve a
+    conexão ao pool e o unlock pode ir para outra conexão, deixando o lock
+    preso. Aqui o lock, os lotes e o unlock usam a mesma conexão dedicada.
+    Retorna None se outro processo detém o lock; fora do PostgreSQL, a
+    própria `db`.
+    """
+    if db.get_bind().dialect.name != 'postgresql':
+        yield db
+        return
+
+    connection = db.get_bind().engine.connect()
+    try:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': key}).scalar():
+            yield None
+            return
+        connection.commit()
+
+        locked = Session(bind=connection, autoflush=False)
+        try:
+            yield locked
+        finally:
+            locked.close()
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': key})
+            connection.commit()
+    finally:
+        connection.close()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Transporte de Email com Pool de Conexões SMTP
+
+Abrir uma conexão SMTP por email (conexão, STARTTLS e login) custa várias
+idas ao servidor, e o smtplib bloqueia o event loop quando usado dentro de
+funções async. Este módulo mantém conexões autenticadas reutilizáveis e
+executa os envios em um pool de threads:
+- Até `pool_size` conexões abertas, reutilizadas entre mensagens e
+  renovadas após `max_messages` envios ou `idle_seconds` sem uso
+- Reconexão e reenvio único quando o servidor fecha a conexão
+- Envios concorrentes em lote (send_many), limitados ao tamanho do pool
+- Um transporte por servidor/conta, compartilhado pelo processo
+"""
+
+import os
+import ssl
+import time
+import asyncio
+import logging
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.message import Message
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class _PooledConnection:
+    smtp: smtplib.SMTP
+    messages: int = 0
+    last_used: float = 0.0
+
+class SMTPTransport:
+    """Envio de emails por um pool de conexões SMTP autenticadas"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = True,
+        pool_size: Optional[int] = None,
+        max_messages: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.pool_size = pool_size or int(os.getenv("SMTP_POOL_SIZE", "4"))
+        self.max_messages = max_messages or int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(
+            os.getenv("SMTP_IDLE_SECONDS", "60")
+        )
+        self.timeout = timeout or float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+        self._idle: List[_PooledConnection] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="smtp")
+        self._ssl_context = ssl.create_default_context()
+
+        # Métricas
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self.reconnects = 0
+
+    async def send(self, message: Message):
+        """Envia uma mensagem sem bloquear o event loop (exceções do smtplib são propagadas)"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._send, message)
+
+    async def send_many(self, messages: Sequence[Message]) -> List[Optional[Exception]]:
+        """Envia as mensagens em paralelo; retorna o erro de cada uma (None se enviada)"""
+        results = await asyncio.gather(*(self.send(message) for message in messages), return_exceptions=True)
+        return [result if isinstance(result, Exception) else None for result in results]
+
+    def close(self):
+        """Encerra as conexões ociosas"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._quit(connection)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            'connections_opened': self.connections_opened,
+            'idle_connections': len(self._idle),
+            'messages_sent': self.messages_sent,
+            'reconnects': self.reconnects
+        }
+
+    def _send(self, message: Message):
+        connection = self._acquire()
+        try:
+            connection.smtp.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            connection = self._resend(connection, message)
+        except smtplib.SMTPException:
+            # Destinatário ou remetente recusado: a conexão continua válida
+            self._release(connection, sent=False)
+            raise
+        except OSError:
+            # Erro de socket ou TLS (SMTPException também é OSError, tratada acima)
+            connection = self._resend(connection, message)
+        except BaseException:
+            self._discard(connection)
+            raise
+
+        self._release(connection, sent=True)
+
+    def _resend(self, connection: _PooledConnection, message: Message) -> _PooledConnection:
+        """Conexão perdida: uma nova tentativa com outra conexão"""
+        self._discard(connection)
+        self.reconnects += 1
+        connection = self._connect()
+        try:
+            connection.smtp.send_message(message)
+        except BaseException:
+            self._discard(connection)
+            raise
+        return connection
+
+    def _acquire(self) -> _PooledConnection:
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                return self._connect()
+            if time.monotonic() - connection.last_used < self.idle_seconds:
+                return connection
+            # Ociosa há muito tempo: confirmar que o servidor não a encerrou
+            try:
+                if connection.smtp.noop()[0] == 250:
+                    return connection
+            except Exception:
+                pass
+            self._quit(connection)
+
+    def _release(self, connection: _PooledConnection, sent: bool):
+        if sent:
+            connection.messages += 1
+            self.messages_sent += 1
+        else:
+            try:
+                connection.smtp.rset()
+            except Exception:
+                self._discard(connection)
+                return
+
+        if connection.messages >= self.max_messages:
+            self._quit(connection)
+            return
+        connection.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(connection)
+
+    def _connect(self) -> _PooledConnection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls(context=self._ssl_context)
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            self._quit(_PooledConnection(smtp))
+            raise
+        self.connections_opened += 1
+        return _PooledConnection(smtp, last_used=time.monotonic())
+
+    def _discard(self, connection: _PooledConnection):
+        try:
+            connection.smtp.close()
+        except Exception:
+            pass
+
+    def _quit(self, connection: _PooledConnection):
+        try:
+            connection.smtp.quit()
+        except Exception:
+            self._discard(connection)
+
+class SMTPTransportRegistry:
+    """Transportes compartilhados por servidor e conta"""
+
+    def __init__(self):
+        self._transports: Dict[Tuple, SMTPTransport] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str, port: int, username: Optional[str], password: Optional[str],
+            use_tls: bool = True, **options) -> SMTPTransport:
+        key = (host, port, username, password, use_tls)
+        transport = self._transports.get(key)
+        if transport is None:
+            with self._lock:
+                transport = self._transports.get(key)
+                if transport is None:
+                    transport = SMTPTransport(host, port, username, password, use_tls, **options)
+                    self._transports[key] = transport
+        return transport
+
+    def close_all(self):
+        with self._lock:
+            transports, self._transports = list(self._transports.values()), {}
+        for transport in transports:
+            transport.close()
+
+# Instância global
+smtp_transports = SMTPTransportRegistry()
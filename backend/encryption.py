@@ -4,58 +4,188 @@ DataClínica - Sistema de Criptografia de Dados Sensíveis
 
 Este módulo implementa criptografia AES-256 para proteger dados sensíveis
 como CPF, RG, dados médicos e outras informações pessoais.
+
+Formatos de token (a leitura aceita todos):
+- "v2:<id da chave>:" + base64(nonce + AES-256-GCM): formato atual
+- "v2:" + base64(nonce + AES-256-GCM): v2 sem id (chave primária)
+- Token Fernet em base64 duplo: formato anterior (ENCRYPTION_TOKEN_FORMAT=fernet
+  mantém a gravação nele, ex.: durante a atualização de várias instâncias)
+- Token Fernet sem a segunda codificação
+
+Chaves (KeyRing): a chave primária vem de ENCRYPTION_KEY (id em
+ENCRYPTION_KEY_ID) e chaves adicionais de ENCRYPTION_KEYS ("id:segredo,...");
+ENCRYPTION_ACTIVE_KEY_ID escolhe a chave das novas gravações. Cada chave é
+derivada (PBKDF2) uma única vez por processo.
+
+Busca (blind index): HMAC-SHA256 com chave derivada da chave primária, do
+valor completo (busca exata) e dos prefixos a partir de BLIND_INDEX_MIN_PREFIX
+caracteres (busca parcial).
 """
 
 import os
 import base64
+import hmac
 import hashlib
-from typing import Optional, Union
+import threading
+from functools import lru_cache
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 import logging
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Prefixos dos formatos de token
+TOKEN_PREFIX_V2 = "v2:"
+FERNET_PREFIX = "gAAAAA"
+LEGACY_PREFIX = "Z0FBQUFB"  # base64 de "gAAAAA" (Fernet em base64 duplo)
+
+GCM_NONCE_SIZE = 12
+
+PBKDF2_SALT = b'dataclinica_salt_2024'
+PBKDF2_ITERATIONS = 100000
+
+# Tamanho mínimo dos prefixos indexados para busca parcial
+BLIND_INDEX_MIN_PREFIX = int(os.getenv("BLIND_INDEX_MIN_PREFIX", "3"))
+
+class KeyMaterial:
+    """Objetos de criptografia derivados de uma chave"""
+    
+    __slots__ = ('key_id', 'fernet_key', 'fernet', 'aead', 'search_key')
+    
+    def __init__(self, key_id: str, fernet_key: bytes, fernet: Fernet, aead: AESGCM, search_key: bytes):
+        self.key_id = key_id
+        self.fernet_key = fernet_key
+        self.fernet = fernet
+        self.aead = aead
+        self.search_key = search_key
+
+@lru_cache(maxsize=32)
+def _derive_key_objects(secret: str):
+    """Deriva (uma vez por processo) as chaves Fernet, AES-GCM e de busca de um segredo"""
+    # Usar salt fixo para garantir que a mesma senha sempre gere a mesma chave
+    # Em produção, considere usar um salt único por instalação
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=PBKDF2_SALT,
+        iterations=PBKDF2_ITERATIONS,
+        backend=default_backend()
+    )
+    fernet_key = base64.urlsafe_b64encode(kdf.derive(secret.encode()))
+    
+    # Chaves do formato v2 e do blind index, derivadas da chave Fernet
+    master_key = base64.urlsafe_b64decode(fernet_key)
+    aead_key, search_key = (
+        HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=info,
+            backend=default_backend()
+        ).derive(master_key)
+        for info in (b'dataclinica-field-encryption-v2', b'dataclinica-blind-index')
+    )
+    return fernet_key, Fernet(fernet_key), AESGCM(aead_key), search_key
+
+class KeyRing:
+    """
+    Conjunto de chaves ativas, indexadas pelo id gravado nos tokens.
+    
+    A chave primária também decifra tokens sem id (formatos anteriores);
+    a chave ativa é usada nas novas gravações.
+    """
+    
+    def __init__(self, keys: Dict[str, str], primary_key_id: str, active_key_id: Optional[str] = None):
+        if primary_key_id not in keys:
+            raise ValueError(f"Chave primária {primary_key_id} não configurada")
+        
+        self.primary_key_id = primary_key_id
+        self.active_key_id = active_key_id or primary_key_id
+        if self.active_key_id not in keys:
+            raise ValueError(f"Chave ativa {self.active_key_id} não configurada")
+        
+        self._keys: Dict[str, KeyMaterial] = {}
+        for key_id, secret in keys.items():
+            if not key_id or ':' in key_id:
+                raise ValueError(f"Id de chave inválido: {key_id!r}")
+            self._keys[key_id] = KeyMaterial(key_id, *_derive_key_objects(secret))
+    
+    @classmethod
+    def from_env(cls, primary_secret: str) -> "KeyRing":
+        primary_key_id = os.getenv("ENCRYPTION_KEY_ID", "k1")
+        keys = {primary_key_id: primary_secret}
+        for entry in os.getenv("ENCRYPTION_KEYS", "").split(","):
+            if entry.strip():
+                key_id, _, secret = entry.strip().partition(":")
+                keys[key_id] = secret
+        return cls(keys, primary_key_id, os.getenv("ENCRYPTION_ACTIVE_KEY_ID") or None)
+    
+    @property
+    def primary(self) -> KeyMaterial:
+        return self._keys[self.primary_key_id]
+    
+    @property
+    def active(self) -> KeyMaterial:
+        return self._keys[self.active_key_id]
+    
+    @property
+    def key_ids(self) -> List[str]:
+        return list(self._keys)
+    
+    def get(self, key_id: str) -> KeyMaterial:
+        try:
+            return self._keys[key_id]
+        except KeyError:
+            raise ValueError(f"Chave de criptografia desconhecida: {key_id}")
+    
+    def fernet_candidates(self) -> List[KeyMaterial]:
+        """Chaves a tentar em tokens Fernet (sem id): primária primeiro"""
+        return [self.primary] + [key for key_id, key in self._keys.items() if key_id != self.primary_key_id]
+
 class DataEncryption:
     """Classe para criptografia de dados sensíveis"""
     
-    def __init__(self, encryption_key: Optional[str] = None):
+    def __init__(self, encryption_key: Optional[str] = None, key_ring: Optional[KeyRing] = None):
         """
         Inicializa o sistema de criptografia.
         
         Args:
             encryption_key: Chave de criptografia. Se não fornecida, usa variável de ambiente.
+            key_ring: Conjunto de chaves (padrão: chave primária + ENCRYPTION_KEYS)
         """
         self.encryption_key = encryption_key or os.getenv("ENCRYPTION_KEY")
         if not self.encryption_key:
             raise ValueError("Chave de criptografia não configurada")
         
-        # Gerar chave Fernet a partir da chave mestra
-        self.fernet_key = self._derive_fernet_key(self.encryption_key)
-        self.fernet = Fernet(self.fernet_key)
+        # Chaves derivadas uma única vez por processo (cache em _derive_key_objects)
+        self.key_ring = key_ring or KeyRing.from_env(self.encryption_key)
+        self.fernet_key = self.key_ring.primary.fernet_key
+        self.fernet = self.key_ring.primary.fernet
+        self.aead = self.key_ring.primary.aead
+        # O blind index usa sempre a chave primária: não muda na rotação
+        self.search_key = self.key_ring.primary.search_key
+        self.token_format = os.getenv("ENCRYPTION_TOKEN_FORMAT", "v2").lower()
+        
+        # Operações em lote: paralelas a partir de `parallel_min_values` valores
+        self.workers = int(os.getenv("ENCRYPTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.parallel_min_values = int(os.getenv("ENCRYPTION_PARALLEL_MIN_VALUES", "2000"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
         
         logger.info("Sistema de criptografia inicializado")
     
     def _derive_fernet_key(self, password: str) -> bytes:
         """Deriva uma chave Fernet a partir de uma senha"""
-        # Usar salt fixo para garantir que a mesma senha sempre gere a mesma chave
-        # Em produção, considere usar um salt único por instalação
-        salt = b'dataclinica_salt_2024'
-        
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-            backend=default_backend()
-        )
-        
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        return key
+        return _derive_key_objects(password)[0]
     
     def encrypt_string(self, plaintext: str) -> str:
         """
@@ -71,8 +201,14 @@ class DataEncryption:
             return plaintext
         
         try:
-            encrypted_bytes = self.fernet.encrypt(plaintext.encode('utf-8'))
-            return base64.urlsafe_b64encode(encrypted_bytes).decode('utf-8')
+            key = self.key_ring.active
+            if self.token_format == "fernet":
+                encrypted_bytes = key.fernet.encrypt(plaintext.encode('utf-8'))
+                return base64.urlsafe_b64encode(encrypted_bytes).decode('utf-8')
+            
+            nonce = os.urandom(GCM_NONCE_SIZE)
+            encrypted_bytes = key.aead.encrypt(nonce, plaintext.encode('utf-8'), None)
+            return f"{TOKEN_PREFIX_V2}{key.key_id}:" + base64.urlsafe_b64encode(nonce + encrypted_bytes).decode('ascii')
         except Exception as e:
             logger.error(f"Erro ao criptografar string: {e}")
             raise
@@ -91,13 +227,85 @@ class DataEncryption:
             return ciphertext
         
         try:
-            encrypted_bytes = base64.urlsafe_b64decode(ciphertext.encode('utf-8'))
-            decrypted_bytes = self.fernet.decrypt(encrypted_bytes)
+            if ciphertext.startswith(TOKEN_PREFIX_V2):
+                key_id, payload = self._split_v2(ciphertext)
+                token = base64.urlsafe_b64decode(payload)
+                aead = self.key_ring.get(key_id).aead
+                decrypted_bytes = aead.decrypt(token[:GCM_NONCE_SIZE], token[GCM_NONCE_SIZE:], None)
+            elif ciphertext.startswith(FERNET_PREFIX):
+                decrypted_bytes = self._fernet_decrypt(ciphertext.encode('ascii'))
+            else:
+                encrypted_bytes = base64.urlsafe_b64decode(ciphertext.encode('utf-8'))
+                decrypted_bytes = self._fernet_decrypt(encrypted_bytes)
             return decrypted_bytes.decode('utf-8')
         except Exception as e:
             logger.error(f"Erro ao descriptografar string: {e}")
             raise
     
+    def key_id_of(self, ciphertext: str) -> Optional[str]:
+        """Id da chave de um token v2 (None para formatos sem id)"""
+        if ciphertext and ciphertext.startswith(TOKEN_PREFIX_V2):
+            return self._split_v2(ciphertext)[0]
+        return None
+    
+    def needs_reencryption(self, ciphertext: str) -> bool:
+        """Indica se o token não está no formato e na chave das novas gravações"""
+        if not self.is_encrypted(ciphertext):
+            return False
+        if self.token_format == "fernet":
+            return False
+        return self.key_id_of(ciphertext) != self.key_ring.active_key_id
+    
+    def reencrypt_string(self, ciphertext: str) -> str:
+        """Recriptografa um token com a chave ativa"""
+        return self.encrypt_string(self.decrypt_string(ciphertext))
+    
+    def _split_v2(self, ciphertext: str):
+        body = ciphertext[len(TOKEN_PREFIX_V2):]
+        key_id, separator, payload = body.partition(':')
+        if not separator:
+            # v2 sem id: chave primária
+            return self.key_ring.primary_key_id, body
+        return key_id, payload
+    
+    def _fernet_decrypt(self, token: bytes) -> bytes:
+        last_error = None
+        for key in self.key_ring.fernet_candidates():
+            try:
+                return key.fernet.decrypt(token)
+            except Exception as e:
+                last_error = e
+        raise last_error
+    
+    def encrypt_many(self, values: Sequence[str]) -> List[str]:
+        """Criptografa uma lista de strings (em paralelo para lotes grandes)"""
+        return self.map_batch(self.encrypt_string, values)
+    
+    def decrypt_many(self, values: Sequence[str]) -> List[str]:
+        """Descriptografa uma lista de strings (em paralelo para lotes grandes)"""
+        return self.map_batch(self.decrypt_string, values)
+    
+    def map_batch(self, func: Callable[[str], str], values: Sequence[str]) -> List[str]:
+        """
+        Aplica `func` a todos os valores. Lotes com ao menos
+        `parallel_min_values` valores são divididos entre as threads do pool.
+        """
+        if self.workers <= 1 or len(values) < self.parallel_min_values:
+            return [func(value) for value in values]
+        
+        chunk_size = -(-len(values) // self.workers)
+        chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+        results: List[str] = []
+        for chunk_result in self._get_executor().map(lambda chunk: [func(value) for value in chunk], chunks):
+            results.extend(chunk_result)
+        return results
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encryption")
+            return self._executor
+    
     def encrypt_cpf(self, cpf: str) -> str:
         """Criptografa um CPF"""
         if not cpf:
@@ -153,18 +361,38 @@ class DataEncryption:
             data: Dados a serem hasheados
             
         Returns:
-            Hash SHA-256 dos dados
+            HMAC-SHA256 (hex) dos dados normalizados
         """
         if not data:
             return data
         
-        # Limpar dados antes de hashear
-        clean_data = ''.join(filter(str.isalnum, data.lower()))
-        
-        # Adicionar salt para evitar rainbow tables
-        salted_data = f"{clean_data}_{self.encryption_key[:16]}"
-        
-        return hashlib.sha256(salted_data.encode()).hexdigest()
+        return self._search_hmac(b'exact:', self.normalize_for_search(data))
+    
+    def prefix_hash_for_search(self, data: str) -> Optional[str]:
+        """Hash de um termo parcial, comparável aos de prefix_hashes_for_search"""
+        clean_data = self.normalize_for_search(data or '')
+        if len(clean_data) < BLIND_INDEX_MIN_PREFIX:
+            return None
+        return self._search_hmac(b'prefix:', clean_data)
+    
+    def prefix_hashes_for_search(self, data: str) -> List[str]:
+        """
+        Hashes dos prefixos dos dados normalizados (do tamanho mínimo até o
+        valor completo), para busca parcial pelo início do valor.
+        """
+        clean_data = self.normalize_for_search(data or '')
+        return [
+            self._search_hmac(b'prefix:', clean_data[:length])
+            for length in range(BLIND_INDEX_MIN_PREFIX, len(clean_data) + 1)
+        ]
+    
+    @staticmethod
+    def normalize_for_search(data: str) -> str:
+        """Remove formatação (pontos, traços, espaços) e caixa"""
+        return ''.join(filter(str.isalnum, data.lower()))
+    
+    def _search_hmac(self, domain: bytes, clean_data: str) -> str:
+        return hmac.new(self.search_key, domain + clean_data.encode('utf-8'), hashlib.sha256).hexdigest()
     
     def encrypt_file(self, file_path: str, output_path: Optional[str] = None) -> str:
         """
@@ -239,13 +467,89 @@ class DataEncryption:
         if not data:
             return False
         
+        # Todos os formatos têm prefixo fixo (versão do token Fernet ou "v2:")
+        return data.startswith((TOKEN_PREFIX_V2, FERNET_PREFIX, LEGACY_PREFIX)) and len(data) > 20
+
+class LazyDecryptedRow(MutableMapping):
+    """
+    Linha cujos campos sensíveis são descriptografados somente quando lidos.
+    
+    Modelos Pydantic de resposta leem apenas os campos que emitem, de modo
+    que colunas criptografadas fora do schema nunca são descriptografadas.
+    Cada valor é descriptografado uma única vez (memo compartilhado entre as
+    linhas da mesma listagem).
+    """
+    
+    __slots__ = ('_data', '_pending', '_field_encryption', '_memo', '_model_name')
+    
+    def __init__(self, data: dict, pending: Set[str], field_encryption: "FieldEncryption",
+                 memo: Dict[str, str], model_name: Optional[str] = None):
+        self._data = data
+        self._pending = pending
+        self._field_encryption = field_encryption
+        self._memo = memo
+        self._model_name = model_name
+    
+    def __getitem__(self, key: str) -> Any:
+        value = self._data[key]
+        if key in self._pending:
+            value = self._decrypt(key, value)
+        return value
+    
+    def __setitem__(self, key: str, value: Any):
+        self._pending.discard(key)
+        self._data[key] = value
+    
+    def __delitem__(self, key: str):
+        self._pending.discard(key)
+        del self._data[key]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __getattr__(self, name: str) -> Any:
+        # Acesso por atributo (schemas com from_attributes e código legado)
+        if name.startswith('_'):
+            raise AttributeError(name)
         try:
-            # Tentar decodificar base64
-            base64.urlsafe_b64decode(data.encode('utf-8'))
-            # Se conseguiu decodificar e tem tamanho típico de dados criptografados
-            return len(data) > 50 and '=' in data[-4:]
-        except:
-            return False
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    def __repr__(self) -> str:
+        return f"LazyDecryptedRow({sorted(self._data)}, pendentes={sorted(self._pending)})"
+    
+    def copy(self) -> dict:
+        return self.to_dict()
+    
+    def to_dict(self) -> dict:
+        """Descriptografa os campos pendentes em lote e retorna um dicionário"""
+        if self._pending:
+            fields = sorted(self._pending)
+            plaintexts = self._field_encryption.encryption.map_batch(
+                self._field_encryption._decrypt_or_none, [self._data[field] for field in fields]
+            )
+            for field, plaintext in zip(fields, plaintexts):
+                self._store(field, self._data[field], plaintext)
+        return dict(self._data)
+    
+    def _decrypt(self, key: str, ciphertext: str) -> Any:
+        plaintext = self._memo.get(ciphertext)
+        if plaintext is None:
+            plaintext = self._field_encryption._decrypt_or_none(ciphertext)
+        return self._store(key, ciphertext, plaintext)
+    
+    def _store(self, key: str, ciphertext: str, plaintext: Optional[str]) -> Any:
+        self._pending.discard(key)
+        if plaintext is None:
+            logger.warning(f"Erro ao descriptografar campo {key}" + (f" de {self._model_name}" if self._model_name else ""))
+            return ciphertext
+        self._memo[ciphertext] = plaintext
+        self._data[key] = plaintext
+        return plaintext
 
 class FieldEncryption:
     """Classe para criptografia automática de campos específicos"""
@@ -261,57 +565,120 @@ class FieldEncryption:
     # Campos que devem ter hash para busca
     SEARCHABLE_FIELDS = {'cpf', 'rg_number', 'phone'}
     
+    # Modelos com colunas <campo>_hash (blind index)
+    SEARCH_INDEXED_MODELS = {'Patient'}
+    
     def __init__(self, encryption: DataEncryption):
         self.encryption = encryption
     
-    def encrypt_model_data(self, model_data: dict) -> dict:
+    def encrypt_model_data(self, model_data: dict, model_name: Optional[str] = None) -> dict:
         """
         Criptografa campos sensíveis de um modelo.
         
         Args:
             model_data: Dicionário com dados do modelo
+            model_name: Nome do modelo (informativo)
             
         Returns:
             Dicionário com campos sensíveis criptografados
         """
-        encrypted_data = model_data.copy()
-        
-        for field_name, value in model_data.items():
-            if field_name in self.ENCRYPTED_FIELDS and value:
-                # Criptografar o campo
-                encrypted_data[field_name] = self.encryption.encrypt_string(str(value))
-                
-                # Criar hash para busca se necessário
-                if field_name in self.SEARCHABLE_FIELDS:
-                    hash_field = f"{field_name}_hash"
-                    encrypted_data[hash_field] = self.encryption.hash_for_search(str(value))
-        
-        return encrypted_data
+        return self.encrypt_rows([model_data], model_name)[0]
     
-    def decrypt_model_data(self, model_data: dict) -> dict:
+    def decrypt_model_data(self, model_data: dict, model_name: Optional[str] = None) -> dict:
         """
         Descriptografa campos sensíveis de um modelo.
         
         Args:
             model_data: Dicionário com dados criptografados
+            model_name: Nome do modelo (informativo)
             
         Returns:
             Dicionário com campos descriptografados
         """
-        decrypted_data = model_data.copy()
+        return self.decrypt_rows([model_data], model_name)[0]
+    
+    def encrypt_rows(self, rows: Sequence[dict], model_name: Optional[str] = None) -> List[dict]:
+        """
+        Criptografa os campos sensíveis de várias linhas em uma única operação
+        em lote (paralela para lotes grandes).
+        """
+        encrypted_rows = [row.copy() for row in rows]
+        targets = [
+            (index, field_name, str(value))
+            for index, row in enumerate(rows)
+            for field_name, value in row.items()
+            if field_name in self.ENCRYPTED_FIELDS and value
+        ]
         
-        for field_name, value in model_data.items():
-            if field_name in self.ENCRYPTED_FIELDS and value:
-                try:
-                    # Verificar se está criptografado antes de tentar descriptografar
-                    if self.encryption.is_encrypted(str(value)):
-                        decrypted_data[field_name] = self.encryption.decrypt_string(str(value))
-                except Exception as e:
-                    logger.warning(f"Erro ao descriptografar campo {field_name}: {e}")
-                    # Manter valor original se não conseguir descriptografar
-                    pass
+        ciphertexts = self.encryption.encrypt_many([value for _, _, value in targets])
+        for (index, field_name, value), ciphertext in zip(targets, ciphertexts):
+            encrypted_rows[index][field_name] = ciphertext
         
-        return decrypted_data
+        # Criar hash para busca (somente modelos com blind index)
+        if model_name in self.SEARCH_INDEXED_MODELS:
+            for row, encrypted_row in zip(rows, encrypted_rows):
+                for field_name in self.SEARCHABLE_FIELDS.intersection(row):
+                    value = row[field_name]
+                    encrypted_row[f"{field_name}_hash"] = self.encryption.hash_for_search(str(value)) if value else None
+        
+        return encrypted_rows
+    
+    def search_tokens(self, model_data: dict) -> List[Tuple[str, str]]:
+        """
+        Pares (campo, hash de prefixo) dos campos pesquisáveis presentes em
+        `model_data` (valores ainda não criptografados).
+        """
+        return [
+            (field_name, token_hash)
+            for field_name in sorted(self.SEARCHABLE_FIELDS.intersection(model_data))
+            if model_data[field_name]
+            for token_hash in self.encryption.prefix_hashes_for_search(str(model_data[field_name]))
+        ]
+    
+    def decrypt_rows(self, rows: Sequence[dict], model_name: Optional[str] = None) -> List[dict]:
+        """
+        Descriptografa os campos sensíveis de várias linhas em uma única
+        operação em lote (paralela para lotes grandes). Valores que não puderem
+        ser descriptografados são mantidos.
+        """
+        decrypted_rows = [dict(row) for row in rows]
+        targets = [
+            (index, field_name, str(value))
+            for index, row in enumerate(decrypted_rows)
+            for field_name, value in row.items()
+            if field_name in self.ENCRYPTED_FIELDS and value and self.encryption.is_encrypted(str(value))
+        ]
+        
+        plaintexts = self.encryption.map_batch(self._decrypt_or_none, [value for _, _, value in targets])
+        for (index, field_name, value), plaintext in zip(targets, plaintexts):
+            if plaintext is None:
+                logger.warning(f"Erro ao descriptografar campo {field_name}" + (f" de {model_name}" if model_name else ""))
+            else:
+                decrypted_rows[index][field_name] = plaintext
+        
+        return decrypted_rows
+    
+    def decrypt_rows_lazy(self, rows: Sequence[dict], model_name: Optional[str] = None) -> List[LazyDecryptedRow]:
+        """
+        Retorna as linhas com os campos sensíveis descriptografados sob
+        demanda (apenas os campos efetivamente lidos ou serializados).
+        """
+        memo: Dict[str, str] = {}
+        lazy_rows = []
+        for row in rows:
+            data = dict(row)
+            pending = {
+                field_name for field_name, value in data.items()
+                if field_name in self.ENCRYPTED_FIELDS and isinstance(value, str) and self.encryption.is_encrypted(value)
+            }
+            lazy_rows.append(LazyDecryptedRow(data, pending, self, memo, model_name))
+        return lazy_rows
+    
+    def _decrypt_or_none(self, value: str) -> Optional[str]:
+        try:
+            return self.encryption.decrypt_string(value)
+        except Exception:
+            return None
 
 # Instância global
 encryption_key = os.getenv("ENCRYPTION_KEY", "dataclinica_default_key_2024_change_in_production")
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 import models
 import schemas
+from appointment_stats import appointment_stats, AppointmentStatsSource
 
 class FinancialCalculator:
     """Calculadora para métricas financeiras de clínicas"""
@@ -19,6 +20,10 @@ class FinancialCalculator:
         self.db = db
         self.clinic_id = clinic_id
     
+    def get_appointment_statistics(self, start_date: date, end_date: date):
+        """Estatísticas de consultas do período (compartilhadas com o painel de consultas)"""
+        return appointment_stats.get(AppointmentStatsSource(self.db), self.clinic_id, start_date, end_date)
+    
     def calculate_revenue_per_patient(self, start_date: date, end_date: date) -> Decimal:
         """Calcula receita média por paciente no período"""
         # Buscar faturamento do período
@@ -123,13 +128,8 @@ class FinancialCalculator:
     
     def calculate_cost_per_appointment(self, start_date: date, end_date: date) -> Decimal:
         """Calcula custo médio por atendimento"""
-        # Buscar total de consultas
-        total_appointments = self.db.query(models.Appointment).filter(
-            models.Appointment.clinic_id == self.clinic_id,
-            models.Appointment.appointment_date >= start_date,
-            models.Appointment.appointment_date <= end_date,
-            models.Appointment.status == 'completed'
-        ).count()
+        # Total de consultas realizadas
+        total_appointments = self.get_appointment_statistics(start_date, end_date).totals['completed']
         
         if total_appointments == 0:
             return Decimal('0.00')
@@ -195,13 +195,9 @@ class FinancialCalculator:
         
         estimated_slots = total_days * total_doctors * 16  # 16 slots por médico por dia
         
-        # Buscar consultas realizadas
-        completed_appointments = self.db.query(models.Appointment).filter(
-            models.Appointment.clinic_id == self.clinic_id,
-            models.Appointment.appointment_date >= start_date,
-            models.Appointment.appointment_date <= end_date,
-            models.Appointment.status.in_(['completed', 'confirmed'])
-        ).count()
+        # Consultas realizadas e confirmadas
+        stats = self.get_appointment_statistics(start_date, end_date)
+        completed_appointments = stats.totals['completed'] + stats.totals['confirmed']
         
         if estimated_slots == 0:
             return Decimal('0.00')
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Recriptografia de Campos na Rotação de Chaves
+
+Este módulo migra os campos criptografados para a chave ativa do KeyRing
+(ENCRYPTION_ACTIVE_KEY_ID) e para o formato atual de token:
+- Tabelas e colunas descobertas a partir dos modelos (colunas em
+  FieldEncryption.ENCRYPTED_FIELDS)
+- Lotes limitados, um por transação, percorridos pela chave primária
+- UPDATE compare-and-set (só grava se o valor ainda for o lido); linhas
+  alteradas pela aplicação no meio do lote são relidas e tentadas de novo
+- Pausa entre lotes para não competir com o tráfego da aplicação
+- Advisory lock no PostgreSQL para que apenas um processo execute a migração
+
+Enquanto a migração não termina, os tokens antigos continuam legíveis porque
+todas as chaves configuradas permanecem no KeyRing.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, advisory_lock_session
+from encryption import field_encryption, FieldEncryption
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock que evita migrações concorrentes
+KEY_ROTATION_LOCK_KEY = 7_314_552_003
+
+def encrypted_columns(base=None) -> List[Tuple[type, List[str]]]:
+    """Modelos mapeados e suas colunas criptografadas"""
+    if base is None:
+        from models import Base as base
+
+    targets = []
+    for mapper in base.registry.mappers:
+        columns = [
+            attr.key for attr in mapper.column_attrs
+            if attr.key in FieldEncryption.ENCRYPTED_FIELDS
+        ]
+        if columns and len(mapper.primary_key) == 1:
+            targets.append((mapper.class_, columns))
+    return targets
+
+class KeyRotationJob:
+    """Migração em segundo plano dos campos para a chave ativa"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        batch_size: Optional[int] = None,
+        pause_seconds: Optional[float] = None,
+        encryption: FieldEncryption = None
+    ):
+        self.session_factory = session_factory or SessionLocal
+        self.batch_size = batch_size or int(os.getenv("ENCRYPTION_REENCRYPT_BATCH_SIZE", "500"))
+        self.pause_seconds = pause_seconds if pause_seconds is not None else float(
+            os.getenv("ENCRYPTION_REENCRYPT_PAUSE_SECONDS", "0.5")
+        )
+        self.field_encryption = encryption or field_encryption
+        self.max_retries = int(os.getenv("ENCRYPTION_REENCRYPT_MAX_RETRIES", "3"))
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Progresso por tabela: linhas examinadas e valores recriptografados
+        self.progress: Dict[str, Dict[str, int]] = {}
+
+    def start(self):
+        """Inicia a migração em segundo plano"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="encryption-key-rotation",
+            daemon=True
+        )
+        self._thread.start()
+
+    def shutdown(self):
+        """Interrompe a migração ao final do lote atual"""
+        self._stopped.set()
+
+    def run(self, db: Session) -> int:
+        """
+        Migra todas as tabelas com colunas criptografadas.
+
+        Returns:
+            Número de valores recriptografados
+        """
+        with advisory_lock_session(db, KEY_ROTATION_LOCK_KEY) as locked:
+            if locked is None:
+                return 0
+
+            migrated = 0
+            for model, columns in encrypted_columns():
+                if self._stopped.is_set():
+                    break
+                migrated += self.migrate_table(locked, model, columns)
+            return migrated
+
+    def migrate_table(self, db: Session, model, columns: List[str]) -> int:
+        """
+        Recriptografa as colunas de uma tabela em lotes de `batch_size` linhas.
+
+        Cada UPDATE só grava se a coluna ainda tiver o valor lido (compare-and-set):
+        uma gravação concorrente da aplicação não é sobrescrita. As linhas que
+        mudaram no meio do lote são relidas e tentadas de novo até
+        `max_retries` vezes.
+        """
+        primary_key = model.__mapper__.primary_key[0]
+        selected = [primary_key] + [getattr(model, column) for column in columns]
+        progress = self.progress.setdefault(model.__tablename__, {'rows': 0, 'migrated': 0, 'missed': 0})
+
+        last_id = None
+        migrated = 0
+        missed: List[object] = []
+        while not self._stopped.is_set():
+            query = db.query(*selected)
+            if last_id is not None:
+                query = query.filter(primary_key > last_id)
+            rows = query.order_by(primary_key).limit(self.batch_size).all()
+            if not rows:
+                break
+
+            batch_migrated, batch_missed = self._reencrypt_rows(db, model, primary_key, columns, rows)
+            migrated += batch_migrated
+            missed.extend(batch_missed)
+
+            progress['rows'] += len(rows)
+            progress['migrated'] += batch_migrated
+            last_id = rows[-1][0]
+
+            if self.pause_seconds:
+                time.sleep(self.pause_seconds)
+
+        # Linhas alteradas durante a migração: reler e tentar de novo
+        for _ in range(self.max_retries):
+            if not missed or self._stopped.is_set():
+                break
+            retried, missed = missed, []
+            for start in range(0, len(retried), self.batch_size):
+                rows = db.query(*selected).filter(
+                    primary_key.in_(retried[start:start + self.batch_size])
+                ).order_by(primary_key).all()
+                batch_migrated, batch_missed = self._reencrypt_rows(db, model, primary_key, columns, rows)
+                migrated += batch_migrated
+                progress['migrated'] += batch_migrated
+                missed.extend(batch_missed)
+
+        progress['missed'] = len(missed)
+        if missed:
+            logger.warning(
+                f"{len(missed)} linhas de {model.__tablename__} mudaram durante a recriptografia "
+                f"e ficam para a próxima execução"
+            )
+        if migrated:
+            logger.info(f"{migrated} valores de {model.__tablename__} recriptografados com a chave ativa")
+        return migrated
+
+    def _reencrypt_rows(self, db: Session, model, primary_key, columns: List[str], rows) -> Tuple[int, List[object]]:
+        """
+        Recriptografa em lote os valores fora da chave ativa e grava com
+        compare-and-set em uma transação.
+
+        Returns:
+            (valores recriptografados, ids das linhas alteradas concorrentemente)
+        """
+        encryption = self.field_encryption.encryption
+        targets = [
+            (index, column, value)
+            for index, row in enumerate(rows)
+            for column, value in zip(columns, row[1:])
+            if isinstance(value, str) and encryption.needs_reencryption(value)
+        ]
+        if not targets:
+            return 0, []
+
+        ciphertexts = encryption.map_batch(encryption.reencrypt_string, [value for _, _, value in targets])
+
+        changes: Dict[object, Dict[str, Tuple[str, str]]] = {}
+        for (index, column, old), ciphertext in zip(targets, ciphertexts):
+            changes.setdefault(rows[index][0], {})[column] = (old, ciphertext)
+
+        migrated = 0
+        missed = []
+        for row_id, values in changes.items():
+            result = db.execute(
+                update(model)
+                .where(primary_key == row_id, *(getattr(model, column) == old for column, (old, _) in values.items()))
+                .values(**{column: new for column, (_, new) in values.items()})
+            )
+            if result.rowcount:
+                migrated += len(values)
+            else:
+                missed.append(row_id)
+        db.commit()
+        return migrated, missed
+
+    def _run(self):
+        """Execução da thread de migração"""
+        db = self.session_factory()
+        try:
+            migrated = self.run(db)
+            logger.info(f"Recriptografia concluída: {migrated} valores migrados")
+        except Exception as e:
+            logger.error(f"Erro na recriptografia de campos: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+# Instância global
+key_rotation = KeyRotationJob()
+
+if os.getenv("ENCRYPTION_REENCRYPT_ENABLED", "false").lower() == "true":
+    key_rotation.start()
+
+if __name__ == "__main__":
+    # Execução única: python key_rotation.py
+    logging.basicConfig(level=logging.INFO)
+    session = key_rotation.session_factory()
+    try:
+        print(f"Valores recriptografados: {key_rotation.run(session)}")
+    finally:
+        session.close()
@@ -1,20 +1,74 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from datetime import timedelta, date, datetime
 from typing import List, Optional
+import os
+import logging
 
 import schemas, auth, models
 from crud_supabase import crud_supabase
+from availability import availability_engine, SupabaseAppointmentSource, SchedulingConflictError
+from pharmacy_reports import pharmacy_reports, SupabasePharmacyReportSource
 from database_supabase import get_supabase_client
 from audit_backup import AuditLogger, BackupManager, ComplianceChecker
 from financial_utils import FinancialCalculator, ReportGenerator
 from routers import external_apis, saas, two_factor_auth, telemedicine, companions_visitors, medical_devices, analytics_ai, stock_management, beds_rooms, hospitalization, permissions
 
+logger = logging.getLogger(__name__)
+
+def _notification_workers():
+    """Pool de workers da fila de notificações, se habilitado neste processo"""
+    if os.getenv("NOTIFICATION_WORKERS_ENABLED", "true").lower() != "true":
+        return None
+    try:
+        from backend.notification_queue import notification_workers
+    except ImportError as e:
+        # Sem os workers, notificações agendadas e em retry nunca seriam entregues
+        raise RuntimeError(
+            "NOTIFICATION_WORKERS_ENABLED=true, mas backend.notification_queue não pôde ser importado; "
+            "execute a aplicação como backend.main:app (PYTHONPATH com a raiz do projeto e backend/) "
+            "ou defina NOTIFICATION_WORKERS_ENABLED=false"
+        ) from e
+    return notification_workers
+
+def _audit_jobs():
+    """Jobs periódicos de auditoria habilitados neste processo"""
+    jobs = []
+    if os.getenv("AUDIT_ROLLUP_ENABLED", "true").lower() == "true":
+        try:
+            from audit_stats import audit_stats
+        except Exception as e:
+            # Sem o agregado as estatísticas continuam exatas (consultas diretas em audit_logs)
+            logger.error(f"Agregado de auditoria não iniciado: {e}", exc_info=True)
+        else:
+            jobs.append(audit_stats)
+    if os.getenv("AUDIT_PARTITION_JOB_ENABLED", "true").lower() == "true":
+        from audit_partitions import partition_manager
+        jobs.append(partition_manager)
+    return jobs
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Entrega das notificações pendentes, agendadas e em retry
+    notification_workers = _notification_workers()
+    if notification_workers is not None:
+        notification_workers.start()
+    audit_jobs = _audit_jobs()
+    for job in audit_jobs:
+        job.start()
+    yield
+    for job in audit_jobs:
+        job.shutdown()
+    if notification_workers is not None:
+        await notification_workers.stop()
+
 app = FastAPI(
     title="Sistema Clínico Profissional",
     description="ERP web para clínicas com prontuário eletrônico, faturamento TISS e gestão completa",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -24,6 +78,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Count-Estimated"],
 )
 
 # Incluir routers
@@ -234,11 +289,36 @@ def create_patient(patient: schemas.PatientCreate, current_user: dict = Depends(
         raise HTTPException(status_code=400, detail="CPF already registered")
     return crud_supabase.create_patient(patient=patient, clinic_id=current_user["clinic_id"])
 
+def paged_response(response: Response, load_page):
+    """Itens da página; próximo cursor e total nos cabeçalhos X-Next-Cursor e X-Total-Count"""
+    try:
+        page = load_page()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+        response.headers["X-Total-Count-Estimated"] = "true" if page.total_is_estimate else "false"
+    return page.items
+
 @app.get("/patients/", response_model=List[schemas.Patient])
-def read_patients(skip: int = 0, limit: int = 100, search: Optional[str] = None, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+def read_patients(response: Response, skip: int = 0, limit: int = 100, search: Optional[str] = None, cursor: Optional[str] = None, with_total: bool = False, use_cursor: bool = False, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+    if cursor or use_cursor:
+        # Paginação por cursor; sem cursor nem use_cursor, skip/limit como antes
+        return paged_response(response, lambda: crud_supabase.get_patients_page(
+            clinic_id=current_user["clinic_id"], limit=limit, cursor=cursor, search=search, with_total=with_total
+        ))
     patients = crud_supabase.get_patients(clinic_id=current_user["clinic_id"], skip=skip, limit=limit, search=search)
     return patients
 
+@app.get("/patients/search", response_model=schemas.PatientSearchPage)
+def search_patients(q: str, limit: int = 20, cursor: Optional[str] = None, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+    try:
+        return crud_supabase.search_patients(clinic_id=current_user["clinic_id"], search=q, limit=min(limit, 100), cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/patients/{patient_id}", response_model=schemas.Patient)
 def read_patient(patient_id: int, current_user: dict = Depends(auth.get_current_active_user_supabase)):
     db_patient = crud_supabase.get_patient(patient_id=patient_id, clinic_id=current_user["clinic_id"])
@@ -277,10 +357,33 @@ def read_doctor(doctor_id: int, current_user: dict = Depends(auth.get_current_ac
 # Appointments endpoints
 @app.post("/appointments/", response_model=schemas.Appointment)
 def create_appointment(appointment: schemas.AppointmentCreate, current_user: dict = Depends(auth.get_current_active_user_supabase)):
-    return crud_supabase.create_appointment(appointment=appointment, clinic_id=current_user["clinic_id"])
+    try:
+        return crud_supabase.create_appointment(appointment=appointment, clinic_id=current_user["clinic_id"])
+    except SchedulingConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/appointments/availability/free-slots")
+def read_free_slots(day: date, duration: Optional[int] = None, doctor_id: Optional[int] = None, count: int = 3, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+    source = SupabaseAppointmentSource(crud_supabase.supabase)
+    if doctor_id is not None:
+        if crud_supabase.get_doctor(doctor_id=doctor_id, clinic_id=current_user["clinic_id"]) is None:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        after = max(datetime.combine(day, datetime.min.time()), datetime.now())
+        slots = {doctor_id: availability_engine.next_free_slots(source, doctor_id, after, count, duration)}
+    else:
+        # Todos os médicos da clínica com uma única consulta
+        slots = availability_engine.clinic_free_slots(source, current_user["clinic_id"], day, duration, per_doctor=count)
+    return [
+        {"doctor_id": slot.doctor_id, "start": slot.start, "end": slot.end}
+        for doctor_slots in slots.values() for slot in doctor_slots
+    ]
 
 @app.get("/appointments/", response_model=List[schemas.Appointment])
-def read_appointments(skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+def read_appointments(response: Response, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, cursor: Optional[str] = None, with_total: bool = False, use_cursor: bool = False, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+    if cursor or use_cursor:
+        return paged_response(response, lambda: crud_supabase.get_appointments_page(
+            clinic_id=current_user["clinic_id"], limit=limit, cursor=cursor, patient_id=patient_id, doctor_id=doctor_id, with_total=with_total
+        ))
     appointments = crud_supabase.get_appointments(clinic_id=current_user["clinic_id"], skip=skip, limit=limit, patient_id=patient_id, doctor_id=doctor_id)
     return appointments
 
@@ -293,7 +396,10 @@ def read_appointment(appointment_id: int, current_user: dict = Depends(auth.get_
 
 @app.put("/appointments/{appointment_id}", response_model=schemas.Appointment)
 def update_appointment(appointment_id: int, appointment: schemas.AppointmentUpdate, current_user: dict = Depends(auth.get_current_active_user_supabase)):
-    db_appointment = crud_supabase.update_appointment(appointment_id=appointment_id, appointment=appointment, clinic_id=current_user["clinic_id"])
+    try:
+        db_appointment = crud_supabase.update_appointment(appointment_id=appointment_id, appointment=appointment, clinic_id=current_user["clinic_id"])
+    except SchedulingConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if db_appointment is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
     return db_appointment
@@ -305,7 +411,11 @@ def create_medical_record(record: schemas.MedicalRecordCreate, current_user: dic
     return crud_supabase.create_medical_record(record=record, clinic_id=current_user["clinic_id"])
 
 @app.get("/medical-records/", response_model=List[schemas.MedicalRecord])
-def read_medical_records(skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+def read_medical_records(response: Response, skip: int = 0, limit: int = 100, patient_id: Optional[int] = None, doctor_id: Optional[int] = None, cursor: Optional[str] = None, with_total: bool = False, use_cursor: bool = False, current_user: dict = Depends(auth.get_current_active_user_supabase)):
+    if cursor or use_cursor:
+        return paged_response(response, lambda: crud_supabase.get_medical_records_page(
+            clinic_id=current_user["clinic_id"], limit=limit, cursor=cursor, patient_id=patient_id, doctor_id=doctor_id, with_total=with_total
+        ))
     records = crud_supabase.get_medical_records(clinic_id=current_user["clinic_id"], skip=skip, limit=limit, patient_id=patient_id, doctor_id=doctor_id)
     return records
 
@@ -2487,80 +2597,34 @@ def update_purchase_order(
 # Stock Reports endpoints
 @app.get("/pharmacy/reports/stock-summary")
 def get_stock_summary(
-    current_user: schemas.User = Depends(auth.get_current_active_user_supabase)
+    limit: int = 100,
+    expiring_days: Optional[int] = None,
+    current_user: dict = Depends(auth.get_current_active_user_supabase)
 ):
-    """Relatório resumo do estoque"""
-    # Produtos com estoque baixo
-    low_stock_products = crud_supabase.get_products(
-        clinic_id=current_user.clinic_id, 
-        low_stock=True, 
-        limit=1000
+    """Relatório resumo do estoque (contagens e filtros executados no banco)"""
+    summary = pharmacy_reports.stock_summary(
+        SupabasePharmacyReportSource(crud_supabase.supabase),
+        current_user["clinic_id"],
+        limit=min(limit, 1000),
+        expiring_days=expiring_days
     )
-    
-    # Lotes próximos ao vencimento
-    expiring_batches = crud_supabase.get_product_batches(
-        clinic_id=current_user.clinic_id,
-        expiring_soon=True,
-        limit=1000
-    )
-    
-    # Total de produtos ativos
-    total_products = len(crud_supabase.get_products(
-        clinic_id=current_user.clinic_id, 
-        limit=10000
-    ))
-    
-    return {
-        "total_products": total_products,
-        "low_stock_count": len(low_stock_products),
-        "low_stock_products": [{
-            "id": p.id,
-            "name": p.name,
-            "current_stock": p.current_stock,
-            "minimum_stock": p.minimum_stock
-        } for p in low_stock_products],
-        "expiring_batches_count": len(expiring_batches),
-        "expiring_batches": [{
-            "id": b.id,
-            "product_name": b.product.name if b.product else "N/A",
-            "batch_number": b.batch_number,
-            "expiry_date": b.expiry_date.isoformat() if b.expiry_date else None,
-            "quantity": b.quantity
-        } for b in expiring_batches]
-    }
+    return summary.to_dict()
 
 @app.get("/pharmacy/reports/movement-history")
 def get_movement_history(
     days: int = 30,
     product_id: Optional[int] = None,
-    current_user: schemas.User = Depends(auth.get_current_active_user_supabase)
+    limit: int = 1000,
+    current_user: dict = Depends(auth.get_current_active_user_supabase)
 ):
     """Histórico de movimentações de estoque"""
-    movements = crud_supabase.get_product_stock_movements(
-        clinic_id=current_user.clinic_id,
+    return pharmacy_reports.movement_history(
+        SupabasePharmacyReportSource(crud_supabase.supabase),
+        current_user["clinic_id"],
+        days=days,
         product_id=product_id,
-        limit=1000
+        limit=min(limit, 1000)
     )
-    
-    # Filtrar por período
-    from datetime import datetime, timedelta
-    cutoff_date = datetime.now() - timedelta(days=days)
-    recent_movements = [m for m in movements if m.created_at >= cutoff_date]
-    
-    return {
-        "period_days": days,
-        "total_movements": len(recent_movements),
-        "movements": [{
-            "id": m.id,
-            "product_name": m.product.name if m.product else "N/A",
-            "movement_type": m.movement_type,
-            "quantity": m.quantity,
-            "department": m.department,
-            "reason": m.reason,
-            "created_at": m.created_at.isoformat(),
-            "user_name": m.user.full_name if m.user else "N/A"
-        } for m in recent_movements]
-    }
 
 # ============================================================================
 # LGPD ENDPOINTS
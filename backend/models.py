@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Date, Numeric, JSON, Time, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Date, Numeric, JSON, Time, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -87,6 +87,10 @@ class Patient(Base):
     father_name = Column(String)
     marital_status = Column(String)
     profession = Column(String)
+    # Blind index (HMAC) dos campos criptografados pesquisáveis
+    cpf_hash = Column(String(64), index=True)
+    rg_number_hash = Column(String(64), index=True)
+    phone_hash = Column(String(64), index=True)
     # Campos LGPD
     lgpd_consent = Column(Boolean, default=False)
     lgpd_consent_date = Column(DateTime)
@@ -103,6 +107,22 @@ class Patient(Base):
     appointments = relationship("Appointment", back_populates="patient")
     medical_records = relationship("MedicalRecord", back_populates="patient")
     documents = relationship("PatientDocument", back_populates="patient")
+    search_tokens = relationship("PatientSearchToken", back_populates="patient", cascade="all, delete-orphan")
+
+class PatientSearchToken(Base):
+    """Hashes dos prefixos de CPF, RG e telefone para busca parcial"""
+    __tablename__ = "patient_search_tokens"
+    
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("patients.id", ondelete="CASCADE"), nullable=False)
+    clinic_id = Column(Integer, ForeignKey("clinics.id"))
+    field = Column(String(30), nullable=False)
+    token_hash = Column(String(64), nullable=False)
+    
+    # Relacionamentos
+    patient = relationship("Patient", back_populates="search_tokens")
+    
+    __table_args__ = (Index('ix_patient_search_tokens_hash', 'token_hash', 'patient_id'),)
 
 class PatientDocument(Base):
     __tablename__ = "patient_documents"
@@ -332,6 +352,8 @@ class Appointment(Base):
     doctor = relationship("Doctor", back_populates="appointments")
     procedure = relationship("TussProcedure")
     creator = relationship("User")
+    
+    __table_args__ = (Index('ix_appointments_clinic_date', 'clinic_id', 'appointment_date'),)
 
 class MedicalRecord(Base):
     __tablename__ = "medical_records"
@@ -576,6 +598,15 @@ class ProductStockMovement(Base):
     batch = relationship("ProductBatch")
     user = relationship("User")
 
+class PharmacyStockSnapshot(Base):
+    """Totais de estoque por clínica, mantidos pelas gravações de produtos (pharmacy_reports)"""
+    __tablename__ = "pharmacy_stock_snapshots"
+    
+    clinic_id = Column(Integer, ForeignKey("clinics.id", ondelete="CASCADE"), primary_key=True)
+    total_products = Column(Integer, nullable=False, default=0)
+    low_stock_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 class StockRequisition(Base):
     __tablename__ = "stock_requisitions"
     
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Fila Persistente de Notificações
+
+Este módulo usa a própria tabela notifications como outbox: toda notificação
+pendente tem um horário de tentativa (next_attempt_at) e é entregue por um
+pool de workers asyncio, inclusive as agendadas (scheduled_at e horário
+silencioso) e as que falharam:
+- Reserva de lotes com SELECT ... FOR UPDATE SKIP LOCKED no PostgreSQL e
+  UPDATE condicional com token de reserva (portável para o SQLite)
+- Reserva com prazo (lease): se o processo cair, a notificação volta à fila
+- Backoff de retry_delay_minutes e falha definitiva após max_retries
+- rate_limit_per_minute por canal com o rate limiter de janela deslizante
+  (Redis, fakeredis:// ou memory://)
+- Métricas de atraso da fila (lag) por canal
+- Inserção em lote (enqueue_many) e entrega de lotes já reservados
+  (deliver), usadas pelos envios em massa do NotificationSystem
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from sqlalchemy import and_, case, func, insert, or_, select, update
+
+from .rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_DELAY_MINUTES = [5, 15, 60]
+
+# Prazo da reserva de uma notificação em entrega
+LEASE_SECONDS = float(os.getenv("NOTIFICATION_LEASE_SECONDS", "300"))
+
+# Ids por instrução UPDATE ... WHERE id IN (...)
+ID_CHUNK_SIZE = 1000
+
+def _chunks(ids: Sequence[int]) -> Iterator[List[int]]:
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+def _notification_module():
+    # Importado sob demanda: notification_system também usa este módulo
+    from . import notification_system
+    return notification_system
+
+class NotificationOutbox:
+    """Operações da fila sobre a tabela notifications (SQLAlchemy Core)"""
+
+    def __init__(self, table=None, status=None):
+        self._table = table
+        self._status = status
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = _notification_module().Notification.__table__
+        return self._table
+
+    @property
+    def status(self):
+        if self._status is None:
+            self._status = _notification_module().NotificationStatus
+        return self._status
+
+    def schedule(self, db, notification_id: int, when: datetime):
+        """(Re)agenda uma notificação pendente para `when`"""
+        table = self.table
+        db.execute(update(table).where(table.c.id == notification_id).values(
+            status=self.status.PENDING, next_attempt_at=when, locked_until=None, claim_token=None
+        ))
+        db.commit()
+
+    def enqueue_many(self, db, rows: List[Dict[str, Any]], lease_seconds: float = None,
+                     now: datetime = None) -> List[Dict[str, Any]]:
+        """
+        Insere notificações pendentes em lote (INSERT de várias linhas).
+        Com `lease_seconds`, as já vencidas ficam reservadas para quem as
+        inseriu e são retornadas para entrega imediata.
+        """
+        if not rows:
+            return []
+        table = self.table
+        now = now or datetime.now()
+        token = uuid.uuid4().hex if lease_seconds else None
+
+        for row in rows:
+            due = row.get('next_attempt_at') or now
+            row['next_attempt_at'] = due
+            claimed = token is not None and due <= now
+            row['locked_until'] = now + timedelta(seconds=lease_seconds) if claimed else None
+            row['claim_token'] = token if claimed else None
+
+        db.execute(insert(table), rows)
+        db.commit()
+        if token is None:
+            return []
+        return [dict(row._mapping) for row in db.execute(
+            select(table).where(table.c.claim_token == token).order_by(table.c.id)
+        )]
+
+    def claim(self, db, batch_size: int, lease_seconds: float, now: datetime = None) -> List[Dict[str, Any]]:
+        """
+        Reserva até `batch_size` notificações vencidas por `lease_seconds`.
+        Linhas reservadas por outro worker (ou com reserva ainda válida) são
+        ignoradas.
+        """
+        table = self.table
+        now = now or datetime.now()
+        pending = self.status.PENDING
+
+        # Notificações expiradas saem da fila
+        db.execute(update(table).where(
+            table.c.status == pending, table.c.expires_at.isnot(None), table.c.expires_at <= now
+        ).values(status=self.status.EXPIRED, locked_until=None, claim_token=None))
+
+        available = and_(
+            table.c.status == pending,
+            table.c.next_attempt_at <= now,
+            or_(table.c.locked_until.is_(None), table.c.locked_until < now)
+        )
+        ids = db.execute(
+            select(table.c.id).where(available).order_by(table.c.next_attempt_at, table.c.id)
+            .limit(batch_size).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not ids:
+            db.commit()
+            return []
+
+        token = uuid.uuid4().hex
+        db.execute(update(table).where(table.c.id.in_(ids), available).values(
+            locked_until=now + timedelta(seconds=lease_seconds), claim_token=token
+        ))
+        db.commit()
+
+        rows = db.execute(select(table).where(table.c.claim_token == token).order_by(table.c.next_attempt_at, table.c.id))
+        return [dict(row._mapping) for row in rows]
+
+    def mark_sent(self, db, notification_ids: Sequence[int], now: datetime = None):
+        if not notification_ids:
+            return
+        table = self.table
+        for chunk in _chunks(notification_ids):
+            db.execute(update(table).where(table.c.id.in_(chunk)).values(
+                status=self.status.SENT, sent_at=now or datetime.now(), locked_until=None, claim_token=None, last_error=None
+            ))
+        db.commit()
+
+    def retry(self, db, notification: Dict[str, Any], error: str = None,
+              retry_delay_minutes: Sequence[int] = None, now: datetime = None) -> bool:
+        """
+        Registra uma tentativa que falhou. Retorna True se a notificação foi
+        reagendada e False se esgotou as tentativas (status FAILED).
+        """
+        table = self.table
+        now = now or datetime.now()
+        delays = list(retry_delay_minutes or DEFAULT_RETRY_DELAY_MINUTES)
+        retry_count = notification.get('retry_count') or 0
+        max_retries = notification.get('max_retries')
+        max_retries = len(delays) if max_retries is None else max_retries
+
+        values = {'retry_count': retry_count + 1, 'locked_until': None, 'claim_token': None, 'last_error': error}
+        retried = retry_count < max_retries
+        if retried:
+            values['next_attempt_at'] = now + timedelta(minutes=delays[min(retry_count, len(delays) - 1)])
+        else:
+            values['status'] = self.status.FAILED
+        db.execute(update(table).where(table.c.id == notification['id']).values(**values))
+        db.commit()
+        return retried
+
+    def defer(self, db, notification_ids: Sequence[int], until: datetime):
+        """Devolve notificações reservadas à fila sem contar tentativa (ex.: rate limit)"""
+        if not notification_ids:
+            return
+        table = self.table
+        for chunk in _chunks(notification_ids):
+            db.execute(update(table).where(table.c.id.in_(chunk)).values(
+                next_attempt_at=until, locked_until=None, claim_token=None
+            ))
+        db.commit()
+
+    def lag(self, db, now: datetime = None) -> Dict[str, Dict[str, Any]]:
+        """Por canal: pendentes, vencidas e atraso da mais antiga vencida (segundos)"""
+        table = self.table
+        now = now or datetime.now()
+        due = table.c.next_attempt_at <= now
+        rows = db.execute(
+            select(
+                table.c.channel,
+                func.count(),
+                func.sum(case((due, 1), else_=0)),
+                func.min(case((due, table.c.next_attempt_at), else_=None))
+            ).where(table.c.status == self.status.PENDING).group_by(table.c.channel)
+        ).all()
+
+        lag = {}
+        for channel, pending, due_count, oldest in rows:
+            if isinstance(oldest, str):
+                oldest = datetime.fromisoformat(oldest)
+            lag[getattr(channel, 'value', channel)] = {
+                'pending': int(pending),
+                'due': int(due_count or 0),
+                'lag_seconds': max(0.0, (now - oldest).total_seconds()) if oldest else 0.0
+            }
+        return lag
+
+class NotificationWorkerPool:
+    """
+    Pool de workers asyncio que entrega as notificações da outbox.
+
+    Cada worker tem sua sessão e seu NotificationSystem (criado por
+    `system_factory(db)`), reserva um lote, entrega pelos handlers de canal e
+    registra o resultado. Sem notificações vencidas, espera `poll_seconds`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = None,
+        system_factory: Callable = None,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        poll_seconds: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+        limiter: RateLimiter = None,
+        outbox: NotificationOutbox = None
+    ):
+        self.session_factory = session_factory
+        self.system_factory = system_factory
+        self.workers = workers or int(os.getenv("NOTIFICATION_WORKERS", "4"))
+        self.batch_size = batch_size or int(os.getenv("NOTIFICATION_BATCH_SIZE", "100"))
+        self.poll_seconds = poll_seconds if poll_seconds is not None else float(
+            os.getenv("NOTIFICATION_POLL_SECONDS", "2")
+        )
+        self.lease_seconds = lease_seconds or LEASE_SECONDS
+        self.limiter = limiter or RateLimiter(os.getenv("NOTIFICATION_RATE_LIMIT_REDIS_URL"))
+        self.outbox = outbox or notification_outbox
+
+        # Criado em start(), no loop que executa os workers
+        self._stopped: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # Métricas
+        self.claimed = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def start(self):
+        """Inicia os workers no loop atual"""
+        if any(not task.done() for task in self._tasks):
+            return
+        self._stopped = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"notification-worker-{index}")
+            for index in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Interrompe os workers ao final do lote atual"""
+        if self._stopped is not None:
+            self._stopped.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def process_batch(self, db, system) -> int:
+        """Reserva e entrega um lote; retorna o número de notificações reservadas"""
+        notifications = self.outbox.claim(db, self.batch_size, self.lease_seconds)
+        if notifications:
+            self.claimed += len(notifications)
+            await self.deliver(db, system, notifications)
+        return len(notifications)
+
+    async def deliver(self, db, system, notifications: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Entrega notificações já reservadas, canal a canal: aplica o rate
+        limit do canal, envia em paralelo até o limite de concorrência do
+        canal e registra envios, novas tentativas e falhas.
+        """
+        config = getattr(system, 'config', {})
+        retry_delays = config.get('retry_delay_minutes', DEFAULT_RETRY_DELAY_MINUTES)
+        rate_limit = int(config.get('rate_limit_per_minute', 60))
+        counts = {'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0}
+
+        by_channel: Dict[Any, List[Dict[str, Any]]] = {}
+        for notification in notifications:
+            by_channel.setdefault(notification['channel'], []).append(notification)
+
+        for channel, channel_notifications in by_channel.items():
+            channel_name = getattr(channel, 'value', channel)
+
+            admitted = channel_notifications
+            if rate_limit > 0:
+                admitted = []
+                for index, notification in enumerate(channel_notifications):
+                    decision = await self.limiter.hit([(f"notifications:{channel_name}", rate_limit, 60)])
+                    if not decision.allowed:
+                        # Limite do canal esgotado: o restante volta à fila sem contar tentativa
+                        ids = [remaining['id'] for remaining in channel_notifications[index:]]
+                        self.outbox.defer(db, ids, datetime.now() + timedelta(seconds=max(1.0, decision.retry_after)))
+                        counts['deferred'] += len(ids)
+                        break
+                    admitted.append(notification)
+
+            handler = system.channel_handlers.get(channel)
+            semaphore = asyncio.Semaphore(self._concurrency(system, channel_name))
+
+            async def attempt(notification: Dict[str, Any]):
+                async with semaphore:
+                    try:
+                        if handler is None:
+                            raise ValueError(f"Handler não encontrado para canal: {channel_name}")
+                        return await handler(self._message(notification)), None
+                    except Exception as e:
+                        return False, str(e)
+
+            outcomes = await asyncio.gather(*(attempt(notification) for notification in admitted))
+
+            sent: List[int] = []
+            for notification, (delivered, error) in zip(admitted, outcomes):
+                if delivered:
+                    sent.append(notification['id'])
+                elif self.outbox.retry(db, notification, error, retry_delays):
+                    counts['retried'] += 1
+                else:
+                    counts['failed'] += 1
+            self.outbox.mark_sent(db, sent)
+            counts['sent'] += len(sent)
+
+        self.sent += counts['sent']
+        self.retried += counts['retried']
+        self.failed += counts['failed']
+        self.deferred += counts['deferred']
+        return counts
+
+    def get_metrics(self, db=None) -> Dict[str, Any]:
+        metrics = {
+            'workers': sum(1 for task in self._tasks if not task.done()),
+            'claimed': self.claimed,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'deferred': self.deferred
+        }
+        if db is not None:
+            metrics['queues'] = self.outbox.lag(db)
+        return metrics
+
+    async def _worker(self):
+        db = (self.session_factory or self._default_session_factory())()
+        system = None
+        try:
+            while not self._stopped.is_set():
+                try:
+                    # Criado dentro do laço: uma falha na criação não encerra o worker
+                    if system is None:
+                        system = (self.system_factory or self._default_system_factory)(db)
+                    claimed = await self.process_batch(db, system)
+                except Exception as e:
+                    logger.error(f"Erro no worker de notificações: {e}")
+                    db.rollback()
+                    claimed = 0
+
+                if claimed < self.batch_size:
+                    try:
+                        await asyncio.wait_for(self._stopped.wait(), timeout=self.poll_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            db.close()
+
+    @staticmethod
+    def _concurrency(system, channel_name: str) -> int:
+        """Envios simultâneos por canal: emails até o tamanho do pool SMTP"""
+        transport = getattr(system, 'email_transport', None)
+        if channel_name == 'email' and transport is not None:
+            return transport.pool_size
+        return 1
+
+    def _message(self, notification: Dict[str, Any]):
+        module = _notification_module()
+        data = notification.get('data')
+        return module.NotificationMessage(
+            recipient_id=notification.get('user_id'),
+            recipient_email=notification.get('recipient_email'),
+            recipient_phone=notification.get('recipient_phone'),
+            notification_type=notification['notification_type'],
+            channel=notification['channel'],
+            priority=notification.get('priority') or module.NotificationPriority.NORMAL,
+            title=notification['title'],
+            message=notification['message'],
+            data=json.loads(data) if data else None,
+            scheduled_at=notification.get('scheduled_at'),
+            expires_at=notification.get('expires_at'),
+            notification_id=notification['id']
+        )
+
+    @staticmethod
+    def _default_session_factory():
+        from .database import SessionLocal
+        return SessionLocal
+
+    @staticmethod
+    def _default_system_factory(db):
+        # Mesmo sistema (e configurações de email e SMS) da API
+        return _notification_module().create_notification_system(db)
+
+# Instâncias globais
+notification_outbox = NotificationOutbox()
+notification_workers = NotificationWorkerPool()
+
+if __name__ == "__main__":
+    # Execução dos workers: python -m backend.notification_queue
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        notification_workers.start()
+        await asyncio.gather(*notification_workers._tasks)
+
+    asyncio.run(_main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Push de Notificações em Tempo Real
+
+As notificações in-app só eram obtidas por polling de /notifications/ e
+/notifications/unread-count, e NotificationSystem.subscribers alcança apenas
+o próprio processo. Este módulo entrega eventos por usuário às conexões
+WebSocket ou Server-Sent Events abertas em qualquer worker:
+- Publicação no canal Redis do usuário (notifications:user:<id>); cada
+  processo assina somente os canais dos usuários conectados a ele
+- Sem Redis (NOTIFICATION_PUSH_REDIS_URL=memory:// ou falha de conexão),
+  entrega apenas às conexões do próprio processo
+- Eventos "notification" (nova notificação in-app) e "unread_count" (total
+  ao conectar, depois apenas deltas de criação, leitura e remoção)
+- Fila limitada por conexão: um cliente lento recebe "resync" (recarregar
+  a contagem) em vez de acumular eventos
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "notifications:user:"
+
+RESYNC_EVENT = {'event': 'resync'}
+
+class NotificationStream:
+    """Eventos de notificação por usuário, com fan-out entre processos via Redis pub/sub"""
+
+    def __init__(self, redis_url: Optional[str] = None, queue_size: Optional[int] = None,
+                 heartbeat_seconds: Optional[float] = None):
+        self.redis_url = redis_url or os.getenv(
+            "NOTIFICATION_PUSH_REDIS_URL", os.getenv("REDIS_URL", "memory://")
+        )
+        self.queue_size = queue_size or int(os.getenv("NOTIFICATION_PUSH_QUEUE_SIZE", "100"))
+        self.heartbeat_seconds = heartbeat_seconds or float(
+            os.getenv("NOTIFICATION_PUSH_HEARTBEAT_SECONDS", "20")
+        )
+        self.redis_retry_seconds = float(os.getenv("NOTIFICATION_PUSH_REDIS_RETRY_SECONDS", "30"))
+
+        # user_id -> filas das conexões abertas neste processo
+        self._connections: Dict[int, Set[asyncio.Queue]] = {}
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._pubsub_lock: Optional[asyncio.Lock] = None  # criado no loop em uso
+        self._redis_retry_at = 0.0
+
+        # Métricas
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def notification_created(self, user_id: Optional[int], notification: Dict[str, Any]):
+        """Nova notificação in-app entregue ao usuário"""
+        await self.publish(user_id, {'event': 'notification', 'notification': notification})
+
+    async def unread_changed(self, changes: Iterable[Tuple[Optional[int], int]]):
+        """Variações da contagem de não lidas: pares (user_id, delta)"""
+        await self.publish_many(
+            (user_id, {'event': 'unread_count', 'delta': delta}) for user_id, delta in changes if delta
+        )
+
+    async def publish(self, user_id: Optional[int], event: Dict[str, Any]):
+        """Publica um evento para todas as conexões do usuário, em qualquer processo"""
+        await self.publish_many([(user_id, event)])
+
+    async def publish_many(self, events: Iterable[Tuple[Optional[int], Dict[str, Any]]]):
+        events = [(user_id, event) for user_id, event in events if user_id]
+        if not events:
+            return
+        self.published += len(events)
+
+        redis = await self._ensure_pubsub()
+        if redis is not None:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for user_id, event in events:
+                        pipe.publish(self._channel(user_id), json.dumps(event, default=str))
+                    await pipe.execute()
+                return
+            except Exception as e:
+                self._redis_failed(e)
+
+        for user_id, event in events:
+            self._dispatch(user_id, event)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int) -> AsyncIterator[asyncio.Queue]:
+        """Fila de eventos de uma conexão do usuário, enquanto o contexto estiver aberto"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        connections = self._connections.setdefault(user_id, set())
+        first = not connections
+        connections.add(queue)
+        try:
+            if first:
+                await self._redis_subscribe(user_id)
+            yield queue
+        finally:
+            connections.discard(queue)
+            if not connections and self._connections.get(user_id) is connections:
+                del self._connections[user_id]
+                await self._redis_unsubscribe(user_id)
+
+    async def events(self, user_id: int, initial: Optional[Dict[str, Any]] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Eventos do usuário até a conexão ser encerrada; None a cada
+        heartbeat_seconds sem eventos (para manter a conexão aberta).
+        """
+        async with self.subscribe(user_id) as queue:
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'users': len(self._connections),
+            'connections': sum(len(queues) for queues in self._connections.values()),
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'redis': self._pubsub is not None
+        }
+
+    async def close(self):
+        """Encerra a assinatura no Redis (ex.: no shutdown da aplicação)"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.cancel()
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            await self._close_pubsub(pubsub)
+
+    def _dispatch(self, user_id: int, event: Dict[str, Any]):
+        for queue in list(self._connections.get(user_id, ())):
+            try:
+                queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Cliente lento: descarta o acumulado e pede recarga da contagem
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_EVENT)
+                self.dropped += 1
+
+    @staticmethod
+    def _channel(user_id: int) -> str:
+        return f"{CHANNEL_PREFIX}{user_id}"
+
+    async def _ensure_pubsub(self):
+        """Cliente Redis com pub/sub ativo (assinando os usuários conectados), ou None"""
+        if self._pubsub is not None:
+            return self._redis
+        if self.redis_url == "memory://" or time.monotonic() < self._redis_retry_at:
+            return None
+
+        if self._pubsub_lock is None:
+            self._pubsub_lock = asyncio.Lock()
+        async with self._pubsub_lock:
+            if self._pubsub is not None:
+                return self._redis
+            try:
+                if self._redis is None:
+                    if self.redis_url.startswith("fakeredis://"):
+                        import fakeredis
+                        self._redis = fakeredis.FakeAsyncRedis()
+                    else:
+                        import redis.asyncio as aioredis
+                        self._redis = aioredis.from_url(self.redis_url)
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                # Canal de controle: mantém a assinatura ativa mesmo sem usuários conectados
+                await pubsub.subscribe(f"{CHANNEL_PREFIX}_", *(self._channel(user_id) for user_id in self._connections))
+            except Exception as e:
+                self._redis_failed(e)
+                return None
+
+            self._pubsub = pubsub
+            self._listener = asyncio.create_task(self._listen(pubsub), name="notification-stream-listener")
+            return self._redis
+
+    async def _redis_subscribe(self, user_id: int):
+        # SUBSCRIBE é idempotente: repetir é seguro se a criação do pub/sub já assinou o canal
+        if await self._ensure_pubsub() is None:
+            return
+        try:
+            await self._pubsub.subscribe(self._channel(user_id))
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def _redis_unsubscribe(self, user_id: int):
+        if self._pubsub is None:
+            return
+        try:
+            await self._pubsub.unsubscribe(self._channel(user_id))
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def _listen(self, pubsub):
+        try:
+            async for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                try:
+                    user_id = int(channel[len(CHANNEL_PREFIX):])
+                    event = json.loads(message['data'])
+                except (ValueError, TypeError):
+                    continue
+                self._dispatch(user_id, event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._redis_failed(e)
+
+    def _redis_failed(self, error: Exception):
+        logger.error(f"Redis indisponível para push de notificações, entregando apenas neste processo: {error}")
+        self._redis_retry_at = time.monotonic() + self.redis_retry_seconds
+        pubsub, self._pubsub = self._pubsub, None
+        listener, self._listener = self._listener, None
+        if listener is not None and listener is not asyncio.current_task():
+            listener.cancel()
+        if pubsub is not None:
+            asyncio.ensure_future(self._close_pubsub(pubsub))
+
+    @staticmethod
+    async def _close_pubsub(pubsub):
+        try:
+            await pubsub.close()
+        except Exception:
+            pass
+
+# Instância global
+notification_stream = NotificationStream()
@@ -6,25 +6,40 @@ Este módulo implementa um sistema completo de notificações em tempo real,
 alertas de segurança, notificações por email/SMS e comunicação com usuários.
 """
 
+import os
 import json
-import smtplib
 import asyncio
+import threading
+from collections import Counter
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Set, Callable
+from typing import Dict, List, Optional, Any, Set, Callable, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-import ssl
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, Enum as SQLEnum, func, select
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 from .models import User, Patient, Base
 from .audit_logger import AuditLogger, EventType, EventSeverity
 from .security_config import SecurityConfig
+from .notification_queue import notification_outbox, notification_workers, LEASE_SECONDS
+from .email_transport import smtp_transports
+from .notification_stream import notification_stream
+from .notification_templates import notification_templates
+
+# Usuários por consulta de preferências nos envios em lote
+PREFERENCE_CHUNK_SIZE = 1000
+
+# Sessão e audit logger da requisição (ou task) atual: o NotificationSystem é
+# compartilhado pelo processo e cada requisição usa a própria sessão
+_request_context: ContextVar[Optional[Tuple[Session, AuditLogger]]] = ContextVar(
+    'notification_request_context', default=None
+)
 
 class NotificationType(str, Enum):
     """Tipos de notificação"""
@@ -98,8 +113,18 @@ class Notification(Base):
     retry_count = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
     
+    # Fila de entrega (notification_queue)
+    next_attempt_at = Column(DateTime, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    claim_token = Column(String(32), nullable=True, index=True)
+    last_error = Column(Text, nullable=True)
+    
     # Relacionamentos
     user = relationship("User", back_populates="notifications")
+    
+    __table_args__ = (
+        Index('ix_notifications_status_next_attempt', 'status', 'next_attempt_at'),
+    )
 
 class NotificationTemplate(Base):
     """Modelo de template de notificação"""
@@ -152,8 +177,9 @@ class NotificationMessage:
     expires_at: Optional[datetime] = None
     template_name: Optional[str] = None
     template_vars: Optional[Dict[str, Any]] = None
+    notification_id: Optional[int] = None  # Registro em notifications, após criado
 
-@dataclass
+@dataclass(frozen=True)
 class EmailConfig:
     """Configuração de email"""
     smtp_server: str
@@ -163,8 +189,9 @@ class EmailConfig:
     use_tls: bool = True
     from_email: str = ""
     from_name: str = "DataClínica"
+    pool_size: Optional[int] = None  # Conexões SMTP reutilizáveis (padrão: SMTP_POOL_SIZE)
 
-@dataclass
+@dataclass(frozen=True)
 class SMSConfig:
     """Configuração de SMS"""
     provider: str  # twilio, aws_sns, etc.
@@ -172,21 +199,53 @@ class SMSConfig:
     api_secret: str
     from_number: str
 
+# Configurações de email e SMS do processo (variáveis de ambiente, ver .env.example),
+# usadas pela API e pelos workers da fila
+EMAIL_CONFIG = EmailConfig(
+    smtp_server=os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+    smtp_port=int(os.getenv("SMTP_PORT", "587")),
+    username=os.getenv("SMTP_USERNAME", "noreply@dataclinica.com"),
+    password=os.getenv("SMTP_PASSWORD", "app_password"),
+    use_tls=os.getenv("SMTP_USE_TLS", "true").lower() == "true",
+    from_email=os.getenv("EMAIL_FROM", "noreply@dataclinica.com"),
+    from_name=os.getenv("EMAIL_FROM_NAME", "DataClínica")
+)
+
+SMS_CONFIG = SMSConfig(
+    provider=os.getenv("SMS_PROVIDER", "twilio"),
+    api_key=os.getenv("SMS_API_KEY", "your_api_key"),
+    api_secret=os.getenv("SMS_API_SECRET", "your_api_secret"),
+    from_number=os.getenv("SMS_FROM_NUMBER", "+1234567890")
+)
+
 class NotificationSystem:
     """Sistema de notificações"""
     
     def __init__(self, db: Session, audit_logger: AuditLogger, 
                  email_config: Optional[EmailConfig] = None,
                  sms_config: Optional[SMSConfig] = None):
-        self.db = db
-        self.audit_logger = audit_logger
+        # Usados fora de uma requisição associada por bind()
+        self._db = db
+        self._audit_logger = audit_logger
         self.email_config = email_config
         self.sms_config = sms_config
         
-        # Filas de notificação por canal
-        self.notification_queues: Dict[NotificationChannel, List[NotificationMessage]] = {
-            channel: [] for channel in NotificationChannel
-        }
+        # Conexões SMTP autenticadas, compartilhadas entre instâncias
+        self.email_transport = smtp_transports.get(
+            email_config.smtp_server,
+            email_config.smtp_port,
+            email_config.username,
+            email_config.password,
+            email_config.use_tls,
+            pool_size=email_config.pool_size
+        ) if email_config else None
+        
+        # Fila persistente (tabela notifications), entregue por NotificationWorkerPool
+        self.outbox = notification_outbox
+        self.workers = notification_workers
+        
+        # Push em tempo real (WebSocket/SSE) para conexões em qualquer processo
+        self.stream = notification_stream
         
         # Handlers para diferentes canais
         self.channel_handlers: Dict[NotificationChannel, Callable] = {
@@ -197,9 +256,8 @@ class NotificationSystem:
             NotificationChannel.WEBHOOK: self._handle_webhook_notification
         }
         
-        # Templates de notificação em memória
-        self.templates: Dict[str, Dict[str, str]] = {}
-        self._load_templates()
+        # Templates compilados, compartilhados pelo processo
+        self.templates = notification_templates
         
         # Subscribers para eventos em tempo real
         self.subscribers: Dict[str, List[Callable]] = {}
@@ -214,17 +272,41 @@ class NotificationSystem:
             'notification_retention_days': 90
         }
     
+    @property
+    def db(self) -> Session:
+        context = _request_context.get()
+        db = context[0] if context else self._db
+        if db is None:
+            raise RuntimeError("NotificationSystem sem sessão: use create_notification_system(db) ou bind(db)")
+        return db
+    
+    @property
+    def audit_logger(self) -> AuditLogger:
+        context = _request_context.get()
+        return context[1] if context else self._audit_logger
+    
+    def bind(self, db: Session, audit_logger: Optional[AuditLogger] = None) -> 'NotificationSystem':
+        """
+        Associa a sessão (e o audit logger, por padrão o do sistema) à
+        requisição ou task atual.
+        """
+        if db is None:
+            raise ValueError("bind() requer uma sessão do banco")
+        _request_context.set((db, audit_logger or self._audit_logger))
+        return self
+    
     async def send_notification(self, notification: NotificationMessage) -> bool:
         """Envia notificação"""
         try:
             # Verificar preferências do usuário
-            if not await self._check_user_preferences(notification):
+            preference = self._get_preference(notification)
+            if not self._check_user_preferences(notification, preference):
                 return False
             
             # Verificar horário silencioso
-            if await self._is_quiet_hours(notification):
+            if self._is_quiet_hours(notification, preference):
                 # Agendar para depois do horário silencioso
-                notification.scheduled_at = await self._calculate_next_send_time(notification)
+                notification.scheduled_at = self._calculate_next_send_time(notification, preference)
             
             # Aplicar template se especificado
             if notification.template_name:
@@ -232,10 +314,12 @@ class NotificationSystem:
             
             # Criar registro no banco
             db_notification = await self._create_notification_record(notification)
+            notification.notification_id = db_notification.id
+            await self.stream.unread_changed([(notification.recipient_id, 1)])
             
             # Enviar imediatamente ou agendar
             if notification.scheduled_at and notification.scheduled_at > datetime.now():
-                await self._schedule_notification(notification)
+                await self._schedule_notification(notification, db_notification)
                 return True
             else:
                 return await self._send_immediate(notification, db_notification)
@@ -254,29 +338,52 @@ class NotificationSystem:
             )
             return False
     
-    async def send_bulk_notifications(self, notifications: List[NotificationMessage]) -> Dict[str, int]:
-        """Envia notificações em lote"""
-        results = {'sent': 0, 'failed': 0, 'scheduled': 0}
+    async def send_bulk_notifications(self, notifications: List[NotificationMessage],
+                                      deliver_inline: bool = True) -> Dict[str, int]:
+        """
+        Envia notificações em lote.
+        
+        As preferências de todos os destinatários são lidas de uma vez, o
+        horário silencioso é avaliado em memória e os registros são gravados
+        com um único INSERT de várias linhas. As notificações vencidas são
+        entregues por canal pelo mesmo caminho dos workers da fila, ou, com
+        deliver_inline=False, deixadas para os workers.
+        """
+        results = {'sent': 0, 'failed': 0, 'scheduled': 0, 'skipped': 0, 'queued': 0}
+        now = datetime.now()
+        preferences = self._load_preferences(notifications)
         
-        # Agrupar por canal para otimização
-        by_channel = {}
+        rows = []
         for notification in notifications:
-            channel = notification.channel
-            if channel not in by_channel:
-                by_channel[channel] = []
-            by_channel[channel].append(notification)
-        
-        # Processar cada canal
-        for channel, channel_notifications in by_channel.items():
-            for notification in channel_notifications:
-                success = await self.send_notification(notification)
-                if success:
-                    if notification.scheduled_at and notification.scheduled_at > datetime.now():
-                        results['scheduled'] += 1
-                    else:
-                        results['sent'] += 1
-                else:
-                    results['failed'] += 1
+            preference = preferences.get(self._preference_key(notification))
+            if not self._check_user_preferences(notification, preference):
+                results['skipped'] += 1
+                continue
+            
+            if self._is_quiet_hours(notification, preference, now):
+                notification.scheduled_at = self._calculate_next_send_time(notification, preference, now)
+            
+            if notification.template_name:
+                await self._apply_template(notification)
+            
+            rows.append(self._notification_row(notification, now))
+            if notification.scheduled_at and notification.scheduled_at > now:
+                results['scheduled'] += 1
+        
+        # Vencidas ficam reservadas para este envio (sem disputa com os workers)
+        due = self.outbox.enqueue_many(
+            self.db, rows, lease_seconds=LEASE_SECONDS if deliver_inline else None, now=now
+        )
+        await self.stream.unread_changed(Counter(row['user_id'] for row in rows if row['user_id']).items())
+        if not deliver_inline:
+            results['queued'] = len(rows) - results['scheduled']
+            return results
+        
+        if due:
+            counts = await self.workers.deliver(self.db, self, due)
+            results['sent'] = counts['sent']
+            results['failed'] = counts['failed']
+            results['queued'] = counts['retried'] + counts['deferred']
         
         return results
     
@@ -430,36 +537,51 @@ class NotificationSystem:
             
             success = await handler(notification)
             
-            # Atualizar status no banco
+            # Atualizar status no banco; falhas voltam à fila com backoff
             if success:
                 db_notification.status = NotificationStatus.SENT
                 db_notification.sent_at = datetime.now()
+                db_notification.locked_until = None
+                self.db.commit()
             else:
-                db_notification.status = NotificationStatus.FAILED
-            
-            self.db.commit()
+                self._retry_later(db_notification, None)
             return success
         
         except Exception as e:
-            db_notification.status = NotificationStatus.FAILED
-            self.db.commit()
+            self._retry_later(db_notification, str(e))
             raise e
     
+    def _retry_later(self, db_notification: Notification, error: Optional[str]):
+        """Reagenda a notificação conforme retry_delay_minutes (ou marca como falha)"""
+        self.outbox.retry(self.db, {
+            'id': db_notification.id,
+            'retry_count': db_notification.retry_count,
+            'max_retries': db_notification.max_retries
+        }, error, self.config['retry_delay_minutes'])
+        self.db.expire(db_notification)
+    
     async def _handle_in_app_notification(self, notification: NotificationMessage) -> bool:
         """Processa notificação in-app"""
         try:
             # Notificação in-app é apenas salvar no banco
             # O frontend buscará as notificações via API
             
-            # Notificar subscribers em tempo real (WebSocket)
-            await self._notify_subscribers('notification', {
+            event = {
+                'id': notification.notification_id,
                 'user_id': notification.recipient_id,
                 'type': notification.notification_type.value,
                 'title': notification.title,
                 'message': notification.message,
                 'priority': notification.priority.value,
+                'data': notification.data,
                 'timestamp': datetime.now().isoformat()
-            })
+            }
+            
+            # Notificar subscribers em tempo real (neste processo)
+            await self._notify_subscribers('notification', event)
+            
+            # Conexões WebSocket/SSE do usuário, em qualquer worker
+            await self.stream.notification_created(notification.recipient_id, event)
             
             return True
         
@@ -475,7 +597,7 @@ class NotificationSystem:
     
     async def _handle_email_notification(self, notification: NotificationMessage) -> bool:
         """Processa notificação por email"""
-        if not self.email_config or not notification.recipient_email:
+        if not self.email_transport or not notification.recipient_email:
             return False
         
         try:
@@ -493,13 +615,8 @@ class NotificationSystem:
             
             msg.attach(MIMEText(body, 'plain', 'utf-8'))
             
-            # Enviar email
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.email_config.smtp_server, self.email_config.smtp_port) as server:
-                if self.email_config.use_tls:
-                    server.starttls(context=context)
-                server.login(self.email_config.username, self.email_config.password)
-                server.send_message(msg)
+            # Enviar email por uma conexão do pool, fora do event loop
+            await self.email_transport.send(msg)
             
             return True
         
@@ -589,16 +706,40 @@ class NotificationSystem:
         except Exception as e:
             return False
     
-    async def _check_user_preferences(self, notification: NotificationMessage) -> bool:
-        """Verifica preferências do usuário"""
+    @staticmethod
+    def _preference_key(notification: NotificationMessage):
+        return (notification.recipient_id, notification.notification_type, notification.channel)
+    
+    def _get_preference(self, notification: NotificationMessage) -> Optional[NotificationPreference]:
+        """Preferência do destinatário para o tipo e canal da notificação"""
         if not notification.recipient_id:
-            return True  # Sem usuário, enviar sempre
+            return None
         
-        preference = self.db.query(NotificationPreference).filter(
+        return self.db.query(NotificationPreference).filter(
             NotificationPreference.user_id == notification.recipient_id,
             NotificationPreference.notification_type == notification.notification_type,
             NotificationPreference.channel == notification.channel
         ).first()
+    
+    def _load_preferences(self, notifications: List[NotificationMessage]) -> Dict[tuple, Any]:
+        """Preferências de todos os destinatários, por (usuário, tipo, canal)"""
+        user_ids = sorted({n.recipient_id for n in notifications if n.recipient_id})
+        table = NotificationPreference.__table__
+        preferences = {}
+        
+        # Um IN por bloco de PREFERENCE_CHUNK_SIZE usuários
+        for start in range(0, len(user_ids), PREFERENCE_CHUNK_SIZE):
+            chunk = user_ids[start:start + PREFERENCE_CHUNK_SIZE]
+            for row in self.db.execute(select(table).where(table.c.user_id.in_(chunk)).order_by(table.c.id)):
+                # Mesma escolha de .first() quando há preferências repetidas
+                preferences.setdefault((row.user_id, row.notification_type, row.channel), row)
+        
+        return preferences
+    
+    def _check_user_preferences(self, notification: NotificationMessage, preference) -> bool:
+        """Verifica preferências do usuário"""
+        if not notification.recipient_id:
+            return True  # Sem usuário, enviar sempre
         
         if preference:
             return preference.enabled
@@ -606,7 +747,8 @@ class NotificationSystem:
         # Se não há preferência definida, usar padrão (habilitado)
         return True
     
-    async def _is_quiet_hours(self, notification: NotificationMessage) -> bool:
+    def _is_quiet_hours(self, notification: NotificationMessage, preference,
+                        now: Optional[datetime] = None) -> bool:
         """Verifica se está em horário silencioso"""
         if notification.priority in [NotificationPriority.URGENT, NotificationPriority.CRITICAL]:
             return False  # Notificações urgentes ignoram horário silencioso
@@ -614,13 +756,6 @@ class NotificationSystem:
         if not notification.recipient_id:
             return False
         
-        # Buscar preferências do usuário
-        preference = self.db.query(NotificationPreference).filter(
-            NotificationPreference.user_id == notification.recipient_id,
-            NotificationPreference.notification_type == notification.notification_type,
-            NotificationPreference.channel == notification.channel
-        ).first()
-        
         if preference and preference.quiet_hours_start and preference.quiet_hours_end:
             quiet_start = preference.quiet_hours_start
             quiet_end = preference.quiet_hours_end
@@ -628,7 +763,7 @@ class NotificationSystem:
             quiet_start, quiet_end = self.config['quiet_hours_default']
         
         # Verificar se hora atual está no período silencioso
-        current_time = datetime.now().strftime('%H:%M')
+        current_time = (now or datetime.now()).strftime('%H:%M')
         
         if quiet_start <= quiet_end:
             # Mesmo dia (ex: 22:00 - 08:00 do dia seguinte)
@@ -637,17 +772,12 @@ class NotificationSystem:
             # Atravessa meia-noite (ex: 22:00 - 08:00)
             return current_time >= quiet_start or current_time <= quiet_end
     
-    async def _calculate_next_send_time(self, notification: NotificationMessage) -> datetime:
+    def _calculate_next_send_time(self, notification: NotificationMessage, preference,
+                                  now: Optional[datetime] = None) -> datetime:
         """Calcula próximo horário de envio após horário silencioso"""
+        now = now or datetime.now()
         if not notification.recipient_id:
-            return datetime.now()
-        
-        # Buscar preferências do usuário
-        preference = self.db.query(NotificationPreference).filter(
-            NotificationPreference.user_id == notification.recipient_id,
-            NotificationPreference.notification_type == notification.notification_type,
-            NotificationPreference.channel == notification.channel
-        ).first()
+            return now
         
         if preference and preference.quiet_hours_end:
             quiet_end = preference.quiet_hours_end
@@ -655,7 +785,6 @@ class NotificationSystem:
             quiet_end = self.config['quiet_hours_default'][1]
         
         # Calcular próximo horário após o fim do período silencioso
-        now = datetime.now()
         end_hour, end_minute = map(int, quiet_end.split(':'))
         
         next_send = now.replace(hour=end_hour, minute=end_minute, second=0, microsecond=0)
@@ -670,14 +799,13 @@ class NotificationSystem:
         if not notification.template_name or not notification.template_vars:
             return
         
-        template = self.templates.get(notification.template_name)
+        template = self.templates.get(self.db, notification.template_name)
         if not template:
             return
         
         try:
-            # Aplicar variáveis ao template
-            notification.title = template['subject'].format(**notification.template_vars)
-            notification.message = template['body'].format(**notification.template_vars)
+            # Aplicar variáveis ao template compilado
+            notification.title, notification.message = template.render(notification.template_vars)
         
         except KeyError as e:
             await self.audit_logger.log_event(
@@ -691,20 +819,33 @@ class NotificationSystem:
                 }
             )
     
+    def _notification_row(self, notification: NotificationMessage, now: datetime) -> Dict[str, Any]:
+        """Colunas do registro de uma notificação"""
+        scheduled = notification.scheduled_at is not None and notification.scheduled_at > now
+        return {
+            'user_id': notification.recipient_id,
+            'recipient_email': notification.recipient_email,
+            'recipient_phone': notification.recipient_phone,
+            'notification_type': notification.notification_type,
+            'channel': notification.channel,
+            'priority': notification.priority,
+            'title': notification.title,
+            'message': notification.message,
+            'data': json.dumps(notification.data) if notification.data else None,
+            'scheduled_at': notification.scheduled_at,
+            'expires_at': notification.expires_at,
+            'max_retries': self.config['max_retries'],
+            'next_attempt_at': notification.scheduled_at if scheduled else now
+        }
+    
     async def _create_notification_record(self, notification: NotificationMessage) -> Notification:
         """Cria registro de notificação no banco"""
+        now = datetime.now()
+        row = self._notification_row(notification, now)
         db_notification = Notification(
-            user_id=notification.recipient_id,
-            recipient_email=notification.recipient_email,
-            recipient_phone=notification.recipient_phone,
-            notification_type=notification.notification_type,
-            channel=notification.channel,
-            priority=notification.priority,
-            title=notification.title,
-            message=notification.message,
-            data=json.dumps(notification.data) if notification.data else None,
-            scheduled_at=notification.scheduled_at,
-            expires_at=notification.expires_at
+            **row,
+            # Envio imediato: a reserva impede que um worker entregue em paralelo
+            locked_until=None if row['next_attempt_at'] > now else now + timedelta(seconds=LEASE_SECONDS)
         )
         
         self.db.add(db_notification)
@@ -713,11 +854,9 @@ class NotificationSystem:
         
         return db_notification
     
-    async def _schedule_notification(self, notification: NotificationMessage):
-        """Agenda notificação para envio posterior"""
-        # Adicionar à fila de agendamento
-        # Em uma implementação real, usaria Celery, RQ ou similar
-        pass
+    async def _schedule_notification(self, notification: NotificationMessage, db_notification: Notification):
+        """Agenda notificação para envio posterior pelos workers da fila"""
+        self.outbox.schedule(self.db, db_notification.id, notification.scheduled_at)
     
     async def _notify_subscribers(self, event_type: str, data: Dict[str, Any]):
         """Notifica subscribers de eventos em tempo real"""
@@ -734,51 +873,6 @@ class NotificationSystem:
                     {'event_type': event_type, 'error': str(e)}
                 )
     
-    def _load_templates(self):
-        """Carrega templates de notificação"""
-        # Templates padrão
-        self.templates = {
-            'appointment_reminder': {
-                'subject': 'Lembrete de Consulta - {appointment_date}',
-                'body': '''Olá {patient_name},
-
-Este é um lembrete de sua consulta agendada:
-
-Data: {appointment_date}
-Horário: {appointment_time}
-Médico: {doctor_name}
-
-Por favor, chegue com 15 minutos de antecedência.
-
-Atenciosamente,
-Equipe DataClínica'''
-            },
-            'password_expiry': {
-                'subject': 'Sua senha expira em breve',
-                'body': '''Olá {user_name},
-
-Sua senha expirará em {days_until_expiry} dias.
-
-Por favor, altere sua senha antes do vencimento para evitar interrupções no acesso.
-
-Atenciosamente,
-Equipe DataClínica'''
-            },
-            'security_alert': {
-                'subject': 'Alerta de Segurança - {alert_type}',
-                'body': '''Olá {user_name},
-
-Detectamos atividade suspeita em sua conta:
-
-{alert_description}
-
-Se você não reconhece esta atividade, altere sua senha imediatamente e entre em contato conosco.
-
-Atenciosamente,
-Equipe de Segurança DataClínica'''
-            }
-        }
-    
     def subscribe(self, event_type: str, callback: Callable):
         """Inscreve callback para eventos"""
         if event_type not in self.subscribers:
@@ -806,6 +900,13 @@ Equipe de Segurança DataClínica'''
         
         return query.all()
     
+    async def get_unread_count(self, user_id: int) -> int:
+        """Contagem de notificações não lidas do usuário"""
+        return self.db.query(func.count(Notification.id)).filter(
+            Notification.user_id == user_id,
+            Notification.read_at.is_(None)
+        ).scalar()
+    
     async def mark_notification_read(self, notification_id: int, user_id: int) -> bool:
         """Marca notificação como lida"""
         notification = self.db.query(Notification).filter(
@@ -814,9 +915,12 @@ Equipe de Segurança DataClínica'''
         ).first()
         
         if notification:
+            was_unread = notification.read_at is None
             notification.read_at = datetime.now()
             notification.status = NotificationStatus.READ
             self.db.commit()
+            if was_unread:
+                await self.stream.unread_changed([(user_id, -1)])
             return True
         
         return False
@@ -832,6 +936,7 @@ Equipe de Segurança DataClínica'''
         })
         
         self.db.commit()
+        await self.stream.unread_changed([(user_id, -count)])
         return count
     
     async def delete_notification(self, notification_id: int, user_id: int) -> bool:
@@ -842,8 +947,11 @@ Equipe de Segurança DataClínica'''
         ).first()
         
         if notification:
+            was_unread = notification.read_at is None
             self.db.delete(notification)
             self.db.commit()
+            if was_unread:
+                await self.stream.unread_changed([(user_id, -1)])
             return True
         
         return False
@@ -855,11 +963,19 @@ Equipe de Segurança DataClínica'''
         
         cutoff_date = datetime.now() - timedelta(days=days)
         
+        # Não lidas removidas, por usuário, para os contadores em tempo real
+        unread_removed = self.db.query(Notification.user_id, func.count(Notification.id)).filter(
+            Notification.created_at < cutoff_date,
+            Notification.user_id.isnot(None),
+            Notification.read_at.is_(None)
+        ).group_by(Notification.user_id).all()
+        
         count = self.db.query(Notification).filter(
             Notification.created_at < cutoff_date
         ).delete()
         
         self.db.commit()
+        await self.stream.unread_changed((user_id, -removed) for user_id, removed in unread_removed)
         return count
     
     async def get_notification_statistics(self, user_id: Optional[int] = None, 
@@ -919,8 +1035,18 @@ Equipe de Segurança DataClínica'''
         return stats
 
 # Função utilitária para criar instância do sistema
-def create_notification_system(db: Session, audit_logger: AuditLogger,
-                             email_config: Optional[EmailConfig] = None,
-                             sms_config: Optional[SMSConfig] = None) -> NotificationSystem:
-    """Cria instância do sistema de notificações"""
-    return NotificationSystem(db, audit_logger, email_config, sms_config)
\ No newline at end of file
+# Sistemas compartilhados pelo processo, por configuração de email e SMS
+_shared_system: Optional[NotificationSystem] = None
+_shared_system_lock = threading.Lock()
+
+def create_notification_system(db: Session, audit_logger: Optional[AuditLogger] = None) -> NotificationSystem:
+    """
+    Obtém o sistema de notificações do processo (criado uma única vez, com
+    EMAIL_CONFIG e SMS_CONFIG) associado à sessão da requisição atual.
+    """
+    global _shared_system
+    if _shared_system is None:
+        with _shared_system_lock:
+            if _shared_system is None:
+                _shared_system = NotificationSystem(None, AuditLogger(), EMAIL_CONFIG, SMS_CONFIG)
+    return _shared_system.bind(db, audit_logger)
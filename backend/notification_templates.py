@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Templates de Notificação Compilados
+
+Os templates eram recriados em cada NotificationSystem e formatados a cada
+envio, e os cadastrados pela API (notification_templates) não eram usados.
+Este módulo mantém os templates compilados uma vez por processo:
+- Compilação com string.Formatter.parse: sintaxe validada e variáveis
+  obrigatórias conhecidas antes da renderização
+- Templates padrão mais as linhas ativas de NotificationTemplate (as do
+  banco prevalecem), em cache com versão (quantidade e maior updated_at)
+  verificada a cada NOTIFICATION_TEMPLATE_CHECK_SECONDS e invalidação
+  explícita nas gravações da API
+"""
+
+import os
+import time
+import logging
+import threading
+from string import Formatter
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_formatter = Formatter()
+
+# Templates padrão (sintaxe de str.format)
+DEFAULT_TEMPLATES = {
+    'appointment_reminder': {
+        'subject': 'Lembrete de Consulta - {appointment_date}',
+        'body': '''Olá {patient_name},
+
+Este é um lembrete de sua consulta agendada:
+
+Data: {appointment_date}
+Horário: {appointment_time}
+Médico: {doctor_name}
+
+Por favor, chegue com 15 minutos de antecedência.
+
+Atenciosamente,
+Equipe DataClínica'''
+    },
+    'password_expiry': {
+        'subject': 'Sua senha expira em breve',
+        'body': '''Olá {user_name},
+
+Sua senha expirará em {days_until_expiry} dias.
+
+Por favor, altere sua senha antes do vencimento para evitar interrupções no acesso.
+
+Atenciosamente,
+Equipe DataClínica'''
+    },
+    'security_alert': {
+        'subject': 'Alerta de Segurança - {alert_type}',
+        'body': '''Olá {user_name},
+
+Detectamos atividade suspeita em sua conta:
+
+{alert_description}
+
+Se você não reconhece esta atividade, altere sua senha imediatamente e entre em contato conosco.
+
+Atenciosamente,
+Equipe de Segurança DataClínica'''
+    }
+}
+
+class CompiledTemplate:
+    """
+    Template no formato de str.format, analisado uma única vez: sintaxe
+    validada e variáveis obrigatórias conhecidas. A renderização fica com o
+    format_map nativo (mais rápido que recompor as partes em Python).
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.fields = frozenset(
+            _root_field(field_name)
+            for _, field_name, _, _ in _formatter.parse(source)
+            if field_name is not None
+        )
+
+    def render(self, variables: Mapping[str, Any]) -> str:
+        """Texto com as variáveis aplicadas; KeyError se faltar alguma"""
+        missing = self.fields.difference(variables)
+        if missing:
+            raise KeyError(min(missing))
+        return self.source.format_map(variables)
+
+class CompiledNotificationTemplate:
+    """Assunto e corpo compilados de um template de notificação"""
+
+    def __init__(self, name: str, subject: str, body: str):
+        self.name = name
+        self.subject = CompiledTemplate(subject)
+        self.body = CompiledTemplate(body)
+
+    def render(self, variables: Mapping[str, Any]) -> Tuple[str, str]:
+        """(título, mensagem); KeyError se faltar alguma variável"""
+        return self.subject.render(variables), self.body.render(variables)
+
+def _root_field(field_name: str) -> str:
+    """Nome da variável de um campo (ex.: "patient.name" -> "patient", "items[0]" -> "items")"""
+    for index, char in enumerate(field_name):
+        if char in '.[':
+            return field_name[:index]
+    return field_name
+
+class NotificationTemplateCache:
+    """
+    Templates compilados compartilhados pelo processo. Os do banco são
+    recompilados somente quando a tabela muda.
+    """
+
+    def __init__(self, defaults: Dict[str, Dict[str, str]] = None, check_seconds: float = None):
+        self.check_seconds = check_seconds if check_seconds is not None else float(
+            os.getenv("NOTIFICATION_TEMPLATE_CHECK_SECONDS", "60")
+        )
+        self.defaults = {
+            name: CompiledNotificationTemplate(name, template['subject'], template['body'])
+            for name, template in (defaults if defaults is not None else DEFAULT_TEMPLATES).items()
+        }
+        self._templates: Dict[str, CompiledNotificationTemplate] = dict(self.defaults)
+        self._version: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.loads = 0
+
+    def get(self, db, name: str) -> Optional[CompiledNotificationTemplate]:
+        """Template compilado `name` (do banco, se cadastrado e ativo, ou padrão)"""
+        return self.templates(db).get(name)
+
+    def templates(self, db) -> Dict[str, CompiledNotificationTemplate]:
+        if db is None or time.monotonic() - self._checked_at < self.check_seconds:
+            return self._templates
+
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return self._templates
+            try:
+                version = self._fetch_version(db)
+                if version != self._version:
+                    self._templates = self._load(db)
+                    self._version = version
+                    self.loads += 1
+            except Exception as e:
+                logger.warning(f"Templates de notificação do banco indisponíveis, usando os carregados: {e}")
+                db.rollback()
+            self._checked_at = time.monotonic()
+            return self._templates
+
+    def invalidate(self):
+        """Força a verificação da versão na próxima consulta (ex.: após gravar um template)"""
+        with self._lock:
+            self._checked_at = 0.0
+            self._version = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'templates': len(self._templates),
+            'database_templates': sum(
+                1 for name, template in self._templates.items() if self.defaults.get(name) is not template
+            ),
+            'loads': self.loads
+        }
+
+    def _fetch_version(self, db) -> Tuple:
+        from sqlalchemy import func, select
+        table = self._table()
+        return tuple(db.execute(select(func.count(), func.max(table.c.updated_at)).select_from(table)).one())
+
+    def _load(self, db) -> Dict[str, CompiledNotificationTemplate]:
+        from sqlalchemy import select
+        table = self._table()
+        templates = dict(self.defaults)
+        rows = db.execute(
+            select(table.c.name, table.c.subject_template, table.c.body_template).where(table.c.is_active == True)
+        )
+        for row in rows:
+            try:
+                templates[row.name] = CompiledNotificationTemplate(row.name, row.subject_template, row.body_template)
+            except ValueError as e:
+                logger.error(f"Template de notificação {row.name} inválido: {e}")
+        return templates
+
+    @staticmethod
+    def _table():
+        from .notification_system import NotificationTemplate
+        return NotificationTemplate.__table__
+
+# Instância global
+notification_templates = NotificationTemplateCache()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Paginação por Cursor (keyset)
+
+Listagens paginadas por OFFSET custam O(offset): o banco lê e descarta todas
+as linhas anteriores à página. Este módulo pagina pela posição do último item
+((chave de ordenação, id)), com custo constante por página quando há índice
+sobre a ordenação:
+- Cursores opacos (base64 de JSON tipado), devolvidos como next_cursor
+- SQLAlchemy (paginate) e Supabase/PostgREST (supabase_paginate)
+- Total opcional: estimativa do planejador no PostgreSQL (contagem exata
+  abaixo de PAGINATION_EXACT_COUNT_THRESHOLD), contagem exata nos demais bancos
+
+Os parâmetros skip/limit das listagens continuam aceitos.
+"""
+
+import os
+import json
+import base64
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXACT_COUNT_THRESHOLD = int(os.getenv("PAGINATION_EXACT_COUNT_THRESHOLD", "10000"))
+
+@dataclass
+class Page:
+    """Página de resultados de uma listagem por cursor"""
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)}
+    return value
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'dec' in value:
+            return Decimal(value['dec'])
+    return value
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Cursor opaco com os valores de ordenação do último item"""
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode('ascii')
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Valores codificados por encode_cursor; ValueError se o cursor for inválido"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(values, list):
+            raise ValueError
+        return [_decode_value(value) for value in values]
+    except Exception:
+        raise ValueError("Cursor de paginação inválido")
+
+def paginate(query, order_column, id_column, limit: int = 100, cursor: Optional[str] = None,
+             descending: bool = False, with_total: bool = False) -> Page:
+    """
+    Página de `query` ordenada por (order_column, id_column).
+
+    `order_column` deve ser não nulo (ex.: created_at com default); use o
+    próprio id_column para ordenar apenas pelo id.
+    """
+    from sqlalchemy import tuple_
+
+    columns = [id_column] if order_column is id_column else [order_column, id_column]
+
+    total, is_estimate = (None, False)
+    if with_total:
+        total, is_estimate = estimate_count(query)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(columns):
+            raise ValueError("Cursor de paginação inválido")
+        position = tuple_(*columns) if len(columns) > 1 else columns[0]
+        after = tuple_(*values) if len(columns) > 1 else values[0]
+        query = query.filter(position < after if descending else position > after)
+
+    query = query.order_by(*(column.desc() if descending else column.asc() for column in columns))
+    rows = query.limit(limit + 1).all()
+
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return Page(items=items, next_cursor=next_cursor, total=total, total_is_estimate=is_estimate)
+
+def estimate_count(query) -> Tuple[int, bool]:
+    """
+    Total de linhas de `query`: (total, é_estimativa). No PostgreSQL usa a
+    estimativa do planejador e só conta quando ela é pequena.
+    """
+    from sqlalchemy import text
+
+    session = query.session
+    if session.get_bind().dialect.name == 'postgresql':
+        try:
+            statement = query.order_by(None).statement.compile(
+                dialect=session.get_bind().dialect, compile_kwargs={'literal_binds': True}
+            )
+            plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > EXACT_COUNT_THRESHOLD:
+                return estimate, True
+        except Exception as e:
+            logger.warning(f"Estimativa de contagem indisponível: {e}")
+    return query.order_by(None).count(), False
+
+def supabase_paginate(query, order_field: str, limit: int = 100, cursor: Optional[str] = None,
+                      descending: bool = False, id_field: str = 'id') -> Page:
+    """
+    Equivalente a paginate para consultas do Supabase. Para o total, a
+    consulta deve ser criada com select('*', count='estimated').
+    """
+    fields = [id_field] if order_field == id_field else [order_field, id_field]
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(fields):
+            raise ValueError("Cursor de paginação inválido")
+        operator = 'lt' if descending else 'gt'
+        if len(fields) == 1:
+            query = query.filter(id_field, operator, values[0])
+        else:
+            order_value, id_value = (_supabase_value(value) for value in values)
+            query = query.or_(
+                f"{order_field}.{operator}.{order_value},"
+                f"and({order_field}.eq.{order_value},{id_field}.{operator}.{id_value})"
+            )
+
+    for name in fields:
+        query = query.order(name, desc=descending)
+    response = query.limit(limit + 1).execute()
+
+    rows = response.data or []
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([items[-1][name] for name in fields])
+    total = getattr(response, 'count', None)
+    return Page(items=items, next_cursor=next_cursor, total=total, total_is_estimate=total is not None)
+
+def _supabase_value(value: Any) -> str:
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    value = str(value)
+    # Valores com vírgulas, parênteses ou pontos entre aspas (sintaxe do PostgREST)
+    if any(char in value for char in ',().:'):
+        return '"' + value.replace('"', '\\"') + '"'
+    return value
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Busca de Pacientes
+
+Documentos (blind index): CPF, RG e telefone são gravados criptografados; a
+busca usa hashes HMAC (FieldEncryption/DataEncryption.hash_for_search) em
+colunas indexadas:
+- <campo>_hash em patients: busca exata (uma consulta ao índice)
+- patient_search_tokens: hashes dos prefixos normalizados, para busca parcial
+  pelo início do valor (ex.: primeiros dígitos do CPF)
+
+Nome (PatientNameSearch): busca sem acentos e sem caixa, ordenada por
+relevância e paginada por cursor (keyset), sempre restrita à clínica:
+- PostgreSQL: índice GIN de trigramas (pg_trgm) sobre
+  immutable_unaccent(lower(name)) (full_name no Supabase), ordenação por
+  word_similarity
+- SQLite: tabela FTS5 patients_name_fts (desenvolvimento e testes locais)
+- Demais bancos: ILIKE
+
+Termos só com dígitos (CPF, RG, telefone) são resolvidos apenas pelos índices
+de documentos; os demais também procuram no nome.
+"""
+
+import base64
+import logging
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from encryption import field_encryption, DataEncryption, FieldEncryption
+
+logger = logging.getLogger(__name__)
+
+# Colunas da tabela patients do Supabase com nome diferente do modelo
+# (os hashes mantêm o nome do campo: rg_number_hash)
+SUPABASE_PATIENT_COLUMNS = {'rg_number': 'rg'}
+
+def to_supabase_patient(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Dados de paciente (campos do modelo) com os nomes de coluna do Supabase"""
+    return {SUPABASE_PATIENT_COLUMNS.get(key, key): value for key, value in data.items()}
+
+def from_supabase_patient(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Linha de patients do Supabase com os nomes de campo do modelo"""
+    columns = {column: field for field, column in SUPABASE_PATIENT_COLUMNS.items()}
+    return {columns.get(key, key): value for key, value in row.items()}
+
+def is_document_term(term: str) -> bool:
+    """Termo de busca formado apenas por dígitos (após remover a formatação)"""
+    clean_term = DataEncryption.normalize_for_search(term)
+    return bool(clean_term) and clean_term.isdigit()
+
+def build_search_tokens(values: Dict[str, Any], clinic_id=None, fields: Optional[Iterable[str]] = None) -> list:
+    """Tokens de prefixo (PatientSearchToken) dos campos pesquisáveis em `values`"""
+    from models import PatientSearchToken
+
+    if fields is not None:
+        values = {field: values.get(field) for field in fields}
+    return [
+        PatientSearchToken(clinic_id=clinic_id, field=field, token_hash=token_hash)
+        for field, token_hash in field_encryption.search_tokens(values)
+    ]
+
+def sync_search_tokens(patient, values: Dict[str, Any]):
+    """
+    Atualiza os tokens de prefixo dos campos pesquisáveis presentes em
+    `values` (valores ainda não criptografados).
+    """
+    fields = FieldEncryption.SEARCHABLE_FIELDS.intersection(values)
+    if not fields:
+        return
+    kept = [token for token in patient.search_tokens if token.field not in fields]
+    patient.search_tokens = kept + build_search_tokens(values, patient.clinic_id, fields)
+
+def blind_index_filter(term: str):
+    """Condição SQLAlchemy que encontra pacientes pelos hashes de CPF, RG ou telefone"""
+    from sqlalchemy import or_, select
+    from models import Patient, PatientSearchToken
+
+    encryption = field_encryption.encryption
+    exact_hash = encryption.hash_for_search(term)
+    if not exact_hash:
+        return None
+
+    conditions = [
+        Patient.cpf_hash == exact_hash,
+        Patient.rg_number_hash == exact_hash,
+        Patient.phone_hash == exact_hash
+    ]
+    prefix_hash = encryption.prefix_hash_for_search(term)
+    if prefix_hash:
+        conditions.append(Patient.id.in_(
+            select(PatientSearchToken.patient_id).where(PatientSearchToken.token_hash == prefix_hash)
+        ))
+    return or_(*conditions)
+
+def supabase_blind_index_filter(client, clinic_id, term: str) -> Optional[str]:
+    """
+    Filtro PostgREST (para `.or_()`) equivalente a blind_index_filter.
+    A busca parcial consulta patient_search_tokens antes.
+    """
+    encryption = field_encryption.encryption
+    exact_hash = encryption.hash_for_search(term)
+    if not exact_hash:
+        return None
+
+    conditions = [f"{field}_hash.eq.{exact_hash}" for field in sorted(FieldEncryption.SEARCHABLE_FIELDS)]
+    prefix_hash = encryption.prefix_hash_for_search(term)
+    if prefix_hash:
+        result = client.table('patient_search_tokens').select('patient_id').eq(
+            'clinic_id', clinic_id
+        ).eq('token_hash', prefix_hash).execute()
+        patient_ids = sorted({row['patient_id'] for row in result.data or []})
+        if patient_ids:
+            conditions.append(f"id.in.({','.join(str(patient_id) for patient_id in patient_ids)})")
+    return ','.join(conditions)
+
+def supabase_sync_search_tokens(client, patient_id, clinic_id, values: Dict[str, Any]):
+    """Atualiza os tokens de prefixo de um paciente no Supabase"""
+    fields = sorted(FieldEncryption.SEARCHABLE_FIELDS.intersection(values))
+    if not fields:
+        return
+    client.table('patient_search_tokens').delete().eq('patient_id', patient_id).in_('field', fields).execute()
+    tokens = [
+        {'patient_id': patient_id, 'clinic_id': clinic_id, 'field': field, 'token_hash': token_hash}
+        for field, token_hash in field_encryption.search_tokens({field: values.get(field) for field in fields})
+    ]
+    if tokens:
+        client.table('patient_search_tokens').insert(tokens).execute()
+
+def backfill(db, batch_size: int = 500) -> int:
+    """
+    Preenche os hashes e os tokens de prefixo dos pacientes existentes
+    (valores criptografados ou ainda em texto puro).
+
+    Returns:
+        Número de pacientes processados
+    """
+    from sqlalchemy import delete, insert, select, update
+    from models import Patient, PatientSearchToken
+
+    patients = Patient.__table__
+    search_tokens = PatientSearchToken.__table__
+    encryption = field_encryption.encryption
+    fields = sorted(FieldEncryption.SEARCHABLE_FIELDS)
+
+    processed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(patients.c.id, patients.c.clinic_id, *(patients.c[field] for field in fields))
+            .where(patients.c.id > last_id)
+            .order_by(patients.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        tokens: List[Dict[str, Any]] = []
+        for patient_id, clinic_id, *stored in rows:
+            values = {
+                field: encryption.decrypt_string(value) if value and encryption.is_encrypted(value) else value
+                for field, value in zip(fields, stored)
+            }
+            db.execute(update(patients).where(patients.c.id == patient_id).values({
+                f"{field}_hash": encryption.hash_for_search(value) if value else None
+                for field, value in values.items()
+            }))
+            tokens.extend(
+                {'patient_id': patient_id, 'clinic_id': clinic_id, 'field': field, 'token_hash': token_hash}
+                for field, token_hash in field_encryption.search_tokens(values)
+            )
+
+        ids = [row[0] for row in rows]
+        db.execute(delete(search_tokens).where(search_tokens.c.patient_id.in_(ids)))
+        if tokens:
+            db.execute(insert(search_tokens), tokens)
+        db.commit()
+
+        processed += len(rows)
+        last_id = ids[-1]
+
+    logger.info(f"Blind index preenchido para {processed} pacientes")
+    return processed
+
+def supabase_backfill(client, batch_size: int = 500) -> int:
+    """Equivalente a backfill para a tabela patients do Supabase"""
+    encryption = field_encryption.encryption
+    fields = sorted(FieldEncryption.SEARCHABLE_FIELDS)
+
+    processed = 0
+    last_id = 0
+    while True:
+        columns = [SUPABASE_PATIENT_COLUMNS.get(field, field) for field in fields]
+        rows = client.table('patients').select(','.join(['id', 'clinic_id'] + columns)).gt(
+            'id', last_id
+        ).order('id').limit(batch_size).execute().data or []
+        if not rows:
+            break
+
+        for row in map(from_supabase_patient, rows):
+            values = {
+                field: encryption.decrypt_string(row[field]) if row[field] and encryption.is_encrypted(row[field]) else row[field]
+                for field in fields
+            }
+            client.table('patients').update({
+                f"{field}_hash": encryption.hash_for_search(value) if value else None
+                for field, value in values.items()
+            }).eq('id', row['id']).execute()
+            supabase_sync_search_tokens(client, row['id'], row['clinic_id'], values)
+
+        processed += len(rows)
+        last_id = rows[-1]['id']
+
+    logger.info(f"Blind index do Supabase preenchido para {processed} pacientes")
+    return processed
+
+# ============================================================================
+# BUSCA POR NOME
+# ============================================================================
+
+SQLITE_FTS_TABLE = "patients_name_fts"
+
+def normalize_name(term: str) -> str:
+    """Remove acentos, caixa e espaços repetidos"""
+    decomposed = unicodedata.normalize('NFKD', term or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.lower().split())
+
+def encode_cursor(score: float, patient_id: int) -> str:
+    """Cursor opaco da posição (relevância, id) do último resultado"""
+    return base64.urlsafe_b64encode(f"{score!r}:{patient_id}".encode()).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """Posição codificada por encode_cursor; ValueError se o cursor for inválido"""
+    try:
+        score, _, patient_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode().partition(':')
+        return float(score), int(patient_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido")
+
+@dataclass
+class PatientSearchPage:
+    """Página de resultados da busca de pacientes"""
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _fts_query(term: str) -> str:
+    """Consulta FTS5: todas as palavras, cada uma como prefixo"""
+    return ' '.join(f'"{word}"*' for word in term.replace('"', ' ').split())
+
+class PatientNameSearch:
+    """Busca de pacientes por nome com ranking e paginação por cursor"""
+
+    def __init__(self):
+        self._sqlite_ready = set()
+
+    def search(self, db, clinic_id, term: str, limit: int = 20, cursor: Optional[str] = None) -> PatientSearchPage:
+        """
+        Pacientes da clínica cujo nome corresponde a `term`, do mais para o
+        menos relevante. `cursor` é o next_cursor da página anterior.
+        """
+        from models import Patient
+
+        ranked = self.search_ids(db, clinic_id, term, limit + 1, cursor)
+        page, has_more = ranked[:limit], len(ranked) > limit
+        if not page:
+            return PatientSearchPage()
+
+        patients = {
+            patient.id: patient
+            for patient in db.query(Patient).filter(Patient.id.in_([patient_id for patient_id, _ in page]))
+        }
+        return PatientSearchPage(
+            items=[patients[patient_id] for patient_id, _ in page if patient_id in patients],
+            next_cursor=encode_cursor(page[-1][1], page[-1][0]) if has_more else None
+        )
+
+    def search_ids(self, db, clinic_id, term: str, limit: int, cursor: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Pares (id, relevância) ordenados por relevância decrescente e id"""
+        from sqlalchemy import text
+
+        term = normalize_name(term)
+        if not term:
+            return []
+
+        after_score, after_id = decode_cursor(cursor) if cursor else (None, None)
+        params = {
+            'clinic_id': clinic_id,
+            'term': term,
+            'pattern': _like_pattern(term),
+            'after_score': after_score,
+            'after_id': after_id,
+            'limit': limit
+        }
+
+        dialect = db.get_bind().dialect.name
+        if dialect == 'postgresql':
+            matches = """
+                SELECT id, word_similarity(:term, immutable_unaccent(lower(name))) AS score
+                FROM patients
+                WHERE (:term <% immutable_unaccent(lower(name))
+                       OR immutable_unaccent(lower(name)) LIKE :pattern)
+            """
+        elif dialect == 'sqlite':
+            self._ensure_sqlite_fts(db)
+            params['query'] = _fts_query(term)
+            matches = f"""
+                SELECT p.id AS id, -bm25({SQLITE_FTS_TABLE}) AS score, p.clinic_id AS clinic_id
+                FROM {SQLITE_FTS_TABLE} JOIN patients p ON p.id = {SQLITE_FTS_TABLE}.rowid
+                WHERE {SQLITE_FTS_TABLE} MATCH :query
+            """
+        else:
+            matches = """
+                SELECT id, 0.0 AS score
+                FROM patients
+                WHERE lower(name) LIKE :pattern
+            """
+
+        if clinic_id is not None:
+            matches += " AND clinic_id = :clinic_id"
+        keyset = ""
+        if after_id is not None:
+            keyset = "WHERE score < :after_score OR (score = :after_score AND id > :after_id)"
+
+        rows = db.execute(text(f"""
+            SELECT id, score FROM ({matches}) AS matches
+            {keyset}
+            ORDER BY score DESC, id
+            LIMIT :limit
+        """), params).all()
+        return [(row[0], float(row[1])) for row in rows]
+
+    def name_condition(self, db, term: str):
+        """Condição SQLAlchemy (sem ranking) que usa o mesmo índice da busca"""
+        from sqlalchemy import func, select, text
+        from models import Patient
+
+        term = normalize_name(term)
+        dialect = db.get_bind().dialect.name
+        if dialect == 'postgresql':
+            return func.immutable_unaccent(func.lower(Patient.name)).like(_like_pattern(term))
+        if dialect == 'sqlite':
+            self._ensure_sqlite_fts(db)
+            return Patient.id.in_(
+                select(text('rowid')).select_from(text(SQLITE_FTS_TABLE)).where(
+                    text(f"{SQLITE_FTS_TABLE} MATCH :query")
+                ).params(query=_fts_query(term))
+            )
+        return Patient.name.ilike(f"%{term}%")
+
+    def _ensure_sqlite_fts(self, db):
+        """Cria (uma vez por banco) a tabela FTS5 e os gatilhos de sincronização"""
+        from sqlalchemy import text
+
+        bind = db.get_bind()
+        key = str(bind.url)
+        if key in self._sqlite_ready:
+            return
+
+        exists = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': SQLITE_FTS_TABLE}
+        ).first()
+        if not exists:
+            for statement in sqlite_fts_statements():
+                db.execute(text(statement))
+            db.commit()
+        self._sqlite_ready.add(key)
+
+def sqlite_fts_statements() -> List[str]:
+    """DDL da tabela FTS5 de nomes (sem acentos) e dos gatilhos que a mantêm"""
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+            name, content='patients', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS patients_name_fts_ai AFTER INSERT ON patients BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS patients_name_fts_ad AFTER DELETE ON patients BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS patients_name_fts_au AFTER UPDATE OF name ON patients BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+        END""",
+        f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')"
+    ]
+
+def supabase_search_by_name(client, clinic_id, term: str, limit: int = 20, cursor: Optional[str] = None) -> List[Tuple[int, float]]:
+    """Equivalente a PatientNameSearch.search_ids via RPC search_patients_by_name"""
+    term = normalize_name(term)
+    if not term:
+        return []
+    after_score, after_id = decode_cursor(cursor) if cursor else (None, None)
+    result = client.rpc('search_patients_by_name', {
+        'p_clinic_id': clinic_id,
+        'p_term': term,
+        'p_limit': limit,
+        'p_after_score': after_score,
+        'p_after_id': after_id
+    }).execute()
+    return [(row['id'], float(row['score'])) for row in result.data or []]
+
+# Instância global
+patient_name_search = PatientNameSearch()
+
+if __name__ == "__main__":
+    # Preenche o blind index dos pacientes existentes (após a migração 013,
+    # com ENCRYPTION_KEY): python patient_search.py
+    logging.basicConfig(level=logging.INFO)
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Pacientes processados: {backfill(session)}")
+    finally:
+        session.close()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Relatórios de Estoque da Farmácia
+
+Este módulo monta os relatórios de estoque com contagens, filtros de data e
+de estoque baixo executados no banco, sem carregar as tabelas para contar ou
+filtrar em Python:
+- Resumo do estoque: totais em uma consulta agregada, listas de estoque
+  baixo e de lotes a vencer limitadas a `limit` itens
+- Histórico de movimentações filtrado por período no banco
+- Snapshot materializado por clínica (pharmacy_stock_snapshots), mantido
+  pelas gravações de produtos e movimentações; no Supabase, por trigger
+  na tabela products
+"""
+
+import os
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPIRING_DAYS = int(os.getenv("PHARMACY_EXPIRING_DAYS", "30"))
+
+def _number(value: Any) -> Any:
+    """Numeric do banco para JSON"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _iso(value: Any) -> Optional[str]:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+@dataclass
+class StockSummary:
+    """Resumo do estoque de uma clínica"""
+    total_products: int = 0
+    low_stock_count: int = 0
+    expiring_batches_count: int = 0
+    low_stock_products: List[Dict[str, Any]] = field(default_factory=list)
+    expiring_batches: List[Dict[str, Any]] = field(default_factory=list)
+    snapshot_at: Optional[datetime] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_products': self.total_products,
+            'low_stock_count': self.low_stock_count,
+            'low_stock_products': [
+                {
+                    'id': row['id'],
+                    'name': row['name'],
+                    'current_stock': _number(row['current_stock']),
+                    'minimum_stock': _number(row['minimum_stock'])
+                }
+                for row in self.low_stock_products
+            ],
+            'expiring_batches_count': self.expiring_batches_count,
+            'expiring_batches': [
+                {
+                    'id': row['id'],
+                    'product_name': row.get('product_name') or "N/A",
+                    'batch_number': row['batch_number'],
+                    'expiry_date': _iso(row['expiry_date']),
+                    'quantity': _number(row['quantity'])
+                }
+                for row in self.expiring_batches
+            ],
+            'snapshot_at': _iso(self.snapshot_at)
+        }
+
+class PharmacyReportSource:
+    """Consultas dos relatórios via SQLAlchemy Core"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def stock_counts(self, clinic_id: int, expiring_before: date, include_products: bool = True) -> Dict[str, int]:
+        """Totais de lotes a vencer e (com include_products) de produtos ativos e com estoque baixo"""
+        from sqlalchemy import func, select
+        products, batches = self._tables('products', 'product_batches')
+
+        counts = self.product_counts(clinic_id) if include_products else {}
+        counts['expiring_batches_count'] = self.db.execute(
+            select(func.count()).select_from(batches.join(products, batches.c.product_id == products.c.id)).where(
+                *self._expiring_filter(products, batches, clinic_id, expiring_before)
+            )
+        ).scalar()
+        return counts
+
+    def product_counts(self, clinic_id: int) -> Dict[str, int]:
+        """Produtos ativos e com estoque baixo em uma consulta agregada"""
+        from sqlalchemy import case, func, select
+        products, = self._tables('products')
+        total, low_stock = self.db.execute(select(
+            func.count(),
+            func.coalesce(func.sum(case((products.c.current_stock <= products.c.minimum_stock, 1), else_=0)), 0)
+        ).where(products.c.clinic_id == clinic_id, products.c.is_active == True)).one()
+        return {'total_products': int(total), 'low_stock_count': int(low_stock)}
+
+    def low_stock_products(self, clinic_id: int, limit: int) -> List[Dict[str, Any]]:
+        from sqlalchemy import select
+        products, = self._tables('products')
+        query = select(products.c.id, products.c.name, products.c.current_stock, products.c.minimum_stock).where(
+            products.c.clinic_id == clinic_id,
+            products.c.is_active == True,
+            products.c.current_stock <= products.c.minimum_stock
+        ).order_by((products.c.current_stock - products.c.minimum_stock).asc(), products.c.id).limit(limit)
+        return [dict(row._mapping) for row in self.db.execute(query)]
+
+    def expiring_batches(self, clinic_id: int, expiring_before: date, limit: int) -> List[Dict[str, Any]]:
+        from sqlalchemy import select
+        products, batches = self._tables('products', 'product_batches')
+        query = select(
+            batches.c.id, products.c.name.label('product_name'), batches.c.batch_number,
+            batches.c.expiry_date, batches.c.quantity
+        ).select_from(batches.join(products, batches.c.product_id == products.c.id)).where(
+            *self._expiring_filter(products, batches, clinic_id, expiring_before)
+        ).order_by(batches.c.expiry_date.asc(), batches.c.id).limit(limit)
+        return [dict(row._mapping) for row in self.db.execute(query)]
+
+    def movements(self, clinic_id: int, since: datetime, product_id: Optional[int], limit: int) -> Dict[str, Any]:
+        """Movimentações a partir de `since` (mais recentes primeiro) e o total do período"""
+        from sqlalchemy import func, select
+        movements, products, users = self._tables('product_stock_movements', 'products', 'users')
+
+        # Movimentações não têm clinic_id: o isolamento vem do produto
+        conditions = [products.c.clinic_id == clinic_id, movements.c.created_at >= since]
+        if product_id:
+            conditions.append(movements.c.product_id == product_id)
+
+        scoped = movements.join(products, movements.c.product_id == products.c.id)
+        total = self.db.execute(select(func.count()).select_from(scoped).where(*conditions)).scalar()
+        query = select(
+            movements.c.id, products.c.name.label('product_name'), movements.c.movement_type,
+            movements.c.quantity, movements.c.department, movements.c.reason, movements.c.created_at,
+            users.c.full_name.label('user_name')
+        ).select_from(
+            scoped.outerjoin(users, movements.c.user_id == users.c.id)
+        ).where(*conditions).order_by(movements.c.created_at.desc(), movements.c.id.desc()).limit(limit)
+        return {'total': total, 'rows': [dict(row._mapping) for row in self.db.execute(query)]}
+
+    def snapshot(self, clinic_id: int) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import select
+        snapshots, = self._tables('pharmacy_stock_snapshots')
+        row = self.db.execute(select(snapshots).where(snapshots.c.clinic_id == clinic_id)).first()
+        return dict(row._mapping) if row else None
+
+    def _expiring_filter(self, products, batches, clinic_id: int, expiring_before: date) -> list:
+        # Lotes não têm clinic_id: o isolamento vem do produto
+        return [
+            products.c.clinic_id == clinic_id,
+            batches.c.is_active == True,
+            batches.c.expiry_date.isnot(None),
+            batches.c.expiry_date <= expiring_before
+        ]
+
+    def _tables(self, *names):
+        from models import Base
+        return tuple(Base.metadata.tables[name] for name in names)
+
+class SupabasePharmacyReportSource:
+    """Mesmos relatórios via Supabase (RPC pharmacy_stock_counts e filtros no PostgREST)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def stock_counts(self, clinic_id: int, expiring_before: date, include_products: bool = True) -> Dict[str, int]:
+        if not include_products:
+            result = self.client.table('product_batches').select('id,products!inner(clinic_id)', count='exact', head=True).eq(
+                'products.clinic_id', clinic_id
+            ).eq('is_active', True).not_.is_('expiry_date', 'null').lte('expiry_date', expiring_before.isoformat()).execute()
+            return {'expiring_batches_count': result.count or 0}
+
+        result = self.client.rpc('pharmacy_stock_counts', {
+            'p_clinic_id': clinic_id,
+            'p_expiring_before': expiring_before.isoformat()
+        }).execute()
+        row = (result.data or [{}])[0]
+        return {
+            'total_products': row.get('total_products', 0),
+            'low_stock_count': row.get('low_stock_count', 0),
+            'expiring_batches_count': row.get('expiring_batches_count', 0)
+        }
+
+    def low_stock_products(self, clinic_id: int, limit: int) -> List[Dict[str, Any]]:
+        # PostgREST não compara duas colunas: a view pharmacy_low_stock_products aplica o predicado
+        result = self.client.table('pharmacy_low_stock_products').select(
+            'id,name,current_stock,minimum_stock'
+        ).eq('clinic_id', clinic_id).order('stock_gap').order('id').limit(limit).execute()
+        return result.data or []
+
+    def expiring_batches(self, clinic_id: int, expiring_before: date, limit: int) -> List[Dict[str, Any]]:
+        result = self.client.table('product_batches').select(
+            'id,batch_number,expiry_date,quantity,products!inner(name)'
+        ).eq('products.clinic_id', clinic_id).eq('is_active', True).not_.is_('expiry_date', 'null').lte(
+            'expiry_date', expiring_before.isoformat()
+        ).order('expiry_date').order('id').limit(limit).execute()
+        return [
+            {**row, 'product_name': (row.pop('products', None) or {}).get('name')}
+            for row in result.data or []
+        ]
+
+    def movements(self, clinic_id: int, since: datetime, product_id: Optional[int], limit: int) -> Dict[str, Any]:
+        query = self.client.table('product_stock_movements').select(
+            'id,movement_type,quantity,department,reason,created_at,products!inner(name),users(full_name)', count='exact'
+        ).eq('products.clinic_id', clinic_id).gte('created_at', since.isoformat())
+        if product_id:
+            query = query.eq('product_id', product_id)
+        result = query.order('created_at', desc=True).order('id', desc=True).limit(limit).execute()
+        rows = [
+            {
+                **row,
+                'product_name': (row.pop('products', None) or {}).get('name'),
+                'user_name': (row.pop('users', None) or {}).get('full_name')
+            }
+            for row in result.data or []
+        ]
+        return {'total': result.count if result.count is not None else len(rows), 'rows': rows}
+
+    def snapshot(self, clinic_id: int) -> Optional[Dict[str, Any]]:
+        result = self.client.table('pharmacy_stock_snapshots').select('*').eq('clinic_id', clinic_id).limit(1).execute()
+        return result.data[0] if result.data else None
+
+class PharmacyReportService:
+    """
+    Relatórios de estoque. Com PHARMACY_STOCK_SNAPSHOT_ENABLED, os totais de
+    produtos vêm do snapshot da clínica (uma leitura por chave primária) e a
+    agregação sobre products só é usada quando o snapshot ainda não existe.
+    """
+
+    def __init__(self, use_snapshot: bool = None):
+        self.use_snapshot = use_snapshot if use_snapshot is not None else (
+            os.getenv("PHARMACY_STOCK_SNAPSHOT_ENABLED", "false").lower() == "true"
+        )
+
+    def stock_summary(self, source, clinic_id: int, limit: int = 100, expiring_days: int = None) -> StockSummary:
+        expiring_before = date.today() + timedelta(days=expiring_days if expiring_days is not None else EXPIRING_DAYS)
+
+        snapshot = source.snapshot(clinic_id) if self.use_snapshot else None
+        counts = source.stock_counts(clinic_id, expiring_before, include_products=snapshot is None)
+        if snapshot:
+            counts['total_products'] = snapshot['total_products']
+            counts['low_stock_count'] = snapshot['low_stock_count']
+
+        summary = StockSummary(
+            total_products=int(counts['total_products'] or 0),
+            low_stock_count=int(counts['low_stock_count'] or 0),
+            expiring_batches_count=int(counts['expiring_batches_count'] or 0),
+            snapshot_at=snapshot['updated_at'] if snapshot else None
+        )
+        if summary.low_stock_count:
+            summary.low_stock_products = source.low_stock_products(clinic_id, limit)
+        if summary.expiring_batches_count:
+            summary.expiring_batches = source.expiring_batches(clinic_id, expiring_before, limit)
+        return summary
+
+    def movement_history(self, source, clinic_id: int, days: int = 30, product_id: Optional[int] = None,
+                         limit: int = 1000) -> Dict[str, Any]:
+        since = datetime.now() - timedelta(days=days)
+        result = source.movements(clinic_id, since, product_id, limit)
+        return {
+            'period_days': days,
+            'total_movements': result['total'],
+            'movements': [
+                {
+                    'id': row['id'],
+                    'product_name': row.get('product_name') or "N/A",
+                    'movement_type': row['movement_type'],
+                    'quantity': _number(row['quantity']),
+                    'department': row['department'],
+                    'reason': row['reason'],
+                    'created_at': _iso(row['created_at']),
+                    'user_name': row.get('user_name') or "N/A"
+                }
+                for row in result['rows']
+            ]
+        }
+
+    @staticmethod
+    def stock_state(product) -> Tuple[bool, bool]:
+        """(ativo, estoque baixo) de um produto, para record_product_change"""
+        if product is None:
+            return (False, False)
+        active = bool(product.is_active)
+        low = (product.current_stock or 0) <= (product.minimum_stock or 0)
+        return (active, active and low)
+
+    def record_product_change(self, db, clinic_id: int, before: Tuple[bool, bool], after: Tuple[bool, bool]):
+        """
+        Aplica ao snapshot da clínica a mudança de um produto (estados de
+        stock_state antes e depois da gravação), na transação da gravação.
+        Sem snapshot para a clínica, ele é calculado por completo.
+        """
+        total_delta = int(after[0]) - int(before[0])
+        low_delta = int(after[1]) - int(before[1])
+        if clinic_id is None or (not total_delta and not low_delta):
+            return
+
+        from sqlalchemy import func, update
+        snapshots, = PharmacyReportSource(db)._tables('pharmacy_stock_snapshots')
+        result = db.execute(update(snapshots).where(snapshots.c.clinic_id == clinic_id).values(
+            total_products=snapshots.c.total_products + total_delta,
+            low_stock_count=snapshots.c.low_stock_count + low_delta,
+            updated_at=func.now()
+        ))
+        if result.rowcount == 0:
+            # Flush para que a agregação veja a gravação pendente
+            db.flush()
+            self.refresh_snapshot(db, clinic_id)
+
+    def refresh_snapshot(self, db, clinic_id: int) -> Dict[str, int]:
+        """
+        Recalcula o snapshot da clínica a partir de products (sem commit).
+        Upsert: gravações concorrentes da mesma clínica não colidem na chave.
+        """
+        if db.get_bind().dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        source = PharmacyReportSource(db)
+        snapshots, = source._tables('pharmacy_stock_snapshots')
+        counts = source.product_counts(clinic_id)
+        values = dict(updated_at=datetime.utcnow(), **counts)
+        db.execute(insert(snapshots).values(clinic_id=clinic_id, **values).on_conflict_do_update(
+            index_elements=[snapshots.c.clinic_id], set_=values
+        ))
+        return counts
+
+# Instância global
+pharmacy_reports = PharmacyReportService()
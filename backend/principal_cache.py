@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Cache de Principais Autenticados
+
+Este módulo mantém em memória o usuário resolvido a partir de um token JWT
+(dados do usuário, clínica e papéis atribuídos), evitando a consulta ao
+banco ou ao Supabase em toda requisição autenticada:
+- Chave: `jti` do token (ou o `sub`, para tokens sem jti)
+- Validade limitada pelo TTL configurado e pela expiração do token
+- Invalidação por usuário (atualização, desativação, troca de papel),
+  propagada aos demais processos via Redis pub/sub quando disponível
+"""
+
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from session_cache import LocalSessionCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "principal:invalidate"
+INVALIDATE_ALL = "*"
+
+@dataclass
+class Principal:
+    """Usuário autenticado com clínica e papéis já resolvidos"""
+    user_id: int
+    username: str
+    role: Optional[str]
+    clinic_id: Optional[int]
+    is_active: bool
+    user_data: Dict[str, Any]
+    clinic: Optional[Dict[str, Any]] = None
+    roles: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def role_codes(self) -> Set[str]:
+        """Códigos dos papéis atribuídos (além do papel principal do usuário)"""
+        return {role['code'] for role in self.roles if role.get('code')}
+
+class PrincipalCache:
+    """Cache local de principais com invalidação por usuário"""
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        redis_client=None
+    ):
+        self.enabled = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+        self.local = LocalSessionCache(
+            max_entries=max_entries or int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+            ttl_seconds=ttl_seconds or float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "300"))
+        )
+        # user_id -> chaves em cache
+        self._keys_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        # Incrementado a cada invalidação; evita gravar principais lidos antes dela
+        self._generation = 0
+
+        self.redis_client = redis_client if redis_client is not None else self._get_redis_client()
+        self._pubsub = None
+        self._pubsub_thread = None
+        self._subscribe()
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def cache_key(payload: Dict[str, Any]) -> Optional[str]:
+        """Chave do principal a partir das claims do token"""
+        if payload.get("jti"):
+            return f"jti:{payload['jti']}"
+        if payload.get("sub"):
+            return f"sub:{payload['sub']}"
+        return None
+
+    @property
+    def generation(self) -> int:
+        """Geração atual, a ser lida antes de resolver um principal no banco"""
+        return self._generation
+
+    def get(self, key: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+
+        principal = self.local.get(key)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def set(
+        self,
+        key: str,
+        principal: Principal,
+        token_exp: Optional[float] = None,
+        generation: Optional[int] = None
+    ):
+        """
+        Armazena o principal até o TTL configurado ou a expiração do token
+        (timestamp `exp`), o que ocorrer primeiro. Se `generation` for
+        informada e houve invalidação desde então, o principal é descartado.
+        """
+        if not self.enabled:
+            return
+
+        ttl = None
+        if token_exp is not None:
+            ttl = token_exp - time.time()
+            if ttl <= 0:
+                return
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self.local.set(key, principal, ttl)
+            self._keys_by_user.setdefault(principal.user_id, set()).add(key)
+
+    def invalidate_user(self, user_id: int, publish: bool = True):
+        """Remove os principais de um usuário (em todos os processos)"""
+        with self._lock:
+            self._generation += 1
+            keys = self._keys_by_user.pop(user_id, set())
+            for key in keys:
+                self.local.delete(key)
+        self.invalidations += 1
+
+        if publish:
+            self._publish(str(user_id))
+
+    def invalidate_users(self, user_ids: List[int]):
+        for user_id in set(user_ids):
+            self.invalidate_user(user_id)
+
+    def clear(self, publish: bool = True):
+        """Remove todos os principais (ex.: alteração de um papel compartilhado)"""
+        with self._lock:
+            self._generation += 1
+            self._keys_by_user.clear()
+            self.local.clear()
+        self.invalidations += 1
+
+        if publish:
+            self._publish(INVALIDATE_ALL)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.local),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'invalidations': self.invalidations,
+            'invalidation_listener': bool(self._pubsub_thread and self._pubsub_thread.is_alive())
+        }
+
+    def _get_redis_client(self):
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            return None
+
+        try:
+            if redis_url.startswith("fakeredis://"):
+                import fakeredis
+                return fakeredis.FakeRedis(decode_responses=True)
+
+            import redis
+            return redis.from_url(redis_url, decode_responses=True)
+        except Exception as e:
+            logger.warning(f"Redis não disponível para invalidação de principais: {e}")
+            return None
+
+    def _publish(self, message: str):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.publish(INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            logger.error(f"Erro ao publicar invalidação de principal: {e}")
+
+    def _subscribe(self):
+        if not self.redis_client:
+            return
+
+        try:
+            self._pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            logger.warning(f"Invalidação de principais via pub/sub indisponível: {e}")
+            self._pubsub = None
+            self._pubsub_thread = None
+
+    def _on_invalidation(self, message: Dict[str, Any]):
+        data = message.get("data")
+        if isinstance(data, bytes):
+            data = data.decode()
+
+        if data == INVALIDATE_ALL:
+            self.clear(publish=False)
+        elif data:
+            try:
+                self.invalidate_user(int(data), publish=False)
+            except ValueError:
+                pass
+
+# Instância global
+principal_cache = PrincipalCache()
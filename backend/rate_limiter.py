@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Rate Limiting com Janela Deslizante
+
+Este módulo implementa o mecanismo único de rate limiting da API:
+- Janela deslizante aproximada (contador da janela atual + peso da anterior)
+- Verificação e incremento atômicos no Redis via script Lua (uma ida ao
+  Redis por regra, com cliente assíncrono; compatível com Redis Cluster)
+- Várias regras por requisição (cliente/rota e tenant) avaliadas juntas
+- Fallback em memória quando o Redis está indisponível
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY_PREFIX = "rate_limit:"
+
+# Regras: (chave, limite de requisições, janela em segundos)
+RateLimitRule = Tuple[str, int, int]
+
+# KEYS: pares (janela atual, janela anterior) de cada regra
+# ARGV: trios (limite, janela em ms, ms decorridos na janela atual) de cada regra
+# A requisição só é contabilizada se todas as regras permitirem.
+SLIDING_WINDOW_SCRIPT = """
+local allowed = 1
+local remaining = -1
+local retry_after = 0
+
+for i = 1, #KEYS / 2 do
+    local limit = tonumber(ARGV[i * 3 - 2])
+    local window = tonumber(ARGV[i * 3 - 1])
+    local elapsed = tonumber(ARGV[i * 3])
+    local current = tonumber(redis.call('GET', KEYS[i * 2 - 1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[i * 2]) or '0')
+    local weighted = previous * (window - elapsed) / window + current
+
+    if weighted + 1 > limit then
+        allowed = 0
+        local wait = window - elapsed
+        if previous > 0 and current + 1 <= limit then
+            wait = math.ceil((weighted + 1 - limit) * window / previous)
+        end
+        if wait > retry_after then
+            retry_after = wait
+        end
+    end
+
+    local left = math.floor(limit - weighted - 1)
+    if left < 0 then
+        left = 0
+    end
+    if remaining < 0 or left < remaining then
+        remaining = left
+    end
+end
+
+if allowed == 1 then
+    for i = 1, #KEYS / 2 do
+        redis.call('INCR', KEYS[i * 2 - 1])
+        redis.call('PEXPIRE', KEYS[i * 2 - 1], tonumber(ARGV[i * 3 - 1]) * 2)
+    end
+end
+
+return {allowed, remaining, retry_after}
+"""
+
+@dataclass
+class RateLimitDecision:
+    """Resultado da verificação de rate limiting"""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float = 0.0  # segundos
+    backend: str = "redis"
+
+    def headers(self) -> Dict[str, str]:
+        """Cabeçalhos HTTP informando o estado do limite"""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining)
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+def _window_position(now_ms: int, window_ms: int) -> Tuple[int, int]:
+    """Retorna (índice da janela atual, ms decorridos nela)"""
+    return now_ms // window_ms, now_ms % window_ms
+
+class InMemorySlidingWindow:
+    """Mesmo algoritmo do script Lua, mantido na memória do processo"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # chave -> [índice da janela, contagem atual, contagem anterior, janela em ms]
+        self._counters: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, rules: Sequence[RateLimitRule], now_ms: int) -> Tuple[bool, int, int]:
+        """Verifica e contabiliza a requisição; retorna (permitida, restantes, espera em ms)"""
+        allowed = True
+        remaining = None
+        retry_after = 0
+
+        with self._lock:
+            states = []
+            for key, limit, window_seconds in rules:
+                window_ms = window_seconds * 1000
+                index, elapsed = _window_position(now_ms, window_ms)
+                current, previous = self._counts(key, index, window_ms)
+                weighted = previous * (window_ms - elapsed) / window_ms + current
+
+                if weighted + 1 > limit:
+                    allowed = False
+                    wait = window_ms - elapsed
+                    if previous > 0 and current + 1 <= limit:
+                        wait = math.ceil((weighted + 1 - limit) * window_ms / previous)
+                    retry_after = max(retry_after, wait)
+
+                left = max(0, math.floor(limit - weighted - 1))
+                remaining = left if remaining is None else min(remaining, left)
+                states.append((key, index, current, previous, window_ms))
+
+            if allowed:
+                for key, index, current, previous, window_ms in states:
+                    self._counters[key] = [index, current + 1, previous, window_ms]
+                if len(self._counters) > self.max_keys:
+                    self._prune(now_ms)
+
+        return allowed, remaining or 0, retry_after
+
+    def _counts(self, key: str, index: int, window_ms: int) -> Tuple[int, int]:
+        state = self._counters.get(key)
+        if state is None or state[3] != window_ms:
+            return 0, 0
+        if state[0] == index:
+            return state[1], state[2]
+        if state[0] == index - 1:
+            return 0, state[1]
+        return 0, 0
+
+    def _prune(self, now_ms: int):
+        """Remove contadores que não influenciam mais nenhuma janela"""
+        for key in list(self._counters):
+            index, _, _, window_ms = self._counters[key]
+            if index < now_ms // window_ms - 1:
+                del self._counters[key]
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+class RateLimiter:
+    """
+    Rate limiter com Redis assíncrono e fallback em memória.
+
+    Cada regra da requisição é verificada por uma execução do script Lua
+    (EVALSHA) com chaves de uma única hash tag, o que mantém cada execução
+    em um só slot de Redis Cluster. Após uma falha do Redis, as verificações
+    usam o contador em memória durante `redis_retry_seconds`.
+    Com a URL "memory://" apenas o contador em memória é usado.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self.redis_url = redis_url or os.getenv(
+            "RATE_LIMIT_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        )
+        self.redis_timeout = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_SECONDS", "0.25"))
+        self.redis_retry_seconds = float(os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", "30"))
+        self.local = InMemorySlidingWindow(int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "100000")))
+
+        self._redis = None
+        self._script = None
+        self._redis_retry_at = 0.0
+
+        # Métricas
+        self.redis_checks = 0
+        self.local_checks = 0
+        self.rejected = 0
+
+    async def hit(self, rules: Sequence[RateLimitRule]) -> RateLimitDecision:
+        """
+        Contabiliza uma requisição em todas as regras.
+
+        Args:
+            rules: Regras (chave, limite, janela em segundos); a requisição é
+                rejeitada se qualquer uma delas estiver esgotada
+
+        Returns:
+            Decisão com o menor número de requisições restantes
+        """
+        now_ms = int(time.time() * 1000)
+        limit = min(rule[1] for rule in rules)
+
+        script = self._get_script()
+        if script is not None:
+            try:
+                allowed, remaining, retry_after = await self._redis_hit(script, rules, now_ms)
+                self.redis_checks += 1
+                return self._decision(bool(allowed), limit, int(remaining), int(retry_after), "redis")
+            except Exception as e:
+                self._redis_failed(e)
+
+        allowed, remaining, retry_after = self.local.hit(rules, now_ms)
+        self.local_checks += 1
+        return self._decision(allowed, limit, remaining, retry_after, "memory")
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Retorna métricas do rate limiter"""
+        return {
+            'redis_checks': self.redis_checks,
+            'local_checks': self.local_checks,
+            'rejected': self.rejected,
+            'local_keys': len(self.local)
+        }
+
+    def _decision(self, allowed: bool, limit: int, remaining: int, retry_after_ms: int, backend: str) -> RateLimitDecision:
+        if not allowed:
+            self.rejected += 1
+        return RateLimitDecision(allowed, limit, remaining, retry_after_ms / 1000, backend)
+
+    async def _redis_hit(self, script, rules: Sequence[RateLimitRule], now_ms: int) -> Tuple[bool, int, int]:
+        """
+        Executa o script uma vez por regra, na ordem. Se uma regra rejeitar,
+        as seguintes não são contabilizadas e os incrementos das anteriores
+        são desfeitos, como na execução única com todas as regras.
+        """
+        remaining = None
+        counted = []
+        for rule in rules:
+            keys = self._redis_keys([rule], now_ms)
+            allowed, left, retry_after = await script(keys=keys, args=self._redis_args([rule], now_ms))
+            remaining = int(left) if remaining is None else min(remaining, int(left))
+            if not allowed:
+                for key in counted:
+                    await self._redis.decr(key)
+                return False, remaining, int(retry_after)
+            counted.append(keys[0])
+        return True, remaining, 0
+
+    def _redis_keys(self, rules: Sequence[RateLimitRule], now_ms: int) -> List[str]:
+        keys = []
+        for key, _, window_seconds in rules:
+            index, _ = _window_position(now_ms, window_seconds * 1000)
+            # Hash tag da regra: as duas janelas ficam no mesmo slot em Redis Cluster
+            base = f"{RATE_LIMIT_KEY_PREFIX}{{{key}}}:{window_seconds}"
+            keys.extend([f"{base}:{index}", f"{base}:{index - 1}"])
+        return keys
+
+    def _redis_args(self, rules: Sequence[RateLimitRule], now_ms: int) -> List[int]:
+        args = []
+        for _, limit, window_seconds in rules:
+            window_ms = window_seconds * 1000
+            args.extend([limit, window_ms, now_ms % window_ms])
+        return args
+
+    def _get_script(self):
+        """Cria o cliente Redis assíncrono e registra o script sob demanda"""
+        if self.redis_url == "memory://" or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._script is not None:
+            return self._script
+
+        try:
+            if self.redis_url.startswith("fakeredis://"):
+                import fakeredis
+                self._redis = fakeredis.FakeAsyncRedis()
+            else:
+                import redis.asyncio as aioredis
+                self._redis = aioredis.from_url(
+                    self.redis_url,
+                    socket_timeout=self.redis_timeout,
+                    socket_connect_timeout=self.redis_timeout
+                )
+            self._script = self._redis.register_script(SLIDING_WINDOW_SCRIPT)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+        return self._script
+
+    def _redis_failed(self, error: Exception):
+        logger.error(f"Redis indisponível para rate limiting, usando memória: {error}")
+        self._redis_retry_at = time.monotonic() + self.redis_retry_seconds
+
+# Instância global
+rate_limiter = RateLimiter()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Índice em Memória de Dados de Referência (CID-10 e TUSS)
+
+As tabelas de CID-10 e TUSS são estáticas e consultadas por toda tela de
+prescrição e faturamento. Este módulo as mantém em memória e atende o
+autocomplete sem consultar o banco:
+- Códigos normalizados (sem pontos e traços) em lista ordenada: busca por
+  prefixo com bisect
+- Índice invertido das descrições: palavras sem acentos e sem caixa, cada
+  termo da busca casa como prefixo de uma palavra
+- Carga sob demanda (ou na inicialização) e recarga somente quando a tabela
+  muda: impressão digital (quantidade e maior id) verificada a cada
+  REFERENCE_DATA_CHECK_SECONDS e invalidação explícita nas gravações
+"""
+
+import os
+import re
+import time
+import logging
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tabelas indexadas (nome lógico -> tabela no banco local e no Supabase)
+REFERENCE_TABLES = {
+    'cid': {'table': 'cid_diagnoses', 'supabase_table': 'cid_diagnosis'},
+    'tuss': {'table': 'tuss_procedures', 'supabase_table': 'tuss_procedures'}
+}
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def fold_text(text: str) -> str:
+    """Remove acentos e caixa"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def normalize_code(code: str) -> str:
+    """Código sem pontuação (ex.: "A00.1" -> "A001", "1.01.01.01-2" -> "101010012")"""
+    return ''.join(char for char in (code or '').upper() if char.isalnum())
+
+def tokenize(text: str) -> List[str]:
+    return _WORD_PATTERN.findall(fold_text(text))
+
+class ReferenceIndex:
+    """
+    Índice imutável de uma tabela de referência.
+
+    As linhas são ordenadas por relevância estática (descrições mais curtas
+    primeiro) e as listas do índice invertido seguem essa ordem, de modo que
+    a busca para assim que encontra resultados suficientes.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], fingerprint: Tuple = ()):
+        self.fingerprint = fingerprint
+
+        tokens = [tokenize(row.get('description')) for row in rows]
+        order = sorted(range(len(rows)), key=lambda position: (sum(map(len, tokens[position])), position))
+        self.rows = [rows[position] for position in order]
+        self._words = [frozenset(tokens[position]) for position in order]
+
+        # Códigos ordenados (código normalizado, posição da linha)
+        self._codes: List[Tuple[str, int]] = sorted(
+            (normalize_code(row.get('code')), position) for position, row in enumerate(self.rows)
+        )
+        self._code_keys = [code for code, _ in self._codes]
+
+        # Palavra -> posições em ordem crescente, e vocabulário ordenado para prefixos
+        self._postings: Dict[str, List[int]] = {}
+        for position, words in enumerate(self._words):
+            for word in words:
+                self._postings.setdefault(word, []).append(position)
+        self._vocabulary = sorted(self._postings)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_by_code(self, code: str) -> Optional[Dict[str, Any]]:
+        key = normalize_code(code)
+        index = bisect_left(self._code_keys, key)
+        if index < len(self._code_keys) and self._code_keys[index] == key:
+            return self.rows[self._codes[index][1]]
+        return None
+
+    def search(self, term: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Linhas cujo código começa com `term` (primeiro, em ordem de código)
+        seguidas das linhas cuja descrição contém palavras iniciadas por
+        todos os termos (descrições mais curtas primeiro).
+        """
+        wanted = offset + limit
+        positions = self._code_prefix(normalize_code(term), wanted)
+        if len(positions) < wanted:
+            seen = set(positions)
+            for position in self._description_matches(term):
+                if position not in seen:
+                    positions.append(position)
+                    if len(positions) == wanted:
+                        break
+        return [self.rows[position] for position in positions[offset:wanted]]
+
+    def _code_prefix(self, prefix: str, limit: int) -> List[int]:
+        if not prefix:
+            return []
+        positions = []
+        index = bisect_left(self._code_keys, prefix)
+        while index < len(self._code_keys) and len(positions) < limit and self._code_keys[index].startswith(prefix):
+            positions.append(self._codes[index][1])
+            index += 1
+        return positions
+
+    def _description_matches(self, term: str) -> Iterator[int]:
+        """Posições (em ordem de relevância) com palavras iniciadas por todos os termos"""
+        words = set(tokenize(term))
+        if not words:
+            return
+
+        # O termo mais seletivo conduz a varredura; os demais são conferidos por linha
+        candidates = {word: self._word_prefix(word) for word in words}
+        driver = min(words, key=lambda word: sum(map(len, candidates[word])))
+        others = [word for word in words if word != driver]
+
+        lists = candidates[driver]
+        merged = lists[0] if len(lists) == 1 else heapq.merge(*lists)
+        previous = None
+        for position in merged:
+            if position == previous:
+                continue
+            previous = position
+            row_words = self._words[position]
+            if all(any(row_word.startswith(word) for row_word in row_words) for word in others):
+                yield position
+
+    def _word_prefix(self, prefix: str) -> List[List[int]]:
+        """Listas de posições das palavras do vocabulário iniciadas por `prefix`"""
+        lists = []
+        index = bisect_left(self._vocabulary, prefix)
+        while index < len(self._vocabulary) and self._vocabulary[index].startswith(prefix):
+            lists.append(self._postings[self._vocabulary[index]])
+            index += 1
+        return lists
+
+class ReferenceTableSource:
+    """Carga das tabelas de referência via SQLAlchemy"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def fingerprint(self, name: str) -> Tuple:
+        from sqlalchemy import func, select
+        table = self._table(name)
+        return tuple(self.db.execute(select(func.count(), func.max(table.c.id)).select_from(table)).one())
+
+    def load(self, name: str) -> List[Dict[str, Any]]:
+        from sqlalchemy import select
+        table = self._table(name)
+        return [dict(row._mapping) for row in self.db.execute(select(table).order_by(table.c.id))]
+
+    def _table(self, name: str):
+        from models import Base
+        return Base.metadata.tables[REFERENCE_TABLES[name]['table']]
+
+class SupabaseReferenceTableSource:
+    """Carga das tabelas de referência do Supabase (paginada)"""
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, client):
+        self.client = client
+
+    def fingerprint(self, name: str) -> Tuple:
+        result = self.client.table(self._table(name)).select('id', count='exact').order('id', desc=True).limit(1).execute()
+        return (result.count, result.data[0]['id'] if result.data else None)
+
+    def load(self, name: str) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while True:
+            page = self.client.table(self._table(name)).select('*').order('id').range(
+                len(rows), len(rows) + self.PAGE_SIZE - 1
+            ).execute().data or []
+            rows.extend(page)
+            if len(page) < self.PAGE_SIZE:
+                return rows
+
+    def _table(self, name: str) -> str:
+        return REFERENCE_TABLES[name]['supabase_table']
+
+class ReferenceDataService:
+    """
+    Índices de referência carregados sob demanda e compartilhados pelo
+    processo. As linhas retornadas são compartilhadas: não devem ser alteradas.
+    """
+
+    def __init__(self, check_seconds: float = None):
+        self.check_seconds = check_seconds if check_seconds is not None else float(
+            os.getenv("REFERENCE_DATA_CHECK_SECONDS", "60")
+        )
+        self._indexes: Dict[str, ReferenceIndex] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.loads = 0
+        self.searches = 0
+
+    def index(self, source, name: str) -> ReferenceIndex:
+        """Índice da tabela `name`, carregado ou recarregado se a tabela mudou"""
+        index = self._indexes.get(name)
+        now = time.monotonic()
+        if index is not None and now - self._checked_at.get(name, 0) < self.check_seconds:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is not None and now - self._checked_at.get(name, 0) < self.check_seconds:
+                return index
+
+            fingerprint = source.fingerprint(name)
+            if index is None or index.fingerprint != fingerprint:
+                start = time.perf_counter()
+                index = ReferenceIndex(source.load(name), fingerprint)
+                self._indexes[name] = index
+                self.loads += 1
+                logger.info(
+                    f"Índice de referência {name} carregado: {len(index)} registros "
+                    f"em {(time.perf_counter() - start) * 1000:.0f} ms"
+                )
+            self._checked_at[name] = time.monotonic()
+            return index
+
+    def search(self, source, name: str, term: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        self.searches += 1
+        return self.index(source, name).search(term, limit=limit, offset=offset)
+
+    def get_by_code(self, source, name: str, code: str) -> Optional[Dict[str, Any]]:
+        return self.index(source, name).get_by_code(code)
+
+    def preload(self, source_factory: Callable[[], Any]):
+        """Carrega todos os índices (ex.: na inicialização da aplicação)"""
+        source = source_factory()
+        for name in REFERENCE_TABLES:
+            try:
+                self.index(source, name)
+            except Exception as e:
+                logger.error(f"Erro ao carregar índice de referência {name}: {e}")
+
+    def invalidate(self, name: str = None):
+        """Descarta o índice da tabela (ou todos); recarregado na próxima consulta"""
+        with self._lock:
+            for key in [name] if name else list(self._indexes):
+                self._indexes.pop(key, None)
+                self._checked_at.pop(key, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'tables': {name: len(index) for name, index in self._indexes.items()},
+            'loads': self.loads,
+            'searches': self.searches
+        }
+
+# Instância global
+reference_data = ReferenceDataService()
@@ -3,6 +3,8 @@
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, time, timedelta
 from ..database_supabase import SupabaseRepository, get_supabase_connection
+from ..availability import availability_engine, SupabaseAppointmentSource, FreeSlot
+from ..appointment_stats import appointment_stats, SupabaseAppointmentStatsSource
 
 class AppointmentRepository(SupabaseRepository):
     """Repositório para gerenciar consultas."""
@@ -23,7 +25,9 @@ class AppointmentRepository(SupabaseRepository):
         appointment_data['created_at'] = datetime.utcnow().isoformat()
         appointment_data['updated_at'] = datetime.utcnow().isoformat()
         
-        return self.create(appointment_data)
+        result = self.create(appointment_data)
+        self._invalidate_availability(appointment_data)
+        return result
     
     def get_by_date(self, appointment_date: date) -> List[Dict]:
         """
@@ -94,21 +98,48 @@ class AppointmentRepository(SupabaseRepository):
             True se disponível, False caso contrário
         """
         try:
-            # Calcular horário de fim
-            end_time = (datetime.combine(appointment_date, appointment_time) + 
-                       timedelta(minutes=duration_minutes)).time()
-            
-            # Verificar se há conflito de horário
+            # Agenda da semana do médico carregada uma vez e mantida em cache;
+            # considera também consultas iniciadas antes do horário pedido
             start_datetime = datetime.combine(appointment_date, appointment_time)
-            end_datetime = start_datetime + timedelta(minutes=duration_minutes)
-            
-            result = self.client.table(self.table_name).select('id, appointment_date, duration').eq('doctor_id', doctor_id).gte('appointment_date', start_datetime.isoformat()).lt('appointment_date', end_datetime.isoformat()).neq('status', 'cancelled').execute()
-            
-            return len(result.data or []) == 0
+            return availability_engine.is_slot_free(
+                SupabaseAppointmentSource(self.client), doctor_id, start_datetime, duration_minutes
+            )
         except Exception as e:
             print(f"Erro ao verificar disponibilidade: {e}")
             raise
     
+    def find_next_free_slots(self, doctor_id: str, after: datetime, count: int = 5, duration_minutes: int = 30) -> List[FreeSlot]:
+        """Busca os próximos horários livres de um médico.
+        
+        Args:
+            doctor_id: ID do médico
+            after: Momento a partir do qual buscar
+            count: Quantidade de horários
+            duration_minutes: Duração em minutos
+        
+        Returns:
+            Horários livres em ordem cronológica
+        """
+        return availability_engine.next_free_slots(
+            SupabaseAppointmentSource(self.client), doctor_id, after, count, duration_minutes
+        )
+    
+    def find_clinic_free_slots(self, clinic_id: str, day: date, duration_minutes: int = 30, per_doctor: int = 3) -> Dict[Any, List[FreeSlot]]:
+        """Busca horários livres de todos os médicos da clínica em um dia.
+        
+        Args:
+            clinic_id: ID da clínica
+            day: Data
+            duration_minutes: Duração em minutos
+            per_doctor: Quantidade de horários por médico
+        
+        Returns:
+            Horários livres por médico (uma única consulta para a clínica)
+        """
+        return availability_engine.clinic_free_slots(
+            SupabaseAppointmentSource(self.client), clinic_id, day, duration_minutes, per_doctor
+        )
+    
     def get_appointments_by_status(self, clinic_id: str, status: str) -> List[Dict[str, Any]]:
         """Busca consultas por status.
         
@@ -147,7 +178,9 @@ class AppointmentRepository(SupabaseRepository):
         if notes:
             update_data['notes'] = notes
         
-        return self.update(appointment_id, update_data)
+        result = self.update(appointment_id, update_data)
+        self._invalidate_availability(result)
+        return result
     
     def get_clinic_schedule(self, clinic_id: str, start_date: date, end_date: date) -> List[Dict[str, Any]]:
         """Busca agenda da clínica em um período.
@@ -181,30 +214,11 @@ class AppointmentRepository(SupabaseRepository):
             Estatísticas das consultas
         """
         try:
-            # Total de consultas
-            total_result = self.client.table(self.table_name).select('id', count='exact').eq('clinic_id', clinic_id).gte('appointment_date', start_date.isoformat()).lte('appointment_date', end_date.isoformat()).execute()
-            total_appointments = total_result.count or 0
-            
-            # Consultas realizadas
-            completed_result = self.client.table(self.table_name).select('id', count='exact').eq('clinic_id', clinic_id).eq('status', 'completed').gte('appointment_date', start_date.isoformat()).lte('appointment_date', end_date.isoformat()).execute()
-            completed_appointments = completed_result.count or 0
-            
-            # Consultas canceladas
-            cancelled_result = self.client.table(self.table_name).select('id', count='exact').eq('clinic_id', clinic_id).eq('status', 'cancelled').gte('appointment_date', start_date.isoformat()).lte('appointment_date', end_date.isoformat()).execute()
-            cancelled_appointments = cancelled_result.count or 0
-            
-            # Consultas agendadas
-            scheduled_result = self.client.table(self.table_name).select('id', count='exact').eq('clinic_id', clinic_id).eq('status', 'scheduled').gte('appointment_date', start_date.isoformat()).lte('appointment_date', end_date.isoformat()).execute()
-            scheduled_appointments = scheduled_result.count or 0
-            
-            return {
-                'total_appointments': total_appointments,
-                'completed_appointments': completed_appointments,
-                'cancelled_appointments': cancelled_appointments,
-                'scheduled_appointments': scheduled_appointments,
-                'completion_rate': (completed_appointments / total_appointments * 100) if total_appointments > 0 else 0,
-                'cancellation_rate': (cancelled_appointments / total_appointments * 100) if total_appointments > 0 else 0
-            }
+            # Todas as contagens em uma única chamada RPC (com cache curto por clínica)
+            stats = appointment_stats.get(
+                SupabaseAppointmentStatsSource(self.client), clinic_id, start_date, end_date
+            )
+            return stats.to_dict()
         except Exception as e:
             print(f"Erro ao obter estatísticas de consultas: {e}")
             raise
@@ -227,4 +241,13 @@ class AppointmentRepository(SupabaseRepository):
             'updated_at': datetime.utcnow().isoformat()
         }
         
-        return self.update(appointment_id, update_data)
\ No newline at end of file
+        result = self.update(appointment_id, update_data)
+        self._invalidate_availability(result)
+        return result
+    
+    def _invalidate_availability(self, appointment: Optional[Dict[str, Any]]):
+        """Descarta a agenda do médico e as estatísticas da clínica em cache"""
+        if appointment and appointment.get('doctor_id') is not None:
+            availability_engine.invalidate(appointment['doctor_id'])
+        if appointment:
+            appointment_stats.invalidate(appointment.get('clinic_id'))
@@ -3,6 +3,8 @@
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date
 from ..database_supabase import SupabaseRepository, get_supabase_connection
+from ..encryption import field_encryption
+from ..patient_search import is_document_term, supabase_blind_index_filter, supabase_search_by_name
 
 class PatientRepository(SupabaseRepository):
     """Repositório para gerenciar pacientes."""
@@ -36,7 +38,9 @@ class PatientRepository(SupabaseRepository):
             Paciente encontrado ou None
         """
         try:
-            result = self.client.table(self.table_name).select('*').eq('cpf', cpf).eq('clinic_id', clinic_id).execute()
+            # CPF criptografado: busca pelo blind index
+            cpf_hash = field_encryption.encryption.hash_for_search(cpf)
+            result = self.client.table(self.table_name).select('*').eq('cpf_hash', cpf_hash).eq('clinic_id', clinic_id).execute()
             if result.data:
                 return result.data[0]
             return None
@@ -64,28 +68,34 @@ class PatientRepository(SupabaseRepository):
             print(f"Erro ao buscar pacientes da clínica: {e}")
             raise
     
-    def search_patients(self, clinic_id: str, search_term: str) -> List[Dict[str, Any]]:
-        """Busca pacientes por nome ou CPF.
+    def search_patients(self, clinic_id: str, search_term: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Busca pacientes por nome, CPF, RG ou telefone.
         
         Args:
             clinic_id: ID da clínica
             search_term: Termo de busca
+            limit: Máximo de pacientes encontrados pelo nome
         
         Returns:
-            Lista de pacientes encontrados
+            Lista de pacientes encontrados (os encontrados pelo nome, por relevância)
         """
         try:
-            # Buscar por nome (case insensitive)
-            name_result = self.client.table(self.table_name).select('*').eq('clinic_id', clinic_id).ilike('full_name', f'%{search_term}%').execute()
+            # CPF, RG e telefone pelo blind index; nome pelo índice de trigramas (RPC)
+            conditions = []
+            ranking: Dict[Any, int] = {}
+            if not is_document_term(search_term):
+                ranked = supabase_search_by_name(self.client, clinic_id, search_term, limit=limit)
+                ranking = {patient_id: position for position, (patient_id, _) in enumerate(ranked)}
+                if ranking:
+                    conditions.append(f"id.in.({','.join(str(patient_id) for patient_id in ranking)})")
+            blind_index = supabase_blind_index_filter(self.client, clinic_id, search_term)
+            if blind_index:
+                conditions.append(blind_index)
+            if not conditions:
+                return []
             
-            # Buscar por CPF
-            cpf_result = self.client.table(self.table_name).select('*').eq('clinic_id', clinic_id).ilike('cpf', f'%{search_term}%').execute()
-            
-            # Combinar resultados e remover duplicatas
-            patients = name_result.data + cpf_result.data
-            unique_patients = {p['id']: p for p in patients}.values()
-            
-            return list(unique_patients)
+            result = self.client.table(self.table_name).select('*').eq('clinic_id', clinic_id).or_(','.join(conditions)).execute()
+            return sorted(result.data or [], key=lambda patient: ranking.get(patient['id'], len(ranking)))
         except Exception as e:
             print(f"Erro ao buscar pacientes: {e}")
             raise
@@ -6,16 +6,20 @@ Este módulo implementa os endpoints da API para consulta e gerenciamento
 dos logs de auditoria e segurança do sistema.
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 
 from database import get_db
 from auth import get_current_user
 from models import User
-from audit_logger import audit_logger, AuditLog, AuditEventType, AuditSeverity
+from audit_logger import audit_logger, AuditEventType, AuditSeverity
+from audit_integrity import integrity_verifier, checkpoint_manager
+from audit_stats import audit_stats
+from audit_export import AuditLogExporter, InvalidExportCursor, decode_cursor
 
 router = APIRouter(prefix="/audit", tags=["audit"])
 
@@ -255,69 +259,8 @@ async def get_audit_stats(
                 detail="Acesso negado: apenas administradores podem ver estatísticas de auditoria"
             )
         
-        # Calcular estatísticas
-        now = datetime.utcnow()
-        
-        # Total de logs
-        total_logs = db.query(AuditLog).count()
-        
-        # Logs nas últimas 24 horas
-        logs_24h = db.query(AuditLog).filter(
-            AuditLog.created_at >= now - timedelta(hours=24)
-        ).count()
-        
-        # Logs nos últimos 7 dias
-        logs_7d = db.query(AuditLog).filter(
-            AuditLog.created_at >= now - timedelta(days=7)
-        ).count()
-        
-        # Logs nos últimos 30 dias
-        logs_30d = db.query(AuditLog).filter(
-            AuditLog.created_at >= now - timedelta(days=30)
-        ).count()
-        
-        # Top tipos de evento (últimos 30 dias)
-        recent_logs = db.query(AuditLog).filter(
-            AuditLog.created_at >= now - timedelta(days=30)
-        ).all()
-        
-        event_types = {}
-        users = {}
-        security_events = 0
-        critical_events = 0
-        
-        for log in recent_logs:
-            # Contar tipos de evento
-            event_types[log.event_type] = event_types.get(log.event_type, 0) + 1
-            
-            # Contar usuários
-            if log.username:
-                users[log.username] = users.get(log.username, 0) + 1
-            
-            # Contar eventos de segurança
-            if 'security' in log.event_type or 'suspicious' in log.event_type:
-                security_events += 1
-            
-            # Contar eventos críticos
-            if log.severity == AuditSeverity.CRITICAL.value:
-                critical_events += 1
-        
-        # Top 10 tipos de evento
-        top_event_types = dict(sorted(event_types.items(), key=lambda x: x[1], reverse=True)[:10])
-        
-        # Top 10 usuários
-        top_users = dict(sorted(users.items(), key=lambda x: x[1], reverse=True)[:10])
-        
-        stats = AuditStats(
-            total_logs=total_logs,
-            logs_last_24h=logs_24h,
-            logs_last_7d=logs_7d,
-            logs_last_30d=logs_30d,
-            top_event_types=top_event_types,
-            top_users=top_users,
-            security_events_count=security_events,
-            critical_events_count=critical_events
-        )
+        # Calcular estatísticas a partir do agregado horário
+        stats = AuditStats(**audit_stats.get_stats(db))
         
         # Registrar acesso
         audit_logger.log_event(
@@ -355,6 +298,26 @@ async def get_event_types(
         "severities": [severity.value for severity in AuditSeverity]
     }
 
+@router.get("/writer/metrics")
+async def get_audit_writer_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Retorna métricas do gravador em lote de auditoria (profundidade da fila
+    e latência de flush).
+    Apenas administradores podem acessar.
+    
+    Returns:
+        Métricas do gravador
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso negado: apenas administradores podem ver métricas de auditoria"
+        )
+    
+    return audit_logger.get_writer_metrics()
+
 @router.post("/cleanup")
 async def cleanup_old_logs(
     retention_days: int = Query(2555, ge=30, le=3650, description="Dias de retenção"),
@@ -410,24 +373,34 @@ async def cleanup_old_logs(
 
 @router.get("/export")
 async def export_audit_logs(
-    format: str = Query("json", regex="^(json|csv)$", description="Formato de exportação"),
+    format: str = Query("json", regex="^(json|csv|ndjson)$", description="Formato de exportação"),
+    gzip: bool = Query(False, description="Comprimir a exportação com gzip"),
     start_date: Optional[datetime] = Query(None, description="Data inicial"),
     end_date: Optional[datetime] = Query(None, description="Data final"),
     event_type: Optional[str] = Query(None, description="Tipo do evento"),
     user_id: Optional[int] = Query(None, description="ID do usuário"),
+    cursor: Optional[str] = Query(None, description="Cursor para retomar uma exportação"),
+    max_rows: Optional[int] = Query(None, ge=1, description="Máximo de logs nesta exportação"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Exporta logs de auditoria em formato JSON ou CSV.
+    Exporta logs de auditoria em formato JSON, NDJSON ou CSV.
     Apenas administradores podem exportar.
     
+    Os logs são enviados em streaming, em ordem de id, lidos com cursor no
+    servidor. Com max_rows, o cabeçalho X-Next-Cursor traz o cursor da
+    próxima página; em JSON/NDJSON ele também é incluído ao final.
+    
     Args:
-        format: Formato de exportação (json ou csv)
+        format: Formato de exportação (json, ndjson ou csv)
+        gzip: Comprimir com gzip
         start_date: Data inicial
         end_date: Data final
         event_type: Tipo do evento
         user_id: ID do usuário
+        cursor: Cursor retornado por uma exportação anterior
+        max_rows: Máximo de logs a exportar
         
     Returns:
         Arquivo com logs exportados
@@ -451,21 +424,36 @@ async def export_audit_logs(
                     detail=f"Tipo de evento inválido: {event_type}"
                 )
         
-        # Buscar logs
-        logs = audit_logger.search_logs(
-            db=db,
-            user_id=user_id,
-            event_type=event_type_enum,
+        after_id = None
+        if cursor:
+            try:
+                after_id = decode_cursor(cursor)
+            except InvalidExportCursor as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=str(e)
+                )
+        
+        # Logs pendentes no buffer também devem ser exportados
+        audit_logger.flush()
+        
+        exporter = AuditLogExporter(
+            export_format=format,
+            compress=gzip,
             start_date=start_date,
             end_date=end_date,
-            limit=10000  # Limite alto para exportação
+            event_type=event_type_enum.value if event_type_enum else None,
+            user_id=user_id,
+            after_id=after_id,
+            max_rows=max_rows
         )
+        next_cursor = exporter.resolve_page(db)
         
         # Registrar exportação
         audit_logger.log_event(
             db=db,
             event_type=AuditEventType.DATA_EXPORT,
-            description=f"Exportação de logs de auditoria (formato: {format}, {len(logs)} logs)",
+            description=f"Exportação de logs de auditoria (formato: {format}, gzip: {gzip})",
             user_id=current_user.id,
             username=current_user.username,
             user_role=current_user.role,
@@ -473,7 +461,9 @@ async def export_audit_logs(
             is_sensitive_data=True,
             metadata={
                 "format": format,
-                "logs_count": len(logs),
+                "gzip": gzip,
+                "max_rows": max_rows,
+                "after_id": after_id,
                 "filters": {
                     "start_date": start_date.isoformat() if start_date else None,
                     "end_date": end_date.isoformat() if end_date else None,
@@ -483,92 +473,17 @@ async def export_audit_logs(
             }
         )
         
-        if format == "json":
-            from fastapi.responses import JSONResponse
-            
-            # Converter logs para dicionários
-            logs_data = []
-            for log in logs:
-                log_dict = {
-                    "id": log.id,
-                    "event_type": log.event_type,
-                    "severity": log.severity,
-                    "event_id": log.event_id,
-                    "user_id": log.user_id,
-                    "username": log.username,
-                    "user_role": log.user_role,
-                    "session_id": log.session_id,
-                    "ip_address": log.ip_address,
-                    "resource_type": log.resource_type,
-                    "resource_id": log.resource_id,
-                    "action": log.action,
-                    "description": log.description,
-                    "endpoint": log.endpoint,
-                    "http_method": log.http_method,
-                    "status_code": log.status_code,
-                    "response_time_ms": log.response_time_ms,
-                    "country": log.country,
-                    "city": log.city,
-                    "is_sensitive_data": log.is_sensitive_data,
-                    "created_at": log.created_at.isoformat(),
-                    "old_values": log.old_values,
-                    "new_values": log.new_values,
-                    "metadata": log.metadata
-                }
-                logs_data.append(log_dict)
-            
-            return JSONResponse(
-                content={
-                    "export_info": {
-                        "format": "json",
-                        "exported_at": datetime.utcnow().isoformat(),
-                        "exported_by": current_user.username,
-                        "total_logs": len(logs_data)
-                    },
-                    "logs": logs_data
-                },
-                headers={
-                    "Content-Disposition": f"attachment; filename=audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                }
-            )
+        headers = {
+            "Content-Disposition": f"attachment; filename={exporter.filename}"
+        }
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
         
-        elif format == "csv":
-            import csv
-            import io
-            from fastapi.responses import StreamingResponse
-            
-            # Criar CSV em memória
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            # Cabeçalho
-            writer.writerow([
-                "ID", "Tipo de Evento", "Severidade", "ID do Evento", "ID do Usuário",
-                "Nome do Usuário", "Papel do Usuário", "ID da Sessão", "Endereço IP",
-                "Tipo do Recurso", "ID do Recurso", "Ação", "Descrição", "Endpoint",
-                "Método HTTP", "Código de Status", "Tempo de Resposta (ms)",
-                "País", "Cidade", "Dados Sensíveis", "Data de Criação"
-            ])
-            
-            # Dados
-            for log in logs:
-                writer.writerow([
-                    log.id, log.event_type, log.severity, log.event_id, log.user_id,
-                    log.username, log.user_role, log.session_id, log.ip_address,
-                    log.resource_type, log.resource_id, log.action, log.description,
-                    log.endpoint, log.http_method, log.status_code, log.response_time_ms,
-                    log.country, log.city, log.is_sensitive_data, log.created_at.isoformat()
-                ])
-            
-            output.seek(0)
-            
-            return StreamingResponse(
-                io.BytesIO(output.getvalue().encode('utf-8')),
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename=audit_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                }
-            )
+        return StreamingResponse(
+            exporter.stream(),
+            media_type=exporter.media_type,
+            headers=headers
+        )
         
     except HTTPException:
         raise
@@ -579,17 +494,27 @@ async def export_audit_logs(
         )
 
 @router.get("/integrity/verify")
-async def verify_logs_integrity(
-    limit: int = Query(1000, ge=1, le=10000, description="Limite de logs para verificar"),
+def verify_logs_integrity(
+    limit: int = Query(1000, ge=1, le=10000, description="Limite de logs para verificar (últimos logs)"),
+    full: bool = Query(False, description="Verificar a tabela inteira (ignora o limite)"),
+    start_date: Optional[datetime] = Query(None, description="Data inicial"),
+    end_date: Optional[datetime] = Query(None, description="Data final"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Verifica a integridade dos logs de auditoria.
+    Verifica a integridade encadeada dos logs de auditoria.
     Apenas administradores podem executar.
     
+    Os logs são lidos em blocos ordenados por id e verificados neste
+    processo (a verificação em paralelo roda como job, fora da API); além do
+    checksum de cada log, é conferido o encadeamento com o log anterior.
+    
     Args:
-        limit: Limite de logs para verificar
+        limit: Limite de logs para verificar (últimos logs)
+        full: Verificar a tabela inteira
+        start_date: Data inicial
+        end_date: Data final
         
     Returns:
         Resultado da verificação de integridade
@@ -602,48 +527,41 @@ async def verify_logs_integrity(
                 detail="Acesso negado: apenas administradores podem verificar integridade"
             )
         
-        # Buscar logs recentes
-        logs = db.query(AuditLog).order_by(
-            AuditLog.created_at.desc()
-        ).limit(limit).all()
+        # Garantir que os logs pendentes no buffer também sejam verificados
+        audit_logger.flush()
         
-        # Verificar integridade
-        total_logs = len(logs)
-        corrupted_logs = []
+        if full or start_date or end_date:
+            result = integrity_verifier.verify(db, start_date=start_date, end_date=end_date, max_workers=1)
+        else:
+            result = integrity_verifier.verify_recent(db, limit, max_workers=1)
         
-        for log in logs:
-            if not log.verify_integrity():
-                corrupted_logs.append({
-                    "id": log.id,
-                    "event_id": log.event_id,
-                    "created_at": log.created_at.isoformat(),
-                    "expected_checksum": log.calculate_checksum(),
-                    "stored_checksum": log.checksum
-                })
-        
-        integrity_ok = len(corrupted_logs) == 0
+        integrity_ok = result["integrity_ok"]
         
         # Registrar verificação
         audit_logger.log_event(
             db=db,
             event_type=AuditEventType.SYSTEM_CONFIG_CHANGE,
-            description=f"Verificação de integridade executada: {total_logs} logs verificados, {len(corrupted_logs)} corrompidos",
+            description=f"Verificação de integridade executada: {result['total_logs_checked']} logs verificados, {result['corrupted_logs_count']} corrompidos, {result['broken_links_count']} quebras de cadeia",
             user_id=current_user.id,
             username=current_user.username,
             user_role=current_user.role,
             severity=AuditSeverity.HIGH if not integrity_ok else AuditSeverity.LOW,
             metadata={
-                "total_logs": total_logs,
-                "corrupted_count": len(corrupted_logs),
+                "total_logs": result["total_logs_checked"],
+                "corrupted_count": result["corrupted_logs_count"],
+                "broken_links_count": result["broken_links_count"],
                 "integrity_ok": integrity_ok
             }
         )
         
         return {
             "integrity_ok": integrity_ok,
-            "total_logs_checked": total_logs,
-            "corrupted_logs_count": len(corrupted_logs),
-            "corrupted_logs": corrupted_logs[:10] if corrupted_logs else [],  # Limitar a 10 para não sobrecarregar
+            "total_logs_checked": result["total_logs_checked"],
+            "corrupted_logs_count": result["corrupted_logs_count"],
+            "corrupted_logs": result["corrupted_logs"][:10],  # Limitar a 10 para não sobrecarregar
+            "broken_links_count": result["broken_links_count"],
+            "broken_links": result["broken_links"][:10],
+            "elapsed_seconds": result["elapsed_seconds"],
             "verification_date": datetime.utcnow().isoformat()
         }
         
@@ -653,4 +571,68 @@ async def verify_logs_integrity(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erro na verificação de integridade: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.post("/integrity/checkpoints")
+def build_integrity_checkpoints(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Cria os checkpoints diários de Merkle pendentes (até ontem).
+    Apenas administradores podem executar.
+    
+    Returns:
+        Número de checkpoints criados
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso negado: apenas administradores podem criar checkpoints"
+        )
+    
+    try:
+        audit_logger.flush()
+        created = checkpoint_manager.build_missing_checkpoints(db)
+        
+        return {
+            "message": f"{created} checkpoints criados",
+            "created_count": created
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao criar checkpoints: {str(e)}"
+        )
+
+@router.get("/integrity/checkpoints/verify")
+def verify_integrity_checkpoints(
+    start_date: Optional[date] = Query(None, description="Data inicial"),
+    end_date: Optional[date] = Query(None, description="Data final"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Confere os logs de cada dia contra a raiz de Merkle do checkpoint.
+    Apenas administradores podem executar.
+    
+    Returns:
+        Resultado da verificação dos checkpoints
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso negado: apenas administradores podem verificar integridade"
+        )
+    
+    try:
+        result = checkpoint_manager.verify_checkpoints(db, start_date, end_date)
+        result["verification_date"] = datetime.utcnow().isoformat()
+        return result
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro na verificação de checkpoints: {str(e)}"
+        )
@@ -6,27 +6,37 @@ Este módulo define os endpoints da API para o sistema de notificações,
 incluindo gerenciamento de notificações, preferências e templates.
 """
 
+import os
+import json
+import time
+import asyncio
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field, validator
 
-from ..database import get_db
+from ..database import get_db, SessionLocal
 from ..models import User
-from ..auth import get_current_user, require_permission
+from ..auth import get_current_user, get_current_principal, require_permission
 from ..encryption import field_encryption
 from ..notification_system import (
     NotificationSystem, NotificationMessage, NotificationType, 
     NotificationChannel, NotificationPriority, NotificationStatus,
     Notification, NotificationPreference, NotificationTemplate,
-    EmailConfig, SMSConfig, create_notification_system
+    create_notification_system
 )
-from ..audit_logger import AuditLogger, EventType, EventSeverity
+from ..notification_stream import notification_stream
+from ..notification_templates import notification_templates
 from ..security_config import SecurityConfig
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+# Intervalo de revalidação do token nas conexões WebSocket/SSE
+STREAM_AUTH_CHECK_SECONDS = float(os.getenv("NOTIFICATION_STREAM_AUTH_CHECK_SECONDS", "60"))
+
 # Schemas Pydantic
 class NotificationResponse(BaseModel):
     """Schema de resposta para notificação"""
@@ -164,28 +174,12 @@ class NotificationStatsResponse(BaseModel):
     delivery_rate: float
 
 # Dependências
-def get_notification_system(db: Session = Depends(get_db)) -> NotificationSystem:
-    """Obtém instância do sistema de notificações"""
-    audit_logger = AuditLogger(db)
-    
-    # Configurações de email e SMS (em produção, vir de variáveis de ambiente)
-    email_config = EmailConfig(
-        smtp_server="smtp.gmail.com",
-        smtp_port=587,
-        username="noreply@dataclinica.com",
-        password="app_password",
-        from_email="noreply@dataclinica.com",
-        from_name="DataClínica"
-    )
-    
-    sms_config = SMSConfig(
-        provider="twilio",
-        api_key="your_api_key",
-        api_secret="your_api_secret",
-        from_number="+1234567890"
-    )
-    
-    return create_notification_system(db, audit_logger, email_config, sms_config)
+async def get_notification_system(db: Session = Depends(get_db)) -> NotificationSystem:
+    """
+    Obtém o sistema de notificações do processo, associado à sessão desta
+    requisição (async: a associação vale para o contexto do endpoint).
+    """
+    return create_notification_system(db)
 
 # Endpoints
 
@@ -227,17 +221,119 @@ async def get_unread_count(
 ):
     """Obtém contagem de notificações não lidas"""
     try:
-        notifications = await notification_system.get_user_notifications(
-            user_id=current_user.id,
-            limit=1000,
-            unread_only=True
-        )
+        unread_count = await notification_system.get_unread_count(current_user.id)
         
-        return {"unread_count": len(notifications)}
+        return {"unread_count": unread_count}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao contar notificações: {str(e)}")
 
+async def _stream_principal(token: str, db: Session):
+    """
+    Principal do token da query string (WebSocket e EventSource não enviam
+    o cabeçalho Authorization); None se inválido ou inativo.
+    """
+    try:
+        principal = await get_current_principal(token, db)
+    except HTTPException:
+        return None
+    return principal if principal.is_active else None
+
+async def _open_stream(token: str):
+    """
+    (principal, evento inicial com a contagem de não lidas), ou (None, None)
+    se o token for inválido. Usa uma sessão curta, fechada antes do
+    streaming: uma conexão aberta não prende uma conexão do pool.
+    """
+    db = SessionLocal()
+    try:
+        principal = await _stream_principal(token, db)
+        if principal is None:
+            return None, None
+        unread_count = db.query(func.count(Notification.id)).filter(
+            Notification.user_id == principal.user_id,
+            Notification.read_at.is_(None)
+        ).scalar()
+        return principal, {'event': 'unread_count', 'unread_count': unread_count}
+    finally:
+        db.close()
+
+async def _token_valid(token: str) -> bool:
+    """Revalida o token (expiração, usuário desativado ou revogado) com uma sessão curta"""
+    db = SessionLocal()
+    try:
+        return await _stream_principal(token, db) is not None
+    finally:
+        db.close()
+
+async def _authorized_events(token: str, user_id: int, initial: Dict[str, Any]):
+    """
+    Eventos do usuário enquanto o token continuar válido: revalidado a cada
+    STREAM_AUTH_CHECK_SECONDS (os heartbeats garantem a verificação mesmo
+    sem eventos).
+    """
+    checked_at = time.monotonic()
+    async for event in notification_stream.events(user_id, initial):
+        if time.monotonic() - checked_at >= STREAM_AUTH_CHECK_SECONDS:
+            if not await _token_valid(token):
+                return
+            checked_at = time.monotonic()
+        yield event
+
+def _sse_event(event: Optional[Dict[str, Any]]) -> str:
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+@router.websocket("/ws")
+async def notifications_websocket(websocket: WebSocket, token: str = Query(...)):
+    """
+    Push de notificações do usuário atual por WebSocket: contagem de não
+    lidas ao conectar, depois novas notificações e deltas da contagem. A
+    conexão é fechada (1008) quando o token expira ou é revogado.
+    """
+    principal, initial = await _open_stream(token)
+    if principal is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    
+    async def send_events():
+        async for event in _authorized_events(token, principal.user_id, initial):
+            await websocket.send_json(event if event is not None else {'event': 'ping'})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    
+    sender = asyncio.create_task(send_events())
+    try:
+        # Mensagens do cliente são ignoradas; a leitura detecta a desconexão
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+
+@router.get("/stream")
+async def notifications_event_stream(token: str = Query(...)):
+    """
+    Push de notificações do usuário atual por Server-Sent Events (mesmos
+    eventos do WebSocket); o stream termina quando o token expira ou é revogado.
+    """
+    principal, initial = await _open_stream(token)
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    
+    async def event_source():
+        async for event in _authorized_events(token, principal.user_id, initial):
+            yield _sse_event(event)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/", response_model=Dict[str, str])
 async def create_notification(
     notification_data: NotificationCreate,
@@ -574,6 +670,7 @@ async def create_notification_template(
         db.add(template)
         db.commit()
         db.refresh(template)
+        notification_templates.invalidate()
         
         return template
     
@@ -617,6 +714,7 @@ async def update_notification_template(
         
         db.commit()
         db.refresh(template)
+        notification_templates.invalidate()
         
         return template
     
@@ -645,6 +743,7 @@ async def delete_notification_template(
         
         db.delete(template)
         db.commit()
+        notification_templates.invalidate()
         
         return {"message": "Template deletado com sucesso"}
     
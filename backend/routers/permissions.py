@@ -13,6 +13,7 @@ from schemas import (
 )
 from auth import get_current_user
 from encryption import field_encryption
+from principal_cache import principal_cache
 
 router = APIRouter(prefix="/permissions", tags=["Permissions"])
 
@@ -136,6 +137,12 @@ def update_user_role(
     role.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(role)
+    
+    # Principais em cache carregam os papéis atribuídos
+    assigned_users = db.query(UserRoleAssignment.user_id).filter(
+        UserRoleAssignment.role_id == role_id
+    ).all()
+    principal_cache.invalidate_users([user_id for (user_id,) in assigned_users])
     return role
 
 @router.delete("/roles/{role_id}")
@@ -468,6 +475,7 @@ def create_user_role_assignment(
     db.add(db_assignment)
     db.commit()
     db.refresh(db_assignment)
+    principal_cache.invalidate_user(db_assignment.user_id)
     return db_assignment
 
 @router.get("/user-assignments/", response_model=List[UserRoleAssignmentSchema])
@@ -570,6 +578,7 @@ def deactivate_user_role_assignment(
     assignment.deactivated_by = current_user.id
     
     db.commit()
+    principal_cache.invalidate_user(assignment.user_id)
     return {"message": "Atribuição desativada com sucesso"}
 
 @router.put("/user-assignments/{assignment_id}/activate")
@@ -606,6 +615,7 @@ def activate_user_role_assignment(
     assignment.deactivated_by = None
     
     db.commit()
+    principal_cache.invalidate_user(assignment.user_id)
     return {"message": "Atribuição reativada com sucesso"}
 
 # Utility endpoints
@@ -625,6 +625,13 @@ class Patient(PatientBase):
     class Config:
         from_attributes = True
 
+class PatientSearchPage(BaseModel):
+    items: List[Patient]
+    next_cursor: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
 # Doctor Schemas
 class DoctorBase(BaseModel):
     clinic_id: Optional[int] = None
@@ -152,6 +152,9 @@ class NetworkPolicy(BaseSettings):
     blocked_ips: List[str] = Field(default=[])
     rate_limit_requests: int = Field(default=100, ge=10, le=10000)
     rate_limit_window: int = Field(default=60, ge=1, le=3600)  # segundos
+    # Limites específicos: prefixo de rota / tenant -> [requests, window_seconds]
+    rate_limit_routes: Dict[str, List[int]] = Field(default={})
+    rate_limit_tenants: Dict[str, List[int]] = Field(default={})
     enable_cors: bool = True
     cors_origins: List[str] = Field(default=["http://localhost:3000"])
     enable_csrf_protection: bool = True
@@ -399,9 +402,47 @@ def should_require_2fa(user_role: str) -> bool:
     
     return False
 
-def get_rate_limit() -> tuple:
-    """Retorna configuração de rate limiting (requests, window_seconds)"""
-    return (security_config.network.rate_limit_requests, security_config.network.rate_limit_window)
+def get_rate_limit(route: Optional[str] = None, tenant_id: Optional[str] = None) -> tuple:
+    """
+    Retorna configuração de rate limiting (requests, window_seconds).
+
+    Com `tenant_id`, retorna o limite configurado para o tenant; com `route`,
+    o limite da rota de prefixo mais longo. Sem correspondência, retorna o
+    limite padrão.
+    """
+    network = security_config.network
+
+    if tenant_id is not None and str(tenant_id) in network.rate_limit_tenants:
+        requests, window = network.rate_limit_tenants[str(tenant_id)]
+        return (requests, window)
+
+    prefix = get_rate_limit_route(route) if route else None
+    if prefix:
+        requests, window = network.rate_limit_routes[prefix]
+        return (requests, window)
+
+    return (network.rate_limit_requests, network.rate_limit_window)
+
+def get_rate_limit_route(path: str) -> Optional[str]:
+    """Retorna o prefixo de rota com limite próprio que corresponde ao caminho"""
+    matches = [prefix for prefix in security_config.network.rate_limit_routes if path.startswith(prefix)]
+    return max(matches, key=len) if matches else None
+
+def get_rate_limit_rules(route: str, tenant_id: Optional[str] = None) -> List[tuple]:
+    """
+    Retorna as regras de rate limiting de uma requisição como
+    (escopo, requests, window_seconds).
+
+    O escopo "ip" (ou "route:<prefixo>") é contado por cliente; o escopo
+    "tenant:<id>" é compartilhado por todos os clientes do tenant.
+    """
+    prefix = get_rate_limit_route(route)
+    rules = [(f"route:{prefix}" if prefix else "ip", *get_rate_limit(route=route))]
+
+    if tenant_id is not None and str(tenant_id) in security_config.network.rate_limit_tenants:
+        rules.append((f"tenant:{tenant_id}", *get_rate_limit(tenant_id=tenant_id)))
+
+    return rules
 
 def is_ip_allowed(ip_address: str) -> bool:
     """Verifica se um IP é permitido"""
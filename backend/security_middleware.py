@@ -5,8 +5,14 @@ DataClínica - Middleware de Segurança
 Este módulo implementa middlewares de segurança para aplicar automaticamente
 políticas de segurança, rate limiting, validação de IP, cabeçalhos de segurança
 e auditoria em todas as requisições da API.
+
+Os middlewares são ASGI puros (sem BaseHTTPMiddleware): não criam tarefas
+nem reempacotam o corpo da resposta, preservando respostas em streaming.
+Os dados da requisição (IP do cliente, token, sessão, corpo) são calculados
+uma única vez em um RequestContext compartilhado entre as camadas.
 """
 
+import os
 import time
 import json
 import hashlib
@@ -14,95 +20,214 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from fastapi import Request, Response, HTTPException, status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
-import redis
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from sqlalchemy.orm import Session
 
 from database import get_db
-from security_config import get_security_config, is_ip_allowed, get_rate_limit
+from security_config import get_security_config, is_ip_allowed, get_rate_limit_rules
 from audit_logger import audit_logger, AuditEventType, AuditSeverity
-from session_manager import SessionManager
+from session_manager import session_manager, UserSession
+from rate_limiter import rate_limiter, RateLimitDecision
+from attack_detection import attack_detector, AttackMatch
+from auth import cached_principal
+
+CONTEXT_STATE_KEY = "security_context"
+
+class RequestContext:
+    """
+    Dados da requisição compartilhados pelos middlewares de segurança.
 
-class SecurityMiddleware(BaseHTTPMiddleware):
+    Fica em scope["state"] e é acessível nas rotas como
+    request.state.security_context.
+    """
+    
+    def __init__(self, scope: Scope, receive: Receive):
+        self.scope = scope
+        self.request = Request(scope, receive)
+        self.method: str = scope["method"]
+        self.path: str = scope["path"]
+        self.headers = self.request.headers
+        self.client_ip = self._get_client_ip()
+        self.token = self._get_bearer_token()
+        self.session: Optional[UserSession] = None
+        self.body: Optional[bytes] = None
+        self._body_read = False
+    
+    @classmethod
+    def get(cls, scope: Scope, receive: Receive) -> "RequestContext":
+        """Retorna o contexto da requisição, criando-o na primeira camada"""
+        state = scope.setdefault("state", {})
+        context = state.get(CONTEXT_STATE_KEY)
+        if context is None:
+            context = state[CONTEXT_STATE_KEY] = cls(scope, receive)
+        return context
+    
+    async def read_body(self, receive: Receive, max_bytes: int) -> Tuple[Optional[bytes], Receive]:
+        """
+        Lê corpos pequenos e textuais (uma única vez por requisição).
+        
+        Returns:
+            (corpo ou None, receive que reentrega o corpo lido à aplicação)
+        """
+        if self._body_read:
+            return self.body, self._replay_receive(receive)
+        
+        if self.method not in ('POST', 'PUT', 'PATCH'):
+            return None, receive
+        
+        if self.headers.get('content-type', '').startswith('multipart/'):
+            return None, receive  # Uploads de arquivos não são verificados
+        
+        try:
+            content_length = int(self.headers.get('content-length', ''))
+        except ValueError:
+            return None, receive  # Corpo em streaming (chunked)
+        if content_length > max_bytes:
+            return None, receive
+        
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        
+        self.body = b"".join(chunks)
+        self._body_read = True
+        return self.body, self._replay_receive(receive)
+    
+    def _replay_receive(self, receive: Receive) -> Receive:
+        delivered = False
+        
+        async def replay() -> Message:
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": self.body or b"", "more_body": False}
+        
+        return replay
+    
+    def _get_client_ip(self) -> str:
+        """Obtém o IP real do cliente"""
+        # Verificar cabeçalhos de proxy
+        forwarded_for = self.headers.get('X-Forwarded-For')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+        
+        real_ip = self.headers.get('X-Real-IP')
+        if real_ip:
+            return real_ip
+        
+        client = self.scope.get("client")
+        return client[0] if client else "unknown"
+    
+    def _get_bearer_token(self) -> Optional[str]:
+        auth_header = self.headers.get('authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            return auth_header[7:]  # Remover 'Bearer '
+        return None
+
+class SecurityMiddleware:
     """Middleware principal de segurança"""
     
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
+        self.app = app
         self.security_config = get_security_config()
-        self.redis_client = None
-        self.session_manager = SessionManager()
-        
-        # Inicializar Redis para rate limiting
-        try:
-            import redis
-            self.redis_client = redis.Redis(
-                host=os.getenv('REDIS_HOST', 'localhost'),
-                port=int(os.getenv('REDIS_PORT', 6379)),
-                db=int(os.getenv('REDIS_DB', 0)),
-                decode_responses=True
-            )
-        except Exception as e:
-            print(f"Aviso: Redis não disponível para rate limiting: {e}")
+        self.session_manager = session_manager
+        self.rate_limiter = rate_limiter
+        self.attack_detector = attack_detector
+        # Corpo fora da triagem por padrão (como antes): texto clínico livre gera falsos positivos
+        self.screen_body = os.getenv('ATTACK_SCREEN_BODY', 'false').lower() == 'true'
+        self.security_headers = self.security_config.get_security_headers()
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """Processa a requisição aplicando políticas de segurança"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
         start_time = time.time()
+        context = RequestContext.get(scope, receive)
+        request = context.request
+        client_ip = context.client_ip
+        response_started = False
+        status_code = 500
         
         try:
             # 1. Validar IP
-            client_ip = self._get_client_ip(request)
             if not is_ip_allowed(client_ip):
-                return self._create_error_response(
+                response = self._create_error_response(
                     "IP bloqueado",
                     status.HTTP_403_FORBIDDEN,
                     request,
                     start_time
                 )
+                await response(scope, receive, send)
+                return
             
             # 2. Aplicar rate limiting
-            if not await self._check_rate_limit(client_ip, request):
-                return self._create_error_response(
+            rate_limit = await self._check_rate_limit(context)
+            if rate_limit and not rate_limit.allowed:
+                response = self._create_error_response(
                     "Muitas requisições. Tente novamente mais tarde.",
                     status.HTTP_429_TOO_MANY_REQUESTS,
                     request,
                     start_time
                 )
+                response.headers.update(rate_limit.headers())
+                await response(scope, receive, send)
+                return
             
             # 3. Validar tamanho da requisição
             if not self._validate_request_size(request):
-                return self._create_error_response(
+                response = self._create_error_response(
                     "Requisição muito grande",
                     status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                     request,
                     start_time
                 )
+                await response(scope, receive, send)
+                return
             
             # 4. Detectar ataques comuns
-            if self._detect_attack_patterns(request):
+            attack, receive = await self._detect_attack_patterns(context, receive)
+            if attack:
                 await self._log_security_event(
                     request,
-                    "Padrão de ataque detectado",
+                    f"Padrão de ataque detectado ({attack.category} em {attack.target})",
                     AuditSeverity.HIGH,
                     client_ip
                 )
-                return self._create_error_response(
+                response = self._create_error_response(
                     "Requisição suspeita bloqueada",
                     status.HTTP_400_BAD_REQUEST,
                     request,
                     start_time
                 )
-            
-            # 5. Processar requisição
-            response = await call_next(request)
-            
-            # 6. Aplicar cabeçalhos de segurança
-            self._apply_security_headers(response)
+                await response(scope, receive, send)
+                return
+            
+            # 5. Processar requisição, aplicando cabeçalhos de segurança (6)
+            async def send_wrapper(message: Message):
+                nonlocal response_started, status_code
+                if message["type"] == "http.response.start":
+                    response_started = True
+                    status_code = message["status"]
+                    headers = MutableHeaders(scope=message)
+                    self._apply_security_headers(headers)
+                    if rate_limit:
+                        headers.update(rate_limit.headers())
+                await send(message)
+            
+            await self.app(scope, receive, send_wrapper)
             
             # 7. Auditar requisição (se necessário)
-            await self._audit_request(request, response, start_time, client_ip)
-            
-            return response
+            await self._audit_request(context, status_code, start_time)
             
         except Exception as e:
             # Log do erro
@@ -113,64 +238,46 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                 client_ip
             )
             
-            return self._create_error_response(
+            if response_started:
+                raise  # A resposta já começou a ser enviada
+            
+            response = self._create_error_response(
                 "Erro interno do servidor",
                 status.HTTP_500_INTERNAL_SERVER_ERROR,
                 request,
                 start_time
             )
+            await response(scope, receive, send)
     
-    def _get_client_ip(self, request: Request) -> str:
-        """Obtém o IP real do cliente"""
-        # Verificar cabeçalhos de proxy
-        forwarded_for = request.headers.get('X-Forwarded-For')
-        if forwarded_for:
-            return forwarded_for.split(',')[0].strip()
-        
-        real_ip = request.headers.get('X-Real-IP')
-        if real_ip:
-            return real_ip
-        
-        return request.client.host if request.client else "unknown"
-    
-    async def _check_rate_limit(self, client_ip: str, request: Request) -> bool:
-        """Verifica rate limiting"""
-        if not self.redis_client:
-            return True  # Se Redis não estiver disponível, permitir
-        
+    async def _check_rate_limit(self, context: RequestContext) -> Optional[RateLimitDecision]:
+        """Verifica rate limiting (regras por cliente/rota e por tenant)"""
+        request = context.request
+        client_ip = context.client_ip
         try:
-            requests_limit, window_seconds = get_rate_limit()
-            
-            # Chave única para o IP
-            key = f"rate_limit:{client_ip}"
-            
-            # Obter contagem atual
-            current_requests = self.redis_client.get(key)
+            # Tenant do principal autenticado, nunca de um cabeçalho enviado pelo cliente
+            principal = cached_principal(context.token)
+            tenant_id = principal.clinic_id if principal else None
+            rules = [
+                (scope if scope.startswith('tenant:') else f"{scope}:{client_ip}", requests_limit, window_seconds)
+                for scope, requests_limit, window_seconds in get_rate_limit_rules(request.url.path, tenant_id)
+            ]
             
-            if current_requests is None:
-                # Primeira requisição na janela
-                self.redis_client.setex(key, window_seconds, 1)
-                return True
+            decision = await self.rate_limiter.hit(rules)
             
-            current_requests = int(current_requests)
-            
-            if current_requests >= requests_limit:
+            if not decision.allowed:
                 # Limite excedido
                 await self._log_security_event(
                     request,
-                    f"Rate limit excedido: {current_requests}/{requests_limit}",
+                    f"Rate limit excedido: limite de {decision.limit} requisições",
                     AuditSeverity.MEDIUM,
                     client_ip
                 )
-                return False
             
-            # Incrementar contador
-            self.redis_client.incr(key)
-            return True
+            return decision
             
         except Exception as e:
             print(f"Erro no rate limiting: {e}")
-            return True  # Em caso de erro, permitir
+            return None  # Em caso de erro, permitir
     
     def _validate_request_size(self, request: Request) -> bool:
         """Valida o tamanho da requisição"""
@@ -184,88 +291,35 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                 return False
         return True
     
-    def _detect_attack_patterns(self, request: Request) -> bool:
-        """Detecta padrões de ataque comuns"""
-        url = str(request.url)
-        user_agent = request.headers.get('user-agent', '').lower()
-        
-        # Padrões suspeitos na URL
-        suspicious_patterns = [
-            # SQL Injection
-            "union select", "drop table", "insert into", "delete from",
-            "' or '1'='1", "' or 1=1", "'; drop", "' union",
-            
-            # XSS
-            "<script", "javascript:", "onerror=", "onload=",
-            "alert(", "document.cookie", "eval(",
-            
-            # Path Traversal
-            "../", "..%2f", "..%5c", "%2e%2e%2f",
-            
-            # Command Injection
-            "; cat", "; ls", "; rm", "; wget", "; curl",
-            "| cat", "| ls", "| rm", "| wget", "| curl",
-            
-            # LDAP Injection
-            "*)(uid=*", "*)(cn=*", ")(|(uid=*",
-            
-            # XML Injection
-            "<!entity", "<!doctype", "<![cdata["
-        ]
-        
-        # Verificar URL
-        url_lower = url.lower()
-        for pattern in suspicious_patterns:
-            if pattern in url_lower:
-                return True
-        
-        # Verificar User-Agent suspeito
-        suspicious_agents = [
-            "sqlmap", "nikto", "nmap", "masscan", "zap",
-            "burp", "w3af", "acunetix", "nessus", "openvas",
-            "python-requests", "curl", "wget", "bot", "crawler"
-        ]
-        
-        for agent in suspicious_agents:
-            if agent in user_agent:
-                return True
-        
-        # Verificar cabeçalhos suspeitos
-        suspicious_headers = {
-            'x-forwarded-for': ['127.0.0.1', 'localhost', '0.0.0.0'],
-            'x-real-ip': ['127.0.0.1', 'localhost', '0.0.0.0'],
-            'x-originating-ip': ['127.0.0.1', 'localhost', '0.0.0.0']
-        }
-        
-        for header, suspicious_values in suspicious_headers.items():
-            header_value = request.headers.get(header, '').lower()
-            if any(value in header_value for value in suspicious_values):
-                return True
-        
-        return False
+    async def _detect_attack_patterns(self, context: RequestContext, receive: Receive) -> Tuple[Optional[AttackMatch], Receive]:
+        """Detecta padrões de ataque comuns na URL, cabeçalhos e corpo"""
+        body = None
+        if self.screen_body:
+            body, receive = await context.read_body(receive, self.attack_detector.max_body_chars)
+        return self.attack_detector.scan(str(context.request.url), context.headers, body), receive
     
-    def _apply_security_headers(self, response: Response):
+    def _apply_security_headers(self, headers: MutableHeaders):
         """Aplica cabeçalhos de segurança"""
-        security_headers = self.security_config.get_security_headers()
-        
-        for header, value in security_headers.items():
-            response.headers[header] = value
+        for header, value in self.security_headers.items():
+            headers[header] = value
         
         # Remover cabeçalhos que podem vazar informações
         headers_to_remove = ['server', 'x-powered-by', 'x-aspnet-version']
         for header in headers_to_remove:
-            if header in response.headers:
-                del response.headers[header]
+            if header in headers:
+                del headers[header]
     
-    async def _audit_request(self, request: Request, response: Response, start_time: float, client_ip: str):
+    async def _audit_request(self, context: RequestContext, status_code: int, start_time: float):
         """Audita a requisição se necessário"""
+        request = context.request
+        client_ip = context.client_ip
         try:
             # Calcular tempo de resposta
             response_time_ms = int((time.time() - start_time) * 1000)
             
             # Determinar se deve auditar
             should_audit = (
-                response.status_code >= 400 or  # Erros
+                status_code >= 400 or  # Erros
                 request.method in ['POST', 'PUT', 'DELETE', 'PATCH'] or  # Operações de modificação
                 '/admin' in str(request.url) or  # Endpoints administrativos
                 '/auth' in str(request.url) or  # Endpoints de autenticação
@@ -279,21 +333,16 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                 user_role = None
                 session_id = None
                 
-                # Tentar extrair do token JWT ou sessão
-                auth_header = request.headers.get('authorization')
-                if auth_header and auth_header.startswith('Bearer '):
-                    try:
-                        # Aqui você pode decodificar o JWT para obter informações do usuário
-                        # Por simplicidade, vamos deixar como None por enquanto
-                        pass
-                    except:
-                        pass
+                # Usar a sessão validada pelo SessionValidationMiddleware
+                if context.session is not None:
+                    user_id = context.session.user_id
+                    session_id = str(context.session.id)
                 
                 # Determinar severidade
                 severity = AuditSeverity.LOW
-                if response.status_code >= 500:
+                if status_code >= 500:
                     severity = AuditSeverity.HIGH
-                elif response.status_code >= 400:
+                elif status_code >= 400:
                     severity = AuditSeverity.MEDIUM
                 elif request.method in ['DELETE']:
                     severity = AuditSeverity.MEDIUM
@@ -304,7 +353,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                     event_type = AuditEventType.LOGIN_ATTEMPT
                 elif '/auth/logout' in str(request.url):
                     event_type = AuditEventType.LOGOUT
-                elif response.status_code >= 400:
+                elif status_code >= 400:
                     event_type = AuditEventType.SECURITY_VIOLATION
                 
                 # Obter sessão do banco de dados
@@ -314,7 +363,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                 audit_logger.log_event(
                     db=db,
                     event_type=event_type,
-                    description=f"{request.method} {request.url.path} - Status: {response.status_code}",
+                    description=f"{request.method} {request.url.path} - Status: {status_code}",
                     user_id=user_id,
                     username=username,
                     user_role=user_role,
@@ -322,7 +371,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                     ip_address=client_ip,
                     endpoint=str(request.url.path),
                     http_method=request.method,
-                    status_code=response.status_code,
+                    status_code=status_code,
                     response_time_ms=response_time_ms,
                     severity=severity,
                     metadata={
@@ -379,44 +428,50 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         )
         
         # Aplicar cabeçalhos de segurança
-        self._apply_security_headers(response)
+        self._apply_security_headers(response.headers)
         
         return response
 
-class CSRFMiddleware(BaseHTTPMiddleware):
+class CSRFMiddleware:
     """Middleware de proteção CSRF"""
     
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
+        self.app = app
         self.security_config = get_security_config()
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """Verifica proteção CSRF"""
-        if not self.security_config.network.enable_csrf_protection:
-            return await call_next(request)
+        if scope["type"] != "http" or not self.security_config.network.enable_csrf_protection:
+            await self.app(scope, receive, send)
+            return
+        
+        context = RequestContext.get(scope, receive)
         
         # Métodos que precisam de proteção CSRF
-        if request.method in ['POST', 'PUT', 'DELETE', 'PATCH']:
+        if context.method in ['POST', 'PUT', 'DELETE', 'PATCH']:
             # Verificar se é uma requisição AJAX
-            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return await call_next(request)
+            if context.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                await self.app(scope, receive, send)
+                return
             
             # Verificar token CSRF
-            csrf_token = request.headers.get('X-CSRF-Token')
+            csrf_token = context.headers.get('X-CSRF-Token')
             if not csrf_token:
                 # Tentar obter do formulário
-                if request.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+                if context.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
                     # Aqui você implementaria a lógica para extrair do corpo da requisição
                     pass
             
             # Validar token CSRF (implementação simplificada)
-            if not self._validate_csrf_token(csrf_token, request):
-                return JSONResponse(
+            if not self._validate_csrf_token(csrf_token, context.request):
+                response = JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"error": "Token CSRF inválido ou ausente"}
                 )
+                await response(scope, receive, send)
+                return
         
-        return await call_next(request)
+        await self.app(scope, receive, send)
     
     def _validate_csrf_token(self, token: str, request: Request) -> bool:
         """Valida token CSRF"""
@@ -432,19 +487,21 @@ class CSRFMiddleware(BaseHTTPMiddleware):
         except:
             return False
 
-class CORSMiddleware(BaseHTTPMiddleware):
+class CORSMiddleware:
     """Middleware de CORS customizado"""
     
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
+        self.app = app
         self.security_config = get_security_config()
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """Aplica políticas de CORS"""
-        if not self.security_config.network.enable_cors:
-            return await call_next(request)
+        if scope["type"] != "http" or not self.security_config.network.enable_cors:
+            await self.app(scope, receive, send)
+            return
         
-        origin = request.headers.get('origin')
+        context = RequestContext.get(scope, receive)
+        origin = context.headers.get('origin')
         
         # Verificar se a origem é permitida
         allowed_origins = self.security_config.network.cors_origins
@@ -454,7 +511,7 @@ class CORSMiddleware(BaseHTTPMiddleware):
             origin in allowed_origins  # Se a origem está na lista
         )
         
-        if request.method == 'OPTIONS':
+        if context.method == 'OPTIONS':
             # Requisição preflight
             if is_allowed_origin:
                 response = Response()
@@ -462,91 +519,90 @@ class CORSMiddleware(BaseHTTPMiddleware):
                 response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
                 response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, X-CSRF-Token'
                 response.headers['Access-Control-Max-Age'] = '86400'  # 24 horas
-                return response
             else:
-                return JSONResponse(
+                response = JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"error": "Origem não permitida"}
                 )
+            await response(scope, receive, send)
+            return
         
         # Processar requisição normal
         if not is_allowed_origin:
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=status.HTTP_403_FORBIDDEN,
                 content={"error": "Origem não permitida"}
             )
-        
-        response = await call_next(request)
-        
-        # Adicionar cabeçalhos CORS
-        if origin:
-            response.headers['Access-Control-Allow-Origin'] = origin
-        response.headers['Access-Control-Allow-Credentials'] = 'true'
-        
-        return response
+            await response(scope, receive, send)
+            return
+        
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                # Adicionar cabeçalhos CORS
+                headers = MutableHeaders(scope=message)
+                if origin:
+                    headers['Access-Control-Allow-Origin'] = origin
+                headers['Access-Control-Allow-Credentials'] = 'true'
+            await send(message)
+        
+        await self.app(scope, receive, send_wrapper)
 
-class SessionValidationMiddleware(BaseHTTPMiddleware):
+class SessionValidationMiddleware:
     """Middleware de validação de sessão"""
     
+    # Endpoints que não precisam de validação de sessão
+    PUBLIC_ENDPOINTS = (
+        '/docs', '/redoc', '/openapi.json',
+        '/auth/login', '/auth/register', '/auth/forgot-password',
+        '/health', '/status'
+    )
+    
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
-        self.session_manager = SessionManager()
+        self.app = app
+        self.session_manager = session_manager
         self.security_config = get_security_config()
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         """Valida sessões ativas"""
-        # Endpoints que não precisam de validação de sessão
-        public_endpoints = [
-            '/docs', '/redoc', '/openapi.json',
-            '/auth/login', '/auth/register', '/auth/forgot-password',
-            '/health', '/status'
-        ]
-        
-        if any(request.url.path.startswith(endpoint) for endpoint in public_endpoints):
-            return await call_next(request)
+        if scope["type"] != "http" or scope["path"].startswith(self.PUBLIC_ENDPOINTS):
+            await self.app(scope, receive, send)
+            return
         
         # Obter token de autorização
-        auth_header = request.headers.get('authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return await call_next(request)  # Deixar para o middleware de auth tratar
-        
-        token = auth_header[7:]  # Remover 'Bearer '
+        context = RequestContext.get(scope, receive)
+        if not context.token or self._is_jwt(context.token):
+            # Sem token ou JWT de acesso (sem linha em user_sessions): deixar para o auth tratar
+            await self.app(scope, receive, send)
+            return
         
         try:
-            # Validar sessão
-            db = next(get_db())
+            # Valida o token opaco do SessionManager numa thread, pois um cache miss consulta o banco
+            context.session = await run_in_threadpool(self._validate_session, context.token)
             
-            # Aqui você implementaria a lógica de validação da sessão
-            # Por exemplo, verificar se a sessão ainda é válida
-            session_valid = await self.session_manager.validate_session(
-                db, token, self._get_client_ip(request)
-            )
-            
-            if not session_valid:
-                db.close()
-                return JSONResponse(
+            if context.session is None:
+                response = JSONResponse(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     content={"error": "Sessão inválida ou expirada"}
                 )
-            
-            db.close()
+                await response(scope, receive, send)
+                return
             
         except Exception as e:
             print(f"Erro na validação de sessão: {e}")
         
-        return await call_next(request)
+        await self.app(scope, receive, send)
     
-    def _get_client_ip(self, request: Request) -> str:
-        """Obtém o IP real do cliente"""
-        forwarded_for = request.headers.get('X-Forwarded-For')
-        if forwarded_for:
-            return forwarded_for.split(',')[0].strip()
-        
-        real_ip = request.headers.get('X-Real-IP')
-        if real_ip:
-            return real_ip
-        
-        return request.client.host if request.client else "unknown"
+    @staticmethod
+    def _is_jwt(token: str) -> bool:
+        """JWT (cabeçalho.payload.assinatura); tokens de sessão não contêm pontos"""
+        return token.count('.') == 2
+    
+    def _validate_session(self, token: str) -> Optional[UserSession]:
+        db = next(get_db())
+        try:
+            return self.session_manager.validate_session(db, token)
+        finally:
+            db.close()
 
 # Função para aplicar todos os middlewares
 def apply_security_middlewares(app):
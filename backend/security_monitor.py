@@ -16,14 +16,16 @@ from enum import Enum
 from collections import defaultdict, deque
 import hashlib
 import ipaddress
-import re
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
 
 from .models import User, UserSession, AuditLog
 from .audit_logger import AuditLogger, EventType, EventSeverity
 from .session_manager import SessionManager
-from .security_config import SecurityConfig
+from .security_config import SecurityConfig, get_rate_limit
+from .rate_limiter import rate_limiter
+from .attack_detection import attack_detector
+from .principal_cache import principal_cache
 
 class ThreatLevel(str, Enum):
     """Níveis de ameaça"""
@@ -91,6 +93,14 @@ class UserBehaviorProfile:
 class SecurityMonitor:
     """Monitor de segurança em tempo real"""
     
+    # Categoria do detector de ataques -> (tipo de ameaça, nível, descrição)
+    ATTACK_THREATS = {
+        'sql_injection': (ThreatType.SQL_INJECTION, ThreatLevel.HIGH, "SQL Injection"),
+        'xss': (ThreatType.XSS_ATTEMPT, ThreatLevel.MEDIUM, "XSS"),
+        'path_traversal': (ThreatType.UNUSUAL_ACTIVITY, ThreatLevel.MEDIUM, "Path Traversal"),
+        'command_injection': (ThreatType.UNUSUAL_ACTIVITY, ThreatLevel.HIGH, "Command Injection")
+    }
+    
     def __init__(self, db: Session, config: SecurityConfig):
         self.db = db
         self.config = config
@@ -99,27 +109,10 @@ class SecurityMonitor:
         
         # Armazenamento em memória para análise em tempo real
         self.failed_login_attempts: Dict[str, deque] = defaultdict(lambda: deque(maxlen=100))
-        self.request_counts: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
+        self.rate_limiter = rate_limiter
         self.user_profiles: Dict[int, UserBehaviorProfile] = {}
         self.blocked_ips: Set[str] = set()
-        self.suspicious_patterns: Dict[str, List[str]] = {
-            'sql_injection': [
-                r"('|(\-\-)|(;)|(\||\|)|(\*|\*))",
-                r"(union|select|insert|delete|update|drop|create|alter|exec|execute)",
-                r"(script|javascript|vbscript|onload|onerror|onclick)"
-            ],
-            'xss': [
-                r"<script[^>]*>.*?</script>",
-                r"javascript:\s*[^\s]",
-                r"on\w+\s*=\s*['\"][^'\"]*['\"]?"
-            ],
-            'path_traversal': [
-                r"\.\./",
-                r"\.\.\\\\",
-                r"%2e%2e%2f",
-                r"%2e%2e%5c"
-            ]
-        }
+        self.attack_detector = attack_detector
         
         # Métricas de segurança
         self.security_metrics = {
@@ -168,22 +161,20 @@ class SecurityMonitor:
     async def monitor_request(self, ip: str, endpoint: str, method: str, 
                             user_id: Optional[int] = None, payload: str = "") -> Optional[SecurityEvent]:
         """Monitora requisições HTTP"""
-        current_time = datetime.now()
+        # Rate limiting (mesmo mecanismo do SecurityMiddleware)
+        requests_limit, window_seconds = get_rate_limit(route=endpoint)
+        decision = await self.rate_limiter.hit([(f"monitor:{ip}", requests_limit, window_seconds)])
         
-        # Rate limiting
-        self.request_counts[ip].append(current_time)
-        recent_requests = [t for t in self.request_counts[ip] 
-                          if current_time - t <= timedelta(minutes=1)]
-        
-        if len(recent_requests) > self.config.security.rate_limit_requests:
+        if not decision.allowed:
             return await self._create_security_event(
                 ThreatType.DDoS_ATTACK,
                 ThreatLevel.MEDIUM,
                 ip,
                 user_id,
-                f"Rate limit excedido: {len(recent_requests)} requisições por minuto",
+                f"Rate limit excedido: mais de {requests_limit} requisições em {window_seconds}s",
                 {
-                    'requests_count': len(recent_requests),
+                    'requests_limit': requests_limit,
+                    'window_seconds': window_seconds,
                     'endpoint': endpoint,
                     'method': method
                 },
@@ -325,60 +316,29 @@ class SecurityMonitor:
     async def _detect_malicious_patterns(self, ip: str, endpoint: str, payload: str, 
                                        user_id: Optional[int] = None) -> Optional[SecurityEvent]:
         """Detecta padrões maliciosos no payload"""
-        payload_lower = payload.lower()
-        
-        # SQL Injection
-        for pattern in self.suspicious_patterns['sql_injection']:
-            if re.search(pattern, payload_lower, re.IGNORECASE):
-                return await self._create_security_event(
-                    ThreatType.SQL_INJECTION,
-                    ThreatLevel.HIGH,
-                    ip,
-                    user_id,
-                    f"Tentativa de SQL Injection detectada em {endpoint}",
-                    {
-                        'endpoint': endpoint,
-                        'pattern_matched': pattern,
-                        'payload_sample': payload[:200]
-                    },
-                    [ResponseAction.BLOCK_IP, ResponseAction.ALERT_ADMIN]
-                )
-        
-        # XSS
-        for pattern in self.suspicious_patterns['xss']:
-            if re.search(pattern, payload, re.IGNORECASE):
-                return await self._create_security_event(
-                    ThreatType.XSS_ATTEMPT,
-                    ThreatLevel.MEDIUM,
-                    ip,
-                    user_id,
-                    f"Tentativa de XSS detectada em {endpoint}",
-                    {
-                        'endpoint': endpoint,
-                        'pattern_matched': pattern,
-                        'payload_sample': payload[:200]
-                    },
-                    [ResponseAction.BLOCK_IP, ResponseAction.ALERT_ADMIN]
-                )
+        match = self.attack_detector.scan_text(payload)
+        if not match:
+            return None
         
-        # Path Traversal
-        for pattern in self.suspicious_patterns['path_traversal']:
-            if re.search(pattern, payload, re.IGNORECASE):
-                return await self._create_security_event(
-                    ThreatType.UNUSUAL_ACTIVITY,
-                    ThreatLevel.MEDIUM,
-                    ip,
-                    user_id,
-                    f"Tentativa de Path Traversal detectada em {endpoint}",
-                    {
-                        'endpoint': endpoint,
-                        'pattern_matched': pattern,
-                        'payload_sample': payload[:200]
-                    },
-                    [ResponseAction.BLOCK_IP, ResponseAction.ALERT_ADMIN]
-                )
+        threat_type, threat_level, label = self.ATTACK_THREATS.get(
+            match.category,
+            (ThreatType.UNUSUAL_ACTIVITY, ThreatLevel.MEDIUM, match.category)
+        )
         
-        return None
+        return await self._create_security_event(
+            threat_type,
+            threat_level,
+            ip,
+            user_id,
+            f"Tentativa de {label} detectada em {endpoint}",
+            {
+                'endpoint': endpoint,
+                'category': match.category,
+                'pattern_matched': match.matched,
+                'payload_sample': payload[:200]
+            },
+            [ResponseAction.BLOCK_IP, ResponseAction.ALERT_ADMIN]
+        )
     
     async def _detect_privilege_escalation(self, user_id: int, action: str, 
                                          details: Dict[str, Any]) -> Optional[SecurityEvent]:
@@ -551,6 +511,7 @@ class SecurityMonitor:
         if user:
             user.is_active = False
             self.db.commit()
+            principal_cache.invalidate_user(user_id)
     
     async def _force_logout_user(self, user_id: int):
         """Força logout do usuário"""
@@ -623,15 +584,6 @@ class SecurityMonitor:
             if not self.failed_login_attempts[ip]:
                 del self.failed_login_attempts[ip]
         
-        # Limpar contadores de requisição
-        for ip in list(self.request_counts.keys()):
-            self.request_counts[ip] = deque(
-                [t for t in self.request_counts[ip] if t > cutoff_date],
-                maxlen=1000
-            )
-            if not self.request_counts[ip]:
-                del self.request_counts[ip]
-        
         # Limpar perfis de usuário inativos
         for user_id in list(self.user_profiles.keys()):
             profile = self.user_profiles[user_id]
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+DataClínica - Cache de Sessões em Dois Níveis
+
+Este módulo implementa o cache usado pelo SessionManager:
+- Nível local: cache em memória do processo com TTL e descarte LRU
+- Nível compartilhado: Redis, com invalidação entre processos via pub/sub
+
+As entradas são dicionários serializáveis em JSON; a conversão para
+UserSession fica a cargo do SessionManager.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_PREFIX = "session:"
+INVALIDATION_CHANNEL = "session:invalidate"
+
+class LocalSessionCache:
+    """Cache em memória com TTL e limite de entradas (LRU)"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        ttl = min(ttl_seconds, self.ttl_seconds) if ttl_seconds is not None else self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class TwoTierSessionCache:
+    """
+    Cache de sessões com nível local e Redis.
+
+    Leituras consultam primeiro o nível local e depois o Redis (promovendo a
+    entrada para o nível local). Invalidações removem a entrada dos dois
+    níveis e são publicadas no canal de invalidação para os demais processos.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        local_ttl_seconds: Optional[float] = None,
+        local_max_entries: Optional[int] = None
+    ):
+        self.redis_client = redis_client
+        self.redis_retry_seconds = float(os.getenv("SESSION_REDIS_RETRY_SECONDS", "30"))
+        self._redis_retry_at = 0.0
+        self.local = LocalSessionCache(
+            max_entries=local_max_entries or int(os.getenv("SESSION_LOCAL_CACHE_SIZE", "10000")),
+            ttl_seconds=local_ttl_seconds or float(os.getenv("SESSION_LOCAL_CACHE_TTL_SECONDS", "30"))
+        )
+
+        self._pubsub = None
+        self._pubsub_thread = None
+        self._subscribe()
+
+        # Métricas
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get(self, session_token: str) -> Optional[Dict[str, Any]]:
+        """Busca a sessão nos dois níveis"""
+        value = self.local.get(session_token)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        if self._redis_available():
+            try:
+                cached = self.redis_client.get(SESSION_KEY_PREFIX + session_token)
+                if cached:
+                    value = json.loads(cached)
+                    self.local.set(session_token, value)
+                    self.redis_hits += 1
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+
+        self.misses += 1
+        return None
+
+    def set(self, session_token: str, value: Dict[str, Any], ttl_seconds: int):
+        """Armazena a sessão nos dois níveis"""
+        if ttl_seconds <= 0:
+            return
+
+        self.local.set(session_token, value, ttl_seconds)
+
+        if self._redis_available():
+            try:
+                self.redis_client.setex(SESSION_KEY_PREFIX + session_token, ttl_seconds, json.dumps(value))
+            except Exception as e:
+                self._redis_failed(e)
+
+    def update_local(self, session_token: str, value: Dict[str, Any]):
+        """Atualiza apenas o nível local (ex.: última atividade)"""
+        self.local.set(session_token, value)
+
+    def invalidate(self, session_token: str):
+        """Remove a sessão dos dois níveis e notifica os demais processos"""
+        self.local.delete(session_token)
+
+        if self.redis_client:
+            # Invalidações sempre tentam o Redis, mesmo após falhas recentes
+            try:
+                self.redis_client.delete(SESSION_KEY_PREFIX + session_token)
+                self.redis_client.publish(INVALIDATION_CHANNEL, session_token)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Retorna métricas de acerto do cache"""
+        total = self.local_hits + self.redis_hits + self.misses
+        return {
+            'local_entries': len(self.local),
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.local_hits + self.redis_hits) / total, 4) if total else 0.0,
+            'invalidation_listener': bool(self._pubsub_thread and self._pubsub_thread.is_alive())
+        }
+
+    def close(self):
+        """Encerra a escuta de invalidações"""
+        if self._pubsub_thread:
+            self._pubsub_thread.stop()
+            self._pubsub_thread = None
+        if self._pubsub:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def _redis_available(self) -> bool:
+        """Evita consultar o Redis logo após uma falha (uso somente do nível local)"""
+        return bool(self.redis_client) and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, error: Exception):
+        logger.error(f"Erro no cache Redis de sessões: {error}")
+        self._redis_retry_at = time.monotonic() + self.redis_retry_seconds
+
+    def _subscribe(self):
+        """Escuta invalidações publicadas por outros processos"""
+        if not self.redis_client:
+            return
+
+        try:
+            self._pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            logger.warning(f"Invalidação de sessões via pub/sub indisponível: {e}")
+            self._pubsub = None
+            self._pubsub_thread = None
+
+    def _on_invalidation(self, message: Dict[str, Any]):
+        token = message.get("data")
+        if isinstance(token, bytes):
+            token = token.decode()
+        if token:
+            self.local.delete(token)
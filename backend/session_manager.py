@@ -11,13 +11,14 @@ Este módulo implementa controle avançado de sessões com recursos como:
 """
 
 import os
-import json
+import atexit
 import hashlib
 import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON, update
 from sqlalchemy.orm import relationship
 import redis
 import logging
@@ -25,8 +26,9 @@ from user_agents import parse
 import geoip2.database
 import geoip2.errors
 
-from database import Base, get_db
+from database import Base, get_db, SessionLocal
 from models import User
+from session_cache import TwoTierSessionCache
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -37,7 +39,9 @@ class UserSession(Base):
     __tablename__ = "user_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # User pertence a outra declarative_base (models.Base): a chave estrangeira
+    # referencia a coluna e não há relationship, que não resolveria "User" aqui
+    user_id = Column(Integer, ForeignKey(User.id), nullable=False)
     session_token = Column(String(255), unique=True, index=True, nullable=False)
     refresh_token = Column(String(255), unique=True, index=True)
     
@@ -72,7 +76,6 @@ class UserSession(Base):
     session_metadata = Column(JSON)
     
     # Relacionamentos
-    user = relationship("User")
     activities = relationship("SessionActivity", back_populates="session")
     
     def __repr__(self):
@@ -120,6 +123,92 @@ class SessionActivity(Base):
     def __repr__(self):
         return f"<SessionActivity(session_id={self.session_id}, type={self.activity_type})>"
 
+class SessionActivityBuffer:
+    """
+    Agrupa atualizações de last_activity das sessões.
+    
+    Cada requisição apenas registra o horário em memória; uma thread grava
+    periodicamente todas as sessões tocadas com um único UPDATE em lote.
+    """
+    
+    def __init__(self, session_factory=None, flush_interval_seconds: Optional[float] = None):
+        self.session_factory = session_factory or SessionLocal
+        self.flush_interval_seconds = flush_interval_seconds or float(
+            os.getenv("SESSION_ACTIVITY_FLUSH_SECONDS", "30")
+        )
+        
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        """Inicia a thread de gravação periódica"""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="session-activity-writer",
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.shutdown)
+    
+    def touch(self, session_id: int, timestamp: Optional[datetime] = None):
+        """Registra atividade de uma sessão"""
+        with self._lock:
+            self._pending[session_id] = timestamp or datetime.utcnow()
+    
+    def pending_activity(self, session_id: int) -> Optional[datetime]:
+        """Última atividade registrada e ainda não gravada"""
+        return self._pending.get(session_id)
+    
+    def flush(self) -> int:
+        """
+        Grava as atividades pendentes.
+        
+        Returns:
+            Número de sessões atualizadas
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(UserSession),
+                [{"id": session_id, "last_activity": timestamp} for session_id, timestamp in pending.items()]
+            )
+            db.commit()
+            return len(pending)
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Erro ao gravar atividade das sessões: {e}")
+            
+            # Devolver as atualizações sem sobrescrever atividades mais recentes
+            with self._lock:
+                for session_id, timestamp in pending.items():
+                    self._pending.setdefault(session_id, timestamp)
+            return 0
+            
+        finally:
+            db.close()
+    
+    def shutdown(self):
+        """Interrompe a thread e grava as atividades pendentes"""
+        self._stopped.set()
+        self.flush()
+    
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval_seconds):
+            self.flush()
+
 class SessionManager:
     """Gerenciador de sessões avançado"""
     
@@ -130,6 +219,11 @@ class SessionManager:
         self.inactive_timeout_minutes = int(os.getenv("INACTIVE_TIMEOUT_MINUTES", "60"))  # 1 hora
         self.geoip_db_path = os.getenv("GEOIP_DB_PATH", "GeoLite2-City.mmdb")
         
+        # Cache em dois níveis (memória local + Redis) e gravação agrupada de atividade
+        self.cache = TwoTierSessionCache(self.redis_client)
+        self.activity_buffer = SessionActivityBuffer()
+        self.activity_buffer.start()
+        
         # Carregar banco de dados GeoIP se disponível
         self.geoip_reader = None
         try:
@@ -142,6 +236,12 @@ class SessionManager:
         """Obtém cliente Redis"""
         try:
             redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+            
+            # Substituto local para testes e desenvolvimento
+            if redis_url.startswith("fakeredis://"):
+                import fakeredis
+                return fakeredis.FakeRedis(decode_responses=True)
+            
             return redis.from_url(redis_url, decode_responses=True)
         except Exception as e:
             logger.warning(f"Redis não disponível: {e}")
@@ -223,9 +323,8 @@ class SessionManager:
                 ip_address=ip_address, user_agent=user_agent
             )
             
-            # Armazenar no Redis para acesso rápido
-            if self.redis_client:
-                self._cache_session(session)
+            # Armazenar no cache para acesso rápido
+            self._cache_session(session)
             
             logger.info(f"Sessão criada para usuário {user_id}: {session_token[:8]}...")
             
@@ -251,21 +350,28 @@ class SessionManager:
         """
         Valida uma sessão e retorna informações do usuário.
         
+        A sessão é buscada no cache local, depois no Redis e por último no
+        banco. A última atividade é registrada em memória e gravada em lote
+        pelo SessionActivityBuffer, sem commit por requisição.
+        
         Args:
             db: Sessão do banco de dados
             session_token: Token da sessão
             
         Returns:
-            Objeto UserSession se válida, None caso contrário
+            Objeto UserSession se válida, None caso contrário. Sessões vindas
+            do cache são objetos desanexados da sessão do banco.
         """
         try:
+            now = datetime.utcnow()
+            
             # Tentar buscar no cache primeiro
-            if self.redis_client:
-                cached_session = self._get_cached_session(session_token)
-                if cached_session:
-                    return cached_session
+            cached_session = self._get_cached_session(session_token)
+            if cached_session and self._is_usable(cached_session, now):
+                self._record_activity(cached_session, now)
+                return cached_session
             
-            # Buscar no banco de dados
+            # Buscar no banco de dados (cache ausente ou possivelmente desatualizado)
             session = db.query(UserSession).filter(
                 UserSession.session_token == session_token,
                 UserSession.is_active == True,
@@ -280,18 +386,18 @@ class SessionManager:
                 self.terminate_session(db, session_token, "expired")
                 return None
             
-            # Verificar inatividade
-            if session.time_since_last_activity.total_seconds() > (self.inactive_timeout_minutes * 60):
+            # Verificar inatividade (considerando atividade ainda não gravada)
+            last_activity = max(
+                session.last_activity,
+                self.activity_buffer.pending_activity(session.id) or session.last_activity
+            )
+            if (now - last_activity).total_seconds() > (self.inactive_timeout_minutes * 60):
                 self.terminate_session(db, session_token, "inactive")
                 return None
             
-            # Atualizar última atividade
-            session.last_activity = datetime.utcnow()
-            db.commit()
-            
-            # Atualizar cache
-            if self.redis_client:
-                self._cache_session(session)
+            # Atualizar cache e registrar atividade
+            self._cache_session(session, last_activity=now)
+            self._record_activity(session, now, persisted=True)
             
             return session
             
@@ -299,6 +405,10 @@ class SessionManager:
             logger.error(f"Erro ao validar sessão: {e}")
             return None
     
+    def get_cache_metrics(self) -> Dict[str, Any]:
+        """Retorna métricas do cache de sessões"""
+        return self.cache.get_metrics()
+    
     def terminate_session(self, db: Session, session_token: str, reason: str = "manual") -> bool:
         """
         Termina uma sessão.
@@ -331,9 +441,8 @@ class SessionManager:
             
             db.commit()
             
-            # Remover do cache
-            if self.redis_client:
-                self._remove_cached_session(session_token)
+            # Remover do cache (todos os processos)
+            self._remove_cached_session(session_token)
             
             logger.info(f"Sessão terminada: {session_token[:8]}... (motivo: {reason})")
             return True
@@ -391,9 +500,8 @@ class SessionManager:
             
             db.commit()
             
-            # Remover do cache
-            if self.redis_client:
-                self._remove_cached_session(session_token)
+            # Remover do cache (todos os processos)
+            self._remove_cached_session(session_token)
             
             logger.warning(f"Sessão bloqueada: {session_token[:8]}... (motivo: {reason})")
             return True
@@ -543,40 +651,68 @@ class SessionManager:
         except Exception as e:
             logger.error(f"Erro ao registrar atividade da sessão: {e}")
     
-    def _cache_session(self, session: UserSession):
-        """Armazena sessão no cache Redis"""
-        if not self.redis_client:
-            return
+    def _is_usable(self, session: UserSession, now: datetime) -> bool:
+        """
+        Verifica uma sessão em cache. Sessões que parecem expiradas ou
+        inativas são revalidadas no banco, pois a atividade registrada por
+        outros processos pode não estar no cache local.
+        """
+        if not session.is_active or session.is_blocked:
+            return False
+        if session.expires_at and now > session.expires_at:
+            return False
+        return (now - session.last_activity).total_seconds() <= (self.inactive_timeout_minutes * 60)
+    
+    def _record_activity(self, session: UserSession, now: datetime, persisted: bool = False):
+        """Registra a atividade em memória e no cache local"""
+        self.activity_buffer.touch(session.id, now)
         
+        if not persisted:
+            session.last_activity = now
+            self.cache.update_local(session.session_token, self._serialize_session(session))
+    
+    def _serialize_session(self, session: UserSession) -> Dict[str, Any]:
+        """Converte a sessão em dicionário serializável"""
+        data = {}
+        for column in UserSession.__table__.columns:
+            value = getattr(session, column.key)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            data[column.key] = value
+        return data
+    
+    def _deserialize_session(self, data: Dict[str, Any]) -> UserSession:
+        """Reconstrói uma UserSession desanexada a partir do cache"""
+        values = {}
+        for column in UserSession.__table__.columns:
+            value = data.get(column.key)
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            values[column.key] = value
+        return UserSession(**values)
+    
+    def _cache_session(self, session: UserSession, last_activity: Optional[datetime] = None):
+        """Armazena sessão no cache (memória local e Redis)"""
         try:
-            session_data = {
-                "id": session.id,
-                "user_id": session.user_id,
-                "ip_address": session.ip_address,
-                "is_active": session.is_active,
-                "is_blocked": session.is_blocked,
-                "expires_at": session.expires_at.isoformat() if session.expires_at else None,
-                "last_activity": session.last_activity.isoformat()
-            }
+            ttl_seconds = self.session_timeout_minutes * 60
+            if session.expires_at:
+                ttl_seconds = min(ttl_seconds, int((session.expires_at - datetime.utcnow()).total_seconds()))
             
-            self.redis_client.setex(
-                f"session:{session.session_token}",
-                self.session_timeout_minutes * 60,
-                json.dumps(session_data)
-            )
+            data = self._serialize_session(session)
+            if last_activity:
+                data["last_activity"] = last_activity.isoformat()
+            
+            self.cache.set(session.session_token, data, ttl_seconds)
             
         except Exception as e:
             logger.error(f"Erro ao armazenar sessão no cache: {e}")
     
-    def _get_cached_session(self, session_token: str) -> Optional[Dict]:
-        """Recupera sessão do cache Redis"""
-        if not self.redis_client:
-            return None
-        
+    def _get_cached_session(self, session_token: str) -> Optional[UserSession]:
+        """Recupera sessão do cache (memória local ou Redis)"""
         try:
-            cached_data = self.redis_client.get(f"session:{session_token}")
+            cached_data = self.cache.get(session_token)
             if cached_data:
-                return json.loads(cached_data)
+                return self._deserialize_session(cached_data)
             return None
             
         except Exception as e:
@@ -584,12 +720,9 @@ class SessionManager:
             return None
     
     def _remove_cached_session(self, session_token: str):
-        """Remove sessão do cache Redis"""
-        if not self.redis_client:
-            return
-        
+        """Remove sessão do cache e publica a invalidação para os demais processos"""
         try:
-            self.redis_client.delete(f"session:{session_token}")
+            self.cache.invalidate(session_token)
         except Exception as e:
             logger.error(f"Erro ao remover sessão do cache: {e}")
 
@@ -0,0 +1,18 @@
+"""
+Configuração dos testes do backend (make test-backend).
+
+Os módulos são importados como pacote (backend.*) e também pelo nome
+simples, como no container; o banco padrão é SQLite em memória.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+for path in (ROOT_DIR, BACKEND_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
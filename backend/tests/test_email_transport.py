@@ -0,0 +1,112 @@
+"""
+Pool de conexões SMTP (email_transport) contra um servidor aiosmtpd local:
+reutilização das conexões, reconexão e destinatário recusado.
+"""
+
+import asyncio
+import smtplib
+import socket
+from email.mime.text import MIMEText
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from backend.email_transport import SMTPTransport
+
+class RecordingHandler:
+    """Guarda as mensagens recebidas e recusa destinatários refused@..."""
+
+    def __init__(self):
+        self.messages = []
+        self.logins = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused@"):
+            return "550 Destinatário inexistente"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.rcpt_tos)
+        return "250 OK"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins += 1
+        return AuthResult(success=auth_data.password == b"secret", handled=False)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(
+        handler, hostname="127.0.0.1", port=_free_port(),
+        authenticator=handler.authenticate, auth_require_tls=False
+    )
+    controller.start()
+    try:
+        yield controller, handler
+    finally:
+        controller.stop()
+
+@pytest.fixture
+def transport(smtp_server):
+    controller, _ = smtp_server
+    transport = SMTPTransport(
+        controller.hostname, controller.port, "clinica", "secret",
+        use_tls=False, pool_size=2, max_messages=50, timeout=5
+    )
+    yield transport
+    transport.close()
+
+def _message(to: str) -> MIMEText:
+    message = MIMEText("corpo", "plain", "utf-8")
+    message["From"] = "noreply@dataclinica.com"
+    message["To"] = to
+    message["Subject"] = "Teste"
+    return message
+
+def test_pooled_connections_are_reused(smtp_server, transport):
+    _, handler = smtp_server
+
+    errors = asyncio.run(transport.send_many([_message(f"p{i}@example.com") for i in range(20)]))
+    errors += asyncio.run(transport.send_many([_message(f"q{i}@example.com") for i in range(20)]))
+
+    assert errors == [None] * 40
+    assert len(handler.messages) == 40
+    metrics = transport.get_metrics()
+    assert metrics['messages_sent'] == 40
+    assert 1 <= metrics['connections_opened'] <= transport.pool_size
+    assert handler.logins == metrics['connections_opened']
+
+def test_reconnects_when_server_disconnected(smtp_server, transport):
+    _, handler = smtp_server
+    asyncio.run(transport.send(_message("first@example.com")))
+
+    # Conexão ociosa perdida: o próximo envio recebe SMTPServerDisconnected
+    for connection in transport._idle:
+        connection.smtp.close()
+    asyncio.run(transport.send(_message("second@example.com")))
+
+    assert handler.messages == [["first@example.com"], ["second@example.com"]]
+    metrics = transport.get_metrics()
+    assert metrics['reconnects'] == 1
+    assert metrics['connections_opened'] == 2
+    assert metrics['idle_connections'] == 1
+
+def test_refused_recipient_raises_and_keeps_connection(smtp_server, transport):
+    _, handler = smtp_server
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        asyncio.run(transport.send(_message("refused@example.com")))
+    asyncio.run(transport.send(_message("ok@example.com")))
+
+    assert handler.messages == [["ok@example.com"]]
+    metrics = transport.get_metrics()
+    assert metrics['connections_opened'] == 1
+    assert metrics['reconnects'] == 0
+    assert metrics['messages_sent'] == 1
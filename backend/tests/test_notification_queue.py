@@ -0,0 +1,188 @@
+"""
+Fila persistente de notificações: reserva, retry e entrega pelo pool de
+workers, com SQLite e rate limiter em fakeredis.
+"""
+
+import asyncio
+import enum
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Enum, Integer, String, Text, create_engine, insert, select
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.notification_queue import NotificationOutbox, NotificationWorkerPool
+from backend.rate_limiter import RateLimiter
+
+Base = declarative_base()
+
+class Status(enum.Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    EXPIRED = "expired"
+
+class Channel(enum.Enum):
+    EMAIL = "email"
+    SMS = "sms"
+    IN_APP = "in_app"
+
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    channel = Column(Enum(Channel), nullable=False)
+    status = Column(Enum(Status), nullable=False)
+    title = Column(String(200))
+    message = Column(Text)
+    created_at = Column(DateTime)
+    sent_at = Column(DateTime)
+    expires_at = Column(DateTime)
+    retry_count = Column(Integer, default=0)
+    max_retries = Column(Integer, default=3)
+    next_attempt_at = Column(DateTime)
+    locked_until = Column(DateTime)
+    claim_token = Column(String(32))
+    last_error = Column(Text)
+
+TABLE = Notification.__table__
+
+class FakeSystem:
+    """Handlers de canal: email sempre falha, os demais entregam"""
+
+    def __init__(self, rate_limit_per_minute: int = 0):
+        self.config = {'retry_delay_minutes': [5, 15, 60], 'rate_limit_per_minute': rate_limit_per_minute}
+        self.delivered = []
+
+        async def deliver(message):
+            self.delivered.append(message['id'])
+            return True
+
+        async def fail(message):
+            raise RuntimeError("smtp down")
+
+        self.channel_handlers = {Channel.EMAIL: fail, Channel.SMS: deliver, Channel.IN_APP: deliver}
+
+class WorkerPool(NotificationWorkerPool):
+    def _message(self, notification):
+        return notification
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine(
+        "sqlite://", connect_args={'check_same_thread': False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def outbox():
+    return NotificationOutbox(TABLE, Status)
+
+def _add(db, count, channel=Channel.IN_APP, due=None, **values):
+    now = datetime.now()
+    rows = [dict({
+        'user_id': 1, 'channel': channel, 'status': Status.PENDING, 'title': 't', 'message': 'm',
+        'created_at': now, 'retry_count': 0, 'max_retries': 2,
+        'next_attempt_at': due or now - timedelta(seconds=1), 'expires_at': None
+    }, **values) for _ in range(count)]
+    db.execute(insert(TABLE), rows)
+    db.commit()
+
+def _statuses(db):
+    counts = {}
+    for status in db.execute(select(TABLE.c.status)).scalars():
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+def test_claim_reserves_disjoint_batches_and_expires(session_factory, outbox):
+    db, other = session_factory(), session_factory()
+    _add(db, 12)
+    _add(db, 3, due=datetime.now() + timedelta(hours=1))
+    _add(db, 1, expires_at=datetime.now() - timedelta(seconds=1))
+
+    first = outbox.claim(db, 5, 60)
+    second = outbox.claim(other, 10, 60)
+
+    assert len(first) == 5 and len(second) == 7
+    assert not {row['id'] for row in first} & {row['id'] for row in second}
+    assert outbox.claim(db, 10, 60) == []
+    assert _statuses(db)[Status.EXPIRED] == 1
+    assert outbox.lag(db)['in_app']['pending'] == 15
+
+def test_claim_returns_rows_after_lease_expires(session_factory, outbox):
+    db = session_factory()
+    _add(db, 2)
+    claimed = outbox.claim(db, 10, 60)
+
+    later = datetime.now() + timedelta(seconds=61)
+    reclaimed = outbox.claim(db, 10, 60, now=later)
+
+    assert [row['id'] for row in reclaimed] == [row['id'] for row in claimed]
+    assert reclaimed[0]['claim_token'] != claimed[0]['claim_token']
+
+def test_retry_backs_off_then_fails(session_factory, outbox):
+    db = session_factory()
+    _add(db, 1, max_retries=1)
+    notification = outbox.claim(db, 1, 60)[0]
+    now = datetime.now()
+
+    assert outbox.retry(db, notification, "timeout", [5], now=now) is True
+    row = db.execute(select(TABLE)).one()
+    assert row.retry_count == 1 and row.last_error == "timeout"
+    assert row.next_attempt_at == now + timedelta(minutes=5)
+    assert row.claim_token is None
+
+    assert outbox.retry(db, dict(row._mapping), "timeout", [5], now=now) is False
+    assert db.execute(select(TABLE.c.status)).scalar() == Status.FAILED
+
+def test_deliver_sends_retries_and_defers_over_rate_limit(session_factory, outbox):
+    db = session_factory()
+    _add(db, 5, Channel.SMS)
+    _add(db, 2, Channel.EMAIL)
+    pool = WorkerPool(limiter=RateLimiter("fakeredis://"), outbox=outbox)
+    system = FakeSystem(rate_limit_per_minute=3)
+
+    counts = asyncio.run(pool.deliver(db, system, outbox.claim(db, 10, 60)))
+
+    assert counts == {'sent': 3, 'retried': 2, 'failed': 0, 'deferred': 2}
+    assert len(system.delivered) == 3
+    assert _statuses(db) == {Status.SENT: 3, Status.PENDING: 4}
+    deferred = db.execute(select(TABLE).where(TABLE.c.channel == Channel.SMS, TABLE.c.status == Status.PENDING)).all()
+    assert all(row.retry_count == 0 and row.next_attempt_at > datetime.now() for row in deferred)
+
+def test_worker_pool_delivers_due_notifications(session_factory, outbox):
+    db = session_factory()
+    _add(db, 7, Channel.IN_APP)
+    _add(db, 2, Channel.SMS, due=datetime.now() + timedelta(hours=1))
+    system = FakeSystem()
+    calls = []
+
+    def system_factory(session):
+        # A primeira criação falha: o worker deve continuar
+        calls.append(session)
+        if len(calls) == 1:
+            raise RuntimeError("configuração indisponível")
+        return system
+
+    pool = WorkerPool(
+        session_factory=session_factory, system_factory=system_factory, workers=1, batch_size=3,
+        poll_seconds=0.01, limiter=RateLimiter("memory://"), outbox=outbox
+    )
+
+    async def run():
+        pool.start()
+        for _ in range(200):
+            if pool.sent == 7:
+                break
+            await asyncio.sleep(0.01)
+        await pool.stop()
+
+    asyncio.run(run())
+
+    assert sorted(system.delivered) == list(range(1, 8))
+    assert _statuses(db) == {Status.SENT: 7, Status.PENDING: 2}
+    assert pool.get_metrics()['workers'] == 0
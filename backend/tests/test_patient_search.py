@@ -0,0 +1,107 @@
+"""
+Busca de pacientes por nome no SQLite (tabela FTS5 patients_name_fts):
+sem acentos e sem caixa, por prefixo, restrita à clínica, paginada por
+cursor e sincronizada pelos gatilhos.
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.patient_search import PatientNameSearch, encode_cursor
+
+PATIENTS = [
+    (1, 1, "José da Silva"),
+    (2, 1, "JOSE Santos"),
+    (3, 1, "Josefa Lima"),
+    (4, 1, "Maria José"),
+    (5, 1, "Ana Souza"),
+    (6, 2, "José Pereira"),
+]
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    session = sessionmaker(bind=engine)()
+    session.execute(text("CREATE TABLE patients (id INTEGER PRIMARY KEY, clinic_id INTEGER, name TEXT)"))
+    for patient_id, clinic_id, name in PATIENTS:
+        session.execute(
+            text("INSERT INTO patients (id, clinic_id, name) VALUES (:id, :clinic_id, :name)"),
+            {'id': patient_id, 'clinic_id': clinic_id, 'name': name}
+        )
+    session.commit()
+    yield session
+    session.close()
+
+@pytest.fixture
+def name_search():
+    # Instância própria: a global guarda os bancos já preparados pela URL
+    return PatientNameSearch()
+
+def _ids(name_search, db, clinic_id, term, limit=20, cursor=None):
+    return [patient_id for patient_id, _ in name_search.search_ids(db, clinic_id, term, limit, cursor)]
+
+def test_prefix_match_ignores_accents_and_case(db, name_search):
+    assert sorted(_ids(name_search, db, 1, "jose")) == [1, 2, 3, 4]
+    assert sorted(_ids(name_search, db, 1, "JOSÉ")) == [1, 2, 3, 4]
+    assert _ids(name_search, db, 1, "josé SIL") == [1]
+    assert _ids(name_search, db, 1, "souza") == [5]
+    assert _ids(name_search, db, 1, "   ") == []
+
+def test_results_are_restricted_to_the_clinic(db, name_search):
+    assert 6 not in _ids(name_search, db, 1, "jose")
+    assert _ids(name_search, db, 2, "jose") == [6]
+    assert _ids(name_search, db, 2, "souza") == []
+
+def test_cursor_pages_are_stable(db, name_search):
+    expected = name_search.search_ids(db, 1, "jose", 20)
+
+    seen, cursor = [], None
+    while True:
+        page = name_search.search_ids(db, 1, "jose", 2, cursor)
+        seen.extend(page)
+        if len(page) < 2:
+            break
+        cursor = encode_cursor(page[-1][1], page[-1][0])
+
+    assert seen == expected
+    assert len({patient_id for patient_id, _ in seen}) == 4
+
+def test_triggers_track_updates_and_deletes(db, name_search):
+    assert sorted(_ids(name_search, db, 1, "jose")) == [1, 2, 3, 4]
+
+    db.execute(text("UPDATE patients SET name = 'Carlos da Silva' WHERE id = 1"))
+    db.execute(text("UPDATE patients SET name = 'Joséane Souza' WHERE id = 5"))
+    db.execute(text("DELETE FROM patients WHERE id = 2"))
+    db.execute(text("INSERT INTO patients (id, clinic_id, name) VALUES (7, 1, 'Josué Alves')"))
+    db.commit()
+
+    assert sorted(_ids(name_search, db, 1, "jos")) == [3, 4, 5, 7]
+    assert _ids(name_search, db, 1, "carlos") == [1]
+    assert _ids(name_search, db, 1, "santos") == []
+
+def test_search_returns_patients_page_by_page():
+    from backend import models
+
+    try:
+        configure_mappers()
+    except SQLAlchemyError as e:
+        pytest.skip(f"mapeamentos de models.Base não configuram: {e}")
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    for patient_id, clinic_id, name in PATIENTS:
+        db.add(models.Patient(id=patient_id, clinic_id=clinic_id, name=name))
+    db.commit()
+
+    name_search = PatientNameSearch()
+    first = name_search.search(db, 1, "Jose", limit=3)
+    second = name_search.search(db, 1, "Jose", limit=3, cursor=first.next_cursor)
+
+    assert len(first.items) == 3 and first.next_cursor
+    assert second.next_cursor is None
+    assert sorted(patient.id for patient in first.items + second.items) == [1, 2, 3, 4]
+    db.close()
@@ -0,0 +1,45 @@
+"""
+Rate limiting no Redis (fakeredis): uma execução do script por regra, cada
+uma em um único slot de Redis Cluster, e nenhuma contagem quando alguma
+regra rejeita a requisição.
+"""
+
+import asyncio
+
+from redis.crc import key_slot
+
+from backend.rate_limiter import RateLimiter
+
+def test_each_script_call_stays_in_one_cluster_slot():
+    limiter = RateLimiter("fakeredis://")
+    calls = []
+    script = limiter._get_script()
+
+    async def recording_script(keys, args):
+        calls.append(keys)
+        return await script(keys=keys, args=args)
+
+    rules = [("ip:10.0.0.1", 10, 60), ("tenant:7", 100, 60)]
+    allowed, remaining, _ = asyncio.run(limiter._redis_hit(recording_script, rules, 1_000_000))
+
+    assert allowed and remaining == 9
+    assert len(calls) == 2
+    for keys in calls:
+        assert len({key_slot(key.encode()) for key in keys}) == 1
+
+def test_rejected_request_is_not_counted_by_other_rules():
+    limiter = RateLimiter("fakeredis://")
+
+    async def run():
+        tenant_rule = ("tenant:7", 1, 60)
+        first = await limiter.hit([("ip:10.0.0.1", 10, 60), tenant_rule])
+        second = await limiter.hit([("ip:10.0.0.2", 10, 60), tenant_rule])
+        third = await limiter.hit([("ip:10.0.0.2", 10, 60)])
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+
+    assert first.allowed and first.backend == "redis"
+    assert not second.allowed and second.retry_after > 0
+    # A requisição rejeitada pelo tenant não consumiu o limite do cliente
+    assert third.allowed and third.remaining == 9
@@ -0,0 +1,135 @@
+"""
+Cache de sessões em dois níveis (memória local + Redis em fakeredis),
+invalidação entre processos via pub/sub e gravação agrupada de last_activity.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.session_cache import TwoTierSessionCache
+from backend.session_manager import SessionActivity, SessionActivityBuffer, SessionManager, UserSession
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+def _redis(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    # users vive em outra metadata (models.Base): cópia mínima só para as chaves estrangeiras
+    metadata = MetaData()
+    Table("users", metadata, Column("id", Integer, primary_key=True))
+    for model in (UserSession, SessionActivity):
+        model.__table__.to_metadata(metadata)
+    metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+@pytest.fixture
+def managers(redis_server, session_factory):
+    """Dois SessionManager ("processos") com o mesmo Redis e o mesmo banco"""
+    created = []
+    for _ in range(2):
+        manager = SessionManager(redis_client=_redis(redis_server))
+        manager.activity_buffer.shutdown()
+        manager.activity_buffer = SessionActivityBuffer(session_factory=session_factory)
+        created.append(manager)
+    yield created
+    for manager in created:
+        manager.cache.close()
+
+def _add_session(db, token, **values):
+    now = datetime.utcnow()
+    session = UserSession(
+        user_id=1, session_token=token, is_active=True, is_blocked=False,
+        created_at=now, last_activity=now, expires_at=now + timedelta(hours=8), **values
+    )
+    db.add(session)
+    db.commit()
+    return session
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+def test_local_and_redis_tier_hits(redis_server):
+    writer = TwoTierSessionCache(_redis(redis_server))
+    reader = TwoTierSessionCache(_redis(redis_server))
+    try:
+        writer.set("token-1", {"id": 1}, ttl_seconds=60)
+
+        assert writer.get("token-1") == {"id": 1}
+        assert reader.get("token-1") == {"id": 1}  # Redis, promovida ao nível local
+        assert reader.get("token-1") == {"id": 1}
+        assert reader.get("unknown") is None
+
+        assert writer.get_metrics()['local_hits'] == 1
+        metrics = reader.get_metrics()
+        assert (metrics['local_hits'], metrics['redis_hits'], metrics['misses']) == (1, 1, 1)
+        assert metrics['local_entries'] == 1
+    finally:
+        writer.close()
+        reader.close()
+
+@pytest.mark.parametrize("action", ["terminate_session", "block_session"])
+def test_terminate_and_block_invalidate_other_processes(managers, session_factory, action):
+    first, second = managers
+    db = session_factory()
+    _add_session(db, "token-1")
+
+    assert first.validate_session(db, "token-1") is not None
+    assert second.validate_session(db, "token-1") is not None
+    assert second.cache.local.get("token-1") is not None
+    assert second.get_cache_metrics()['redis_hits'] == 1
+
+    assert getattr(first, action)(db, "token-1") is True
+
+    # A invalidação publicada pelo primeiro processo remove a entrada local do segundo
+    assert _wait_until(lambda: second.cache.local.get("token-1") is None)
+    assert second.validate_session(db, "token-1") is None
+    db.close()
+
+def test_activity_buffer_flushes_last_activity_in_one_batch(session_factory):
+    db = session_factory()
+    sessions = [_add_session(db, f"token-{index}") for index in range(3)]
+    ids = [session.id for session in sessions]
+    db.close()
+
+    buffer = SessionActivityBuffer(session_factory=session_factory)
+    later = datetime.utcnow() + timedelta(minutes=5)
+    buffer.touch(ids[0], later - timedelta(minutes=1))
+    buffer.touch(ids[0], later)
+    buffer.touch(ids[1], later)
+    assert buffer.pending_activity(ids[0]) == later
+
+    statements = []
+    engine = session_factory.kw['bind']
+    listener = lambda conn, cursor, statement, parameters, context, executemany: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert buffer.flush() == 2
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len([statement for statement in statements if statement.startswith("UPDATE")]) == 1
+    assert buffer.pending_activity(ids[0]) is None
+    assert buffer.flush() == 0
+
+    db = session_factory()
+    activity = dict(db.execute(select(UserSession.id, UserSession.last_activity)).all())
+    db.close()
+    assert activity[ids[0]] == later
+    assert activity[ids[1]] == later
+    assert activity[ids[2]] < later
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de Criptografia de Campos - DataClinica
+
+Mede o tempo de criptografia gasto por uma listagem (ex.: documentos médicos
+de um paciente) comparando:
+- anterior: decrypt_model_data linha a linha com tokens Fernet em base64
+  duplo (formato gravado até então)
+- lote: FieldEncryption.decrypt_rows com tokens v2 (AES-GCM), usando o pool
+  de threads quando o lote é grande
+
+Uso:
+    python benchmark_encryption.py [--rows 500] [--repeat 20] [--workers 4]
+"""
+
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Adicionar o backend ao path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from encryption import DataEncryption, FieldEncryption
+
+def build_rows(rows: int):
+    return [
+        {
+            'id': i,
+            'patient_id': 42,
+            'cpf': f"123.456.789-{i % 100:02d}",
+            'phone': "(11) 98765-4321",
+            'observations': "Paciente relata melhora dos sintomas, manter conduta. " * 3,
+            'prescription_content': "Dipirona 500mg, 1 comprimido de 6/6h se dor ou febre.",
+            'document_type': "receita"
+        }
+        for i in range(rows)
+    ]
+
+def measure(name: str, func, repeat: int, rows: int) -> float:
+    func()  # Aquecimento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    per_page_ms = (time.perf_counter() - start) / repeat * 1000
+    print(f"  {name:<32} {per_page_ms:8.2f} ms/página  {per_page_ms * 1000 / rows:7.2f} µs/linha")
+    return per_page_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de criptografia de campos")
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    key = "benchmark_key"
+    rows = build_rows(args.rows)
+
+    os.environ["ENCRYPTION_TOKEN_FORMAT"] = "fernet"
+    legacy = FieldEncryption(DataEncryption(key))
+    legacy_rows = legacy.encrypt_rows(rows)
+
+    os.environ["ENCRYPTION_TOKEN_FORMAT"] = "v2"
+    batch_encryption = DataEncryption(key)
+    batch_encryption.workers = args.workers
+    batch_encryption.parallel_min_values = 1000
+    batch = FieldEncryption(batch_encryption)
+    v2_rows = batch.encrypt_rows(rows)
+
+    print(
+        f"Descriptografia de {args.rows} linhas "
+        f"(token médio: anterior {len(legacy_rows[0]['observations'])} / v2 {len(v2_rows[0]['observations'])} caracteres, "
+        f"{args.workers} threads):"
+    )
+    before = measure("anterior (linha a linha)", lambda: [legacy.decrypt_model_data(row) for row in legacy_rows], args.repeat, args.rows)
+    after = measure("lote (v2)", lambda: batch.decrypt_rows(v2_rows), args.repeat, args.rows)
+    mixed = measure("lote (tokens anteriores)", lambda: batch.decrypt_rows(legacy_rows), args.repeat, args.rows)
+    print(f"  Ganho: {before / after:.1f}x (leitura de tokens anteriores: {before / mixed:.1f}x)")
+
+    print(f"Criptografia de {args.rows} linhas:")
+    before = measure("anterior (linha a linha)", lambda: [legacy.encrypt_model_data(row) for row in rows], args.repeat, args.rows)
+    after = measure("lote (v2)", lambda: batch.encrypt_rows(rows), args.repeat, args.rows)
+    print(f"  Ganho: {before / after:.1f}x")
+
+if __name__ == "__main__":
+    main()
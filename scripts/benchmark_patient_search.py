@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark da Busca de Pacientes por Nome - DataClinica
+
+Compara, em um banco SQLite temporário com N pacientes, a busca anterior
+(name ILIKE '%termo%', varredura completa da tabela) com a busca indexada
+de patient_search.PatientNameSearch (FTS5, ranking e cursor).
+
+Uso:
+    python benchmark_patient_search.py [--sizes 100000,1000000] [--clinics 1] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+# Adicionar o backend ao path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from patient_search import PatientNameSearch, encode_cursor
+
+FIRST_NAMES = ["Ana", "João", "Maria", "José", "Antônio", "Francisca", "Luíza", "Carlos", "Paulo", "Lúcia",
+               "Marcos", "Patrícia", "Sebastião", "Conceição", "Raimundo", "Fábio", "Júlia", "Rafael", "Débora", "Célia"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+              "Costa", "Ribeiro", "Martins", "Carvalho", "Araújo", "Melo", "Barbosa", "Cardoso", "Conceição", "Assunção"]
+
+# Comum, duas palavras, com acento no nome gravado, rara
+TERMS = ["maria", "maria souza", "assuncao", "debora melo barbosa"]
+
+def build_database(path: str, size: int, clinics: int):
+    engine = create_engine(f"sqlite:///{path}")
+    random.seed(size)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE patients (id INTEGER PRIMARY KEY, clinic_id INTEGER, name TEXT)"))
+        connection.execute(text("CREATE INDEX ix_patients_clinic_id ON patients(clinic_id)"))
+        batch = []
+        for patient_id in range(1, size + 1):
+            name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)} {random.choice(LAST_NAMES)} {patient_id}"
+            batch.append({'id': patient_id, 'clinic_id': patient_id % clinics + 1, 'name': name})
+            if len(batch) == 50000:
+                connection.execute(text("INSERT INTO patients VALUES (:id, :clinic_id, :name)"), batch)
+                batch = []
+        if batch:
+            connection.execute(text("INSERT INTO patients VALUES (:id, :clinic_id, :name)"), batch)
+    return engine
+
+def measure(name: str, func, repeat: int) -> float:
+    func()  # Aquecimento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    per_query_ms = (time.perf_counter() - start) / repeat * 1000
+    print(f"    {name:<28} {per_query_ms:9.2f} ms/busca")
+    return per_query_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark da busca de pacientes por nome")
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--clinics", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = build_database(os.path.join(directory, "patients.db"), size, args.clinics)
+            search = PatientNameSearch()
+            with Session(bind=engine) as db:
+                start = time.perf_counter()
+                search.search_ids(db, 1, "maria", 20)  # Cria o índice FTS5
+                print(f"{size} pacientes (índice criado em {time.perf_counter() - start:.1f} s):")
+
+                for term in TERMS:
+                    print(f"  termo {term!r}:")
+                    before = measure("anterior (ILIKE)", lambda: db.execute(text(
+                        "SELECT id FROM patients WHERE clinic_id = :clinic_id AND name LIKE :pattern LIMIT 20"
+                    ), {'clinic_id': 1, 'pattern': f"%{term}%"}).all(), args.repeat)
+                    first_page = search.search_ids(db, 1, term, 21)
+                    after = measure("indexada (1ª página)", lambda: search.search_ids(db, 1, term, 21), args.repeat)
+                    if len(first_page) > 20:
+                        cursor_id, cursor_score = first_page[19]
+                        cursor = encode_cursor(cursor_score, cursor_id)
+                        measure("indexada (página seguinte)", lambda: search.search_ids(db, 1, term, 21, cursor), args.repeat)
+                    print(f"    Ganho: {before / after:.1f}x ({len(first_page[:20])} resultados na 1ª página)")
+            engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks de Segurança - DataClinica
+
+patterns: mede o custo por requisição da detecção de padrões de ataque
+(backend/attack_detection.py) comparado à verificação anterior, que
+percorria listas de substrings na URL, no User-Agent e nos cabeçalhos e
+executava re.search para cada padrão do payload. O detector usa
+Aho-Corasick quando pyahocorasick está instalado e a regex combinada
+caso contrário.
+
+middlewares: mede latência e vazão da pilha de middlewares de segurança
+(backend/security_middleware.py, ASGI puro) comparada à mesma pilha com
+cada camada envolvida por BaseHTTPMiddleware, como na estrutura anterior.
+As requisições são enviadas diretamente à aplicação ASGI, sem rede.
+
+Uso:
+    python benchmark_security.py [--suite all|patterns|middlewares]
+                                 [--iterations 20000] [--body-size 2048]
+                                 [--requests 3000] [--concurrency 50]
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# Adicionar o backend ao path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from attack_detection import AttackPatternMatcher
+
+# Implementação anterior (SecurityMiddleware + SecurityMonitor), para comparação
+LEGACY_URL_PATTERNS = [
+    "union select", "drop table", "insert into", "delete from",
+    "' or '1'='1", "' or 1=1", "'; drop", "' union",
+    "<script", "javascript:", "onerror=", "onload=",
+    "alert(", "document.cookie", "eval(",
+    "../", "..%2f", "..%5c", "%2e%2e%2f",
+    "; cat", "; ls", "; rm", "; wget", "; curl",
+    "| cat", "| ls", "| rm", "| wget", "| curl",
+    "*)(uid=*", "*)(cn=*", ")(|(uid=*",
+    "<!entity", "<!doctype", "<![cdata["
+]
+LEGACY_AGENTS = [
+    "sqlmap", "nikto", "nmap", "masscan", "zap",
+    "burp", "w3af", "acunetix", "nessus", "openvas",
+    "python-requests", "curl", "wget", "bot", "crawler"
+]
+LEGACY_HEADERS = {
+    'x-forwarded-for': ['127.0.0.1', 'localhost', '0.0.0.0'],
+    'x-real-ip': ['127.0.0.1', 'localhost', '0.0.0.0'],
+    'x-originating-ip': ['127.0.0.1', 'localhost', '0.0.0.0']
+}
+LEGACY_PAYLOAD_PATTERNS = [
+    r"<script[^>]*>.*?</script>",
+    r"javascript:\s*[^\s]",
+    r"on\w+\s*=\s*['\"][^'\"]*['\"]?",
+    r"\.\./",
+    r"%2e%2e%2f",
+    r"%2e%2e%5c"
+]
+
+def legacy_scan(url: str, headers: Dict[str, str], body: str) -> bool:
+    url_lower = url.lower()
+    if any(pattern in url_lower for pattern in LEGACY_URL_PATTERNS):
+        return True
+
+    user_agent = headers.get('user-agent', '').lower()
+    if any(agent in user_agent for agent in LEGACY_AGENTS):
+        return True
+
+    for header, values in LEGACY_HEADERS.items():
+        value = headers.get(header, '').lower()
+        if any(v in value for v in values):
+            return True
+
+    return any(re.search(pattern, body, re.IGNORECASE) for pattern in LEGACY_PAYLOAD_PATTERNS)
+
+def build_requests(body_size: int) -> List[Tuple[str, Dict[str, str], str]]:
+    """Requisições típicas (limpas) e algumas maliciosas"""
+    body = ('{"nome": "Maria da Silva", "observacoes": "' + "retorno em 30 dias " * (body_size // 20) + '"}')[:body_size]
+    headers = {
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+        'referer': 'https://app.dataclinica.com.br/pacientes',
+        'x-forwarded-for': '200.150.10.20'
+    }
+    clean = [
+        ("https://api.dataclinica.com.br/api/patients?page=2&search=silva", headers, ""),
+        ("https://api.dataclinica.com.br/api/appointments/123", headers, body),
+        ("https://api.dataclinica.com.br/api/medical-records?patient_id=42", headers, body)
+    ]
+    malicious = [
+        ("https://api.dataclinica.com.br/api/patients?q=1' union select password from users", headers, ""),
+        ("https://api.dataclinica.com.br/api/files?path=../../etc/passwd", headers, ""),
+        ("https://api.dataclinica.com.br/api/patients", headers, body + '<script>alert(1)</script>')
+    ]
+    return clean * 3 + malicious
+
+def measure(name: str, func: Callable, requests: List, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        url, headers, body = requests[i % len(requests)]
+        func(url, headers, body)
+    per_request_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"  {name:<28} {per_request_us:8.2f} µs/requisição")
+    return per_request_us
+
+def benchmark_patterns(args):
+    matcher = AttackPatternMatcher()
+    requests = build_requests(args.body_size)
+
+    # Conferir que as duas implementações concordam nos exemplos
+    for url, headers, body in requests:
+        assert bool(matcher.scan(url, headers, body)) == legacy_scan(url, headers, body), url
+
+    print(f"Triagem de ataques ({args.iterations} requisições, corpo de {args.body_size} bytes):")
+    legacy = measure("anterior (substrings + re)", legacy_scan, requests, args.iterations)
+    compiled = measure(f"detector ({matcher.engine})", matcher.scan, requests, args.iterations)
+    print(f"  Ganho: {legacy / compiled:.1f}x")
+
+def build_stacks():
+    """Aplicação de teste com a pilha ASGI pura e com BaseHTTPMiddleware por camada"""
+    # Rate limiting apenas em memória e sem triagem do corpo (requisições GET)
+    os.environ.setdefault("RATE_LIMIT_REDIS_URL", "memory://")
+
+    from starlette.applications import Starlette
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+    from security_middleware import (
+        SecurityMiddleware, CSRFMiddleware, CORSMiddleware, SessionValidationMiddleware
+    )
+
+    async def endpoint(request):
+        return JSONResponse({"status": "ok"})
+
+    async def passthrough(request, call_next):
+        return await call_next(request)
+
+    def stack(wrap_legacy: bool):
+        app = Starlette(routes=[Route("/api/patients", endpoint)])
+        # Mesma ordem de apply_security_middlewares (a última é a mais externa)
+        for middleware in (SecurityMiddleware, CORSMiddleware, CSRFMiddleware, SessionValidationMiddleware):
+            app.add_middleware(middleware)
+            if wrap_legacy:
+                app.add_middleware(BaseHTTPMiddleware, dispatch=passthrough)
+        return app
+
+    return stack(wrap_legacy=True), stack(wrap_legacy=False)
+
+async def call_asgi(app, index: int) -> float:
+    """Envia uma requisição GET e retorna a latência em segundos"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/api/patients",
+        "raw_path": b"/api/patients", "query_string": b"page=2",
+        "root_path": "", "server": ("testserver", 80),
+        "client": (f"10.0.{index // 250 % 250}.{index % 250}", 50000),
+        "headers": [
+            (b"host", b"testserver"),
+            (b"origin", b"http://localhost:3000"),
+            (b"user-agent", b"Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0")
+        ]
+    }
+
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            await asyncio.Event().wait()  # Cliente conectado até o fim da resposta
+        request_sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - start
+    assert statuses == [200], statuses
+    return elapsed
+
+async def measure_stack(name: str, app, requests: int, concurrency: int):
+    # Aquecimento
+    for i in range(50):
+        await call_asgi(app, i)
+
+    latencies = [await call_asgi(app, i) for i in range(requests)]
+
+    start = time.perf_counter()
+    for offset in range(0, requests, concurrency):
+        await asyncio.gather(*(call_asgi(app, offset + i) for i in range(concurrency)))
+    throughput = requests / (time.perf_counter() - start)
+
+    latencies.sort()
+    print(
+        f"  {name:<28} média {statistics.mean(latencies) * 1e6:8.1f} µs  "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.1f} µs  "
+        f"{throughput:8.0f} req/s"
+    )
+    return throughput
+
+def benchmark_middlewares(args):
+    legacy_app, asgi_app = build_stacks()
+
+    print(f"Pilha de middlewares ({args.requests} requisições, concorrência {args.concurrency}):")
+    legacy = asyncio.run(measure_stack("BaseHTTPMiddleware", legacy_app, args.requests, args.concurrency))
+    pure = asyncio.run(measure_stack("ASGI puro", asgi_app, args.requests, args.concurrency))
+    print(f"  Ganho de vazão: {pure / legacy:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de segurança")
+    parser.add_argument("--suite", choices=["all", "patterns", "middlewares"], default="all")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--body-size", type=int, default=2048)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.suite in ("all", "patterns"):
+        benchmark_patterns(args)
+    if args.suite in ("all", "middlewares"):
+        benchmark_middlewares(args)
+
+if __name__ == "__main__":
+    main()
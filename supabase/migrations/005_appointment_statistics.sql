@@ -0,0 +1,42 @@
+-- Estatísticas de consultas em uma única consulta agregada
+-- Usada por backend/appointment_stats.py (SupabaseAppointmentStatsSource)
+
+CREATE OR REPLACE FUNCTION appointment_statistics(
+    p_clinic_id INTEGER,
+    p_start TIMESTAMP WITH TIME ZONE,
+    p_end TIMESTAMP WITH TIME ZONE
+)
+RETURNS TABLE (
+    doctor_id INTEGER,
+    day DATE,
+    total BIGINT,
+    completed BIGINT,
+    cancelled BIGINT,
+    scheduled BIGINT,
+    confirmed BIGINT,
+    no_show BIGINT
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    SELECT
+        a.doctor_id,
+        a.appointment_date::date AS day,
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE a.status IN ('completed', 'realizado')) AS completed,
+        COUNT(*) FILTER (WHERE a.status IN ('cancelled', 'cancelado')) AS cancelled,
+        COUNT(*) FILTER (WHERE a.status IN ('scheduled', 'agendado')) AS scheduled,
+        COUNT(*) FILTER (WHERE a.status IN ('confirmed', 'confirmado')) AS confirmed,
+        COUNT(*) FILTER (WHERE a.status IN ('no_show', 'faltou')) AS no_show
+    FROM appointments a
+    WHERE a.clinic_id = p_clinic_id
+      AND a.appointment_date >= p_start
+      AND a.appointment_date < p_end
+    GROUP BY a.doctor_id, a.appointment_date::date;
+$$;
+
+-- Índice que atende o filtro por clínica e período
+CREATE INDEX IF NOT EXISTS idx_appointments_clinic_date ON appointments(clinic_id, appointment_date);
+
+GRANT EXECUTE ON FUNCTION appointment_statistics(INTEGER, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE) TO authenticated;
@@ -0,0 +1,35 @@
+-- Blind index para busca de pacientes por CPF, RG e telefone criptografados
+-- Hashes HMAC calculados pelo backend (backend/patient_search.py); após aplicar,
+-- preencher os pacientes existentes com patient_search.supabase_backfill
+-- O RG fica na coluna rg do Supabase (rg_number nos modelos); o hash mantém o nome rg_number_hash
+
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS cpf_hash VARCHAR(64);
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS rg_number_hash VARCHAR(64);
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS phone_hash VARCHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_patients_clinic_cpf_hash ON patients(clinic_id, cpf_hash) WHERE cpf_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_patients_clinic_rg_number_hash ON patients(clinic_id, rg_number_hash) WHERE rg_number_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_patients_clinic_phone_hash ON patients(clinic_id, phone_hash) WHERE phone_hash IS NOT NULL;
+
+-- Hashes dos prefixos (busca parcial)
+CREATE TABLE IF NOT EXISTS patient_search_tokens (
+    id SERIAL PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    clinic_id INTEGER REFERENCES clinics(id),
+    field VARCHAR(30) NOT NULL,
+    token_hash VARCHAR(64) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_patient_search_tokens_lookup ON patient_search_tokens(clinic_id, token_hash, patient_id);
+CREATE INDEX IF NOT EXISTS idx_patient_search_tokens_patient ON patient_search_tokens(patient_id);
+
+ALTER TABLE patient_search_tokens ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view patient search tokens from their clinic" ON patient_search_tokens
+  FOR SELECT USING (clinic_id = get_current_user_clinic_id());
+
+CREATE POLICY "Users can insert patient search tokens in their clinic" ON patient_search_tokens
+  FOR INSERT WITH CHECK (clinic_id = get_current_user_clinic_id());
+
+CREATE POLICY "Users can delete patient search tokens from their clinic" ON patient_search_tokens
+  FOR DELETE USING (clinic_id = get_current_user_clinic_id());
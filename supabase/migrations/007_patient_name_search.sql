@@ -0,0 +1,48 @@
+-- Busca de pacientes por nome sem acentos, com ranking por similaridade
+-- Usada por backend/patient_search.py (supabase_search_by_name)
+-- Na tabela patients do Supabase o nome fica em full_name (name nos modelos SQLAlchemy)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() não é IMMUTABLE; o wrapper permite usá-lo em índices
+CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients
+    USING gin (immutable_unaccent(lower(full_name)) gin_trgm_ops);
+
+-- p_term já normalizado pelo backend (sem acentos, minúsculo);
+-- p_after_score/p_after_id: posição do último resultado da página anterior
+CREATE OR REPLACE FUNCTION search_patients_by_name(
+    p_clinic_id INTEGER,
+    p_term TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_after_score REAL DEFAULT NULL,
+    p_after_id INTEGER DEFAULT NULL
+)
+RETURNS TABLE (
+    id INTEGER,
+    score REAL
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    SELECT m.id, m.score
+    FROM (
+        SELECT p.id, word_similarity(p_term, immutable_unaccent(lower(p.full_name))) AS score
+        FROM patients p
+        WHERE p.clinic_id = p_clinic_id
+          AND (p_term <% immutable_unaccent(lower(p.full_name))
+               OR immutable_unaccent(lower(p.full_name)) LIKE '%' || p_term || '%')
+    ) m
+    WHERE p_after_id IS NULL
+       OR m.score < p_after_score
+       OR (m.score = p_after_score AND m.id > p_after_id)
+    ORDER BY m.score DESC, m.id
+    LIMIT p_limit;
+$$;
+
+GRANT EXECUTE ON FUNCTION search_patients_by_name(INTEGER, TEXT, INTEGER, REAL, INTEGER) TO authenticated;
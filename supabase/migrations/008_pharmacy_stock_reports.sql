@@ -0,0 +1,117 @@
+-- Relatórios de estoque da farmácia com contagens e filtros no banco
+-- Usados por backend/pharmacy_reports.py (SupabasePharmacyReportSource)
+
+-- Índices das contagens, do vencimento de lotes e do histórico por período
+CREATE INDEX IF NOT EXISTS idx_products_clinic_active ON products(clinic_id, is_active);
+CREATE INDEX IF NOT EXISTS idx_product_batches_product_expiry ON product_batches(product_id, expiry_date);
+CREATE INDEX IF NOT EXISTS idx_product_stock_movements_product_created ON product_stock_movements(product_id, created_at);
+
+-- Totais do resumo em uma única chamada
+CREATE OR REPLACE FUNCTION pharmacy_stock_counts(
+    p_clinic_id INTEGER,
+    p_expiring_before DATE
+)
+RETURNS TABLE (
+    total_products BIGINT,
+    low_stock_count BIGINT,
+    expiring_batches_count BIGINT
+)
+LANGUAGE sql
+STABLE
+SECURITY INVOKER
+AS $$
+    SELECT
+        (SELECT COUNT(*) FROM products p
+          WHERE p.clinic_id = p_clinic_id AND p.is_active = true),
+        (SELECT COUNT(*) FROM products p
+          WHERE p.clinic_id = p_clinic_id AND p.is_active = true
+            AND p.current_stock <= p.minimum_stock),
+        (SELECT COUNT(*) FROM product_batches b
+           JOIN products p ON p.id = b.product_id
+          WHERE p.clinic_id = p_clinic_id AND b.is_active = true
+            AND b.expiry_date IS NOT NULL AND b.expiry_date <= p_expiring_before);
+$$;
+
+GRANT EXECUTE ON FUNCTION pharmacy_stock_counts(INTEGER, DATE) TO authenticated;
+
+-- PostgREST não compara duas colunas; a view aplica o predicado de estoque baixo
+CREATE OR REPLACE VIEW pharmacy_low_stock_products
+WITH (security_invoker = true) AS
+    SELECT id, clinic_id, name, current_stock, minimum_stock,
+           current_stock - minimum_stock AS stock_gap
+    FROM products
+    WHERE is_active = true AND current_stock <= minimum_stock;
+
+GRANT SELECT ON pharmacy_low_stock_products TO authenticated;
+
+-- Snapshot materializado por clínica
+CREATE TABLE IF NOT EXISTS pharmacy_stock_snapshots (
+    clinic_id INTEGER PRIMARY KEY REFERENCES clinics(id) ON DELETE CASCADE,
+    total_products INTEGER NOT NULL DEFAULT 0,
+    low_stock_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE pharmacy_stock_snapshots ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "pharmacy_stock_snapshots_clinic_access" ON pharmacy_stock_snapshots
+    FOR SELECT USING (clinic_id = get_current_user_clinic_id());
+
+GRANT SELECT ON pharmacy_stock_snapshots TO authenticated;
+
+-- Mantém o snapshot a cada gravação em products (inclusive as feitas pelas
+-- movimentações de estoque), aplicando apenas a diferença da linha alterada
+CREATE OR REPLACE FUNCTION pharmacy_stock_snapshot_apply()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    old_active INTEGER := 0;
+    old_low INTEGER := 0;
+    new_active INTEGER := 0;
+    new_low INTEGER := 0;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active AND OLD.clinic_id IS NOT NULL THEN
+        old_active := 1;
+        old_low := CASE WHEN OLD.current_stock <= OLD.minimum_stock THEN 1 ELSE 0 END;
+        UPDATE pharmacy_stock_snapshots
+           SET total_products = total_products - old_active,
+               low_stock_count = low_stock_count - old_low,
+               updated_at = NOW()
+         WHERE clinic_id = OLD.clinic_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active AND NEW.clinic_id IS NOT NULL THEN
+        new_active := 1;
+        new_low := CASE WHEN NEW.current_stock <= NEW.minimum_stock THEN 1 ELSE 0 END;
+        INSERT INTO pharmacy_stock_snapshots AS s (clinic_id, total_products, low_stock_count)
+        VALUES (NEW.clinic_id, new_active, new_low)
+        ON CONFLICT (clinic_id) DO UPDATE
+           SET total_products = s.total_products + EXCLUDED.total_products,
+               low_stock_count = s.low_stock_count + EXCLUDED.low_stock_count,
+               updated_at = NOW();
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS pharmacy_stock_snapshot_trigger ON products;
+CREATE TRIGGER pharmacy_stock_snapshot_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF clinic_id, is_active, current_stock, minimum_stock ON products
+    FOR EACH ROW EXECUTE FUNCTION pharmacy_stock_snapshot_apply();
+
+-- Snapshot inicial
+INSERT INTO pharmacy_stock_snapshots (clinic_id, total_products, low_stock_count)
+SELECT clinic_id,
+       COUNT(*),
+       COUNT(*) FILTER (WHERE current_stock <= minimum_stock)
+FROM products
+WHERE is_active = true AND clinic_id IS NOT NULL
+GROUP BY clinic_id
+ON CONFLICT (clinic_id) DO UPDATE
+   SET total_products = EXCLUDED.total_products,
+       low_stock_count = EXCLUDED.low_stock_count,
+       updated_at = NOW();